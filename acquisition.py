@@ -0,0 +1,430 @@
+import sys
+import threading
+import time
+import numpy as np
+from profiling import observe
+
+ACCEL_BUFFER_SECONDS = 10   # samples kept while the writer is busy
+WRITE_INTERVAL = 0.5        # seconds between batched writes
+SWITCH_INTERVAL = 0.0005    # seconds, lets the sampler take the GIL sooner
+SECONDS_PER_DAY = 24 * 60 * 60
+HISTOGRAM_BIN_WIDTH = 0.01  # m/s^2, resolution of the running threshold
+HISTOGRAM_MAX_VALUE = 160   # m/s^2, the MPU-6050 measures at most 16 g
+TRIGGER_PERCENTILE = 70     # threshold of |z|, as in func.bump_sizes
+TRIGGER_DEVIATION = 1.5     # medium bump of func.BUMP_SIZE_LIMITS
+PRE_TRIGGER_SECONDS = 0.3   # samples kept for the start of a window
+POST_TRIGGER_SECONDS = 1.0  # window after the last trigger, a bump rings
+SUMMARY_INTERVAL = 1.0      # seconds per summary row outside windows
+SUMMARY_COLUMN = 'summary'  # log column that marks the summary rows
+
+
+class RingBuffer:
+    """Fixed size, thread-safe FIFO of numeric rows.
+
+    When the buffer is full new rows are dropped and counted, so
+    the rows already waiting to be written are never overwritten.
+    """
+
+    def __init__(self, capacity, width):
+        self.data = np.empty((capacity, width))
+        self.capacity = capacity
+        self.start = 0
+        self.size = 0
+        self.dropped = 0
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return self.size
+
+    def push(self, row):
+        """Appends a row, returns False if it was dropped."""
+        with self.lock:
+            if self.size == self.capacity:
+                self.dropped += 1
+                return False
+            self.data[(self.start + self.size) % self.capacity] = row
+            self.size += 1
+            return True
+
+    def drain(self):
+        """Removes and returns all buffered rows, oldest first."""
+        with self.lock:
+            indices = (self.start + np.arange(self.size)) % self.capacity
+            rows = self.data[indices]
+            self.start = (self.start + self.size) % self.capacity
+            self.size = 0
+        return rows
+
+
+class RunningPercentile:
+    """Estimates a percentile of a stream of values in constant memory.
+
+    The values are counted in a fixed histogram, so the estimate is
+    off by at most one bin width for values below max_value.
+    """
+
+    def __init__(self, q, bin_width=HISTOGRAM_BIN_WIDTH,
+                 max_value=HISTOGRAM_MAX_VALUE):
+        self.q = q
+        self.bin_width = bin_width
+        self.counts = np.zeros(int(np.ceil(max_value / bin_width)),
+                               dtype=np.int64)
+        self.count = 0
+
+    def add(self, values):
+        values = np.asarray(values, dtype=np.float64)
+        bins = np.clip((values / self.bin_width).astype(np.int64),
+                       0, len(self.counts) - 1)
+        self.counts += np.bincount(bins, minlength=len(self.counts))
+        self.count += len(values)
+
+    def value(self):
+        """Returns the estimate, None before any value is added."""
+        if self.count == 0:
+            return None
+        # Same rank as numpy's default linear interpolation
+        rank = (self.count - 1) * self.q / 100
+        cumulative = np.cumsum(self.counts)
+        index = int(np.searchsorted(cumulative, rank, side='right'))
+        before = cumulative[index] - self.counts[index]
+        fraction = (rank - before) / self.counts[index]
+        return (index + fraction) * self.bin_width
+
+
+class EventCapture:
+    """Selects the accelerometer samples worth writing at full rate.
+
+    A sample triggers a window when |z| deviates from the running
+    percentile of |z| by at least deviation, as in bump_sizes. Road
+    noise alone reaches the small bump limit, so the default is the
+    medium one; small bumps still peak well above it.
+    Every sample from pre_trigger seconds before a trigger until
+    post_trigger seconds after the last one is written unchanged.
+    Between windows only one summary row per summary_interval is
+    written, the sample that deviates the most, so the log keeps the
+    roughness of the road at a fraction of the size. Summary rows are
+    marked, since their peaks would raise the z deviation of a segment
+    and the bump threshold of the drive.
+
+    Untriggered samples wait in a pre-trigger buffer of at most
+    pre_trigger seconds, so the selected rows stay in time order.
+
+    Args:
+        pre_trigger (float): Seconds written before a trigger.
+        post_trigger (float): Seconds written after the last trigger.
+        summary_interval (float): Seconds per summary row.
+        deviation (float): Deviation of |z| that triggers a window.
+    """
+
+    def __init__(self, pre_trigger=PRE_TRIGGER_SECONDS,
+                 post_trigger=POST_TRIGGER_SECONDS,
+                 summary_interval=SUMMARY_INTERVAL,
+                 deviation=TRIGGER_DEVIATION):
+        self.pre_trigger = pre_trigger
+        self.post_trigger = post_trigger
+        self.summary_interval = summary_interval
+        self.deviation = deviation
+        self.threshold = RunningPercentile(TRIGGER_PERCENTILE)
+        # Rows with their deviation as a fifth column
+        self.pending = np.empty((0, 5))
+        self.summarized = np.empty((0, 5))
+        self.capture_until = -np.inf
+        self.in_window = False
+        self.samples = 0
+        self.events = 0
+        self.full_rate = 0
+        self.summaries = 0
+
+    def select(self, rows, final=False):
+        """
+        Passes a batch of samples through the trigger.
+
+        Args:
+            rows (numpy.ndarray): (timestamp, x, y, z) samples, oldest
+              first, newer than the samples of the previous batches.
+            final (bool): Returns the samples still waiting as well,
+              at the end of the recording.
+
+        Returns:
+            numpy.ndarray: The (timestamp, x, y, z, summary) rows to
+              write, oldest first, summary is 1 for summary rows and 0
+              for samples written at full rate.
+        """
+        triggers = np.empty(0)
+        deviation = np.empty(0)
+        if len(rows) > 0:
+            self.samples += len(rows)
+            z = np.abs(rows[:, 3])
+            self.threshold.add(z)
+            deviation = np.abs(z - self.threshold.value())
+            triggers = rows[deviation >= self.deviation, 0]
+        rows = np.concatenate((self.pending,
+                               np.column_stack((rows, deviation))))
+        times = rows[:, 0]
+
+        captured = times <= self.capture_until
+        if len(triggers) > 0:
+            # Nearest trigger at or after and at or before every sample
+            after = np.searchsorted(triggers, times, side='left')
+            before = np.searchsorted(triggers, times, side='right') - 1
+            captured |= ((after < len(triggers))
+                         & (triggers[np.minimum(after, len(triggers) - 1)]
+                            - times <= self.pre_trigger))
+            captured |= ((before >= 0)
+                         & (times - triggers[np.maximum(before, 0)]
+                            <= self.post_trigger))
+            self.capture_until = max(self.capture_until,
+                                     triggers[-1] + self.post_trigger)
+        if len(rows) > 0:
+            previous = np.concatenate(([self.in_window], captured[:-1]))
+            self.events += int(np.count_nonzero(captured & ~previous))
+            self.in_window = bool(captured[-1])
+
+        # Later triggers can still reach the newest untriggered samples
+        keep = np.zeros(len(rows), dtype=bool)
+        if not final and len(rows) > 0:
+            last_captured = times[captured][-1] if captured.any() else -np.inf
+            keep = (~captured & (times >= times[-1] - self.pre_trigger)
+                    & (times > last_captured))
+        self.pending = rows[keep]
+        done = np.concatenate((self.summarized, rows[~keep]))
+        full = np.concatenate((np.zeros(len(self.summarized), dtype=bool),
+                               captured[~keep]))
+        if len(done) == 0:
+            return np.empty((0, 5))
+
+        # Consecutive untriggered samples of one interval share a summary
+        interval = np.floor(done[:, 0] / self.summary_interval)
+        change = np.ones(len(done), dtype=bool)
+        change[1:] = (full[1:] != full[:-1]) | (interval[1:] != interval[:-1])
+        group = np.cumsum(change)
+        summarized = ~full
+        open_group = not final and not full[-1]
+        if open_group:
+            # More samples of the last interval may follow
+            summarized &= group != group[-1]
+            self.summarized = done[group == group[-1]]
+        else:
+            self.summarized = np.empty((0, 5))
+        selected = full.copy()
+        candidates = np.flatnonzero(summarized)
+        if len(candidates) > 0:
+            order = candidates[np.lexsort((done[candidates, 4],
+                                           group[candidates]))]
+            last = np.append(group[order][1:] != group[order][:-1], True)
+            selected[order[last]] = True
+            self.summaries += int(np.count_nonzero(last))
+        self.full_rate += int(np.count_nonzero(full))
+        return np.column_stack((done[selected, :4], ~full[selected]))
+
+    def finish(self):
+        """Returns the samples still waiting, at the end of the
+        recording."""
+        return self.select(np.empty((0, 4)), final=True)
+
+    def statistics(self):
+        """
+        Returns the capture statistics.
+
+        Returns:
+            dict: Number of triggered windows, samples written at full
+              rate, summary rows and the ratio of samples to written
+              rows.
+        """
+        written = self.full_rate + self.summaries
+        return {'events': self.events, 'full_rate': self.full_rate,
+                'summaries': self.summaries,
+                'reduction': self.samples / written if written else 0}
+
+
+class AccelerometerSampler(threading.Thread):
+    """Reads the accelerometer at a fixed rate into a ring buffer.
+
+    Samples are scheduled on an absolute monotonic timeline, so sleep
+    overshoot doesn't accumulate into a lower rate. When a read takes
+    longer than a whole period the missed slots are skipped and counted.
+    """
+
+    def __init__(self, read_sample, buffer, rate):
+        super().__init__(name='accelerometer', daemon=True)
+        self.read_sample = read_sample
+        self.buffer = buffer
+        self.period = 1.0 / rate
+        self.stop_event = threading.Event()
+        self.missed = 0
+
+    def run(self):
+        next_time = time.monotonic()
+        while not self.stop_event.is_set():
+            delay = next_time - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            timestamp = time.monotonic()
+            observe('sample_lateness', timestamp - next_time)
+            x, y, z = self.read_sample()
+            self.buffer.push((timestamp, x, y, z))
+            next_time += self.period
+            behind = time.monotonic() - next_time
+            if behind > self.period:
+                skipped = int(behind / self.period)
+                self.missed += skipped
+                next_time += skipped * self.period
+
+    def stop(self):
+        self.stop_event.set()
+
+
+class BatchWriter(threading.Thread):
+    """Periodically moves rows from a ring buffer to a log writer
+    and passes them on to on_rows, if given.
+
+    Rows start with their time.monotonic() timestamp, so the time the
+    oldest row of every batch waited is observed as the write latency
+    of a profiled run.
+    """
+
+    def __init__(self, buffer, writer, format_rows, interval=WRITE_INTERVAL,
+                 on_rows=None):
+        super().__init__(name='writer', daemon=True)
+        self.buffer = buffer
+        self.writer = writer
+        self.format_rows = format_rows
+        self.interval = interval
+        self.on_rows = on_rows
+        self.stop_event = threading.Event()
+        self.written = 0
+
+    def run(self):
+        while not self.stop_event.wait(self.interval):
+            self.flush()
+        self.flush()
+
+    def flush(self):
+        rows = self.buffer.drain()
+        if len(rows) > 0:
+            self.writer.writerows(self.format_rows(rows))
+            self.written += len(rows)
+            observe('write_latency', time.monotonic() - rows[0, 0])
+            observe('write_batch_rows', len(rows))
+            if self.on_rows is not None:
+                self.on_rows(rows)
+
+    def stop(self):
+        self.stop_event.set()
+
+
+def local_clock_offset():
+    """Returns the offset that turns time.monotonic() into local time
+    in seconds, counted from the epoch."""
+    return time.time() - time.monotonic() + time.localtime().tm_gmtoff
+
+
+def format_time(milliseconds):
+    """Formats milliseconds since midnight as 'HH:MM:SS.mmm'."""
+    seconds, millis = divmod(milliseconds, 1000)
+    return (f'{seconds // 3600:02d}:{seconds // 60 % 60:02d}:'
+            f'{seconds % 60:02d}.{millis:03d}')
+
+
+def log_time(clock_offset, timestamp=None):
+    """Returns a time.monotonic() timestamp, the current one if not
+    given, as a log timestamp."""
+    if timestamp is None:
+        timestamp = time.monotonic()
+    return format_time(
+        int((timestamp + clock_offset) % SECONDS_PER_DAY * 1000))
+
+
+def accel_rows(rows, clock_offset):
+    """Formats buffered (timestamp, x, y, z) samples as log rows, with
+    the summary flag of EventCapture.select after the time if given."""
+    milliseconds = ((rows[:, 0] + clock_offset) % SECONDS_PER_DAY
+                    * 1000).astype(int)
+    formatted = [[x, y, z, format_time(ms)] for (x, y, z), ms
+                 in zip(rows[:, 1:4].tolist(), milliseconds.tolist())]
+    if rows.shape[1] > 4:
+        for row, summary in zip(formatted, rows[:, 4].astype(int).tolist()):
+            row.append(summary)
+    return formatted
+
+
+class AccelerometerPipeline:
+    """Samples the accelerometer on its own thread and writes the samples
+    in batches on another one.
+
+    Args:
+        read_sample (callable): Returns one (x, y, z) sample.
+        writer: csv.writer or binary log writer of the accelerometer log.
+        rate (float): Sampling rate in Hz.
+        clock_offset (float): Offset shared with the GPS log timestamps,
+          see local_clock_offset.
+        on_samples (callable): Called on the writer thread with the local
+          times in seconds since midnight and the (x, y, z) samples of
+          every batch, all of them even when capture selects some.
+        capture (EventCapture): Selects the samples that are written,
+          every sample is written if None.
+    """
+
+    def __init__(self, read_sample, writer, rate, clock_offset=None,
+                 on_samples=None, capture=None):
+        self.rate = rate
+        if clock_offset is None:
+            clock_offset = local_clock_offset()
+        self.clock_offset = clock_offset
+        self.buffer = RingBuffer(int(rate * ACCEL_BUFFER_SECONDS), 4)
+        self.sampler = AccelerometerSampler(read_sample, self.buffer, rate)
+        self.on_samples = on_samples
+        self.capture = capture
+        self.writer = BatchWriter(
+            self.buffer, writer, self.format_rows,
+            on_rows=None if on_samples is None else self.pass_samples)
+        self.started = None
+        self.stopped = None
+        self.switch_interval = None
+
+    def format_rows(self, rows):
+        if self.capture is not None:
+            rows = self.capture.select(rows)
+        return accel_rows(rows, self.clock_offset)
+
+    def pass_samples(self, rows):
+        times = (rows[:, 0] + self.clock_offset) % SECONDS_PER_DAY
+        self.on_samples(times, rows[:, 1:])
+
+    def start(self):
+        # With the default 5 ms interval a busy thread delays samples
+        self.switch_interval = sys.getswitchinterval()
+        sys.setswitchinterval(min(self.switch_interval, SWITCH_INTERVAL))
+        self.started = time.monotonic()
+        self.writer.start()
+        self.sampler.start()
+
+    def stop(self):
+        """Stops sampling and writes the remaining samples."""
+        self.sampler.stop()
+        self.sampler.join()
+        self.stopped = time.monotonic()
+        self.writer.stop()
+        self.writer.join()
+        if self.capture is not None:
+            self.writer.writer.writerows(
+                accel_rows(self.capture.finish(), self.clock_offset))
+        sys.setswitchinterval(self.switch_interval)
+
+    def statistics(self):
+        """
+        Returns the sampling statistics of a stopped pipeline.
+
+        Returns:
+            dict: Number of samples read, achieved rate in Hz,
+              dropped and missed samples, and the capture statistics
+              if only events are written at full rate.
+        """
+        elapsed = self.stopped - self.started
+        statistics = {'samples': self.writer.written,
+                      'rate': self.writer.written / elapsed if elapsed else 0,
+                      'dropped': self.buffer.dropped,
+                      'missed': self.sampler.missed}
+        if self.capture is not None:
+            statistics.update(self.capture.statistics())
+        return statistics
@@ -1,22 +1,39 @@
-import csv
+import contextlib
+import importlib
 import serial
-import pynmea2
+import threading
 import time
 from time import sleep
 from datetime import datetime
-from mpu6050 import mpu6050
 from haversine import haversine, Unit
-from func import process_data
+from binlog import LOG_EXTENSION
+from acquisition import (SUMMARY_COLUMN, AccelerometerPipeline,
+                         EventCapture, local_clock_offset, log_time)
+from logwriter import SegmentedLogWriter, stitch_log
+from nmea import NmeaReader, RecordingPort, configure_neo6m
+from profiling import RunProfile, observe, record
 
 
 MPU6050_REGISTER = 0x68
 SERIAL_PORT = '/dev/ttyAMA0'
 BAUD_RATE = 9600
-GPS_TIMEOUT = 1  # in seconds
+GPS_RATE = 1  # in Hz, 5-10 Hz switches the receiver to a faster baud rate
+GPS_READ_TIMEOUT = 0.05  # in seconds, quiet time that ends a GPS epoch
+GPS_TIMEOUT = 2  # in seconds, longest wait for a fix
+NO_DATA_TIMEOUT = 30  # in seconds without any data from the receiver
 ACCEL_RANGE = 16
 DATA_FOLDER = "./data"
 DATA_RESULTS = "./results"
 THRESHOLD_DISTANCE = 0
+LOG_FORMAT = "csv"  # "csv" or "binary"
+ACCEL_RATE = 0  # in Hz, 0 reads one sample per recorded GPS fix
+CAPTURE_EVENTS = False  # with ACCEL_RATE > 0, full rate only around bumps
+LIVE_ANALYSIS = True  # rate the road while driving
+PROFILE = None  # None, 'timing', 'cprofile' or 'tracemalloc'
+RECORD_NMEA = False  # save the raw GPS stream of the drive for replay.py
+SYNC_URL = None  # upload server of sync.py, finished drives go there
+SYNC_TIMEOUT = 5  # in seconds, longest wait for the server at shutdown
+SYNC_DEADLINE = 60  # in seconds of uploading at shutdown
 
 
 class VehicleNotMovingException(Exception):
@@ -24,37 +41,45 @@ class VehicleNotMovingException(Exception):
     pass
 
 
-def initialize_gps():
-    """Initialize the GPS sensor"""
-    ser = serial.Serial(SERIAL_PORT, BAUD_RATE, timeout=GPS_TIMEOUT)
-    return ser
+def initialize_gps(port=None, nmea_file_name=None):
+    """Initialize the GPS sensor, or start reading a stand-in port such
+    as a replayed drive"""
+    replay = port is not None
+    if port is None:
+        port = serial.Serial(SERIAL_PORT, BAUD_RATE,
+                             timeout=GPS_READ_TIMEOUT)
+        if GPS_RATE != 1:
+            configure_neo6m(port, GPS_RATE)
+        if nmea_file_name is not None:
+            port = RecordingPort(port, nmea_file_name)
+    # A replay waits for the app instead of dropping fixes
+    reader = NmeaReader(port, drop_when_full=not replay)
+    reader.start()
+    return reader
 
 
 def initialize_accelerometer():
     """Initialize the MPU6050 accelerometer"""
+    from mpu6050 import mpu6050
     sensor = mpu6050(MPU6050_REGISTER)
     sensor.set_accel_range(ACCEL_RANGE)
     return sensor
 
 
-def create_csv_file(file_name, headers):
-    """Create and open a CSV file with the given name and write the headers"""
-    file = open(file_name, "w", newline="")
-    writer = csv.writer(file)
-    writer.writerow(headers)
-    return file, writer
-
-
-def read_gps_data(ser):
-    """Read GPS data from the serial port and parse the NMEA message"""
-    data = ser.readline().decode('unicode_escape')
-    if not data:
-        raise ValueError("No data received from NEO 6M sensor,"
-                         "please check connection and run the app again!")
-    if data.startswith('$GPRMC'):
-        msg = pynmea2.parse(data)
-        return msg.latitude, msg.longitude, msg.spd_over_grnd
-    return None, None, None
+def read_gps_data(reader):
+    """Wait for the next GPS fix, returns its position, speed and the
+    monotonic time it was received"""
+    fix = reader.get_fix(GPS_TIMEOUT)
+    if fix is None:
+        if reader.ended:
+            raise EOFError("The GPS replay has ended.")
+        if reader.silence() > NO_DATA_TIMEOUT:
+            raise ValueError("No data received from NEO 6M sensor,"
+                             "please check connection and run the app again!")
+        return None, None, None, None
+    if not fix.has_position():
+        return None, None, None, fix.received
+    return fix.latitude, fix.longitude, fix.speed, fix.received
 
 
 def read_accelerometer_data(sensor):
@@ -63,31 +88,84 @@ def read_accelerometer_data(sensor):
     return accel_data.get("x"), accel_data.get("y"), accel_data.get("z")
 
 
-def main():
-    """Main function to read GPS and accelerometer data"""
+def main(gps_port=None, read_accelerometer=None, report=True):
+    """
+    Main function to read GPS and accelerometer data
+
+    Args:
+        gps_port: Stands in for the serial port of the GPS, such as
+          nmea.ReplayPort. The NEO 6M is read if not given.
+        read_accelerometer (callable): Returns one (x, y, z) sample in
+          place of the MPU6050, such as replay.ReplayAccelerometer.
+        report (bool): Process the drive into a report when it ends.
+    """
 
     prev_lat, prev_lon = 0, 0
     signal_lost = False
     INACTIVE_TIMEOUT = (time.time() + 60 * 5)  # in seconds
 
-    # Creates and opens CSV files for data storage
+    # Creates the logs, written in synced blocks that survive power loss
 
     timestamp = datetime.now().strftime("%Y_%m_%d_%H_%M_%S")
-    accel_file_name = f'accel_data_{timestamp}.csv'
-    gps_file_name = f'gps_data_{timestamp}.csv'
+    extension = LOG_EXTENSION if LOG_FORMAT == "binary" else ".csv"
+    accel_file_name = f'accel_data_{timestamp}{extension}'
+    gps_file_name = f'gps_data_{timestamp}{extension}'
+    nmea_file_name = None
+    if RECORD_NMEA and gps_port is None:
+        nmea_file_name = f'gps_data_{timestamp}.nmea'
 
-    accel_file, accel_writer = create_csv_file(accel_file_name,
-                                               ['x', 'y', 'z', 'time'])
-    gps_file, gps_writer = create_csv_file(gps_file_name,
-                                           ['latitude', 'longitude', 'time'])
+    accel_headers = ['x', 'y', 'z', 'time']
+    if CAPTURE_EVENTS and ACCEL_RATE > 0:
+        # Marks the summary rows between the captured windows
+        accel_headers.append(SUMMARY_COLUMN)
+    accel_writer = SegmentedLogWriter(accel_file_name, accel_headers,
+                                      LOG_FORMAT)
+    gps_writer = SegmentedLogWriter(gps_file_name,
+                                    ['latitude', 'longitude', 'time',
+                                     'speed'], LOG_FORMAT)
     print("---Reading data will start after detecting movement of vehicle---")
 
+    # Sample rates and write latencies go to a run manifest
+    profile_stack = contextlib.ExitStack()
+    run = None
+    if PROFILE is not None:
+        run = profile_stack.enter_context(RunProfile(
+            None if PROFILE == 'timing' else PROFILE,
+            {'log_format': LOG_FORMAT, 'accel_rate': ACCEL_RATE,
+             'capture_events': CAPTURE_EVENTS,
+             'live_analysis': LIVE_ANALYSIS}))
+    first_fix = last_fix = None
+    fixes = 0
+
+    # Both logs are stamped from the same monotonic clock
+    clock_offset = local_clock_offset()
+    accel_pipeline = None
+    live = None
+    if LIVE_ANALYSIS:
+        # The analysis modules load while the receiver looks for a fix
+        threading.Thread(target=importlib.import_module, args=('live',),
+                         daemon=True).start()
+
+        def show_segment(segment, color, bump_count):
+            totals = live.totals()
+            print(f'Segment {totals["segments"]}: {color},'
+                  f' {bump_count} bumps, {totals["distance"]:.0f} m'
+                  f' in {totals["duration"]}')
+
+        def add_live_samples(times, samples):
+            live.add_samples(times, samples[:, 2], samples[:, 0],
+                             samples[:, 1])
+    reader = None
     try:
-        ser = initialize_gps()
-        sensor = initialize_accelerometer()
+        reader = initialize_gps(gps_port, nmea_file_name)
+        if read_accelerometer is None:
+            sensor = initialize_accelerometer()
+
+            def read_accelerometer():
+                return read_accelerometer_data(sensor)
 
         while True:
-            lat, lon, speed = read_gps_data(ser)
+            lat, lon, speed, received = read_gps_data(reader)
 
             if speed is not None:
                 if prev_lat == 0 and prev_lon == 0:
@@ -97,16 +175,47 @@ def main():
                     distance = haversine((prev_lat, prev_lon), (lat, lon),
                                          unit=Unit.METERS)
                     if distance >= THRESHOLD_DISTANCE:
-                        time_ = datetime.now().strftime("%H:%M:%S")
+                        # Stamped when the receiver sent the fix
+                        time_ = log_time(clock_offset, received)
+                        if last_fix is not None:
+                            observe('gps_fix_interval', received - last_fix)
+                        else:
+                            first_fix = received
+                        last_fix = received
+                        fixes += 1
                         print('Timestamp:', time_)
                         print('Latitude:', lat)
                         print('Longitude:', lon)
-                        gps_writer.writerow([lat, lon, time_])
+                        # Speed over ground in knots
+                        gps_writer.writerow([lat, lon, time_, speed])
+                        if LIVE_ANALYSIS and live is None:
+                            # Waits if the import hasn't finished yet
+                            from live import LiveRoadQuality
+                            live = LiveRoadQuality(
+                                show_segment, rate=ACCEL_RATE or None)
+                        if live is not None:
+                            live.add_fix(lat, lon, time_, speed)
 
-                        ax, ay, az = read_accelerometer_data(sensor)
-                        print(f'\tax={ax:.2f} g\tay={ay:.2f} g\taz={az:.2f} g')
-                        accel_writer.writerow([ax, ay, az, time_])
-                        sleep(1)
+                        if ACCEL_RATE > 0:
+                            # Sampled on its own thread from the first fix
+                            if accel_pipeline is None:
+                                accel_pipeline = AccelerometerPipeline(
+                                    read_accelerometer,
+                                    accel_writer, ACCEL_RATE, clock_offset,
+                                    add_live_samples if live else None,
+                                    EventCapture() if CAPTURE_EVENTS
+                                    else None)
+                                accel_pipeline.start()
+                        else:
+                            ax, ay, az = read_accelerometer()
+                            print(f'\tax={ax:.2f} g\tay={ay:.2f} g'
+                                  f'\taz={az:.2f} g')
+                            accel_writer.writerow([ax, ay, az, time_])
+                            if live is not None:
+                                live.add_samples([time_], [az], [ax], [ay])
+                            if gps_port is None:
+                                # A stand-in port paces the fixes itself
+                                sleep(1)
                     elif (distance < THRESHOLD_DISTANCE and
                           time.time() > INACTIVE_TIMEOUT):
                         raise VehicleNotMovingException
@@ -128,13 +237,48 @@ def main():
                     print("Signal found, resuming GPS tracking.")
                     signal_lost = False
 
-    except (KeyboardInterrupt, VehicleNotMovingException, ValueError):
-        accel_file.close()
-        gps_file.close()
+    except (KeyboardInterrupt, VehicleNotMovingException, ValueError,
+            EOFError):
+        if reader is not None:
+            reader.stop()
+            reader.join()
+            reader.port.close()
+            print("GPS:", reader.statistics())
+            record('gps', reader.statistics())
+        if accel_pipeline is not None:
+            accel_pipeline.stop()
+            print("Accelerometer:", accel_pipeline.statistics())
+            record('accelerometer', accel_pipeline.statistics())
+        if fixes > 1:
+            record('gps_rate', (fixes - 1) / (last_fix - first_fix))
+        accel_writer.close()
+        gps_writer.close()
+        # Rotated parts are joined into the logs of the drive
+        stitch_log(accel_file_name)
+        stitch_log(gps_file_name)
         print("GPS tracking stopped!")
-        print("Saving road statistics...")
-        process_data(gps_file_name, accel_file_name,
-                     DATA_FOLDER, DATA_RESULTS)
+        # The analysis and report code is only loaded at the end
+        from func import (NEAREST_TOLERANCE, process_data,
+                          write_run_manifest)
+        if report:
+            print("Saving road statistics...")
+            # The live state already holds the segments of the drive.
+            # Samples read between the fixes only match them nearby.
+            process_data(accel_file_name, gps_file_name,
+                         DATA_FOLDER, DATA_RESULTS, timestamp=timestamp,
+                         merge_tolerance=NEAREST_TOLERANCE
+                         if ACCEL_RATE > 0 else None, live=live)
+        profile_stack.close()
+        if run is not None:
+            write_run_manifest(run, DATA_RESULTS, timestamp)
+        if SYNC_URL is not None:
+            # Drives that failed before are uploaded as well. One try
+            # that can't hold up the shutdown, 'sync.py upload --watch'
+            # keeps retrying what is left.
+            from sync import sync_drives
+            sync_drives(DATA_FOLDER, SYNC_URL, retries=0,
+                        timeout=SYNC_TIMEOUT, deadline=SYNC_DEADLINE)
 
 
-main()
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,302 @@
+import argparse
+import glob
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from binlog import LOG_EXTENSION
+from func import (BUMP_DETECTOR, MAP_RENDERER, MAP_STYLE, MERGE_TOLERANCE,
+                  PROFILE, ROAD_DATABASE, STAGE_CACHE, process_data)
+from logwriter import base_path_of, stitch_folder
+from reports import EXPORT_FORMATS, export_drives
+from tiles import build_tiles
+
+
+DATA_FOLDER = "./data"
+DATA_RESULTS = "./results"
+ACCEL_PREFIX = "accel_data_"
+GPS_PREFIX = "gps_data_"
+LOG_EXTENSIONS = [LOG_EXTENSION, ".csv"]  # binary copies are read first
+MAX_JOBS_PER_WORKER = 10   # restart workers to release leaked memory
+
+
+def find_drive_pairs(folder_data):
+    """
+    Finds the accelerometer and GPS files recorded during the same drive,
+    in CSV or binary log format.
+
+    Args:
+        folder_data (str): Folder where the recorded files are stored.
+
+    Returns:
+        list: List of (timestamp, accel_path, gps_path) tuples
+          sorted by timestamp.
+    """
+    pairs = {}
+    for extension in LOG_EXTENSIONS:
+        pattern = os.path.join(folder_data, f'{ACCEL_PREFIX}*{extension}')
+        for accel_path in glob.glob(pattern):
+            if base_path_of(accel_path) is not None:
+                # Part of a log that could not be stitched
+                continue
+            name = os.path.basename(accel_path)
+            timestamp = name[len(ACCEL_PREFIX):-len(extension)]
+            gps_name = f'{GPS_PREFIX}{timestamp}{extension}'
+            gps_path = os.path.join(folder_data, gps_name)
+            if not os.path.isfile(gps_path):
+                print(f'Skipping {name}, {gps_name} is missing.')
+            elif timestamp not in pairs:
+                # A CSV drive converted to a binary log is the same drive
+                pairs[timestamp] = (timestamp, accel_path, gps_path)
+    return sorted(pairs.values())
+
+
+def is_up_to_date(timestamp, accel_path, gps_path, folder_results):
+    """
+    Checks if the report of a drive is newer than both of its data files.
+
+    Args:
+        timestamp (str): Timestamp of the drive.
+        accel_path (str): Path of the accelerometer data file.
+        gps_path (str): Path of the GPS data file.
+        folder_results (str): Folder where the reports are stored.
+
+    Returns:
+        bool: True if the drive doesn't need to be processed again.
+    """
+    report_path = os.path.join(folder_results,
+                               f'road_statistics_{timestamp}.xlsx')
+    if not os.path.isfile(report_path):
+        return False
+    report_time = os.path.getmtime(report_path)
+    return (report_time >= os.path.getmtime(accel_path)
+            and report_time >= os.path.getmtime(gps_path))
+
+
+def process_pair(timestamp, accel_path, gps_path, folder_data,
+                 folder_results, map_renderer, chunk_size,
+                 database=ROAD_DATABASE, map_style=MAP_STYLE,
+                 bump_detector=BUMP_DETECTOR, profile=PROFILE,
+                 cache=STAGE_CACHE, merge_tolerance=MERGE_TOLERANCE):
+    """Processes one drive in a worker process and returns its outcome.
+
+    Returns:
+        tuple: Timestamp, path of the report or None and processing time.
+    """
+    start = time.perf_counter()
+    report_path = process_data(accel_path, gps_path, folder_data,
+                               folder_results, map_renderer=map_renderer,
+                               timestamp=timestamp, archive=False,
+                               chunk_size=chunk_size,
+                               merge_tolerance=merge_tolerance,
+                               database=database, map_style=map_style,
+                               bump_detector=bump_detector,
+                               profile=profile, cache=cache)
+    return timestamp, report_path, time.perf_counter() - start
+
+
+def run_batch(folder_data=DATA_FOLDER, folder_results=DATA_RESULTS,
+              workers=None, force=False, map_renderer=MAP_RENDERER,
+              chunk_size=None, database=ROAD_DATABASE, map_style=MAP_STYLE,
+              bump_detector=BUMP_DETECTOR, profile=PROFILE,
+              cache=STAGE_CACHE, merge_tolerance=MERGE_TOLERANCE):
+    """
+    Reprocesses every recorded drive in folder_data across worker processes.
+
+    Drives whose reports are already up to date are skipped, so an
+    interrupted batch resumes where it stopped when it is run again.
+
+    Args:
+        folder_data (str): Folder where the recorded files are stored.
+        folder_results (str): Folder where the reports are stored.
+        workers (int): Number of worker processes, one per CPU if not given.
+        force (bool): Process drives even if their reports are up to date.
+        map_renderer (str): Renderer of the report map image.
+        chunk_size (int): Stream every drive in chunks of this many rows,
+          load whole drives if not given.
+        database (str): Path of the road database every drive is added to.
+        map_style (str): Style of the HTML maps, see func.plot_map.
+        bump_detector (str): Bump detector, see func.classify_bumps.
+        profile (str): Writes a run manifest of every drive, see
+          func.process_data.
+        cache (str): Folder of cached stage results shared by the
+          workers, see func.process_data.
+        merge_tolerance (float): Interpolate the GPS positions of samples
+          up to this many seconds from a fix, see func.process_data.
+
+    Returns:
+        tuple: Lists of processed, skipped and failed drive timestamps.
+    """
+    os.makedirs(folder_results, exist_ok=True)
+    # Drives cut short by a power loss are still in parts
+    for path in stitch_folder(folder_data):
+        print(f'Recovered {path}.')
+    processed, skipped, failed = [], [], []
+    jobs = []
+    for timestamp, accel_path, gps_path in find_drive_pairs(folder_data):
+        if not force and is_up_to_date(timestamp, accel_path, gps_path,
+                                       folder_results):
+            skipped.append(timestamp)
+        else:
+            jobs.append((timestamp, accel_path, gps_path))
+    print(f'{len(jobs)} drives to process, {len(skipped)} up to date.')
+    if not jobs:
+        return processed, skipped, failed
+
+    done = 0
+
+    def show(result):
+        nonlocal done
+        timestamp, report_path, seconds = result
+        done += 1
+        if report_path is None:
+            failed.append(timestamp)
+            status = 'failed'
+        else:
+            processed.append(timestamp)
+            status = f'done in {seconds:.1f} s'
+        print(f'[{done}/{len(jobs)}] {timestamp} {status}')
+
+    run_jobs(jobs, workers, process_pair,
+             (folder_data, folder_results, map_renderer, chunk_size,
+              database, map_style, bump_detector, profile, cache,
+              merge_tolerance), show)
+    return processed, skipped, failed
+
+
+def run_jobs(jobs, workers, function, arguments, on_result):
+    """
+    Runs a function for every job across worker processes, so that
+    a worker that dies only fails its own job.
+
+    When a worker dies, e.g. it runs out of memory, its pool breaks and
+    takes every unfinished job with it. The jobs no worker started yet
+    go to a new pool, the ones that were handed to a worker are run
+    again one at a time to find the one that killed it.
+
+    Args:
+        jobs (list): Tuples of arguments, starting with the timestamp of
+          the drive.
+        workers (int): Number of worker processes, one per CPU if None.
+        function (callable): Processes one job, like process_pair.
+        arguments (tuple): Arguments of function after those of a job.
+        on_result (callable): Called with the result of every job, with
+          (timestamp, None, 0) for a job that killed its worker.
+    """
+    # At most one job more than there are workers is handed out at once
+    dispatched = (workers or os.cpu_count() or 1) + 1
+    while jobs:
+        unfinished = run_pool(jobs, workers, function, arguments, on_result)
+        suspects, jobs = unfinished[:dispatched], unfinished[dispatched:]
+        # With one worker the first unfinished job is the one it died on
+        while suspects:
+            unfinished = run_pool(suspects, 1, function, arguments,
+                                  on_result)
+            if unfinished:
+                on_result((unfinished[0][0], None, 0))
+            suspects = unfinished[1:]
+
+
+def run_pool(jobs, workers, function, arguments, on_result):
+    """
+    Runs a function for every job in a new pool of worker processes.
+
+    Returns:
+        list: Jobs that didn't finish because a worker died, in the
+          order they were given.
+    """
+    options = {}
+    # Older versions keep their workers for the whole batch
+    if sys.version_info >= (3, 11):
+        options['max_tasks_per_child'] = MAX_JOBS_PER_WORKER
+    executor = ProcessPoolExecutor(max_workers=workers, **options)
+    broken = set()
+    try:
+        futures = {executor.submit(function, *job, *arguments): job
+                   for job in jobs}
+        for future in as_completed(futures):
+            try:
+                result = future.result()
+            except BrokenProcessPool:
+                broken.add(futures[future])
+                continue
+            on_result(result)
+    except KeyboardInterrupt:
+        print('Interrupted, finished reports are kept.'
+              ' Run again to resume.')
+        executor.shutdown(wait=True, cancel_futures=True)
+        raise
+    executor.shutdown()
+    return [job for job in jobs if job in broken]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Reprocess recorded drives into road quality reports.')
+    parser.add_argument('--data-folder', default=DATA_FOLDER)
+    parser.add_argument('--results-folder', default=DATA_RESULTS)
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--force', action='store_true',
+                        help='process drives with up to date reports too')
+    parser.add_argument('--renderer', choices=['native', 'browser'],
+                        default=MAP_RENDERER)
+    parser.add_argument('--chunk-size', type=int, default=None,
+                        help='stream long recordings in chunks of rows')
+    parser.add_argument('--database', default=ROAD_DATABASE,
+                        help='SQLite file collecting the road quality'
+                             ' of all drives')
+    parser.add_argument('--map-style', default=MAP_STYLE,
+                        choices=['segments', 'merged', 'geojson'],
+                        help='merged and geojson write lighter maps')
+    parser.add_argument('--bump-detector', default=BUMP_DETECTOR,
+                        choices=['percentile', 'dsp'],
+                        help='dsp filters all three accelerometer axes')
+    parser.add_argument('--profile', default=PROFILE,
+                        choices=['timing', 'cprofile', 'tracemalloc'],
+                        help='write run_<timestamp>.json with the time and'
+                             ' memory of every stage')
+    parser.add_argument('--cache', default=STAGE_CACHE,
+                        help='folder of cached stage results, with --force'
+                             ' only stages whose settings changed are'
+                             ' computed again')
+    parser.add_argument('--merge-tolerance', type=float,
+                        default=MERGE_TOLERANCE, metavar='SECONDS',
+                        help='interpolate the GPS position of samples'
+                             ' between fixes, for drives recorded with'
+                             ' an accelerometer rate')
+    parser.add_argument('--tiles', default=None, metavar='FOLDER',
+                        help='draw the road quality of the database into'
+                             ' map tiles, see tiles.py')
+    parser.add_argument('--summary', default=None, metavar='NAME',
+                        help='export the summaries and segments of all'
+                             ' processed drives to report_<NAME>.*')
+    parser.add_argument('--summary-formats', nargs='+',
+                        default=EXPORT_FORMATS,
+                        choices=['xlsx', 'csv', 'parquet'])
+    args = parser.parse_args(argv)
+    if args.tiles is not None and args.database is None:
+        parser.error('--tiles needs --database')
+    try:
+        processed, skipped, failed = run_batch(
+            args.data_folder, args.results_folder, args.workers,
+            args.force, args.renderer, args.chunk_size, args.database,
+            args.map_style, args.bump_detector, args.profile, args.cache,
+            args.merge_tolerance)
+    except KeyboardInterrupt:
+        return 130
+    print(f'Processed: {len(processed)}, skipped: {len(skipped)},'
+          f' failed: {len(failed)}')
+    if args.summary is not None:
+        export_drives(args.results_folder, name=args.summary,
+                      formats=args.summary_formats,
+                      timestamps=processed + skipped)
+    if args.tiles is not None:
+        counts = build_tiles(args.database, args.tiles)
+        print(f'Tiles written: {counts["written"]}, unchanged:'
+              f' {counts["unchanged"]}')
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
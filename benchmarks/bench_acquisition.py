@@ -0,0 +1,58 @@
+"""Measures the threaded accelerometer pipeline with a mock sensor.
+
+The mock sensor busy-waits like an I2C read of the MPU6050 and the
+samples go through the batched writer into a real log file. Run from
+the repository root:
+    python benchmarks/bench_acquisition.py
+"""
+import csv
+import os
+import sys
+import tempfile
+import time
+import numpy as np
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from acquisition import AccelerometerPipeline
+
+RATES = [100, 250, 500]
+DURATION = 5            # seconds per rate
+READ_LATENCY = 0.0004   # seconds, 6 bytes over 400 kHz I2C
+
+
+class MockAccelerometer:
+    def __init__(self):
+        self.read_times = []
+        self.rng = np.random.default_rng(0)
+
+    def read(self):
+        start = time.monotonic()
+        while time.monotonic() - start < READ_LATENCY:
+            pass
+        self.read_times.append(start)
+        x, y, z = self.rng.normal(0, 1, 3).tolist()
+        return x, y, z - 9.81
+
+
+def main():
+    print(f'{"target (Hz)":>11} {"achieved (Hz)":>13} {"jitter (ms)":>11} '
+          f'{"p99 (ms)":>9} {"dropped":>8} {"missed":>7}')
+    with tempfile.TemporaryDirectory() as folder:
+        for rate in RATES:
+            sensor = MockAccelerometer()
+            with open(os.path.join(folder, 'accel_data.csv'), 'w',
+                      newline='') as file:
+                pipeline = AccelerometerPipeline(sensor.read,
+                                                 csv.writer(file), rate)
+                pipeline.start()
+                time.sleep(DURATION)
+                pipeline.stop()
+            statistics = pipeline.statistics()
+            deviation = np.abs(np.diff(sensor.read_times) - 1 / rate) * 1000
+            print(f'{rate:>11} {statistics["rate"]:>13.1f} '
+                  f'{deviation.std():>11.3f} '
+                  f'{np.percentile(deviation, 99):>9.3f} '
+                  f'{statistics["dropped"]:>8} {statistics["missed"]:>7}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+"""Compares the single-pass bump classification with the original loops.
+
+Run from the repository root:
+    python benchmarks/bench_bumps.py
+"""
+import os
+import sys
+import timeit
+import numpy as np
+import pandas as pd
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from func import classify_bumps
+
+SIZES = [10_000, 100_000, 1_000_000]
+# One week of 8 hour shifts sampled at 1 Hz
+WEEK_OF_DRIVES = 7 * 8 * 3600
+
+
+def legacy_find_bump_coords(data):
+    z_data = data['z']
+    threshold = np.percentile(np.abs(z_data), 70)
+    bump_indices = np.where(np.abs((np.abs(z_data) - threshold)) >= 1)[0]
+    bump_coords = []
+    for i in bump_indices:
+        bump_coords.append((data.loc[i, 'latitude'],
+                            data.loc[i, 'longitude']))
+    return bump_coords
+
+
+def legacy_bumps_statistics(z_data):
+    all_bumps = 0
+    big_bumps = 0
+    medium_bumps = 0
+    small_bumps = 0
+    threshold = np.percentile(np.abs(z_data), 70)
+    for i in z_data:
+        if 1 < np.abs((np.abs(i) - threshold)) < 1.5:
+            all_bumps += 1
+            small_bumps += 1
+        elif 1.5 <= np.abs((np.abs(i) - threshold)) < 2:
+            all_bumps += 1
+            medium_bumps += 1
+        elif (np.abs(np.abs(i) - threshold)) >= 2:
+            all_bumps += 1
+            big_bumps += 1
+    return all_bumps, big_bumps, medium_bumps, small_bumps
+
+
+def make_data(num_rows, seed=0):
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({
+        'latitude': 44.8125 + rng.normal(0, 0.01, num_rows),
+        'longitude': 20.4612 + rng.normal(0, 0.01, num_rows),
+        'z': rng.normal(-9.81, 1.0, num_rows)})
+
+
+def legacy(data):
+    legacy_find_bump_coords(data)
+    legacy_bumps_statistics(data['z'])
+
+
+def main():
+    sizes = SIZES + [WEEK_OF_DRIVES]
+    print(f'{"rows":>10} {"legacy (s)":>12} {"single pass (s)":>16} '
+          f'{"speedup":>8} {"same":>5}')
+    for size in sizes:
+        data = make_data(size)
+        _, bump_coords, bumps = classify_bumps(data)
+        same = (bump_coords == legacy_find_bump_coords(data)
+                and bumps == legacy_bumps_statistics(data['z']))
+        legacy_time = min(timeit.repeat(lambda: legacy(data),
+                                        number=1, repeat=1))
+        new_time = min(timeit.repeat(lambda: classify_bumps(data),
+                                     number=1, repeat=3))
+        print(f'{size:>10} {legacy_time:>12.3f} {new_time:>16.3f} '
+              f'{legacy_time / new_time:>7.1f}x {str(same):>5}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,43 @@
+"""Times bump clustering on detections from many drives.
+
+Run from the repository root:
+    python benchmarks/bench_clusters.py
+"""
+import os
+import sys
+import time
+import numpy as np
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from clusters import cluster_bumps
+
+SIZES = [10_000, 50_000, 200_000, 1_000_000]
+NUM_POTHOLES = 2_000
+GPS_NOISE = 0.00002             # degrees, about 2 m
+
+
+def make_detections(num_detections, seed=0):
+    """Detections of NUM_POTHOLES potholes in a 10 km square,
+    one drive per 20 detections."""
+    rng = np.random.default_rng(seed)
+    potholes = (np.array([44.75, 20.40])
+                + rng.uniform(0, 0.09, size=(NUM_POTHOLES, 2)))
+    coords = (potholes[rng.integers(NUM_POTHOLES, size=num_detections)]
+              + rng.normal(0, GPS_NOISE, size=(num_detections, 2)))
+    drives = np.arange(num_detections) // 20
+    return coords, drives
+
+
+def main():
+    print(f'{"detections":>10} {"entities":>9} {"time (s)":>9} '
+          f'{"us / detection":>15}')
+    for size in SIZES:
+        coords, drives = make_detections(size)
+        start = time.perf_counter()
+        _, entities = cluster_bumps(coords, drives)
+        seconds = time.perf_counter() - start
+        print(f'{size:>10} {len(entities):>9} {seconds:>9.3f} '
+              f'{seconds / size * 1e6:>15.2f}')
+
+
+if __name__ == '__main__':
+    main()
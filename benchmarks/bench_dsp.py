@@ -0,0 +1,86 @@
+"""Times the dsp bump detection pipeline on synthetic 500 Hz drives.
+
+The pipeline runs over the whole drive at once and in chunks, with
+scipy.signal.sosfilt and with the NumPy fallback used when SciPy is
+not installed. The percentile detector is timed for comparison.
+
+Run from the repository root:
+    python benchmarks/bench_dsp.py
+"""
+import os
+import sys
+import timeit
+import numpy as np
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import dsp
+from func import bump_sizes
+
+RATE = 500                      # Hz
+DRIVE_MINUTES = [1, 10, 60]
+FALLBACK_MINUTES = 1            # the NumPy fallback loops over samples
+CHUNK_SIZE = 100_000            # rows, same as stream.CHUNK_SIZE
+
+
+def make_drive(num_samples, seed=0):
+    """Returns x, y, z and speed columns of a drive with a tilted sensor,
+    road noise and a pothole every ten seconds."""
+    rng = np.random.default_rng(seed)
+    t = np.arange(num_samples) / RATE
+    vertical = rng.normal(0, 0.5, num_samples)
+    vertical += 10 * np.sin(2 * np.pi * 12 * t) * (t % 10 < 0.05)
+    axis = np.array([0.3, -0.2, 0.93])
+    accel = np.outer(9.81 + vertical, axis / np.linalg.norm(axis))
+    accel += rng.normal(0, 0.1, accel.shape)
+    return {'x': accel[:, 0], 'y': accel[:, 1], 'z': accel[:, 2],
+            'speed': 20 + 5 * np.sin(t / 60)}
+
+
+def run_chunked(drive, chunk_size):
+    pipeline = dsp.default_pipeline(RATE)
+    num_samples = len(drive['z'])
+    return np.concatenate([
+        pipeline({name: values[start:start + chunk_size]
+                  for name, values in drive.items()})
+        for start in range(0, num_samples, chunk_size)])
+
+
+def time_best(function, repeat):
+    return min(timeit.repeat(function, number=1, repeat=repeat))
+
+
+def main():
+    scipy = dsp.load_sosfilt() is not None
+    print(f'SciPy sosfilt: {"yes" if scipy else "no"}')
+    print(f'{"minutes":>8} {"percentile (s)":>15} {"dsp (s)":>9} '
+          f'{"chunked (s)":>12} {"x real time":>12} {"same":>5}')
+    for minutes in DRIVE_MINUTES:
+        drive = make_drive(minutes * 60 * RATE)
+        whole = dsp.default_pipeline(RATE)(drive)
+        same = np.array_equal(whole, run_chunked(drive, CHUNK_SIZE))
+        percentile_time = time_best(lambda: bump_sizes(drive['z']), 3)
+        whole_time = time_best(
+            lambda: dsp.default_pipeline(RATE)(drive), 3)
+        chunked_time = time_best(lambda: run_chunked(drive, CHUNK_SIZE), 3)
+        print(f'{minutes:>8} {percentile_time:>15.3f} {whole_time:>9.3f} '
+              f'{chunked_time:>12.3f} {minutes * 60 / chunked_time:>12.0f} '
+              f'{str(same):>5}')
+
+    if not scipy:
+        return
+    drive = make_drive(FALLBACK_MINUTES * 60 * RATE)
+    expected = dsp.default_pipeline(RATE)(drive)
+    dsp.USE_SCIPY = False
+    try:
+        fallback_time = time_best(
+            lambda: dsp.default_pipeline(RATE)(drive), 1)
+        same = np.array_equal(dsp.default_pipeline(RATE)(drive), expected)
+    finally:
+        dsp.USE_SCIPY = True
+    print(f'NumPy fallback, {FALLBACK_MINUTES} minute: '
+          f'{fallback_time:.3f} s, '
+          f'{FALLBACK_MINUTES * 60 / fallback_time:.0f}x real time, '
+          f'same as SciPy: {same}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,72 @@
+"""Compares logging every accelerometer sample with event capture.
+
+Replays synthetic drives at the full sample rate through
+acquisition.EventCapture in the batches of the writer thread, writes
+both the complete and the captured log as CSV and reports their sizes,
+the time the trigger takes per batch and how many of the injected
+bumps were written at full rate from start to end.
+
+Run from the repository root:
+    python benchmarks/bench_event_capture.py
+"""
+import csv
+import os
+import sys
+import tempfile
+import time
+import numpy as np
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from acquisition import (SUMMARY_COLUMN, WRITE_INTERVAL, EventCapture,
+                         accel_rows)
+from synthetic import BUMP_SECONDS, synthetic_drive
+
+DURATION = 1800                 # seconds, a half hour drive
+RATE = 100                      # Hz
+BUMPS_PER_KM = [0.5, 2, 5]
+
+
+def write_log(path, rows):
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['x', 'y', 'z', 'time', SUMMARY_COLUMN][
+            :rows.shape[1]])
+        writer.writerows(accel_rows(rows, 0))
+    return os.path.getsize(path)
+
+
+def main():
+    batch = int(RATE * WRITE_INTERVAL)
+    print(f'{DURATION} s at {RATE} Hz')
+    print(f'{"bumps/km":>8} {"bumps":>6} {"events":>6} {"rows":>8} '
+          f'{"full MB":>8} {"captured MB":>11} {"ratio":>6} '
+          f'{"us/batch":>9} {"intact":>7}')
+    with tempfile.TemporaryDirectory() as folder:
+        for bumps_per_km in BUMPS_PER_KM:
+            accel_data, _, bumps = synthetic_drive(
+                DURATION, accel_rate=RATE, bumps_per_km=bumps_per_km)
+            samples = accel_data[['time', 'x', 'y', 'z']].to_numpy()
+            capture = EventCapture()
+            start = time.perf_counter()
+            written = [capture.select(samples[i:i + batch])
+                       for i in range(0, len(samples), batch)]
+            seconds = time.perf_counter() - start
+            written = np.concatenate(written + [capture.finish()])
+
+            full = write_log(os.path.join(folder, 'full.csv'), samples)
+            captured = write_log(os.path.join(folder, 'captured.csv'),
+                                 written)
+            kept = np.isin(samples[:, 0], written[:, 0])
+            intact = sum(kept[(samples[:, 0] >= bump_time)
+                              & (samples[:, 0] <= bump_time + BUMP_SECONDS
+                                 - 0.2)].all()
+                         for bump_time in bumps['time'])
+            print(f'{bumps_per_km:>8} {len(bumps):>6} '
+                  f'{capture.statistics()["events"]:>6} {len(written):>8} '
+                  f'{full / 1e6:>8.2f} {captured / 1e6:>11.2f} '
+                  f'{full / captured:>6.1f} '
+                  f'{seconds / len(samples) * batch * 1e6:>9.0f} '
+                  f'{intact:>4}/{len(bumps)}')
+
+
+if __name__ == '__main__':
+    main()
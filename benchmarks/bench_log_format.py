@@ -0,0 +1,66 @@
+"""Compares writing and reading sensor logs as CSV and as binary logs.
+
+Rows are written one at a time, like app.main does, and read back with
+read_data_file. Run from the repository root:
+    python benchmarks/bench_log_format.py
+"""
+import csv
+import os
+import sys
+import tempfile
+import time
+import numpy as np
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from binlog import create_log_file
+from func import read_data_file
+
+SIZES = [10_000, 100_000, 1_000_000]
+
+
+def create_csv_file(file_name, headers):
+    file = open(file_name, "w", newline="")
+    writer = csv.writer(file)
+    writer.writerow(headers)
+    return file, writer
+
+
+def make_rows(num_rows, seed=0):
+    rng = np.random.default_rng(seed)
+    values = rng.normal(0, 1, size=(num_rows, 3)).tolist()
+    return [[x, y, z, f'{i // 3600 % 24:02d}:{i // 60 % 60:02d}:{i % 60:02d}']
+            for i, (x, y, z) in enumerate(values)]
+
+
+def measure(create_file, path, rows):
+    start = time.perf_counter()
+    file, writer = create_file(path, ['x', 'y', 'z', 'time'])
+    for row in rows:
+        writer.writerow(row)
+    file.close()
+    write_time = time.perf_counter() - start
+    start = time.perf_counter()
+    data = read_data_file(path)
+    # Touch the values so lazily mapped files are really read
+    float(data['z'].sum())
+    read_time = time.perf_counter() - start
+    return write_time, read_time, os.path.getsize(path) / 2 ** 20
+
+
+def main():
+    print(f'{"rows":>9} {"format":>7} {"write (s)":>10} {"read (s)":>9} '
+          f'{"size (MB)":>10}')
+    with tempfile.TemporaryDirectory() as folder:
+        for size in SIZES:
+            rows = make_rows(size)
+            for name, create_file, extension in [
+                    ('csv', create_csv_file, '.csv'),
+                    ('binary', create_log_file, '.bin')]:
+                path = os.path.join(folder, f'accel_data{extension}')
+                write_time, read_time, megabytes = measure(create_file, path,
+                                                           rows)
+                print(f'{size:>9} {name:>7} {write_time:>10.3f} '
+                      f'{read_time:>9.3f} {megabytes:>10.1f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+"""Compares flush policies of the sensor log writer.
+
+Writes a minute of 500 Hz accelerometer rows row by row, the way
+app.main does, through csv.writer without syncing, with a synced block
+per row and with the batched blocks of logwriter.SegmentedLogWriter,
+then times recovering and stitching the parts of a longer drive.
+
+Run from the repository root:
+    python benchmarks/bench_log_writer.py
+"""
+import csv
+import os
+import sys
+import tempfile
+import time
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from logwriter import SegmentedLogWriter, stitch_log
+
+RATE = 500                      # Hz
+SECONDS = 60
+FLUSH_ROWS = [1, 100, 1000]
+STITCH_ROWS = 2_000_000
+SEGMENT_ROWS = 250_000
+HEADERS = ['x', 'y', 'z', 'time']
+
+
+def make_rows(num_rows):
+    return [[0.12, -0.05, 9.81, f'08:00:{i / RATE % 60:09.6f}']
+            for i in range(num_rows)]
+
+
+def write_plain(path, rows):
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(HEADERS)
+        for row in rows:
+            writer.writerow(row)
+
+
+def write_segmented(path, rows, flush_rows, segment_rows=None):
+    writer = SegmentedLogWriter(path, HEADERS, flush_rows=flush_rows,
+                                segment_rows=segment_rows)
+    for row in rows:
+        writer.writerow(row)
+    writer.close()
+    return writer
+
+
+def main():
+    rows = make_rows(RATE * SECONDS)
+    with tempfile.TemporaryDirectory() as folder:
+        print(f'{"policy":<22} {"seconds":>8} {"rows/s":>10} '
+              f'{"fsyncs":>7}')
+        start = time.perf_counter()
+        write_plain(os.path.join(folder, 'plain.csv'), rows)
+        seconds = time.perf_counter() - start
+        print(f'{"csv.writer, no sync":<22} {seconds:>8.3f} '
+              f'{len(rows) / seconds:>10.0f} {0:>7}')
+        for flush_rows in FLUSH_ROWS:
+            path = os.path.join(folder, f'flush_{flush_rows}.csv')
+            start = time.perf_counter()
+            writer = write_segmented(path, rows, flush_rows)
+            seconds = time.perf_counter() - start
+            # The data and the index are synced for every block
+            print(f'{f"block of {flush_rows} rows":<22} {seconds:>8.3f} '
+                  f'{len(rows) / seconds:>10.0f} '
+                  f'{2 * (writer.blocks + 1):>7}')
+
+        path = os.path.join(folder, 'stitched.csv')
+        writer = SegmentedLogWriter(path, HEADERS,
+                                    segment_rows=SEGMENT_ROWS)
+        block = make_rows(1000)
+        for _ in range(STITCH_ROWS // len(block)):
+            writer.writerows(block)
+        writer.close()
+        start = time.perf_counter()
+        stitch_log(path)
+        seconds = time.perf_counter() - start
+        size = os.path.getsize(path) / 1e6
+        print(f'\nStitched {len(writer.parts)} parts, {size:.0f} MB, in '
+              f'{seconds:.3f} s ({size / seconds:.0f} MB/s)')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,97 @@
+"""Compares the size and load cost of the HTML map styles.
+
+The load cost is the time V8 takes to compile the inline scripts of
+the page, measured with Node.js when it is installed, and the number
+of lines the page draws.
+
+Run from the repository root:
+    python benchmarks/bench_map_size.py
+"""
+import gzip
+import os
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import numpy as np
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from func import (divide_into_segments, find_bump_mask, plot_map,
+                  segment_bounds, segment_bump_counts, step_distances)
+
+STYLES = ['segments', 'merged', 'geojson']
+DRIVE_MINUTES = [10, 60]
+SAMPLE_RATE = 50                # merged rows per second
+SPEED = 15                      # meters per second
+COMPILE_SCRIPT = """
+const fs = require('fs');
+const source = fs.readFileSync(process.argv[1], 'utf8');
+const start = process.hrtime.bigint();
+for (let i = 0; i < 5; i++) { new Function(source); }
+console.log(Number(process.hrtime.bigint() - start) / 5e6);
+"""
+
+
+def make_drive(minutes, seed=0):
+    """A winding road with rough stretches, one row per sample."""
+    rng = np.random.default_rng(seed)
+    num_rows = minutes * 60 * SAMPLE_RATE
+    heading = np.cumsum(rng.normal(0, 0.002, num_rows))
+    step = SPEED / SAMPLE_RATE / 111_000
+    coords = np.column_stack((44.8 + np.cumsum(np.cos(heading)) * step,
+                              20.4 + np.cumsum(np.sin(heading)) * step))
+    # Road quality changes every few hundred meters
+    roughness = np.repeat(rng.choice([0.3, 0.8, 1.5], num_rows // 1000 + 1),
+                          1000)[:num_rows]
+    z_data = rng.normal(-9.81, roughness)
+    return [tuple(point) for point in coords.tolist()], z_data
+
+
+def compile_time(html_path):
+    """Returns the milliseconds V8 needs to compile the inline scripts,
+    None without Node.js."""
+    node = shutil.which('node')
+    if node is None:
+        return None
+    with open(html_path) as f:
+        scripts = re.findall(r'<script>(.*?)</script>', f.read(), re.S)
+    with tempfile.NamedTemporaryFile('w', suffix='.js',
+                                     delete=False) as f:
+        f.write('\n'.join(scripts))
+    try:
+        output = subprocess.run([node, '-e', COMPILE_SCRIPT, f.name],
+                                capture_output=True, text=True, check=True)
+    finally:
+        os.remove(f.name)
+    return float(output.stdout)
+
+
+def main():
+    folder = tempfile.mkdtemp()
+    print(f'{"minutes":>7} {"style":>9} {"size (kB)":>10} {"gzip (kB)":>10}'
+          f' {"lines":>7} {"compile (ms)":>13}')
+    for minutes in DRIVE_MINUTES:
+        coords, z_data = make_drive(minutes)
+        distances = step_distances(coords)
+        segments, z_segments = divide_into_segments(coords, z_data,
+                                                    distances)
+        bump_mask = find_bump_mask({'z': z_data})
+        bump_counts = segment_bump_counts(bump_mask,
+                                          segment_bounds(distances))
+        for style in STYLES:
+            map_path = plot_map(segments, z_segments, [], folder,
+                                bump_counts, f'{minutes}_{style}', style)
+            with open(map_path, 'rb') as f:
+                html = f.read()
+            lines = (html.count(b'L.polyline(')
+                     + html.count(b'"type": "Feature"'))
+            seconds = compile_time(map_path)
+            print(f'{minutes:>7} {style:>9} {len(html) / 1000:>10.0f}'
+                  f' {len(gzip.compress(html)) / 1000:>10.0f}'
+                  f' {lines:>7}'
+                  f' {"-" if seconds is None else f"{seconds:.1f}":>13}')
+    shutil.rmtree(folder)
+
+
+if __name__ == '__main__':
+    main()
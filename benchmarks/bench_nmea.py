@@ -0,0 +1,98 @@
+"""Times parsing the NMEA output of a drive recorded at 10 Hz.
+
+Compares the old way of app.read_gps_data, one line at a time with
+pynmea2 and only RMC kept, with nmea.NmeaParser fed with raw chunks
+that merges RMC, VTG, GGA and GSA into fixes, and replays the drive
+through an NmeaReader thread.
+
+Run from the repository root:
+    python benchmarks/bench_nmea.py
+"""
+import io
+import os
+import sys
+import tempfile
+import time
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from nmea import NmeaParser, NmeaReader, ReplayPort, nmea_sentence
+
+RATE = 10                       # Hz
+DRIVE_SECONDS = 3600
+CHUNK_SIZE = 256                # bytes, about one epoch
+
+
+def recorded_drive(num_epochs):
+    lines = []
+    for n in range(num_epochs):
+        seconds = 8 * 3600 + n / RATE
+        utc = (f'{int(seconds // 3600):02d}{int(seconds // 60 % 60):02d}'
+               f'{seconds % 60:05.2f}')
+        latitude = f'{4448 + n * 1e-4:.4f}'
+        for body in (
+                f'GPRMC,{utc},A,{latitude},N,02028.5678,E,12.5,84.2,'
+                f'181026,,,A',
+                'GPVTG,84.2,T,,M,12.5,N,23.150,K,A',
+                f'GPGGA,{utc},{latitude},N,02028.5678,E,1,08,0.94,117.3,M,'
+                f'38.5,M,,',
+                'GPGSA,A,3,02,05,12,13,15,18,24,29,,,,,1.72,0.94,1.44'):
+            lines.append(nmea_sentence(body))
+    return ''.join(lines).encode('ascii')
+
+
+def parse_pynmea2(data):
+    import pynmea2
+    fixes = 0
+    for line in io.BytesIO(data):
+        line = line.decode('unicode_escape')
+        if line.startswith('$GPRMC'):
+            msg = pynmea2.parse(line)
+            fixes += msg.latitude is not None
+    return fixes
+
+
+def parse_chunks(data):
+    parser = NmeaParser()
+    fixes = 0
+    for start in range(0, len(data), CHUNK_SIZE):
+        fixes += len(parser.feed(data[start:start + CHUNK_SIZE]))
+    return fixes + (parser.flush() is not None)
+
+
+def replay(data):
+    with tempfile.TemporaryDirectory() as folder:
+        path = os.path.join(folder, 'drive.nmea')
+        with open(path, 'wb') as f:
+            f.write(data)
+        port = ReplayPort(path, timeout=0.01)
+        fixes = []
+        reader = NmeaReader(port, fixes.append)
+        reader.start()
+        while not port.finished():
+            reader.join(0.01)
+        reader.stop()
+        reader.join()
+    return len(fixes)
+
+
+def main():
+    num_epochs = DRIVE_SECONDS * RATE
+    data = recorded_drive(num_epochs)
+    lines = data.count(b'\n')
+    print(f'{num_epochs} epochs, {lines} sentences, {len(data) / 1e6:.1f} MB')
+    print(f'{"parser":<24} {"seconds":>8} {"lines/s":>10} {"fixes":>7}')
+    for name, function in (('pynmea2, RMC per line', parse_pynmea2),
+                           ('NmeaParser, chunks', parse_chunks),
+                           ('NmeaReader, replay', replay)):
+        try:
+            start = time.perf_counter()
+            fixes = function(data)
+        except ImportError:
+            print(f'{name:<24} not installed')
+            continue
+        seconds = time.perf_counter() - start
+        print(f'{name:<24} {seconds:>8.3f} {lines / seconds:>10.0f} '
+              f'{fixes:>7}')
+
+
+if __name__ == '__main__':
+    main()
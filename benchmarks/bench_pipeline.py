@@ -0,0 +1,179 @@
+"""Times the processing pipeline on synthetic drives of growing length.
+
+Every function is timed at every size, in rows of 10 Hz accelerometer
+samples, and compared with a saved baseline. The script exits with
+status 1 when a function got slower than the baseline by more than the
+tolerance, so it can guard against regressions. Baselines only compare
+well on the machine they were saved on.
+
+Run from the repository root:
+    python benchmarks/bench_pipeline.py                 compare
+    python benchmarks/bench_pipeline.py --save          new baseline
+    python benchmarks/bench_pipeline.py --sizes 1000 100000 --cases plot_map
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import timeit
+import numpy as np
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from func import (NEAREST_TOLERANCE, bumps_statistics, classify_bumps,
+                  divide_into_segments, find_bump_coords, get_segment_color,
+                  merge_dataframes, plot_map, process_data, read_data_file,
+                  segment_bounds, segment_bump_counts, step_distances)
+from synthetic import synthetic_drive, write_drive
+
+SIZES = [1_000, 10_000, 100_000, 1_000_000, 10_000_000]
+ACCEL_RATE = 10                 # Hz, rows per second of driving
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                        'baselines', 'pipeline.json')
+TOLERANCE = 0.25                # allowed slowdown over the baseline
+NOISE_FLOOR = 0.005             # seconds, shorter differences are noise
+TIME_BUDGET = 1.0               # seconds of repeats per measurement
+
+
+class Drive:
+    """Synthetic drive with the intermediate results the pipeline
+    functions take as input, written as CSV and binary logs."""
+
+    def __init__(self, num_rows, folder):
+        self.folder = folder
+        self.accel_data, self.gps_data, _ = synthetic_drive(
+            (num_rows - 1) / ACCEL_RATE, accel_rate=ACCEL_RATE)
+        self.csv_paths = write_drive(folder, self.accel_data, self.gps_data,
+                                     'csv', 'csv')
+        self.binary_paths = write_drive(folder, self.accel_data,
+                                        self.gps_data, 'binary', 'binary')
+        self.data = merge_dataframes(self.accel_data, self.gps_data,
+                                     NEAREST_TOLERANCE)
+        self.bump_mask, self.bump_coords, _ = classify_bumps(self.data)
+        self.coords = list(zip(self.data['latitude'],
+                               self.data['longitude']))
+        self.distances = step_distances(self.coords)
+        self.segments, self.z_data_segments = divide_into_segments(
+            self.coords, self.data['z'], self.distances)
+        self.bump_counts = segment_bump_counts(
+            self.bump_mask, segment_bounds(self.distances))
+
+
+def segment_colors(drive):
+    return [get_segment_color(segment, z_data, drive.bump_coords, count)
+            for segment, z_data, count in zip(
+                drive.segments, drive.z_data_segments, drive.bump_counts)]
+
+
+def run_process_data(drive):
+    accel_path, gps_path = drive.binary_paths
+    return process_data(accel_path, gps_path, drive.folder, drive.folder,
+                        timestamp='bench', archive=False,
+                        merge_tolerance=NEAREST_TOLERANCE)
+
+
+# Name, timed function of a Drive and the largest size worth timing
+CASES = [
+    ('read_data_file_csv',
+     lambda drive: read_data_file(drive.csv_paths[0]), None),
+    ('read_data_file_binary',
+     lambda drive: read_data_file(drive.binary_paths[0]), None),
+    ('merge_dataframes',
+     lambda drive: merge_dataframes(drive.accel_data, drive.gps_data,
+                                    NEAREST_TOLERANCE), None),
+    ('find_bump_coords', lambda drive: find_bump_coords(drive.data), None),
+    ('bumps_statistics',
+     lambda drive: bumps_statistics(drive.data['z']), None),
+    ('divide_into_segments',
+     lambda drive: divide_into_segments(drive.coords, drive.data['z'],
+                                        drive.distances), None),
+    ('get_segment_color', segment_colors, None),
+    # Every segment becomes a folium PolyLine, beyond a million rows
+    # the map alone takes minutes and gigabytes
+    ('plot_map',
+     lambda drive: plot_map(drive.segments, drive.z_data_segments,
+                            drive.bump_coords, drive.folder,
+                            drive.bump_counts, 'bench'), 1_000_000),
+    ('process_data', run_process_data, 1_000_000),
+]
+
+
+def measure(function, drive):
+    """Returns the best time in seconds of repeated calls."""
+    first = timeit.timeit(lambda: function(drive), number=1)
+    repeat = int(min(max(TIME_BUDGET / max(first, 1e-9), 1), 5))
+    if repeat == 1:
+        return first
+    return min([first] + timeit.repeat(lambda: function(drive), number=1,
+                                       repeat=repeat - 1))
+
+
+def load_baseline(path):
+    try:
+        with open(path) as f:
+            return json.load(f)['results']
+    except FileNotFoundError:
+        return {}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=SIZES)
+    parser.add_argument('--cases', nargs='+',
+                        choices=[name for name, _, _ in CASES])
+    parser.add_argument('--baseline', default=BASELINE)
+    parser.add_argument('--save', action='store_true',
+                        help='save the results as the new baseline')
+    parser.add_argument('--tolerance', type=float, default=TOLERANCE)
+    args = parser.parse_args(argv)
+
+    cases = [case for case in CASES
+             if args.cases is None or case[0] in args.cases]
+    baseline = load_baseline(args.baseline)
+    results = {}
+    regressions = []
+    print(f'{"case":<22} {"rows":>10} {"seconds":>10} {"baseline":>10} '
+          f'{"ratio":>6}')
+    for size in args.sizes:
+        with tempfile.TemporaryDirectory() as folder:
+            drive = Drive(size, folder)
+            for name, function, max_rows in cases:
+                if max_rows is not None and size > max_rows:
+                    continue
+                seconds = measure(function, drive)
+                results.setdefault(name, {})[str(size)] = seconds
+                before = baseline.get(name, {}).get(str(size))
+                if before is None:
+                    print(f'{name:<22} {size:>10} {seconds:>10.4f}')
+                    continue
+                ratio = seconds / before
+                slower = (ratio > 1 + args.tolerance
+                          and seconds - before > NOISE_FLOOR)
+                if slower:
+                    regressions.append((name, size, ratio))
+                print(f'{name:<22} {size:>10} {seconds:>10.4f} '
+                      f'{before:>10.4f} {ratio:>6.2f}'
+                      f'{" SLOWER" if slower else ""}')
+            drive = None
+
+    if args.save:
+        # Sizes and cases that were not run keep their saved times
+        for name, times in results.items():
+            baseline.setdefault(name, {}).update(times)
+        os.makedirs(os.path.dirname(args.baseline), exist_ok=True)
+        with open(args.baseline, 'w') as f:
+            json.dump({'machine': platform.platform(),
+                       'processor': platform.processor(),
+                       'python': platform.python_version(),
+                       'numpy': np.__version__,
+                       'results': baseline}, f, indent=2, sort_keys=True)
+            f.write('\n')
+        print(f'Baseline saved to {args.baseline}')
+        return 0
+    for name, size, ratio in regressions:
+        print(f'Regression: {name} at {size} rows is {ratio:.2f}x slower')
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,62 @@
+"""Measures the overhead of the profiling instrumentation.
+
+Times a single stage() and observe() call with profiling off and on,
+and process_data on a synthetic drive with every profile setting.
+Run from the repository root:
+    python benchmarks/bench_profiling.py
+"""
+import os
+import sys
+import tempfile
+import timeit
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from func import NEAREST_TOLERANCE, process_data
+from profiling import RunProfile, observe, stage
+from synthetic import synthetic_drive, write_drive
+
+CALLS = 100_000
+DRIVE_SECONDS = 3600            # one hour at 10 Hz
+PROFILES = [None, 'timing', 'cprofile', 'tracemalloc']
+
+
+def empty_stage():
+    with stage('empty'):
+        pass
+
+
+def per_call():
+    """Returns the nanoseconds of a stage and an observe call."""
+    stage_time = timeit.timeit(empty_stage, number=CALLS) / CALLS
+    observe_time = timeit.timeit(lambda: observe('value', 1.0),
+                                 number=CALLS) / CALLS
+    return stage_time * 1e9, observe_time * 1e9
+
+
+def main():
+    off = per_call()
+    with RunProfile():
+        on = per_call()
+    print(f'{"call":<10} {"off (ns)":>10} {"on (ns)":>10}')
+    for name, time_off, time_on in zip(('stage', 'observe'), off, on):
+        print(f'{name:<10} {time_off:>10.0f} {time_on:>10.0f}')
+
+    with tempfile.TemporaryDirectory() as folder:
+        accel_data, gps_data, _ = synthetic_drive(DRIVE_SECONDS)
+        accel_path, gps_path = write_drive(folder, accel_data, gps_data,
+                                           log_format='binary')
+        print(f'\n{"profile":<12} {"process_data (s)":>17} {"overhead":>9}')
+        baseline = None
+        for profile in PROFILES:
+            seconds = min(timeit.repeat(
+                lambda: process_data(accel_path, gps_path, folder, folder,
+                                     timestamp='bench', archive=False,
+                                     merge_tolerance=NEAREST_TOLERANCE,
+                                     profile=profile),
+                number=1, repeat=3))
+            baseline = baseline or seconds
+            print(f'{str(profile):<12} {seconds:>17.3f} '
+                  f'{seconds / baseline - 1:>8.1%}')
+
+
+if __name__ == '__main__':
+    main()
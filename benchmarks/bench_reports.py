@@ -0,0 +1,80 @@
+"""Compares workbook modes for exporting the segments of many drives.
+
+Writes the segment tables of a month of drives into one workbook with
+a regular openpyxl workbook that keeps every cell until it is saved,
+and with reports.ReportWriter, which writes the rows out as they are
+added in write-only mode. The peak traced memory shows what the export
+holds at once.
+
+Run from the repository root:
+    python benchmarks/bench_reports.py
+"""
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+import openpyxl
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from reports import SEGMENT_COLUMNS, ReportWriter
+
+DRIVES = 60                     # two drives a day for a month
+SEGMENTS = 300                  # 30 km drives in 100 m segments
+
+
+def drive_segments(drive):
+    return [[number, 44.81 + number * 1e-3, 20.46, 44.811 + number * 1e-3,
+             20.46, 100.0, number % 3, 0.4, 'yellow']
+            for number in range(SEGMENTS)]
+
+
+def drive_summary(drive):
+    return [f'2024_05_{drive // 2 + 1:02d}_{drive % 2:02d}_00_00',
+            1800.0, 30.0, 100, 10, 30, 60, 'Fair']
+
+
+def write_regular(path):
+    workbook = openpyxl.Workbook()
+    drives = workbook.active
+    drives.title = 'Drives'
+    segments = workbook.create_sheet('Segments')
+    segments.append(['timestamp'] + SEGMENT_COLUMNS)
+    for drive in range(DRIVES):
+        summary = drive_summary(drive)
+        for row in drive_segments(drive):
+            segments.append([summary[0]] + row)
+        drives.append(summary)
+    workbook.save(path)
+
+
+def write_streaming(folder):
+    with ReportWriter(folder, 'month', ['xlsx', 'csv']) as writer:
+        for drive in range(DRIVES):
+            writer.add_drive(drive_summary(drive), drive_segments(drive))
+
+
+def measure(write, *args):
+    tracemalloc.start()
+    start = time.perf_counter()
+    write(*args)
+    seconds = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return seconds, peak
+
+
+def main():
+    print(f'{DRIVES} drives of {SEGMENTS} segments')
+    print(f'{"writer":<28} {"seconds":>8} {"peak MB":>8}')
+    with tempfile.TemporaryDirectory() as folder:
+        seconds, peak = measure(write_regular,
+                                os.path.join(folder, 'regular.xlsx'))
+        print(f'{"openpyxl workbook":<28} {seconds:>8.2f} '
+              f'{peak / 1e6:>8.1f}')
+        seconds, peak = measure(write_streaming, folder)
+        print(f'{"ReportWriter, xlsx and csv":<28} {seconds:>8.2f} '
+              f'{peak / 1e6:>8.1f}')
+
+
+if __name__ == '__main__':
+    main()
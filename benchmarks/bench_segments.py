@@ -0,0 +1,90 @@
+"""Compares the vectorized segmentation with the original per-point loop.
+
+Run from the repository root:
+    python benchmarks/bench_segments.py
+"""
+import os
+import sys
+import timeit
+import numpy as np
+from haversine import haversine, Unit
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from func import (SEGMENT_DISTANCE_THRESHOLD, divide_into_segments,
+                  road_distance, step_distances)
+
+SIZES = [10_000, 100_000, 1_000_000]
+
+
+def legacy_divide_into_segments(coordinates, z_data):
+    z_data_segments = []
+    z_data_segment = [z_data[0]]
+    segments = []
+    total_distance = 0
+    segment = [coordinates[0]]
+    for i in range(1, len(coordinates)):
+        distance = haversine((coordinates[i-1][0], coordinates[i-1][1]),
+                             (coordinates[i][0], coordinates[i][1]),
+                             unit=Unit.METERS)
+        total_distance += distance
+        if total_distance >= SEGMENT_DISTANCE_THRESHOLD:
+            segment.append(coordinates[i])
+            segments.append(segment)
+            segment = [coordinates[i]]
+            z_data_segment.append(z_data[i])
+            z_data_segments.append(z_data_segment)
+            z_data_segment = [z_data[i]]
+            total_distance = 0
+        else:
+            segment.append(coordinates[i])
+            z_data_segment.append(z_data[i])
+    segments.append(segment)
+    z_data_segments.append(z_data_segment)
+    return segments, z_data_segments
+
+
+def legacy_road_distance(coords):
+    distance = 0
+    for i in range(1, len(coords)):
+        distance += haversine(coords[i-1], coords[i], unit=Unit.KILOMETERS)
+    return format(distance, ".2f")
+
+
+def make_drive(num_points, seed=0):
+    """Random walk of roughly 10 m steps starting in Belgrade."""
+    rng = np.random.default_rng(seed)
+    steps = rng.normal(0, 0.0001, size=(num_points, 2))
+    track = np.array([44.8125, 20.4612]) + np.cumsum(steps, axis=0)
+    coords = list(map(tuple, track.tolist()))
+    z_data = rng.normal(-9.81, 0.5, size=num_points).tolist()
+    return coords, z_data
+
+
+def legacy(coords, z_data):
+    legacy_divide_into_segments(coords, z_data)
+    legacy_divide_into_segments(coords, z_data)
+    legacy_road_distance(coords)
+
+
+def vectorized(coords, z_data):
+    distances = step_distances(coords)
+    divide_into_segments(coords, z_data, distances)
+    road_distance(coords, distances)
+
+
+def main():
+    print(f'{"points":>10} {"legacy (s)":>12} {"vectorized (s)":>15} '
+          f'{"speedup":>8} {"same":>5}')
+    for size in SIZES:
+        coords, z_data = make_drive(size)
+        same = (legacy_divide_into_segments(coords, z_data)
+                == divide_into_segments(coords, z_data))
+        legacy_time = min(timeit.repeat(lambda: legacy(coords, z_data),
+                                        number=1, repeat=3))
+        new_time = min(timeit.repeat(lambda: vectorized(coords, z_data),
+                                     number=1, repeat=3))
+        print(f'{size:>10} {legacy_time:>12.3f} {new_time:>15.3f} '
+              f'{legacy_time / new_time:>7.1f}x {str(same):>5}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+"""Measures how long importing the acquisition app takes.
+
+Imports app.py in fresh interpreters with python -X importtime and
+reports the fastest import, the slowest modules it loads and any of
+the analysis and reporting packages that should only be loaded when
+a drive is processed. Exits with status 1 when the import takes
+longer than STARTUP_BUDGET or loads one of those packages, so it can
+guard the time from ignition to the first recorded sample.
+
+Run from the repository root:
+    python benchmarks/bench_startup.py
+"""
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MODULE = 'app'
+RUNS = 5
+STARTUP_BUDGET = 0.5            # seconds, on a desktop CPU
+SLOWEST_SHOWN = 10
+DEFERRED_PACKAGES = ['pandas', 'folium', 'openpyxl', 'matplotlib',
+                     'selenium', 'func', 'live']
+
+
+def import_times(module):
+    """
+    Imports a module in a new interpreter.
+
+    Returns:
+        tuple: Cumulative import time of the module in seconds, and of
+          every module it loads by name.
+    """
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        cwd=ROOT, capture_output=True, text=True, check=True)
+    loaded = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        seconds = int(cumulative) / 1e6
+        # Modules are listed after the modules they import, a name
+        # without indent is a module imported by the interpreter itself
+        if not name.startswith('  '):
+            if name.strip() == module:
+                return seconds, loaded
+            loaded = {}
+        else:
+            loaded[name.strip()] = seconds
+    raise RuntimeError(f'{module} was not imported.')
+
+
+def main():
+    runs = [import_times(MODULE) for _ in range(RUNS)]
+    total, loaded = min(runs, key=lambda run: run[0])
+    print(f'import {MODULE}: {total * 1000:.0f} ms, fastest of {RUNS}'
+          f' (budget {STARTUP_BUDGET * 1000:.0f} ms)')
+    # Top level packages the app loads, with everything they load
+    packages = sorted(((seconds, name) for name, seconds in loaded.items()
+                       if '.' not in name), reverse=True)
+    for seconds, name in packages[:SLOWEST_SHOWN]:
+        print(f'  {name:<24} {seconds * 1000:>7.1f} ms')
+    deferred = [name for name in DEFERRED_PACKAGES if name in loaded]
+    if deferred:
+        print(f'Loaded at startup: {", ".join(deferred)}')
+    return 1 if deferred or total > STARTUP_BUDGET else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,97 @@
+"""Compares peak memory of the in-memory and streaming analysis.
+
+Every measurement runs in a fresh interpreter, so the reported peak RSS
+belongs to that analysis only. Needs Linux for /proc/self/status.
+Run from the repository root:
+    python benchmarks/bench_stream_memory.py
+"""
+import os
+import subprocess
+import sys
+import tempfile
+import numpy as np
+import pandas as pd
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SIZES = [100_000, 400_000, 1_600_000]
+
+MEASURE = '''
+import sys
+sys.path.insert(0, {root!r})
+accel_path, gps_path, mode = sys.argv[1:4]
+if mode == 'memory':
+    from func import (classify_bumps, divide_into_segments, merge_dataframes,
+                      read_data_file, road_distance, segment_bounds,
+                      segment_bump_counts, step_distances)
+    data = merge_dataframes(read_data_file(accel_path),
+                            read_data_file(gps_path))
+    bump_mask, bump_coords, bumps = classify_bumps(data)
+    coords = list(zip(data['latitude'], data['longitude']))
+    distances = step_distances(coords)
+    segments = divide_into_segments(coords, data['z'], distances)
+    segment_bump_counts(bump_mask, segment_bounds(distances))
+    road_distance(coords, distances)
+else:
+    import os, tempfile
+    import numpy as np
+    from stream import (CHUNK_SIZE, SPOOL_COLUMNS, analyze_stream,
+                        spool_merged, streaming_percentile)
+    with tempfile.TemporaryDirectory() as folder:
+        spool_path = os.path.join(folder, 'merged.bin')
+        num_rows = spool_merged(accel_path, gps_path, spool_path)[0]
+        spool = np.memmap(spool_path, dtype=np.float64, mode='r',
+                          shape=(num_rows, len(SPOOL_COLUMNS)))
+        chunks = lambda: (np.abs(spool[i:i + CHUNK_SIZE, 2])
+                          for i in range(0, num_rows, CHUNK_SIZE))
+        threshold = streaming_percentile(chunks, num_rows, 70)
+        analyze_stream(spool, threshold, lambda *segment: None)
+        spool = None
+# ru_maxrss survives exec and would report the parent's peak,
+# VmHWM belongs to this process only
+with open('/proc/self/status') as status:
+    print(status.read().split('VmHWM:')[1].split()[0])
+'''
+
+
+def write_drive(folder, num_rows, seed=0):
+    rng = np.random.default_rng(seed)
+    track = np.array([44.8125, 20.4612]) + np.cumsum(
+        rng.normal(0, 0.0001, size=(num_rows, 2)), axis=0)
+    seconds = np.arange(num_rows) // 10 % 86400
+    times = pd.to_datetime(seconds, unit='s').strftime('%H:%M:%S')
+    accel_path = os.path.join(folder, 'accel_data.csv')
+    gps_path = os.path.join(folder, 'gps_data.csv')
+    pd.DataFrame({'x': rng.normal(0, 1, num_rows),
+                  'y': rng.normal(0, 1, num_rows),
+                  'z': rng.normal(-9.81, 1, num_rows),
+                  'time': times}).to_csv(accel_path, index=False)
+    # One GPS fix per second, like the NEO 6M
+    pd.DataFrame({'latitude': track[::10, 0],
+                  'longitude': track[::10, 1],
+                  'time': times[::10]}).to_csv(gps_path, index=False)
+    return accel_path, gps_path
+
+
+def peak_rss_mb(accel_path, gps_path, mode):
+    output = subprocess.run(
+        [sys.executable, '-c', MEASURE.format(root=ROOT), accel_path,
+         gps_path, mode], check=True, capture_output=True, text=True)
+    return int(output.stdout.split()[-1]) / 1024
+
+
+def main():
+    print(f'{"accel rows":>10} {"CSV (MB)":>9} {"in-memory (MB)":>15} '
+          f'{"streaming (MB)":>15}')
+    for size in SIZES:
+        with tempfile.TemporaryDirectory() as folder:
+            accel_path, gps_path = write_drive(folder, size)
+            csv_size = (os.path.getsize(accel_path)
+                        + os.path.getsize(gps_path)) / 2 ** 20
+            memory = peak_rss_mb(accel_path, gps_path, 'memory')
+            streaming = peak_rss_mb(accel_path, gps_path, 'stream')
+            print(f'{size:>10} {csv_size:>9.1f} {memory:>15.0f} '
+                  f'{streaming:>15.0f}')
+
+
+if __name__ == '__main__':
+    main()
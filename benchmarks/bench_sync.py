@@ -0,0 +1,117 @@
+"""Measures uploading finished drives with sync.py to a local server.
+
+Writes the CSV logs of synthetic drives, then uploads them to an
+UploadServer on the loopback interface: once per compression, with
+more workers, and with a server that drops a share of the requests
+without an answer, like a connection that keeps falling out. The
+server answers every request after LATENCY, the round trip of a
+mobile connection, which more workers hide. Every run starts from an
+empty server and without archives, so its time includes compressing
+the drives.
+
+Run from the repository root:
+    python benchmarks/bench_sync.py
+"""
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from sync import (ARCHIVE_EXTENSIONS, SYNC_FOLDER, Backoff, UploadAgent,
+                  UploadHandler, UploadServer, available_compression)
+from synthetic import synthetic_drive, write_drive
+
+DRIVES = 6
+DURATION = 3600                 # seconds per drive
+ACCEL_RATE = 10                 # Hz
+CHUNK_SIZE = 256 * 1024
+WORKERS = [1, 2, 4]
+DROP_RATES = [0.1, 0.3]
+BACKOFF = (0.01, 0.2)           # start and limit, seconds
+LATENCY = 0.05                  # seconds per request
+
+
+class DroppingHandler(UploadHandler):
+    """Answers after LATENCY and closes the connection instead of
+    answering a share of the requests."""
+
+    def dropped(self):
+        time.sleep(LATENCY)
+        if random.random() >= self.server.drop_rate:
+            return False
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        self.close_connection = True
+        return True
+
+    def do_PATCH(self):
+        if not self.dropped():
+            super().do_PATCH()
+
+    def do_HEAD(self):
+        if not self.dropped():
+            super().do_HEAD()
+
+
+def upload(data, url, received, compression, workers, drop_rate, server):
+    shutil.rmtree(os.path.join(data, SYNC_FOLDER), ignore_errors=True)
+    shutil.rmtree(received)
+    os.makedirs(received)
+    server.drop_rate = drop_rate
+    backoff = Backoff(*BACKOFF)
+    start = time.perf_counter()
+    with UploadAgent(data, url, workers, CHUNK_SIZE, compression,
+                     retries=50, backoff=backoff) as agent:
+        counts = agent.sync()
+    return time.perf_counter() - start, counts, backoff.waited
+
+
+def main():
+    random.seed(0)
+    with tempfile.TemporaryDirectory() as folder:
+        data = os.path.join(folder, 'data')
+        received = os.path.join(folder, 'received')
+        os.makedirs(data)
+        for drive in range(DRIVES):
+            accel_data, gps_data, _ = synthetic_drive(
+                DURATION, accel_rate=ACCEL_RATE, seed=drive)
+            write_drive(data, accel_data, gps_data,
+                        f'2024_05_01_{drive:02d}_00_00')
+        raw = sum(os.path.getsize(os.path.join(data, name))
+                  for name in os.listdir(data))
+        print(f'{DRIVES} drives of {DURATION} s, {raw / 1e6:.1f} MB of logs,'
+              f' {CHUNK_SIZE // 1024} KB chunks,'
+              f' {LATENCY * 1000:.0f} ms per request')
+
+        server = UploadServer(received, ('127.0.0.1', 0), DroppingHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        url = f'http://127.0.0.1:{server.server_port}'
+        compressions = sorted({available_compression(name)
+                               for name in ARCHIVE_EXTENSIONS})
+        runs = ([(compression, 1, 0) for compression in compressions]
+                + [('gzip', workers, 0) for workers in WORKERS[1:]]
+                + [('gzip', 2, drop_rate) for drop_rate in DROP_RATES])
+        print(f'{"compression":<11} {"workers":>7} {"dropped":>7} '
+              f'{"MB sent":>7} {"ratio":>5} {"seconds":>7} {"MB/s":>6} '
+              f'{"retries":>7} {"waited":>6} {"connections":>11}')
+        try:
+            for compression, workers, drop_rate in runs:
+                seconds, counts, waited = upload(
+                    data, url, received, compression, workers, drop_rate,
+                    server)
+                assert counts['uploaded'] == DRIVES
+                print(f'{compression:<11} {workers:>7} {drop_rate:>7.0%} '
+                      f'{counts["sent_bytes"] / 1e6:>7.2f} '
+                      f'{raw / counts["archive_bytes"]:>5.1f} '
+                      f'{seconds:>7.2f} {raw / 1e6 / seconds:>6.1f} '
+                      f'{counts["retries"]:>7} {waited:>6.2f} '
+                      f'{counts["connections"]:>11}')
+        finally:
+            server.shutdown()
+            server.server_close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,105 @@
+"""Times building the road quality tile pyramid and serving its tiles.
+
+Fills a road database with drives over a grid of streets, builds the
+tiles of all zoom levels, builds them again with nothing changed and
+after one more drive, then fetches every tile from the tile server
+twice, the second time revalidated with its ETag.
+
+Run from the repository root:
+    python benchmarks/bench_tiles.py
+"""
+import os
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+import numpy as np
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from roaddb import RoadDatabase
+from tiles import TileServer, build_tiles
+
+DRIVES = 200
+SEGMENTS = 100                  # 10 km drives in 100 m segments
+POINTS = 20                     # GPS fixes per segment
+STREETS = 20                    # streets each way, 500 m apart
+COLORS = ['blue', 'green', 'yellow', 'orange', 'red']
+
+
+def drive_segments(rng):
+    """Returns the segments of a drive along a random street."""
+    street = rng.integers(STREETS) * 0.0045
+    length = SEGMENTS * POINTS
+    along = 44.78 + np.arange(length) * 0.00005
+    across = np.full(length, 20.42 + street)
+    points = np.column_stack((along, across) if rng.integers(2)
+                             else (across - 20.42 + 44.78,
+                                   along - 44.78 + 20.42))
+    return [points[i:i + POINTS].tolist()
+            for i in range(0, length, POINTS)]
+
+
+def fill_database(path, drives, rng):
+    with RoadDatabase(path) as db:
+        for drive in range(drives):
+            segments = drive_segments(rng)
+            db.ingest_drive(f'2024_05_{drive:06d}', segments,
+                            rng.uniform(0.1, 1, len(segments)).tolist(),
+                            rng.integers(0, 6, len(segments)).tolist(), [])
+
+
+def fetch_all(url, names, etags):
+    for name in names:
+        headers = {'If-None-Match': etags[name]} if name in etags else {}
+        try:
+            with urllib.request.urlopen(urllib.request.Request(
+                    f'{url}/{name}.png', headers=headers)) as response:
+                response.read()
+                etags[name] = response.headers['ETag']
+        except urllib.error.HTTPError as error:
+            if error.code != 304:
+                raise
+
+
+def main():
+    rng = np.random.default_rng(0)
+    with tempfile.TemporaryDirectory() as folder:
+        database = os.path.join(folder, 'roads.db')
+        tiles_folder = os.path.join(folder, 'tiles')
+        fill_database(database, DRIVES, rng)
+        for title in ['full build', 'nothing changed']:
+            start = time.perf_counter()
+            counts = build_tiles(database, tiles_folder)
+            print(f'{title:<16} {time.perf_counter() - start:>7.2f} s,'
+                  f' {counts["written"]} written,'
+                  f' {counts["unchanged"]} unchanged')
+        with RoadDatabase(database) as db:
+            db.ingest_drive('2024_06_000000', drive_segments(rng),
+                            [0.5] * SEGMENTS, [6] * SEGMENTS, [])
+        start = time.perf_counter()
+        counts = build_tiles(database, tiles_folder)
+        print(f'{"one more drive":<16} {time.perf_counter() - start:>7.2f} s,'
+              f' {counts["written"]} written,'
+              f' {counts["unchanged"]} unchanged')
+
+        names = [os.path.relpath(os.path.join(root, name), tiles_folder)[:-4]
+                 for root, _, files in os.walk(tiles_folder)
+                 for name in files if name.endswith('.png')]
+        server = TileServer(tiles_folder, ('127.0.0.1', 0))
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        url = f'http://127.0.0.1:{server.server_port}'
+        etags = {}
+        try:
+            for title in ['cold requests', 'revalidated']:
+                start = time.perf_counter()
+                fetch_all(url, names, etags)
+                seconds = time.perf_counter() - start
+                print(f'{title:<16} {len(names) / seconds:>7.0f} tiles/s')
+        finally:
+            server.shutdown()
+            server.server_close()
+
+
+if __name__ == '__main__':
+    main()
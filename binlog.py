@@ -0,0 +1,146 @@
+"""Append-only binary sensor log with fixed size float64 records.
+
+File layout:
+    8 bytes   magic b'RQLOG', format version, unused byte, column count
+    16 bytes  for each column name, ASCII padded with NUL bytes
+    records   one little-endian float64 per column, appended until closed
+
+The number of records follows from the file size, so a log cut short by
+power loss stays readable up to the last complete record, and the
+records can be mapped straight into a NumPy array without parsing.
+"""
+import os
+import struct
+import sys
+import numpy as np
+
+LOG_MAGIC = b'RQLOG'
+LOG_VERSION = 1
+LOG_EXTENSION = '.bin'
+COLUMN_NAME_SIZE = 16
+RECORD_DTYPE = np.dtype('<f8')
+
+
+def time_to_seconds(value):
+    """Converts a 'HH:MM:SS' time to seconds since midnight,
+    numbers are returned unchanged."""
+    if isinstance(value, str):
+        hours, minutes, seconds = value.split(':')
+        return int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+    return float(value)
+
+
+def header_size(num_columns):
+    """Returns the size of the header in bytes."""
+    return 8 + COLUMN_NAME_SIZE * num_columns
+
+
+def is_log_file(file_path):
+    """Checks if the file starts with the binary log magic bytes."""
+    try:
+        with open(file_path, 'rb') as f:
+            return f.read(len(LOG_MAGIC)) == LOG_MAGIC
+    except (FileNotFoundError, IsADirectoryError):
+        return False
+
+
+class BinaryLogWriter:
+    """Writes rows to a binary log with the interface of csv.writer."""
+
+    def __init__(self, file, num_columns):
+        self.file = file
+        self.record = struct.Struct(f'<{num_columns}d')
+
+    def writerow(self, row):
+        self.file.write(self.record.pack(*map(time_to_seconds, row)))
+
+    def writerows(self, rows):
+        for row in rows:
+            self.writerow(row)
+
+
+def create_log_file(file_name, headers):
+    """
+    Creates and opens a binary log with the given name and writes
+    the header.
+
+    Args:
+        file_name (str): Path of the log file.
+        headers (list): Column names, at most 16 ASCII characters each.
+
+    Returns:
+        tuple: Opened file and a writer with a csv.writer interface.
+    """
+    file = open(file_name, 'wb')
+    file.write(LOG_MAGIC + struct.pack('<BBB', LOG_VERSION, 0, len(headers)))
+    for name in headers:
+        file.write(name.encode('ascii').ljust(COLUMN_NAME_SIZE, b'\0'))
+    return file, BinaryLogWriter(file, len(headers))
+
+
+def read_log(file_path):
+    """
+    Maps the records of a binary log into memory without copying.
+
+    Args:
+        file_path (str): Path of the log file.
+
+    Returns:
+        tuple: List of column names and a read-only array with one row
+          per record, empty if the log has no records.
+    """
+    with open(file_path, 'rb') as f:
+        start = f.read(8)
+        if len(start) < 8 or start[:len(LOG_MAGIC)] != LOG_MAGIC:
+            raise ValueError(f'{file_path} is not a binary log.')
+        version, _, num_columns = struct.unpack('<BBB', start[5:])
+        if version != LOG_VERSION:
+            raise ValueError(f'{file_path} has unsupported version {version}.')
+        names = f.read(COLUMN_NAME_SIZE * num_columns)
+    columns = [names[i:i + COLUMN_NAME_SIZE].rstrip(b'\0').decode('ascii')
+               for i in range(0, len(names), COLUMN_NAME_SIZE)]
+    offset = header_size(num_columns)
+    record_size = RECORD_DTYPE.itemsize * num_columns
+    # An incomplete last record is left out
+    num_records = (os.path.getsize(file_path) - offset) // record_size
+    if num_records <= 0:
+        return columns, np.empty((0, num_columns), dtype=RECORD_DTYPE)
+    records = np.memmap(file_path, dtype=RECORD_DTYPE, mode='r',
+                        offset=offset, shape=(num_records, num_columns))
+    return columns, records
+
+
+def convert_csv_to_log(csv_path, log_path=None, chunk_size=100_000):
+    """
+    Converts a CSV sensor log to a binary log, chunk by chunk.
+
+    Args:
+        csv_path (str): Path of the CSV file.
+        log_path (str): Path of the binary log, the CSV path with
+          LOG_EXTENSION if not given.
+        chunk_size (int): Number of rows converted at once.
+
+    Returns:
+        str: Path of the binary log.
+    """
+    import pandas as pd
+
+    if log_path is None:
+        log_path = os.path.splitext(csv_path)[0] + LOG_EXTENSION
+    with open(csv_path) as f:
+        headers = f.readline().strip().split(',')
+    file, _ = create_log_file(log_path, headers)
+    with file:
+        for chunk in pd.read_csv(csv_path, chunksize=chunk_size):
+            if ('time' in chunk
+                    and not pd.api.types.is_numeric_dtype(chunk['time'])):
+                chunk['time'] = pd.to_timedelta(
+                    chunk['time']).dt.total_seconds()
+            file.write(chunk[headers].to_numpy(dtype=RECORD_DTYPE).tobytes())
+    return log_path
+
+
+if __name__ == '__main__':
+    # Usage: python binlog.py accel_data_*.csv gps_data_*.csv
+    for path in sys.argv[1:]:
+        print(f'{path} -> {convert_csv_to_log(path)}')
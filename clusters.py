@@ -0,0 +1,133 @@
+"""Merges bump detections of many drives into stable bump entities.
+
+GPS noise puts the same pothole at slightly different coordinates on
+every pass. Detections closer than the cluster radius are linked and
+every connected group becomes one bump entity.
+
+Detections are sorted into a grid so only nearby cells are compared.
+A pothole hit on hundreds of drives would still make the number of
+compared pairs grow with the square of its hits, so each grid cell is
+split into SUBCELLS x SUBCELLS sub-cells and only one detection of
+every sub-cell is compared. That bounds the pairs per detection and
+keeps clustering at O(n log n); distances are exact to within about
+a sixth of the radius.
+"""
+import numpy as np
+import pandas as pd
+from func import haversine_distances, local_meters
+
+BUMP_CLUSTER_RADIUS = 5.0       # meters
+SUBCELLS = 6                    # per grid cell side
+
+
+def neighbour_pairs(points, radius, cell_size):
+    """
+    Finds all pairs of points closer than radius.
+
+    Args:
+        points (numpy.ndarray): Array of (x, y) positions in meters.
+        radius (float): Largest distance in meters.
+        cell_size (float): Side of the grid cells in meters.
+
+    Returns:
+        tuple: Arrays of the first and second indices of every pair.
+    """
+    reach = int(np.ceil(radius / cell_size))
+    cells = np.floor(points / cell_size).astype(np.int64)
+    cells -= cells.min(axis=0) - reach
+    width = cells[:, 1].max() + reach + 1
+    keys = cells[:, 0] * width + cells[:, 1]
+    order = np.argsort(keys, kind='stable')
+    sorted_keys = keys[order]
+    # Half of the neighbouring cells, the other half gives the same pairs
+    offsets = ([(0, d_col) for d_col in range(reach + 1)]
+               + [(d_row, d_col) for d_row in range(1, reach + 1)
+                  for d_col in range(-reach, reach + 1)])
+    firsts, seconds = [], []
+    for d_row, d_col in offsets:
+        targets = keys + d_row * width + d_col
+        starts = np.searchsorted(sorted_keys, targets, side='left')
+        counts = np.searchsorted(sorted_keys, targets, side='right') - starts
+        first = np.repeat(np.arange(len(points)), counts)
+        # Position of every candidate within its range of the cell
+        offsets_in_cell = np.arange(counts.sum()) - np.repeat(
+            np.cumsum(counts) - counts, counts)
+        second = order[np.repeat(starts, counts) + offsets_in_cell]
+        if (d_row, d_col) == (0, 0):
+            keep = first < second
+            first, second = first[keep], second[keep]
+        close = np.hypot(*(points[first] - points[second]).T) <= radius
+        firsts.append(first[close])
+        seconds.append(second[close])
+    return np.concatenate(firsts), np.concatenate(seconds)
+
+
+def connected_labels(num_points, first, second):
+    """Labels every point with the smallest index of its connected
+    group, by hooking group roots together and shortcutting paths."""
+    labels = np.arange(num_points)
+    while True:
+        roots_first, roots_second = labels[first], labels[second]
+        linked = roots_first != roots_second
+        if not linked.any():
+            return labels
+        smaller = np.minimum(roots_first, roots_second)[linked]
+        np.minimum.at(labels, roots_first[linked], smaller)
+        np.minimum.at(labels, roots_second[linked], smaller)
+        while True:
+            parents = labels[labels]
+            if np.array_equal(parents, labels):
+                break
+            labels = parents
+
+
+def cluster_bumps(bump_coords, drives=None, radius=BUMP_CLUSTER_RADIUS):
+    """
+    Merges bump detections into bump entities.
+
+    Args:
+        bump_coords (list): GPS coordinates of the detected bumps.
+        drives (list): Drive of every detection, counted as passes
+          over the entity, every detection is its own pass if not given.
+        radius (float): Detections closer than this many meters
+          belong to the same entity.
+
+    Returns:
+        tuple: Entity index of every detection and a DataFrame with the
+          latitude, longitude, hits, passes and extent in meters of
+          every entity.
+    """
+    coords = np.asarray(bump_coords, dtype=np.float64).reshape(-1, 2)
+    columns = ['latitude', 'longitude', 'hits', 'passes', 'extent']
+    if len(coords) == 0:
+        return np.empty(0, dtype=np.int64), pd.DataFrame(columns=columns)
+    points = local_meters(coords)
+    # Any two points of a cell are closer than radius
+    cell_size = radius / np.sqrt(2)
+    subcells = np.floor(points / (cell_size / SUBCELLS)).astype(np.int64)
+    subcells -= subcells.min(axis=0)
+    _, representative, subcell = np.unique(
+        subcells[:, 0] * (subcells[:, 1].max() + 1) + subcells[:, 1],
+        return_index=True, return_inverse=True)
+    first, second = neighbour_pairs(points[representative], radius,
+                                    cell_size)
+    labels = connected_labels(len(representative), first, second)
+    _, entity = np.unique(labels[subcell], return_inverse=True)
+    hits = np.bincount(entity)
+    center = np.column_stack(
+        [np.bincount(entity, weights=coords[:, i]) / hits for i in (0, 1)])
+    extent = np.zeros(len(hits))
+    np.maximum.at(extent, entity,
+                  haversine_distances(center[entity], coords))
+    if drives is None:
+        passes = hits
+    else:
+        drive_names, drive_ids = np.unique(np.asarray(drives),
+                                           return_inverse=True)
+        pairs = np.unique(entity * len(drive_names) + drive_ids)
+        passes = np.bincount(pairs // len(drive_names), minlength=len(hits))
+    entities = pd.DataFrame({'latitude': center[:, 0],
+                             'longitude': center[:, 1], 'hits': hits,
+                             'passes': passes, 'extent': extent},
+                            columns=columns)
+    return entity, entities
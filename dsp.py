@@ -0,0 +1,261 @@
+"""Bump detection by filtering the accelerometer signal.
+
+A pipeline of stages runs on consecutive chunks of samples. Every
+stage keeps its filter state and the samples it still needs, so a
+drive processed chunk by chunk gives the same result as all at once.
+Each stage reads columns of the chunk and adds its own:
+
+    GravityRemoval       x, y, z -> vertical
+    BandPass             vertical -> vertical
+    SlidingWindow        vertical -> rms, peak
+    SpeedNormalization   rms, peak, vertical, speed -> same, normalized
+    BumpClassifier       vertical, peak -> size
+
+Filters are designed with NumPy. scipy.signal.sosfilt is used to
+run them when SciPy is installed, a slower NumPy loop otherwise.
+"""
+import functools
+import numpy as np
+
+GRAVITY_CUTOFF = 0.5            # Hz, slower changes are gravity and tilt
+BAND_PASS = (1.0, 40.0)         # Hz, from body motion to wheel hop
+MAX_CUTOFF_RATIO = 0.45         # of the sample rate, below Nyquist
+WINDOW_SECONDS = 0.2
+REFERENCE_SPEED = 10.0          # m/s, speed the bump limits are set for
+MIN_SPEED = 2.0                 # m/s, slower speeds are not normalized
+KNOTS_TO_METERS_PER_SECOND = 1852 / 3600
+DSP_BUMP_LIMITS = [3.0, 5.0, 8.0]   # m/s^2: small, medium, big bump
+USE_SCIPY = True                # False always runs the NumPy loop
+
+
+@functools.lru_cache(maxsize=None)
+def load_sosfilt():
+    """Returns scipy.signal.sosfilt, None if SciPy is not installed.
+    Imported on first use, since SciPy takes a second to load."""
+    try:
+        from scipy.signal import sosfilt
+    except ImportError:
+        return None
+    return sosfilt
+
+
+def biquad(kind, cutoff, rate):
+    """
+    Designs a second order Butterworth section.
+
+    Args:
+        kind (str): 'lowpass' or 'highpass'.
+        cutoff (float): Cutoff frequency in Hz.
+        rate (float): Sample rate in Hz.
+
+    Returns:
+        numpy.ndarray: Section [b0, b1, b2, 1, a1, a2] in the format
+          of scipy.signal.sosfilt.
+    """
+    omega = 2 * np.pi * cutoff / rate
+    alpha = np.sin(omega) / np.sqrt(2)
+    cos = np.cos(omega)
+    if kind == 'lowpass':
+        b = np.array([1 - cos, 2 * (1 - cos), 1 - cos]) / 2
+    else:
+        b = np.array([1 + cos, -2 * (1 + cos), 1 + cos]) / 2
+    a = np.array([1 + alpha, -2 * cos, 1 - alpha])
+    return np.concatenate((b, a)) / a[0]
+
+
+def steady_state(sos, value):
+    """Returns the filter state after a constant input of value,
+    so filtering starts without a transient."""
+    zi = np.zeros((len(sos), 2) + np.shape(value))
+    signal = np.asarray(value, dtype=float)
+    for i, (b0, b1, b2, _, a1, a2) in enumerate(sos):
+        output = signal * (b0 + b1 + b2) / (1 + a1 + a2)
+        zi[i, 0] = output - b0 * signal
+        zi[i, 1] = b2 * signal - a2 * output
+        signal = output
+    return zi
+
+
+def apply_sos(sos, signal, zi):
+    """
+    Filters a signal along the first axis with carried state.
+
+    Args:
+        sos (numpy.ndarray): Second order sections.
+        signal (numpy.ndarray): Samples, one row per sample.
+        zi (numpy.ndarray): State from steady_state or the last call.
+
+    Returns:
+        tuple: Filtered signal and the state for the next chunk.
+    """
+    sosfilt = load_sosfilt() if USE_SCIPY else None
+    if sosfilt is not None:
+        return sosfilt(sos, signal, axis=0, zi=zi)
+    output = np.array(signal, dtype=float)
+    zi = zi.copy()
+    for i, (b0, b1, b2, _, a1, a2) in enumerate(sos):
+        z0, z1 = zi[i]
+        for n in range(len(output)):
+            x = output[n]
+            y = b0 * x + z0
+            z0 = b1 * x - a1 * y + z1
+            z1 = b2 * x - a2 * y
+            output[n] = y
+        zi[i] = z0, z1
+    return output, zi
+
+
+class GravityRemoval:
+    """Estimates gravity with a low-pass filter on all three axes and
+    keeps the acceleration along it, whatever the sensor orientation."""
+
+    def __init__(self, rate, cutoff=GRAVITY_CUTOFF):
+        self.sos = np.array([biquad('lowpass', cutoff, rate)])
+        self.zi = None
+
+    def process(self, chunk):
+        accel = np.column_stack([np.asarray(chunk[axis], dtype=float)
+                                 for axis in ('x', 'y', 'z')])
+        if self.zi is None:
+            self.zi = steady_state(self.sos, accel[0])
+        gravity, self.zi = apply_sos(self.sos, accel, self.zi)
+        norm = np.linalg.norm(gravity, axis=1)
+        norm[norm == 0] = 1
+        chunk['vertical'] = np.sum((accel - gravity) * gravity,
+                                   axis=1) / norm
+        return chunk
+
+
+class BandPass:
+    """Keeps the frequencies of road bumps in the vertical signal."""
+
+    def __init__(self, rate, band=BAND_PASS):
+        low, high = band
+        # The low-pass cutoff has to stay below the Nyquist frequency
+        high = min(high, MAX_CUTOFF_RATIO * rate)
+        self.sos = np.array([biquad('highpass', low, rate),
+                             biquad('lowpass', high, rate)])
+        self.zi = np.zeros((len(self.sos), 2))
+
+    def process(self, chunk):
+        chunk['vertical'], self.zi = apply_sos(self.sos, chunk['vertical'],
+                                               self.zi)
+        return chunk
+
+
+class SlidingWindow:
+    """Adds the RMS and the peak of the absolute vertical signal over
+    the window that ends at every sample."""
+
+    def __init__(self, rate, seconds=WINDOW_SECONDS):
+        self.size = max(int(round(seconds * rate)), 1)
+        self.tail = np.zeros(self.size - 1)
+
+    def process(self, chunk):
+        signal = np.concatenate((self.tail, np.abs(chunk['vertical'])))
+        squares = np.concatenate(([0.0], np.cumsum(signal ** 2)))
+        sums = squares[self.size:] - squares[:-self.size]
+        chunk['rms'] = np.sqrt(np.maximum(sums, 0) / self.size)
+        chunk['peak'] = np.lib.stride_tricks.sliding_window_view(
+            signal, self.size).max(axis=1)
+        self.tail = signal[len(signal) - self.size + 1:]
+        return chunk
+
+
+class SpeedNormalization:
+    """Scales the signal to REFERENCE_SPEED, since the same bump
+    shakes the car harder at higher speed. Chunks without a speed
+    column, in knots like GPS $GPRMC messages, are left as they are."""
+
+    def __init__(self, reference=REFERENCE_SPEED, min_speed=MIN_SPEED):
+        self.reference = reference
+        self.min_speed = min_speed
+
+    def process(self, chunk):
+        if 'speed' not in chunk:
+            return chunk
+        speed = (np.asarray(chunk['speed'], dtype=float)
+                 * KNOTS_TO_METERS_PER_SECOND)
+        factor = self.reference / np.maximum(speed, self.min_speed)
+        factor[np.isnan(factor)] = 1
+        for column in ('vertical', 'rms', 'peak'):
+            if column in chunk:
+                chunk[column] = chunk[column] * factor
+        return chunk
+
+
+class BumpClassifier:
+    """Marks the samples that set a new window peak above the smallest
+    limit, with the same size classes as func.bump_sizes."""
+
+    def __init__(self, limits=DSP_BUMP_LIMITS):
+        self.limits = limits
+
+    def process(self, chunk):
+        magnitude = np.abs(chunk['vertical'])
+        sizes = np.digitize(magnitude, self.limits)
+        sizes[magnitude < chunk['peak']] = 0
+        chunk['size'] = sizes
+        return chunk
+
+
+class BumpPipeline:
+    """
+    Runs stages over consecutive chunks of one drive.
+
+    Args:
+        stages (list): Objects with a process(chunk) method that
+          returns the chunk with their columns added.
+    """
+
+    def __init__(self, stages):
+        self.stages = stages
+
+    def process(self, chunk):
+        """
+        Processes the next chunk of samples.
+
+        Args:
+            chunk (dict or DataFrame): Columns of the samples, at
+              least x, y and z, and speed for speed normalization.
+
+        Returns:
+            dict: Columns of the chunk with those added by the stages.
+        """
+        chunk = {name: np.asarray(values) for name, values in chunk.items()}
+        for stage in self.stages:
+            chunk = stage.process(chunk)
+        return chunk
+
+    def __call__(self, chunk):
+        """Returns the bump size of every sample of the next chunk."""
+        return self.process(chunk)['size']
+
+
+def default_pipeline(rate):
+    """Returns the bump detection pipeline for samples at rate Hz."""
+    return BumpPipeline([GravityRemoval(rate), BandPass(rate),
+                         SlidingWindow(rate), SpeedNormalization(),
+                         BumpClassifier()])
+
+
+def rate_supported(rate, band=BAND_PASS):
+    """Returns whether samples at rate Hz are fast enough to keep any
+    frequencies of the band pass."""
+    return MAX_CUTOFF_RATIO * rate > band[0]
+
+
+def supported_pipeline(rate):
+    """Returns default_pipeline(rate), None with a message if the
+    samples are too slow for the band pass, so the caller falls back
+    to the percentile detector."""
+    if not rate_supported(rate):
+        print(f"Samples at {rate:.1f} Hz are too slow for the dsp bump"
+              " detector, the percentile detector is used.")
+        return None
+    return default_pipeline(rate)
+
+
+def sample_rate(num_samples, duration):
+    """Returns the average sample rate in Hz of a drive."""
+    return (num_samples - 1) / duration if duration > 0 else 1.0
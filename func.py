@@ -1,27 +1,57 @@
+import contextlib
 import shutil
 import os
-import folium
 import traceback
-import openpyxl
-from openpyxl.drawing.image import Image
 import pandas as pd
 import numpy as np
-from haversine import haversine, Unit
-from datetime import datetime
+from datetime import datetime, timedelta
 from time import sleep
-from selenium import webdriver
-from selenium.webdriver.chrome.options import Options
+from binlog import is_log_file, read_log
+from profiling import RunProfile, stage
+from stagecache import StageCache, file_digest, frame_digest, stage_key
+# folium, openpyxl and matplotlib are imported by the functions that draw
+# maps and reports, they take longer to load than the rest of the app
 
 MIN_BUMPS_POOR = 5
 MIN_BUMPS_FAIR = 2
 MAX_BUMPS_GOOD = 0
+SMOOTH_Z_STD = 0.5                      # z deviation of a good road
 SEGMENT_DISTANCE_THRESHOLD = 100        # meters
+EARTH_RADIUS_METERS = 6371008.8         # same mean radius as haversine
+BUMP_SIZE_LIMITS = [1, 1.5, 2]          # small, medium, big deviation
+MAP_RENDERER = 'native'                 # 'native' or 'browser'
+REPORT_IMAGE_SCALE = 1.5                # map image size in the report
+MAP_IMAGE_SIZE = (800, 600)             # pixels
+MAP_TILES_FOLDER = None                 # cached {z}/{x}/{y}.png tiles
+MAP_STYLE = 'segments'                  # 'segments', 'merged' or 'geojson'
+MAP_SIMPLIFY_TOLERANCE = 2.0            # meters, for the light map styles
+MAP_COORDINATE_DECIMALS = 6             # about 0.1 m
+WEB_MERCATOR_RADIUS = 6378137.0         # meters
+TILE_SIZE = 256                         # pixels
+MAP_LEGEND = [('blue', 'excellent'), ('green', 'good'), ('yellow', 'fair'),
+              ('orange', 'poor'), ('red', 'very poor')]
+ROAD_DATABASE = None                    # SQLite file collecting all drives
+MERGE_TOLERANCE = None                  # seconds, None joins equal times
+NEAREST_TOLERANCE = 1.0                 # seconds from the nearest GPS fix
+GPS_COLUMNS = ['latitude', 'longitude', 'speed']    # interpolated columns
+BUMP_DETECTOR = 'percentile'            # 'percentile' or 'dsp'
+DSP_COLUMNS = ['x', 'y', 'z', 'speed']  # read by the dsp pipeline
+SUMMARY_COLUMN = 'summary'              # see acquisition.EventCapture
+PROFILE = None                          # 'timing', 'cprofile', 'tracemalloc'
+STAGE_CACHE = None                      # folder of cached stage results
+SECONDS_PER_DAY = 24 * 60 * 60
 TIMESTAMP_FORMAT = datetime.now().strftime("%Y_%m_%d_%H_%M_%S")
 
 
 def read_data_file(file_path):
-    """Reads a data file and returns a Pandas DataFrame"""
+    """Reads a CSV or binary data file and returns a Pandas DataFrame"""
     try:
+        if is_log_file(file_path):
+            columns, records = read_log(file_path)
+            if len(records) == 0:
+                print(f"{file_path} is empty.")
+                return None
+            return pd.DataFrame(records, columns=columns, copy=False)
         with open(file_path, 'r') as f:
             f.readline().strip()
             second_line = f.readline().strip()
@@ -38,94 +68,564 @@ def read_data_file(file_path):
         return None
 
 
-def merge_dataframes(accel_data, gps_data):
-    """Merges the accelerometer and GPS data"""
+def time_keys(times, last_key=None):
+    """
+    Converts recorded times to seconds that keep increasing when
+    a drive goes past midnight.
+
+    Args:
+        times (array_like): 'HH:MM:SS[.ffffff]' times or seconds since
+          midnight, in the order they were recorded.
+        last_key (float): Key of the sample before the first one when
+          the times are read in chunks.
+
+    Returns:
+        numpy.ndarray: Seconds since the midnight before the first sample.
+    """
+    times = pd.Series(times)
+    if pd.api.types.is_numeric_dtype(times):
+        seconds = times.to_numpy(dtype=np.float64)
+    else:
+        seconds = pd.to_timedelta(times).dt.total_seconds().to_numpy()
+    if len(seconds) == 0:
+        return seconds
+    if last_key is None:
+        previous, start_day = seconds[0], 0
+    else:
+        previous = last_key % SECONDS_PER_DAY
+        start_day = last_key // SECONDS_PER_DAY
+    previous = np.concatenate(([previous], seconds[:-1]))
+    days = start_day + np.cumsum(seconds < previous)
+    return seconds + days * SECONDS_PER_DAY
+
+
+def interpolate_fixes(sample_times, fix_times, values,
+                      tolerance=NEAREST_TOLERANCE):
+    """
+    Linearly interpolates GPS fix values at the accelerometer sample times.
+
+    Both time arrays must be sorted, so every sample is matched with
+    its neighbouring fixes by one binary search.
+
+    Args:
+        sample_times (numpy.ndarray): Accelerometer sample times in seconds.
+        fix_times (numpy.ndarray): GPS fix times in seconds.
+        values (numpy.ndarray): One row per fix, such as its latitude,
+          longitude and speed.
+        tolerance (float): Largest time in seconds between a sample
+          and its nearest fix.
+
+    Returns:
+        tuple: One row of interpolated values per sample and a mask
+          of the samples within tolerance of a fix.
+    """
+    fix_times = np.asarray(fix_times, dtype=np.float64)
+    values = np.asarray(values, dtype=np.float64)
+    # Fixes stamped with the same time keep the last values
+    last = np.append(np.diff(fix_times) > 0, True)
+    fix_times = fix_times[last]
+    values = values[last]
+
+    after = np.searchsorted(fix_times, sample_times)
+    gap_before = np.where(
+        after > 0, sample_times - fix_times[np.maximum(after - 1, 0)], np.inf)
+    gap_after = np.where(
+        after < len(fix_times),
+        fix_times[np.minimum(after, len(fix_times) - 1)] - sample_times,
+        np.inf)
+    within = np.minimum(gap_before, gap_after) <= tolerance
+    interpolated = np.column_stack(
+        [np.interp(sample_times, fix_times, column) for column in values.T])
+    return interpolated, within
+
+
+def merge_nearest(accel_data, gps_data, sample_times, fix_times,
+                  tolerance=NEAREST_TOLERANCE):
+    """
+    Gives every accelerometer sample the GPS position at its time.
+
+    Args:
+        accel_data (DataFrame): Accelerometer data.
+        gps_data (DataFrame): GPS data.
+        sample_times (numpy.ndarray): Sorted times of accel_data in seconds.
+        fix_times (numpy.ndarray): Sorted times of gps_data in seconds.
+        tolerance (float): Samples farther than this many seconds from
+          the nearest fix are left out.
+
+    Returns:
+        DataFrame: Latitude, longitude, speed if the GPS data has it
+          and the accelerometer columns.
+    """
+    columns = [column for column in GPS_COLUMNS if column in gps_data]
+    interpolated, within = interpolate_fixes(
+        sample_times, fix_times, gps_data[columns], tolerance)
+    positions = pd.DataFrame(interpolated[within], columns=columns)
+    samples = accel_data[within].reset_index(drop=True)
+    return pd.concat([positions, samples], axis=1)
+
+
+def merge_dataframes(accel_data, gps_data, tolerance=None):
+    """
+    Merges the accelerometer and GPS data.
+
+    Args:
+        accel_data (DataFrame): Accelerometer data.
+        gps_data (DataFrame): GPS data.
+        tolerance (float): Interpolate the GPS positions at the
+          accelerometer times, leaving out samples farther than this
+          many seconds from a fix. Rows with equal times are joined
+          if not given.
+
+    Returns:
+        DataFrame: Merged data, None if a 'time' column is missing.
+    """
     try:
-        data = pd.merge(gps_data, accel_data, on='time')
-        return data
+        if tolerance is None:
+            # Samples stay in log order, the GPS columns come first
+            data = pd.merge(accel_data, gps_data, on='time')
+            return data[list(gps_data.columns) + [
+                column for column in data.columns
+                if column not in gps_data.columns]]
+        return merge_nearest(accel_data, gps_data,
+                             time_keys(accel_data['time']),
+                             time_keys(gps_data['time']), tolerance)
     except KeyError:
         print("Both data files must have a 'time' column to merge.")
         return None
 
 
-def find_bump_coords(data):
+def bump_sizes(z_data, threshold=None):
+    """
+    Classifies every accelerometer sample by the size of the bump.
+
+    The threshold is the 70th percentile of the absolute z values and
+    a sample is a bump when it deviates from it by at least 1.
+
+    Args:
+        z_data (list): List of accelerometer data along the z-axis.
+        threshold (float): Threshold estimated elsewhere, e.g. while
+          the drive is recorded, calculated from z_data if not given.
+
+    Returns:
+        numpy.ndarray: Array with one element per sample: 0 for no bump,
+          1 for small, 2 for medium and 3 for big bumps.
+    """
+    z_data = np.abs(np.asarray(z_data, dtype=float))
+    if threshold is None:
+        threshold = np.percentile(z_data, 70)
+    return np.digitize(np.abs(z_data - threshold), BUMP_SIZE_LIMITS)
+
+
+def full_rate_mask(data):
+    """Returns a boolean array that is False for the summary rows of
+    an event capture log, see acquisition.EventCapture, and True for
+    the rows written at full rate and every row of other logs."""
+    if SUMMARY_COLUMN not in data:
+        return np.ones(len(data), dtype=bool)
+    return np.asarray(data[SUMMARY_COLUMN]) != 1
+
+
+def bump_threshold(data):
+    """
+    Calculates the threshold of bump_sizes from the rows written at
+    full rate. The summary rows are the peaks of their interval, so
+    they would raise the percentile.
+
+    Args:
+        data (DataFrame): Data collected from sensors.
+
+    Returns:
+        float: Threshold of bump_sizes, None to calculate it from every
+          row when the log has no summary rows or nothing else.
+    """
+    full_rate = full_rate_mask(data)
+    if full_rate.all() or not full_rate.any():
+        return None
+    return np.percentile(np.abs(np.asarray(data['z'], dtype=float)
+                                [full_rate]), 70)
+
+
+def segment_z(data):
+    """Returns the z values of the segments, NaN for the summary rows
+    that z_deviation leaves out."""
+    return pd.Series(data['z'], dtype=float).where(full_rate_mask(data))
+
+
+def z_deviation(z_data):
+    """Returns the standard deviation of the z values of a segment,
+    leaving out the summary rows, 0 if there are no other values."""
+    z_data = np.asarray(z_data, dtype=float)
+    z_data = z_data[~np.isnan(z_data)]
+    return float(np.std(z_data)) if len(z_data) > 0 else 0.0
+
+
+def find_bump_mask(data, sizes=None):
+    """
+    Marks the rows of the accelerometer data where bumps are detected.
+
+    Args:
+        data (DataFrame): Data collected from sensors.
+        sizes (numpy.ndarray): Precomputed result of bump_sizes,
+          calculated from data if not given.
+
+    Returns:
+        numpy.ndarray: Boolean array with one element per row,
+          True where a bump is detected.
+    """
+    if sizes is None:
+        sizes = bump_sizes(data['z'])
+    return sizes > 0
+
+
+def find_bump_coords(data, bump_mask=None):
     """
     Finds the coordinates of bumps in the accelerometer data.
 
     Args:
         data (DataFrame): Data collected from sensors.
+        bump_mask (numpy.ndarray): Precomputed result of find_bump_mask,
+          calculated from data if not given.
 
     Returns:
         list: List of GPS coordinates where bumps are detected.
     """
-    z_data = data['z']
-    threshold = np.percentile(np.abs(z_data), 70)
-    bump_indices = np.where(np.abs((np.abs(z_data) - threshold)) >= 1)[0]
+    if bump_mask is None:
+        bump_mask = find_bump_mask(data)
+    latitudes = np.asarray(data['latitude'])[bump_mask]
+    longitudes = np.asarray(data['longitude'])[bump_mask]
+    return list(zip(latitudes.tolist(), longitudes.tolist()))
+
+
+def dsp_bump_sizes(data):
+    """
+    Classifies bumps with the filtering pipeline of the dsp module.
+
+    Args:
+        data (DataFrame): Merged data with x, y, z and time columns,
+          and speed for speed normalization.
+
+    Returns:
+        numpy.ndarray: Bump size of every row like bump_sizes, None if
+          the data has no x and y columns or too low a sample rate.
+    """
+    if 'x' not in data or 'y' not in data:
+        print("The dsp bump detector needs all three accelerometer axes.")
+        return None
+    # Imported here so SciPy is only loaded when it is used
+    from dsp import sample_rate, supported_pipeline
+    keys = time_keys(data['time'])
+    pipeline = supported_pipeline(sample_rate(len(keys),
+                                              keys[-1] - keys[0]))
+    if pipeline is None:
+        return None
+    return pipeline(data[[column for column in DSP_COLUMNS
+                          if column in data]])
 
-    bump_coords = []
-    for i in bump_indices:
-        bump_coords.append((data.loc[i, 'latitude'],
-                            data.loc[i, 'longitude']))
-    return bump_coords
 
+def classify_bumps(data, detector=BUMP_DETECTOR):
+    """
+    Detects and classifies bumps in a single pass over the data.
+
+    Args:
+        data (DataFrame): Data collected from sensors.
+        detector (str): 'percentile' compares |z| with its 70th
+          percentile, 'dsp' filters all three axes, see dsp_bump_sizes.
+          Falls back to 'percentile' if the data has no x and y or the
+          samples are too slow. The summary rows of an event capture
+          log are never bumps.
 
-def divide_into_segments(coordinates, z_data):
+    Returns:
+        tuple: A tuple containing the bump mask from find_bump_mask,
+          the list of bump coordinates and the bump statistics
+          from bumps_statistics.
+    """
+    sizes = dsp_bump_sizes(data) if detector == 'dsp' else None
+    if sizes is None:
+        sizes = bump_sizes(data['z'], bump_threshold(data))
+    # Summary rows stayed below the trigger of a captured window
+    sizes = np.where(full_rate_mask(data), sizes, 0)
+    bump_mask = find_bump_mask(data, sizes)
+    bump_coords = find_bump_coords(data, bump_mask)
+    bumps = bumps_statistics(data['z'], sizes)
+    return bump_mask, bump_coords, bumps
+
+
+def step_distances(coordinates):
+    """
+    Calculates the distances between consecutive GPS coordinates
+      in one vectorized pass.
+
+    Args:
+        coordinates (list): List of GPS coordinates.
+
+    Returns:
+        numpy.ndarray: Array of len(coordinates) - 1 distances in meters,
+          where element i is the distance between points i and i + 1.
+    """
+    coords = np.asarray(coordinates, dtype=float).reshape(-1, 2)
+    return haversine_distances(coords[:-1], coords[1:])
+
+
+def haversine_distances(start, end):
+    """
+    Calculates the distances between pairs of GPS coordinates.
+
+    Args:
+        start (array_like): (latitude, longitude) pairs, or a single one.
+        end (array_like): (latitude, longitude) pairs, broadcast
+          against start.
+
+    Returns:
+        numpy.ndarray: Distances in meters.
+    """
+    start = np.radians(np.asarray(start, dtype=float))
+    end = np.radians(np.asarray(end, dtype=float))
+    d_lat = end[..., 0] - start[..., 0]
+    d_lon = end[..., 1] - start[..., 1]
+    d = (np.sin(d_lat * 0.5) ** 2
+         + np.cos(start[..., 0]) * np.cos(end[..., 0])
+         * np.sin(d_lon * 0.5) ** 2)
+    return 2 * EARTH_RADIUS_METERS * np.arcsin(np.sqrt(d))
+
+
+def local_meters(coordinates):
+    """Projects GPS coordinates to meters east and north of their mean,
+    accurate enough for distances of up to a few kilometers."""
+    coords = np.radians(np.asarray(coordinates, dtype=float).reshape(-1, 2))
+    center = coords.mean(axis=0)
+    return EARTH_RADIUS_METERS * np.column_stack(
+        ((coords[:, 1] - center[1]) * np.cos(center[0]),
+         coords[:, 0] - center[0]))
+
+
+def simplify_line(coordinates, tolerance=MAP_SIMPLIFY_TOLERANCE):
+    """
+    Simplifies a line with the Douglas-Peucker algorithm.
+
+    Args:
+        coordinates (list): List of GPS coordinates.
+        tolerance (float): Largest distance in meters between the line
+          and a left out point.
+
+    Returns:
+        list: The kept GPS coordinates, always including both ends.
+    """
+    points = np.asarray(coordinates, dtype=float).reshape(-1, 2)
+    if len(points) < 3:
+        return [tuple(point) for point in points.tolist()]
+    xy = local_meters(points)
+    keep = np.zeros(len(points), dtype=bool)
+    keep[[0, -1]] = True
+    ranges = [(0, len(points) - 1)]
+    while ranges:
+        start, end = ranges.pop()
+        if end - start < 2:
+            continue
+        chord = xy[end] - xy[start]
+        offsets = xy[start + 1:end] - xy[start]
+        length = np.hypot(*chord)
+        if length == 0:
+            distances = np.hypot(offsets[:, 0], offsets[:, 1])
+        else:
+            distances = np.abs(chord[0] * offsets[:, 1]
+                               - chord[1] * offsets[:, 0]) / length
+        farthest = int(np.argmax(distances))
+        if distances[farthest] > tolerance:
+            middle = start + 1 + farthest
+            keep[middle] = True
+            ranges.append((start, middle))
+            ranges.append((middle, end))
+    return [tuple(point) for point in points[keep].tolist()]
+
+
+class MergedLines:
+    """
+    Joins consecutive road segments of the same color into one line
+    and simplifies every finished line.
+
+    Args:
+        tolerance (float): Simplification tolerance in meters, see
+          simplify_line.
+    """
+
+    def __init__(self, tolerance=MAP_SIMPLIFY_TOLERANCE):
+        self.tolerance = tolerance
+        self.lines = []             # finished (color, coordinates) pairs
+        self.color = None
+        self.points = []
+
+    def add(self, segment, color):
+        if color != self.color:
+            self.finish_line()
+            self.color = color
+            self.points = list(segment)
+        else:
+            # Consecutive segments share their boundary point
+            self.points.extend(segment[1:])
+
+    def finish_line(self):
+        if self.points:
+            self.lines.append((self.color, simplify_line(self.points,
+                                                         self.tolerance)))
+        self.points = []
+
+    def add_to(self, my_map, style='merged'):
+        """
+        Draws the lines on a map.
+
+        Args:
+            my_map: Map object.
+            style (str): 'merged' adds one polyline per line, 'geojson'
+              adds all lines as a single GeoJSON layer.
+        """
+        import folium
+        self.finish_line()
+        decimals = MAP_COORDINATE_DECIMALS
+        if style == 'geojson':
+            features = [{'type': 'Feature',
+                         'properties': {'color': color},
+                         'geometry': {'type': 'LineString', 'coordinates': [
+                             [round(lon, decimals), round(lat, decimals)]
+                             for lat, lon in line]}}
+                        for color, line in self.lines]
+            folium.GeoJson(
+                {'type': 'FeatureCollection', 'features': features},
+                style_function=lambda feature: {
+                    'color': feature['properties']['color'], 'weight': 6}
+            ).add_to(my_map)
+            return
+        for color, line in self.lines:
+            folium.PolyLine([(round(lat, decimals), round(lon, decimals))
+                             for lat, lon in line],
+                            color=color, weight=6).add_to(my_map)
+
+
+def segment_bounds(distances, threshold=SEGMENT_DISTANCE_THRESHOLD):
+    """
+    Finds the point indices where the road is split into segments.
+
+    A segment is closed at the first point whose distance from the start
+    of the segment reaches the threshold, and that point also starts
+    the next segment.
+
+    Args:
+        distances (numpy.ndarray): Step distances from step_distances.
+        threshold (float): Segment length in meters.
+
+    Returns:
+        list: List of (start, end) index pairs, end is exclusive.
+    """
+    num_points = len(distances) + 1
+    positions = np.concatenate(([0.0], np.cumsum(distances)))
+    bounds = []
+    start = 0
+    while True:
+        end = int(np.searchsorted(positions, positions[start] + threshold,
+                                  side='left'))
+        if end >= num_points:
+            break
+        bounds.append((start, end + 1))
+        start = end
+    bounds.append((start, num_points))
+    return bounds
+
+
+def divide_into_segments(coordinates, z_data, distances=None):
     """
     Divides the coordinates and accelerometer data
       into segments based on distance thresholds.
 
     Args:
         coordinates (list): List of GPS coordinates.
-        accel_data (list): List of accelerometer data.
+        z_data (list): List of accelerometer data.
+        distances (numpy.ndarray): Precomputed step distances,
+          calculated from coordinates if not given.
 
     Returns:
         tuple: A tuple containing lists of
         segments and accelerometer data segments.
     """
-    z_data_segments = []
-    z_data_segment = [z_data[0]]
+    if distances is None:
+        distances = step_distances(coordinates)
+    return split_segments(coordinates, z_data, segment_bounds(distances))
+
+
+def split_segments(coordinates, z_data, bounds):
+    """Splits the coordinates and accelerometer data at the segment
+    bounds from segment_bounds, see divide_into_segments."""
+    coordinates = list(coordinates)
+    z_data = np.asarray(z_data)
     segments = []
-    total_distance = 0
-    segment = [coordinates[0]]
-    for i in range(1, len(coordinates)):
-        distance = haversine((coordinates[i-1][0], coordinates[i-1][1]),
-                             (coordinates[i][0], coordinates[i][1]),
-                             unit=Unit.METERS)
-        total_distance += distance
-        if total_distance >= SEGMENT_DISTANCE_THRESHOLD:
-            segment.append(coordinates[i])
-            segments.append(segment)
-            segment = [coordinates[i]]
-            z_data_segment.append(z_data[i])
-            z_data_segments.append(z_data_segment)
-            z_data_segment = [z_data[i]]
-            total_distance = 0
-        else:
-            segment.append(coordinates[i])
-            z_data_segment.append(z_data[i])
-    segments.append(segment)
-    z_data_segments.append(z_data_segment)
+    z_data_segments = []
+    for start, end in bounds:
+        segments.append(coordinates[start:end])
+        z_data_segments.append(z_data[start:end].tolist())
     return segments, z_data_segments
 
 
-def get_segment_color(segment, z_data_segment, bump_coords):
+def segment_layout(coordinates):
+    """Returns the step distances and segment bounds of a drive."""
+    distances = step_distances(coordinates)
+    return distances, segment_bounds(distances, SEGMENT_DISTANCE_THRESHOLD)
+
+
+def segment_bump_counts(bump_mask, bounds):
+    """
+    Counts the detected bumps in every segment.
+
+    Only the rows detected as bumps are counted. Merged data repeats
+    a GPS fix on every accelerometer row read with it, and the other
+    rows at the coordinates of a bump are not counted again, as they
+    are by the coordinate lookup of get_segment_color.
+
+    Args:
+        bump_mask (numpy.ndarray): Result of find_bump_mask.
+        bounds (list): Segment (start, end) index pairs from segment_bounds.
+
+    Returns:
+        list: Number of bumps in each segment.
+    """
+    bumps_before = np.concatenate(([0], np.cumsum(bump_mask, dtype=int)))
+    return [int(bumps_before[end] - bumps_before[start])
+            for start, end in bounds]
+
+
+def get_segment_color(segment, z_data_segment, bump_coords,
+                      bump_count=None):
     """Returns the color to use for a segment based on
        the number of bumps it contains
        and the smoothness of the road.
 
     Args:
         segment (list): List of GPS coordinates.
-        accel_data_segment (list): List of respective z_data values.
+        z_data_segment (list): List of respective z_data values,
+          NaN for the summary rows of an event capture log.
         bump_coords (list): List of GPS coordinates of detected bumps.
+        bump_count (int): Precomputed number of bumps in the segment,
+          counted from bump_coords if not given.
 
     Returns:
         string: Color used for drawing a map and qualifying road quality.
     """
     z_data_segment = np.array(z_data_segment)
-    count = 0
-    for item in segment:
-        if item in bump_coords:
-            count += 1
+    if bump_count is None:
+        bump_coords = set(bump_coords)
+        bump_count = sum(1 for item in segment if item in bump_coords)
+    return rating_color(bump_count, z_deviation(z_data_segment))
+
+
+def rating_color(count, z_std):
+    """Returns the color of a part of the road.
+
+    Args:
+        count (float): Number of bumps, or average number of bumps
+          over several drives.
+        z_std (float): Standard deviation of the z values, tells
+          smooth roads without bumps apart.
+
+    Returns:
+        string: Color used for drawing a map and qualifying road quality.
+    """
     if count >= MIN_BUMPS_POOR:
         color = 'red'
     elif (MIN_BUMPS_FAIR <= count
@@ -134,30 +634,35 @@ def get_segment_color(segment, z_data_segment, bump_coords):
     elif MAX_BUMPS_GOOD < count < MIN_BUMPS_FAIR:
         color = 'yellow'
     elif count <= MAX_BUMPS_GOOD:
-        if np.std(z_data_segment) >= 0.5:
+        if z_std >= SMOOTH_Z_STD:
             color = 'green'
         else:
             color = "blue"
     return color
 
 
-def plot_segment(segment, z_data_segment, bump_coords, my_map):
+def plot_segment(segment, z_data_segment, bump_coords, my_map,
+                 bump_count=None):
     """Plots a segment on a map with a color based
        on the number of bumps it contains.
 
     Args:
         segment (list): GPS coordinates of one of road segments.
-        accel_data_segment(list): Accel_data values for one road segment.
+        z_data_segment(list): Accel_data values for one road segment.
         bump_coords (list): List of GPS coordinates where bumps are detected.
         my_map: Map object.
+        bump_count (int): Precomputed number of bumps in the segment.
     """
+    import folium
 
-    color = get_segment_color(segment, z_data_segment, bump_coords)
+    color = get_segment_color(segment, z_data_segment, bump_coords,
+                              bump_count)
     folium.PolyLine(segment, color=color, weight=6).add_to(my_map)
 
 
 def plot_map(segments, z_data_segments,
-             bump_coords, folder_results):
+             bump_coords, folder_results, bump_counts=None, timestamp=None,
+             style=MAP_STYLE):
     """
     Plot the segments and associated accelerometer data on a folium map.
 
@@ -172,17 +677,54 @@ def plot_map(segments, z_data_segments,
                         Set to 1 to open, 2 to not open.
         folder_results (str): Path to the folder where the map HTML file
           will be saved.
+        bump_counts (list): Precomputed number of bumps in each segment,
+          from segment_bump_counts.
+        timestamp (str): Timestamp used in the file name,
+          TIMESTAMP_FORMAT if not given.
+        style (str): 'segments' draws every segment with all of its
+          points, 'merged' joins segments of the same color into
+          simplified polylines and 'geojson' adds those as one
+          GeoJSON layer.
 
     Returns:
-        None
+        str: Absolute path of the saved map.
     """
+    import folium
     start_position = segments[0][0]
-    i = 0
+    if bump_counts is None:
+        bump_set = set(bump_coords)
+        bump_counts = [sum(1 for item in segment if item in bump_set)
+                       for segment in segments]
     my_map = folium.Map(location=start_position, zoom_start=15)
-    for segment in segments:
-        plot_segment(segment, z_data_segments[i], bump_coords, my_map)
-        i += 1
+    if style == 'segments':
+        for i, segment in enumerate(segments):
+            plot_segment(segment, z_data_segments[i], bump_coords, my_map,
+                         bump_counts[i])
+    else:
+        lines = MergedLines()
+        for i, segment in enumerate(segments):
+            lines.add(segment, get_segment_color(
+                segment, z_data_segments[i], bump_coords, bump_counts[i]))
+        lines.add_to(my_map, style)
 
+    return save_map(my_map, folder_results, timestamp)
+
+
+def save_map(my_map, folder_results, timestamp=None):
+    """
+    Adds the road quality legend to a map and saves it as HTML.
+
+    Args:
+        my_map: Map object.
+        folder_results (str): Path to the folder where the map HTML file
+          will be saved.
+        timestamp (str): Timestamp used in the file name,
+          TIMESTAMP_FORMAT if not given.
+
+    Returns:
+        str: Absolute path of the saved map.
+    """
+    import folium
     legend_html = '''
     <div style="position: fixed;
                 top: 30px; right: 30px; width: 120px; height: 150px;
@@ -198,7 +740,7 @@ def plot_map(segments, z_data_segments,
 '''
     my_map.get_root().html.add_child(folium.Element(legend_html))
 
-    map_name = f'map_{TIMESTAMP_FORMAT}.html'
+    map_name = f'map_{timestamp or TIMESTAMP_FORMAT}.html'
     map_path = os.path.join(folder_results, map_name)
     my_map.save(map_path)
     return os.path.abspath(map_path)
@@ -225,38 +767,38 @@ def road_duration(data):
     Returns:
         datetime.timedelta: The duration of the road segment.
     """
-    times = data['time']
-    start_time = datetime.strptime(times[0], "%H:%M:%S")
-    end_time = datetime.strptime(times[len(times)-1], "%H:%M:%S")
-    duration = end_time - start_time
-    return duration
+    keys = time_keys(data['time'])
+    return timedelta(seconds=float(keys[-1] - keys[0]))
 
 
-def road_distance(coords):
+def road_distance(coords, distances=None):
     """
     Calculates the distance of a road based on the given coordinates.
 
     Args:
         coords (list): List of GPS coordinates.
+        distances (numpy.ndarray): Precomputed step distances in meters,
+          calculated from coords if not given.
 
     Returns:
         float: The distance of the road in kilometers,
           rounded to 2 decimal places.
     """
-    distance = 0
-    for i in range(1, len(coords)):
-        distance += haversine(coords[i-1], coords[i],
-                              unit=Unit.KILOMETERS)
+    if distances is None:
+        distances = step_distances(coords)
+    distance = float(np.sum(distances)) / 1000
     distance = format(distance, ".2f")
     return distance
 
 
-def bumps_statistics(z_data):
+def bumps_statistics(z_data, sizes=None):
     """
     Calculates statistics of bumps based on the provided accelerometer data.
 
     Args:
         z_data (list): List of accelerometer data along the z-axis.
+        sizes (numpy.ndarray): Precomputed result of bump_sizes,
+          calculated from z_data if not given.
 
     Returns:
         tuple: A tuple containing the following statistics:
@@ -265,52 +807,69 @@ def bumps_statistics(z_data):
             - medium_bumps (int): The number of bumps categorized as medium.
             - small_bumps (int): The number of bumps categorized as small.
     """
-    all_bumps = 0
-    big_bumps = 0
-    medium_bumps = 0
-    small_bumps = 0
-    threshold = np.percentile(np.abs(z_data), 70)
-    for i in z_data:
-        if 1 < np.abs((np.abs(i) - threshold)) < 1.5:
-            all_bumps += 1
-            small_bumps += 1
-        elif 1.5 <= np.abs((np.abs(i) - threshold)) < 2:
-            all_bumps += 1
-            medium_bumps += 1
-        elif (np.abs(np.abs(i) - threshold)) >= 2:
-            all_bumps += 1
-            big_bumps += 1
+    if sizes is None:
+        sizes = bump_sizes(z_data)
+    counts = np.bincount(sizes, minlength=len(BUMP_SIZE_LIMITS) + 1)
+    small_bumps, medium_bumps, big_bumps = (int(c) for c in counts[1:])
+    all_bumps = small_bumps + medium_bumps + big_bumps
     return all_bumps, big_bumps, medium_bumps, small_bumps
 
 
 def create_road_statistics(map, duration, distance, bumps,
-                           folder_results):
-    workbook = openpyxl.Workbook()
-    road_statistics_name = f'road_statistics_{TIMESTAMP_FORMAT}.xlsx'
+                           folder_results, timestamp=None):
+    """
+    Writes the report of a drive: a Summary sheet with the statistics and
+    the map image, and a Segments sheet with the table of the segments
+    from segments_<timestamp>.csv when there is one. The workbook is
+    written in write-only mode, row after row.
+
+    Args:
+        map (str): Path of the map image.
+        duration (datetime.timedelta): Duration of the drive.
+        distance (str): Length of the drive in kilometers.
+        bumps (tuple): All, big, medium and small bumps.
+        folder_results (str): Path of folder where we store result.
+        timestamp (str): Timestamp used in the result file names.
+
+    Returns:
+        str: Path of the report.
+    """
+    import openpyxl
+    from openpyxl.drawing.image import Image
+    # Imported here because reports builds on this module
+    from reports import SEGMENT_COLUMNS, read_segment_table
+    timestamp = timestamp or TIMESTAMP_FORMAT
+    road_statistics_name = f'road_statistics_{timestamp}.xlsx'
     road_statistics_path = os.path.join(folder_results, road_statistics_name)
     rating = calculate_road_rating(duration, distance, bumps[0])
-    sheet = workbook.active
+    workbook = openpyxl.Workbook(write_only=True)
+    sheet = workbook.create_sheet('Summary')
     sheet.column_dimensions["A"].width = 20
     sheet.column_dimensions["B"].width = 20
-    sheet["A1"] = "Duration:"
-    sheet["B1"] = duration
-    sheet["A2"] = "Length (Km)"
-    sheet["B2"] = distance
-    sheet["A4"] = "Number of bumps:"
-    sheet["B4"] = bumps[0]
-    sheet["B5"] = "Big bumps"
-    sheet["C5"] = bumps[1]
-    sheet["B6"] = "Medium bumps:"
-    sheet["C6"] = bumps[2]
-    sheet["B7"] = "Small bumps:"
-    sheet["C7"] = bumps[3]
-    sheet["A8"] = "Road rating:"
-    sheet["B8"] = rating
+    for row in [["Duration:", duration],
+                ["Length (Km)", distance],
+                [],
+                ["Number of bumps:", bumps[0]],
+                [None, "Big bumps", bumps[1]],
+                [None, "Medium bumps:", bumps[2]],
+                [None, "Small bumps:", bumps[3]],
+                ["Road rating:", rating]]:
+        sheet.append(row)
     img = Image(map)
-    sheet.add_image(img, "A10")
-    img.width = img.width * 1.5
-    img.height = img.height * 1.5
-    workbook.save(road_statistics_path)
+    img.width = img.width * REPORT_IMAGE_SCALE
+    img.height = img.height * REPORT_IMAGE_SCALE
+    img.anchor = "A10"
+    sheet.add_image(img)
+    segments_sheet = workbook.create_sheet('Segments')
+    segments_sheet.append(SEGMENT_COLUMNS)
+    for row in read_segment_table(folder_results, timestamp):
+        segments_sheet.append(row)
+    # Save under a temporary name first so an interrupted run never
+    # leaves a truncated report that looks finished
+    temporary_path = road_statistics_path + '.part'
+    workbook.save(temporary_path)
+    os.replace(temporary_path, road_statistics_path)
+    return road_statistics_path
 
 
 def calculate_road_rating(duration, distance, num_bumps):
@@ -352,6 +911,10 @@ def calculate_road_rating(duration, distance, num_bumps):
 
 
 def html_to_png(html_file, png_file):
+    # Selenium is only needed for the browser renderer
+    from selenium import webdriver
+    from selenium.webdriver.chrome.options import Options
+
     # Set up Chrome WebDriver and configure it to run in headless mode
     chrome_options = Options()
     chrome_options.add_argument("--headless")
@@ -371,8 +934,352 @@ def html_to_png(html_file, png_file):
     driver.quit()
 
 
+def to_web_mercator(coordinates):
+    """
+    Projects GPS coordinates to Web Mercator meters.
+
+    Args:
+        coordinates (list): List of GPS coordinates.
+
+    Returns:
+        tuple: Arrays of x and y coordinates in meters.
+    """
+    coords = np.radians(np.asarray(coordinates, dtype=float).reshape(-1, 2))
+    x = WEB_MERCATOR_RADIUS * coords[:, 1]
+    y = WEB_MERCATOR_RADIUS * np.log(np.tan(np.pi / 4 + coords[:, 0] / 2))
+    return x, y
+
+
+def draw_cached_tiles(ax, tiles_folder, x_limits, y_limits, width):
+    """
+    Draws locally cached map tiles under the road segments.
+    Tiles missing from the cache are left blank.
+
+    Args:
+        ax: Matplotlib axes of the map image.
+        tiles_folder (str): Folder with tiles stored as {z}/{x}/{y}.png.
+        x_limits (tuple): Visible Web Mercator x range in meters.
+        y_limits (tuple): Visible Web Mercator y range in meters.
+        width (int): Width of the map image in pixels.
+    """
+    from matplotlib.image import imread
+    world = 2 * np.pi * WEB_MERCATOR_RADIUS
+    meters_per_pixel = (x_limits[1] - x_limits[0]) / width
+    zoom = int(np.clip(np.round(np.log2(world / (TILE_SIZE
+                                                 * meters_per_pixel))),
+                       0, 19))
+    tile_span = world / 2 ** zoom
+    first_x = int((x_limits[0] + world / 2) // tile_span)
+    last_x = int((x_limits[1] + world / 2) // tile_span)
+    first_y = int((world / 2 - y_limits[1]) // tile_span)
+    last_y = int((world / 2 - y_limits[0]) // tile_span)
+    for tile_x in range(first_x, last_x + 1):
+        for tile_y in range(first_y, last_y + 1):
+            tile_path = os.path.join(tiles_folder, str(zoom), str(tile_x),
+                                     f'{tile_y}.png')
+            if not os.path.isfile(tile_path):
+                continue
+            left = tile_x * tile_span - world / 2
+            top = world / 2 - tile_y * tile_span
+            ax.imshow(imread(tile_path), zorder=0,
+                      extent=(left, left + tile_span, top - tile_span, top))
+
+
+def render_map_image(segments, z_data_segments, bump_coords, image_path,
+                     bump_counts=None, tiles_folder=MAP_TILES_FOLDER):
+    """
+    Draws the colored segments and bump markers straight to a PNG image,
+    without starting a browser.
+
+    Args:
+        segments (list): List of segments, where each segment
+          is a list of coordinates.
+        z_data_segments (list): List of accelerometer data segments.
+        bump_coords (list): List of bump coordinates.
+        image_path (str): Path of the PNG file to be created.
+        bump_counts (list): Precomputed number of bumps in each segment,
+          from segment_bump_counts.
+        tiles_folder (str): Optional folder with cached map tiles
+          drawn as background.
+
+    Returns:
+        str: Absolute path of the created image.
+    """
+    if bump_counts is None:
+        bump_set = set(bump_coords)
+        bump_counts = [sum(1 for item in segment if item in bump_set)
+                       for segment in segments]
+    all_points = [point for segment in segments for point in segment]
+    fig, ax = create_map_image(np.min(all_points, axis=0),
+                               np.max(all_points, axis=0), tiles_folder)
+    for i, segment in enumerate(segments):
+        color = get_segment_color(segment, z_data_segments[i], bump_coords,
+                                  bump_counts[i])
+        draw_image_segment(ax, segment, color)
+    draw_image_bumps(ax, bump_coords)
+    return save_map_image(fig, ax, image_path)
+
+
+def create_map_image(south_west, north_east,
+                     tiles_folder=MAP_TILES_FOLDER):
+    """
+    Creates an empty map image covering the given corners of a drive.
+
+    Args:
+        south_west (tuple): Smallest latitude and longitude of the drive.
+        north_east (tuple): Largest latitude and longitude of the drive.
+        tiles_folder (str): Optional folder with cached map tiles
+          drawn as background.
+
+    Returns:
+        tuple: Matplotlib figure and axes to draw the drive on.
+    """
+    from matplotlib.figure import Figure
+    width, height = MAP_IMAGE_SIZE
+    fig = Figure(figsize=(width / 100, height / 100), dpi=100)
+    ax = fig.add_axes([0, 0, 1, 1])
+    ax.set_axis_off()
+
+    corners_x, corners_y = to_web_mercator([south_west, north_east])
+    center_x = (corners_x[0] + corners_x[1]) / 2
+    center_y = (corners_y[0] + corners_y[1]) / 2
+    # Pad the drive by 10% and match the aspect ratio of the image
+    span_x = max(corners_x[1] - corners_x[0], 1.0) * 1.1
+    span_y = max(corners_y[1] - corners_y[0], 1.0) * 1.1
+    span_x = max(span_x, span_y * width / height)
+    span_y = span_x * height / width
+    x_limits = (center_x - span_x / 2, center_x + span_x / 2)
+    y_limits = (center_y - span_y / 2, center_y + span_y / 2)
+
+    if tiles_folder is not None:
+        draw_cached_tiles(ax, tiles_folder, x_limits, y_limits, width)
+    ax.set_xlim(x_limits)
+    ax.set_ylim(y_limits)
+    ax.set_autoscale_on(False)
+    return fig, ax
+
+
+def draw_image_segment(ax, segment, color):
+    """Draws one road segment on a map image."""
+    x, y = to_web_mercator(segment)
+    ax.plot(x, y, color=color, linewidth=4, solid_capstyle='round',
+            zorder=1)
+
+
+def draw_image_bumps(ax, bump_coords):
+    """Marks the detected bumps on a map image."""
+    if len(bump_coords) > 0:
+        x, y = to_web_mercator(bump_coords)
+        ax.scatter(x, y, s=10, color='black', zorder=2)
+
+
+def save_map_image(fig, ax, image_path):
+    """
+    Adds the road quality legend to a map image and saves it as PNG.
+
+    Returns:
+        str: Absolute path of the created image.
+    """
+    from matplotlib.lines import Line2D
+    handles = [Line2D([], [], color=color, linewidth=4, label=label)
+               for color, label in MAP_LEGEND]
+    ax.legend(handles=handles, title='Road quality', loc='upper right')
+    fig.savefig(image_path)
+    return os.path.abspath(image_path)
+
+
+def process_in_memory(file_path_accel, file_path_gps, folder_results,
+                      image_path=None, timestamp=None,
+                      merge_tolerance=MERGE_TOLERANCE, database=None,
+                      map_style=MAP_STYLE, bump_detector=BUMP_DETECTOR,
+                      cache=None):
+    """
+    Loads both data files at once, builds the map and calculates
+    the report statistics.
+
+    Args:
+        file_path_accel (str): Path of file containig accelerometer data.
+        file_path_gps (str): Path of file containig GPS data.
+        folder_results (str): Path of folder where we store result.
+        image_path (str): Path of the map image to draw,
+          no image is drawn if not given.
+        timestamp (str): Timestamp used in the result file names.
+        merge_tolerance (float): Seconds between a sample and its nearest
+          GPS fix, rows with equal times are joined if None.
+        database (str): Path of the road database the results are added
+          to, not stored if not given.
+        map_style (str): Style of the HTML map, see plot_map.
+        bump_detector (str): Bump detector, see classify_bumps.
+        cache (StageCache): Cache of the stage results, the files are
+          read and merged only if their content or the merge settings
+          changed. Nothing is cached if None.
+
+    Returns:
+        tuple: Map path, duration, distance and bump statistics,
+          None if there is no data to process.
+    """
+    def load():
+        with stage('read'):
+            accel_data = read_data_file(file_path_accel)
+            gps_data = read_data_file(file_path_gps)
+        if accel_data is None or gps_data is None:
+            return None
+        with stage('merge'):
+            return merge_dataframes(accel_data, gps_data, merge_tolerance)
+
+    if cache is None:
+        data = load()
+    else:
+        with stage('hash_files'):
+            try:
+                key = stage_key('merge', file_digest(file_path_accel),
+                                file_digest(file_path_gps),
+                                merge_tolerance, GPS_COLUMNS)
+            except FileNotFoundError:
+                key = None
+        data = load() if key is None else cache.cached('merge', key, load)
+    if data is None or len(data) == 0:
+        return None
+    return build_report(data, folder_results, image_path, timestamp,
+                        database, map_style, bump_detector, cache)
+
+
+def build_report(data, folder_results, image_path=None, timestamp=None,
+                 database=None, map_style=MAP_STYLE,
+                 bump_detector=BUMP_DETECTOR, cache=None):
+    """
+    Builds the map and calculates the report statistics of merged data.
+
+    Args:
+        data (DataFrame): Merged data with latitude, longitude,
+          z and time columns.
+        folder_results (str): Path of folder where we store result.
+        image_path (str): Path of the map image to draw,
+          no image is drawn if not given.
+        timestamp (str): Timestamp used in the result file names.
+        database (str): Path of the road database the results are added
+          to, not stored if not given.
+        map_style (str): Style of the HTML map, see plot_map.
+        bump_detector (str): Bump detector, see classify_bumps.
+        cache (StageCache): Cache of the stage results, only the stages
+          whose data or settings changed are computed. Nothing is
+          cached if None.
+
+    Returns:
+        tuple: Map path, duration, distance and bump statistics.
+    """
+    keys = {}
+    if cache is not None:
+        with stage('hash_data'):
+            keys = report_keys(frame_digest(data), map_style, bump_detector)
+    with stage('classify_bumps'):
+        bump_mask, bump_coords, bumps = run_cached(
+            cache, 'classify_bumps', keys,
+            lambda: classify_bumps(data, bump_detector))
+    z_data = segment_z(data)
+    latitudes = data['latitude']
+    longitudes = data['longitude']
+
+    with stage('segments'):
+        coords = list(zip(latitudes, longitudes))
+        distances, bounds = run_cached(cache, 'segments', keys,
+                                       lambda: segment_layout(coords))
+        segments, accel_data_segments = split_segments(coords, z_data,
+                                                       bounds)
+        bump_counts = segment_bump_counts(bump_mask, bounds)
+    with stage('plot_map'):
+        map_name = f'map_{timestamp or TIMESTAMP_FORMAT}.html'
+        map_path = run_cached_file(
+            cache, 'plot_map', keys,
+            os.path.abspath(os.path.join(folder_results, map_name)),
+            lambda: plot_map(segments, accel_data_segments, bump_coords,
+                             folder_results, bump_counts, timestamp,
+                             map_style))
+    if image_path is not None:
+        with stage('map_image'):
+            run_cached_file(
+                cache, 'map_image', keys, image_path,
+                lambda: render_map_image(segments, accel_data_segments,
+                                         bump_coords, image_path,
+                                         bump_counts))
+
+    duration = road_duration(data)
+    distance = road_distance(coords, distances)
+    z_stds = [z_deviation(z) for z in accel_data_segments]
+    with stage('segment_table'):
+        # Imported here because reports builds on this module
+        from reports import segment_rows, write_segment_table
+        write_segment_table(segment_rows(segments, z_stds, bump_counts),
+                            folder_results, timestamp or TIMESTAMP_FORMAT)
+    if database is not None:
+        # Imported here because roaddb builds on this module
+        from roaddb import RoadDatabase
+        with stage('database'), RoadDatabase(database) as db:
+            db.ingest_drive(timestamp or TIMESTAMP_FORMAT, segments,
+                            z_stds, bump_counts, bump_coords, duration,
+                            distance, bumps)
+    return map_path, duration, distance, bumps
+
+
+def report_keys(data_key, map_style=MAP_STYLE,
+                bump_detector=BUMP_DETECTOR):
+    """
+    Returns the cache keys of the report stages of merged data. Every
+    key covers the settings of its stage and the keys of the stages it
+    builds on, so changing a setting only changes the keys downstream.
+
+    Args:
+        data_key (str): Hash of the merged data, from frame_digest.
+        map_style (str): Style of the HTML map, see plot_map.
+        bump_detector (str): Bump detector, see classify_bumps.
+
+    Returns:
+        dict: Key of every stage.
+    """
+    detector_settings = ()
+    if bump_detector == 'dsp':
+        import dsp
+        detector_settings = tuple(
+            (name, value) for name, value in sorted(vars(dsp).items())
+            if name.isupper() and name != 'USE_SCIPY')
+    keys = {'classify_bumps': stage_key(
+                'classify_bumps', data_key, bump_detector, BUMP_SIZE_LIMITS,
+                DSP_COLUMNS, detector_settings),
+            'segments': stage_key('segments', data_key,
+                                  SEGMENT_DISTANCE_THRESHOLD)}
+    colors = (keys['classify_bumps'], keys['segments'], MIN_BUMPS_POOR,
+              MIN_BUMPS_FAIR, MAX_BUMPS_GOOD, SMOOTH_Z_STD)
+    keys['plot_map'] = stage_key('plot_map', colors, map_style,
+                                 MAP_SIMPLIFY_TOLERANCE,
+                                 MAP_COORDINATE_DECIMALS)
+    keys['map_image'] = stage_key('map_image', colors, MAP_IMAGE_SIZE,
+                                  MAP_TILES_FOLDER, MAP_LEGEND)
+    return keys
+
+
+def run_cached(cache, stage_name, keys, compute):
+    """Returns the result of a stage from the cache, computed if it
+    isn't cached or there is no cache."""
+    if cache is None:
+        return compute()
+    return cache.cached(stage_name, keys[stage_name], compute)
+
+
+def run_cached_file(cache, stage_name, keys, path, produce):
+    """Copies the file of a stage to path from the cache, produced if it
+    isn't cached or there is no cache."""
+    if cache is None:
+        return produce()
+    return cache.cached_file(stage_name, keys[stage_name], path, produce)
+
+
 def process_data(file_path_accel, file_path_gps,
-                 folder_data, folder_results, flag_show):
+                 folder_data, folder_results, flag_show=2,
+                 map_renderer=MAP_RENDERER, timestamp=None, archive=True,
+                 chunk_size=None, merge_tolerance=MERGE_TOLERANCE,
+                 live=None, database=ROAD_DATABASE, map_style=MAP_STYLE,
+                 bump_detector=BUMP_DETECTOR, profile=PROFILE,
+                 cache=STAGE_CACHE):
     """The function processes data from two files
     (one containing accelerometer data and the other containing GPS data),
     merges the data, finds bump coordinates,
@@ -388,39 +1295,118 @@ def process_data(file_path_accel, file_path_gps,
         folder_results (<class 'str'>): Path of folder where we store result.
         flag_show (integer): Flag used to decide if we want
         to see resulting map.
+        map_renderer (str): 'native' draws the report image directly,
+        'browser' screenshots the HTML map with headless Chrome.
+        timestamp (str): Timestamp used in the result file names,
+        TIMESTAMP_FORMAT if not given.
+        archive (bool): Move the files to folder_data when done and
+        delete them when they can't be processed. Disabled when
+        reprocessing files that are already stored.
+        chunk_size (int): Process the files in chunks of this many rows
+        with bounded memory, all at once if not given.
+        merge_tolerance (float): Largest time in seconds between
+        an accelerometer sample and its nearest GPS fix, samples get
+        the interpolated GPS position. Rows with equal times are joined
+        if None.
+        live (LiveRoadQuality): State collected while the drive was
+        recorded, finalized instead of reading the files again.
+        database (str): Path of the road database that collects the
+        segments and bumps of all drives, not used if None.
+        map_style (str): 'segments' draws every recorded point,
+        'merged' and 'geojson' write a lighter map, see plot_map.
+        bump_detector (str): 'percentile' compares z with a threshold,
+        'dsp' filters all three axes, see classify_bumps. The live state
+        uses the detector it was created with.
+        profile (str): 'timing' writes the wall time, CPU time and peak
+        memory of every stage to run_<timestamp>.json in folder_results,
+        'cprofile' and 'tracemalloc' also capture every function call
+        or allocation site. Not profiled if None.
+        cache (str): Folder of cached stage results, see stagecache.
+        When only the settings of later stages change, such as the
+        colour thresholds, the earlier stages are loaded from it.
+        Drives processed in chunks or live are not cached.
+
+    Returns:
+        str: Path of the road statistics file, None if processing failed.
     """
+    timestamp_name = timestamp or TIMESTAMP_FORMAT
+    run = None
+    if profile is not None:
+        run = RunProfile(None if profile == 'timing' else profile, {
+            'file_path_accel': file_path_accel,
+            'file_path_gps': file_path_gps, 'chunk_size': chunk_size,
+            'merge_tolerance': merge_tolerance, 'live': live is not None,
+            'map_renderer': map_renderer, 'map_style': map_style,
+            'bump_detector': bump_detector, 'cache': cache})
+    stage_cache = None
+    if cache is not None and live is None and chunk_size is None:
+        stage_cache = StageCache(cache)
+    road_statistics_path = None
     try:
-        accel_data = read_data_file(file_path_accel)
-        gps_data = read_data_file(file_path_gps)
-
-        if accel_data is None or gps_data is None:
-            remove_files(file_path_accel, file_path_gps)
-            print("No data to process!")
-            return
+        with run or contextlib.nullcontext():
+            image_name = f'image_{timestamp_name}.png'
+            image_path = os.path.join(folder_results, image_name)
+            native_image_path = (None if map_renderer == 'browser'
+                                 else image_path)
+            with stage('analyze'):
+                if live is not None:
+                    result = live.finish(folder_results, native_image_path,
+                                         timestamp, database, map_style)
+                elif chunk_size is None:
+                    result = process_in_memory(
+                        file_path_accel, file_path_gps, folder_results,
+                        native_image_path, timestamp, merge_tolerance,
+                        database, map_style, bump_detector, stage_cache)
+                else:
+                    # Imported here because stream builds on this module
+                    from stream import process_stream
+                    result = process_stream(
+                        file_path_accel, file_path_gps, folder_results,
+                        native_image_path, timestamp, chunk_size,
+                        merge_tolerance, database, map_style,
+                        bump_detector)
+
+            if result is None:
+                if archive:
+                    remove_files(file_path_accel, file_path_gps)
+                print("No data to process!")
+                return None
 
-        data = merge_dataframes(gps_data, accel_data)
-        bump_coords = find_bump_coords(data)
-        z_data = data['z']
-        latitudes = data['latitude']
-        longitudes = data['longitude']
-
-        coords = list(zip(latitudes, longitudes))
-        segments = divide_into_segments(coords, z_data)[0]
-        accel_data_segments = divide_into_segments(coords, z_data)[1]
-        map_path = plot_map(segments, accel_data_segments, bump_coords,
-                            folder_results)
-
-        duration = road_duration(data)
-        distance = road_distance(coords)
-        bumps = bumps_statistics(z_data)
-        image_name = f'image_{TIMESTAMP_FORMAT}.png'
-        image_path = os.path.join(folder_results, image_name)
-        html_to_png(map_path, image_path)
-        create_road_statistics(image_path, duration, distance, bumps,
-                               folder_results)
-
-        shutil.move(file_path_accel, folder_data)
-        shutil.move(file_path_gps, folder_data)
+            map_path, duration, distance, bumps = result
+            keys = {}
+            if stage_cache is not None:
+                image_stage = ('html_to_png' if map_renderer == 'browser'
+                               else 'map_image')
+                keys['html_to_png'] = stage_key(
+                    'html_to_png', stage_cache.keys['plot_map'])
+                keys['road_statistics'] = stage_key(
+                    'road_statistics', keys.get(image_stage)
+                    or stage_cache.keys[image_stage], duration, distance,
+                    bumps)
+            if map_renderer == 'browser':
+                with stage('html_to_png'):
+                    run_cached_file(stage_cache, 'html_to_png', keys,
+                                    image_path,
+                                    lambda: html_to_png(map_path,
+                                                        image_path))
+            with stage('road_statistics'):
+                # Imported here because reports builds on this module
+                from reports import write_drive_table
+                write_drive_table(folder_results, timestamp_name, duration,
+                                  distance, bumps)
+                road_statistics_path = run_cached_file(
+                    stage_cache, 'road_statistics', keys,
+                    os.path.join(folder_results,
+                                 f'road_statistics_{timestamp_name}.xlsx'),
+                    lambda: create_road_statistics(
+                        image_path, duration, distance, bumps,
+                        folder_results, timestamp))
+
+            if archive:
+                with stage('archive'):
+                    shutil.move(file_path_accel, folder_data)
+                    shutil.move(file_path_gps, folder_data)
+            return road_statistics_path
 
     except FileNotFoundError as e:
         print(f'File not found: {e.filename}.'
@@ -431,4 +1417,23 @@ def process_data(file_path_accel, file_path_gps,
 
         # If an error occurs during processing, delete the files to avoid
         # leaving incomplete or corrupted data in the system
-        remove_files(file_path_accel, file_path_gps)
+        if archive:
+            remove_files(file_path_accel, file_path_gps)
+    finally:
+        if run is not None:
+            if stage_cache is not None:
+                run.values['stage_cache'] = stage_cache.statistics()
+            run.status = 'ok' if road_statistics_path else 'failed'
+            write_run_manifest(run, folder_results, timestamp_name)
+    return None
+
+
+def write_run_manifest(run, folder_results, timestamp):
+    """Writes the manifest of a profiled run next to its report and
+    prints where it is, errors are printed instead of raised."""
+    manifest_path = os.path.join(folder_results, f'run_{timestamp}.json')
+    try:
+        run.write(manifest_path)
+        print(f'Run manifest saved to {manifest_path}')
+    except OSError as e:
+        print(f'Could not save the run manifest: {e}')
@@ -0,0 +1,350 @@
+"""Road quality analysis that runs while the drive is recorded.
+
+GPS fixes and accelerometer samples are fed in as they are read.
+Samples get their interpolated position as soon as the next fix
+arrives, 100 m segments are closed and coloured on the fly and the
+road totals are kept up to date. Only the open segment is kept whole,
+closed segments are reduced to a summary and the bump coordinates are
+spooled to a temporary file, so memory does not grow with the samples
+or the bumps of the drive and the report is drawn from the summaries.
+"""
+import tempfile
+import threading
+from datetime import timedelta
+import folium
+import numpy as np
+import pandas as pd
+from acquisition import RunningPercentile
+from func import (BUMP_DETECTOR, BUMP_SIZE_LIMITS, MAP_STYLE,
+                  NEAREST_TOLERANCE, SEGMENT_DISTANCE_THRESHOLD,
+                  TIMESTAMP_FORMAT, MergedLines, bump_sizes,
+                  create_map_image, draw_image_bumps, draw_image_segment,
+                  get_segment_color, merge_nearest, save_map,
+                  save_map_image, simplify_line, step_distances, time_keys)
+from profiling import stage
+from reports import segment_row, write_segment_table
+from roaddb import RoadDatabase
+
+BUMP_PERCENTILE = 70
+BUMP_CHUNK_SIZE = 100_000               # bump coordinates read at once
+LIVE_COLUMNS = ['latitude', 'longitude', 'z', 'time', 'x', 'y', 'speed']
+
+
+class LiveRoadQuality:
+    """
+    Incremental counterpart of process_in_memory.
+
+    add_fix and add_samples may be called from different threads.
+
+    Args:
+        on_segment (callable): Called for every closed segment with the
+          list of coordinates, its color and its number of bumps, counted
+          with the threshold estimated so far.
+        merge_tolerance (float): Largest time in seconds between
+          a sample and its nearest GPS fix.
+        bump_detector (str): Bump detector, see func.classify_bumps.
+        rate (float): Sample rate in Hz for the dsp bump detector,
+          estimated from the first segment if not given.
+    """
+
+    def __init__(self, on_segment=None, merge_tolerance=NEAREST_TOLERANCE,
+                 bump_detector=BUMP_DETECTOR, rate=None):
+        self.on_segment = on_segment
+        self.merge_tolerance = merge_tolerance
+        self.bump_detector = bump_detector
+        self.rate = rate
+        self.pipeline = None
+        # Reentrant, on_segment may ask for the totals
+        self.lock = threading.RLock()
+        self.threshold = RunningPercentile(BUMP_PERCENTILE)
+        # GPS fixes that unpositioned samples may still be matched with
+        self.fix_keys, self.fix_latitudes, self.fix_longitudes = [], [], []
+        self.fix_speeds = []
+        self.last_fix_key = None
+        # Samples waiting for the next fix
+        self.sample_keys = np.empty(0)
+        self.sample_axes = np.empty((0, 3))
+        self.last_sample_key = None
+        # Positioned rows of LIVE_COLUMNS of the open segment, time as
+        # a time key. Its first row closed the segment before if shared.
+        self.segment_parts = []
+        self.shared_start = False
+        self.last_size = 0
+        # Simplified coordinates, z deviation, bump count and color
+        # of every closed segment
+        self.summaries = []
+        self.segment_table = []
+        # Latitude and longitude of every bump as float64 pairs
+        self.bump_spool = tempfile.TemporaryFile()
+        self.size_counts = np.zeros(len(BUMP_SIZE_LIMITS) + 1, np.int64)
+        self.south_west = np.full(2, np.inf)
+        self.north_east = np.full(2, -np.inf)
+        self.num_rows = 0
+        self.segment_start = 0.0
+        self.position = 0.0
+        self.previous_point = None
+        self.first_key = None
+        self.last_key = None
+        self.segments = 0
+        self.bumps = 0
+
+    def add_fix(self, latitude, longitude, time, speed=None):
+        """Adds a GPS fix, time as written to the GPS log and speed
+        over ground in knots, if known."""
+        with self.lock:
+            key = time_keys([time], self.last_fix_key)[0]
+            self.last_fix_key = key
+            self.fix_keys.append(key)
+            self.fix_latitudes.append(latitude)
+            self.fix_longitudes.append(longitude)
+            self.fix_speeds.append(np.nan if speed is None else speed)
+            self._position_samples(self.sample_keys < key)
+
+    def add_samples(self, times, z_data, x_data=None, y_data=None):
+        """Adds accelerometer samples in the order they were read,
+        times as written to the accelerometer log or seconds since
+        midnight. The x and y axes are only needed by the dsp bump
+        detector."""
+        with self.lock:
+            keys = time_keys(times, self.last_sample_key)
+            if len(keys) == 0:
+                return
+            self.last_sample_key = keys[-1]
+            self.sample_keys = np.concatenate((self.sample_keys, keys))
+            axes = np.full((len(keys), 3), np.nan)
+            for i, values in enumerate((x_data, y_data, z_data)):
+                if values is not None:
+                    axes[:, i] = values
+            self.sample_axes = np.concatenate((self.sample_axes, axes))
+            if self.last_fix_key is not None:
+                self._position_samples(self.sample_keys < self.last_fix_key)
+
+    def _position_samples(self, ready):
+        """Interpolates the positions of the ready samples and moves
+        them into the open segment."""
+        if not ready.any() or not self.fix_keys:
+            return
+        keys = self.sample_keys[ready]
+        axes = self.sample_axes[ready]
+        samples = pd.DataFrame({'z': axes[:, 2], 'time': keys,
+                                'x': axes[:, 0], 'y': axes[:, 1]})
+        fixes = pd.DataFrame({'latitude': self.fix_latitudes,
+                              'longitude': self.fix_longitudes,
+                              'speed': self.fix_speeds})
+        merged = merge_nearest(samples, fixes, keys,
+                               np.array(self.fix_keys), self.merge_tolerance)
+        self.sample_keys = self.sample_keys[~ready]
+        self.sample_axes = self.sample_axes[~ready]
+        # Later samples only need the fix before the tolerance window
+        start = max(int(np.searchsorted(
+            self.fix_keys, keys[-1] - self.merge_tolerance)) - 1, 0)
+        del self.fix_keys[:start]
+        del self.fix_latitudes[:start]
+        del self.fix_longitudes[:start]
+        del self.fix_speeds[:start]
+        if len(merged) > 0:
+            self._add_rows(merged[LIVE_COLUMNS].to_numpy(dtype=np.float64))
+
+    def _add_rows(self, rows):
+        """Updates the totals and closes the segments that reached
+        SEGMENT_DISTANCE_THRESHOLD, like analyze_stream."""
+        self.num_rows += len(rows)
+        self.threshold.add(np.abs(rows[:, 2]))
+        self.south_west = np.minimum(self.south_west, rows[:, :2].min(axis=0))
+        self.north_east = np.maximum(self.north_east, rows[:, :2].max(axis=0))
+        if self.first_key is None:
+            self.first_key = rows[0, 3]
+        self.last_key = rows[-1, 3]
+
+        coords = rows[:, :2]
+        if self.previous_point is not None:
+            coords = np.vstack((self.previous_point, coords))
+        positions = np.cumsum(np.concatenate(
+            ([self.position], step_distances(coords))))
+        if self.previous_point is not None:
+            positions = positions[1:]
+        self.position = positions[-1]
+        self.previous_point = rows[-1, :2]
+
+        local_start = 0
+        while True:
+            end = int(np.searchsorted(
+                positions, self.segment_start + SEGMENT_DISTANCE_THRESHOLD,
+                side='left'))
+            if end >= len(rows):
+                self.segment_parts.append(rows[local_start:])
+                break
+            self.segment_parts.append(rows[local_start:end + 1])
+            self._close_segment()
+            self.shared_start = True
+            local_start = end
+            self.segment_start = positions[end]
+
+    def _bump_sizes(self, rows):
+        """Classifies rows that follow the rows classified before,
+        with the threshold estimated so far or the dsp pipeline."""
+        if self.bump_detector == 'dsp' and self.pipeline is None:
+            if np.isnan(rows[:, 4:6]).any():
+                print("The dsp bump detector needs all three "
+                      "accelerometer axes.")
+                self.bump_detector = 'percentile'
+            else:
+                # Imported here so SciPy is only loaded when it is used
+                from dsp import sample_rate, supported_pipeline
+                self.pipeline = supported_pipeline(self.rate or sample_rate(
+                    len(rows), rows[-1, 3] - rows[0, 3]))
+                if self.pipeline is None:
+                    self.bump_detector = 'percentile'
+        if self.pipeline is None:
+            return bump_sizes(rows[:, 2], self.threshold.value())
+        return self.pipeline({'x': rows[:, 4], 'y': rows[:, 5],
+                              'z': rows[:, 2], 'speed': rows[:, 6]})
+
+    def _close_segment(self):
+        rows = np.concatenate(self.segment_parts)
+        self.segment_parts = []
+        self.segments += 1
+        # The shared first row was classified with the previous segment
+        new_rows = rows[1:] if self.shared_start else rows
+        self.shared_start = False
+        sizes = self._bump_sizes(new_rows)
+        self.size_counts += np.bincount(sizes, minlength=len(
+            self.size_counts))
+        self.bumps += int(np.count_nonzero(sizes))
+        self.bump_spool.write(np.ascontiguousarray(
+            new_rows[sizes > 0, :2], dtype=np.float64).tobytes())
+        if len(new_rows) < len(rows):
+            sizes = np.concatenate(([self.last_size], sizes))
+        if len(sizes) > 0:
+            self.last_size = sizes[-1]
+
+        segment = list(zip(rows[:, 0].tolist(), rows[:, 1].tolist()))
+        bump_count = int(np.count_nonzero(sizes))
+        z_std = float(np.std(rows[:, 2]))
+        color = get_segment_color(segment, rows[:, 2], [], bump_count)
+        self.segment_table.append(segment_row(
+            len(self.segment_table), segment, z_std, bump_count))
+        self.summaries.append((simplify_line(segment), z_std, bump_count,
+                               color))
+        if self.on_segment is not None:
+            self.on_segment(segment, color, bump_count)
+
+    def bump_chunks(self, chunk_size=BUMP_CHUNK_SIZE):
+        """Reads the coordinates of the bumps of the closed segments
+        back from the spool as arrays of up to chunk_size rows."""
+        position = 0
+        while True:
+            # Segments may still be closed between the chunks
+            with self.lock:
+                self.bump_spool.seek(position)
+                data = self.bump_spool.read(chunk_size * 16)
+                self.bump_spool.seek(0, 2)
+            if not data:
+                break
+            position += len(data)
+            yield np.frombuffer(data, dtype=np.float64).reshape(-1, 2)
+
+    def bump_coords(self):
+        """Yields the coordinates of the bumps of the closed segments."""
+        for chunk in self.bump_chunks():
+            for latitude, longitude in chunk.tolist():
+                yield latitude, longitude
+
+    def bumps_statistics(self):
+        """Returns the bump statistics of the closed segments like
+        func.bumps_statistics. The percentile detector counts them
+        again from the histogram of |z| with the threshold of the
+        whole drive, up to the bin width of the histogram."""
+        counts = self.size_counts
+        if self.pipeline is None:
+            histogram = self.threshold
+            values = ((np.arange(len(histogram.counts)) + 0.5)
+                      * histogram.bin_width)
+            counts = np.bincount(bump_sizes(values, histogram.value()),
+                                 histogram.counts, len(counts))
+        small_bumps, medium_bumps, big_bumps = (int(c) for c in counts[1:])
+        all_bumps = small_bumps + medium_bumps + big_bumps
+        return all_bumps, big_bumps, medium_bumps, small_bumps
+
+    def totals(self):
+        """
+        Returns the road totals so far.
+
+        Returns:
+            dict: Duration, distance in meters, number of closed segments,
+              number of bumps in them and the bump threshold estimated
+              so far.
+        """
+        with self.lock:
+            duration = (0.0 if self.first_key is None
+                        else self.last_key - self.first_key)
+            return {'duration': timedelta(seconds=float(duration)),
+                    'distance': float(self.position),
+                    'segments': self.segments,
+                    'bumps': self.bumps,
+                    'threshold': self.threshold.value()}
+
+    def finish(self, folder_results, image_path=None, timestamp=None,
+               database=None, map_style=MAP_STYLE):
+        """
+        Positions the remaining samples, closes the last segment and
+        builds the report from the segment summaries. The 'segments'
+        map style draws the simplified line of every segment.
+
+        Args:
+            folder_results (str): Path of folder where we store result.
+            image_path (str): Path of the map image to draw,
+              no image is drawn if not given.
+            timestamp (str): Timestamp used in the result file names.
+            database (str): Path of the road database the results are
+              added to, not stored if not given.
+            map_style (str): Style of the HTML map, see plot_map.
+
+        Returns:
+            tuple: Map path, duration, distance and bump statistics
+              like process_in_memory, None if there is no data.
+        """
+        with self.lock:
+            # No more fixes are coming
+            self._position_samples(np.ones(len(self.sample_keys), bool))
+            if self.segment_parts:
+                self._close_segment()
+            if not self.summaries:
+                return None
+            totals = self.totals()
+            bumps = self.bumps_statistics()
+
+        lines = MergedLines()
+        for segment, _, _, color in self.summaries:
+            lines.add(segment, color)
+        with stage('plot_map'):
+            my_map = folium.Map(location=self.summaries[0][0][0],
+                                zoom_start=15)
+            if map_style == 'segments':
+                for segment, _, _, color in self.summaries:
+                    folium.PolyLine(segment, color=color,
+                                    weight=6).add_to(my_map)
+            else:
+                lines.add_to(my_map, map_style)
+            map_path = save_map(my_map, folder_results, timestamp)
+        if image_path is not None:
+            with stage('map_image'):
+                fig, ax = create_map_image(tuple(self.south_west.tolist()),
+                                           tuple(self.north_east.tolist()))
+                for color, line in lines.lines:
+                    draw_image_segment(ax, line, color)
+                for bump_coords in self.bump_chunks():
+                    draw_image_bumps(ax, bump_coords)
+                save_map_image(fig, ax, image_path)
+        duration = totals['duration']
+        distance = format(totals['distance'] / 1000, ".2f")
+        with stage('segment_table'):
+            write_segment_table(self.segment_table, folder_results,
+                                timestamp or TIMESTAMP_FORMAT)
+        if database is not None:
+            segments, z_stds, bump_counts, _ = zip(*self.summaries)
+            with stage('database'), RoadDatabase(database) as db:
+                db.ingest_drive(timestamp or TIMESTAMP_FORMAT, segments,
+                                z_stds, bump_counts, self.bump_coords(),
+                                duration, distance, bumps)
+        return map_path, duration, distance, bumps
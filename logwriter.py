@@ -0,0 +1,337 @@
+"""Crash-safe sensor log writer with rotated parts.
+
+Rows are collected in memory and written as one block when enough rows
+are waiting or enough time has passed since the last block. Every block
+is synced to the card with fsync, so power loss costs at most the rows
+of one flush interval while the card isn't written for every row.
+
+A long drive is split into numbered parts, accel_data_<timestamp>.csv
+is recorded as accel_data_<timestamp>.part001.csv and so on. Every part
+has an index next to it, with the end offset, row count and CRC-32 of
+every block and a footer when the part was closed cleanly:
+
+    8 bytes    magic b'RQIDX', format version, two unused bytes
+    21 bytes   for each block: kind b'B', end offset, rows, CRC-32
+               kind b'F' closes the part with its size and rows
+
+recover_log cuts a part that was cut short back to its last complete
+block and stitch_log joins the parts into one log of the original name
+by copying bytes, without parsing a single row.
+"""
+import csv
+import glob
+import io
+import os
+import re
+import shutil
+import struct
+import threading
+import time
+import zlib
+from binlog import (COLUMN_NAME_SIZE, LOG_MAGIC, LOG_VERSION, header_size,
+                    time_to_seconds)
+from profiling import observe
+
+FLUSH_ROWS = 1000               # rows written at once
+FLUSH_INTERVAL = 5.0            # seconds, longest time rows wait in memory
+SEGMENT_ROWS = 1_000_000        # rows per part, None never rotates
+INDEX_MAGIC = b'RQIDX'
+INDEX_VERSION = 1
+INDEX_EXTENSION = '.idx'
+INDEX_ENTRY = struct.Struct('<cQQI')
+PART_PATTERN = re.compile(r'\.part(\d{3,})$')
+COPY_BUFFER = 1024 * 1024       # bytes copied at once when stitching
+
+
+def part_path(base_path, number):
+    """Returns the path of a part, 'drive.csv' -> 'drive.part001.csv'."""
+    stem, extension = os.path.splitext(base_path)
+    return f'{stem}.part{number:03d}{extension}'
+
+
+def base_path_of(path):
+    """Returns the log a part belongs to, None if path is not a part."""
+    stem, extension = os.path.splitext(path)
+    match = PART_PATTERN.search(stem)
+    if match is None:
+        return None
+    return stem[:match.start()] + extension
+
+
+def log_parts(base_path):
+    """Returns the paths of the parts of a log in recording order."""
+    stem, extension = os.path.splitext(base_path)
+    parts = []
+    for path in glob.glob(f'{glob.escape(stem)}.part*{extension}'):
+        if base_path_of(path) == base_path:
+            number = PART_PATTERN.search(os.path.splitext(path)[0])
+            parts.append((int(number.group(1)), path))
+    return [path for _, path in sorted(parts)]
+
+
+def log_header(headers, log_format):
+    """Returns the bytes a log starts with, like binlog.create_log_file
+    or a CSV header row."""
+    if log_format == 'binary':
+        names = b''.join(name.encode('ascii').ljust(COLUMN_NAME_SIZE, b'\0')
+                         for name in headers)
+        return (LOG_MAGIC + struct.pack('<BBB', LOG_VERSION, 0, len(headers))
+                + names)
+    return csv_rows([headers])
+
+
+def csv_rows(rows):
+    """Formats rows like csv.writer does for app.main."""
+    text = io.StringIO()
+    csv.writer(text).writerows(rows)
+    return text.getvalue().encode('utf-8')
+
+
+def header_length(path):
+    """Returns the size in bytes of the header of a CSV or binary log."""
+    with open(path, 'rb') as f:
+        start = f.read(8)
+        if start[:len(LOG_MAGIC)] == LOG_MAGIC:
+            return header_size(start[7])
+        f.seek(0)
+        return len(f.readline())
+
+
+def sync(file):
+    file.flush()
+    os.fsync(file.fileno())
+
+
+class SegmentedLogWriter:
+    """
+    Writes a sensor log in synced blocks and rotated parts, with the
+    writerow and writerows methods of csv.writer.
+
+    The time policy is checked when rows are written, a row waits at
+    most flush_interval seconds as long as rows keep arriving, and
+    close() writes the rest.
+
+    Args:
+        base_path (str): Path of the log, the parts are named after it.
+        headers (list): Column names.
+        log_format (str): 'csv' or 'binary', see binlog.
+        flush_rows (int): Rows collected before a block is written.
+        flush_interval (float): Seconds after which waiting rows are
+          written even if there are fewer than flush_rows.
+        segment_rows (int): Rows per part, a new part is started after
+          the block that reaches it. Never rotated if None.
+    """
+
+    def __init__(self, base_path, headers, log_format='csv',
+                 flush_rows=FLUSH_ROWS, flush_interval=FLUSH_INTERVAL,
+                 segment_rows=SEGMENT_ROWS):
+        self.base_path = base_path
+        self.headers = list(headers)
+        self.log_format = log_format
+        self.flush_rows = flush_rows
+        self.flush_interval = flush_interval
+        self.segment_rows = segment_rows
+        if log_format == 'binary':
+            self.record = struct.Struct(f'<{len(self.headers)}d')
+        self.lock = threading.Lock()
+        self.pending = []
+        self.last_flush = time.monotonic()
+        self.parts = []
+        self.file = self.index = None
+        self.part_rows = self.part_size = 0
+        self.rows = 0
+        self.blocks = 0
+        self.closed = False
+        self._open_part()
+
+    def _open_part(self):
+        path = part_path(self.base_path, len(self.parts) + 1)
+        self.parts.append(path)
+        self.file = open(path, 'wb')
+        self.index = open(path + INDEX_EXTENSION, 'wb')
+        self.index.write(INDEX_MAGIC + struct.pack('<BBB', INDEX_VERSION,
+                                                   0, 0))
+        self.part_rows = self.part_size = 0
+        self._write_block(log_header(self.headers, self.log_format), 0)
+
+    def _write_block(self, data, num_rows):
+        """Syncs a block to the part, then its index entry, so the
+        index never points past synced data."""
+        self.file.write(data)
+        sync(self.file)
+        self.part_size += len(data)
+        self.part_rows += num_rows
+        self.index.write(INDEX_ENTRY.pack(b'B', self.part_size,
+                                          self.part_rows, zlib.crc32(data)))
+        sync(self.index)
+
+    def _close_part(self):
+        self.index.write(INDEX_ENTRY.pack(b'F', self.part_size,
+                                          self.part_rows, 0))
+        sync(self.index)
+        self.file.close()
+        self.index.close()
+
+    def _format(self, rows):
+        if self.log_format == 'binary':
+            return b''.join(self.record.pack(*map(time_to_seconds, row))
+                            for row in rows)
+        return csv_rows(rows)
+
+    def writerow(self, row):
+        self.writerows([row])
+
+    def writerows(self, rows):
+        with self.lock:
+            self.pending.extend(rows)
+            if (len(self.pending) >= self.flush_rows
+                    or time.monotonic() - self.last_flush
+                    >= self.flush_interval):
+                self._flush()
+
+    def flush(self):
+        """Writes and syncs the waiting rows."""
+        with self.lock:
+            self._flush()
+
+    def _flush(self):
+        self.last_flush = time.monotonic()
+        if not self.pending:
+            return
+        rows, self.pending = self.pending, []
+        start = time.perf_counter()
+        self._write_block(self._format(rows), len(rows))
+        observe('log_flush', time.perf_counter() - start)
+        self.rows += len(rows)
+        self.blocks += 1
+        if (self.segment_rows is not None
+                and self.part_rows >= self.segment_rows):
+            self._close_part()
+            self._open_part()
+
+    def close(self):
+        """Writes the waiting rows and closes the last part with
+        a footer."""
+        with self.lock:
+            if self.closed:
+                return
+            self._flush()
+            self._close_part()
+            self.closed = True
+
+
+def read_index(index_path):
+    """
+    Reads the entries of a part index.
+
+    Args:
+        index_path (str): Path of the index.
+
+    Returns:
+        list: (kind, end, rows, crc) tuples, an incomplete last entry is
+          left out. None if the file is not an index.
+    """
+    try:
+        with open(index_path, 'rb') as f:
+            content = f.read()
+    except FileNotFoundError:
+        return None
+    if content[:len(INDEX_MAGIC)] != INDEX_MAGIC:
+        return None
+    entries = []
+    for offset in range(8, len(content) - INDEX_ENTRY.size + 1,
+                        INDEX_ENTRY.size):
+        kind, end, rows, crc = INDEX_ENTRY.unpack_from(content, offset)
+        entries.append((kind.decode('ascii'), end, rows, crc))
+    return entries
+
+
+def recover_log(path):
+    """
+    Cuts a part back to the end of its last block that is complete
+    and matches its checksum, after a crash or power loss.
+
+    Args:
+        path (str): Path of the part.
+
+    Returns:
+        tuple: Number of rows kept and whether the part was closed
+          cleanly, None if the part has no index.
+    """
+    entries = read_index(path + INDEX_EXTENSION)
+    if entries is None:
+        return None
+    if entries and entries[-1][0] == 'F':
+        _, end, rows, _ = entries[-1]
+        if os.path.getsize(path) == end:
+            return rows, True
+    good_end = good_rows = 0
+    with open(path, 'r+b') as f:
+        for kind, end, rows, crc in entries:
+            if kind != 'B':
+                break
+            f.seek(good_end)
+            block = f.read(end - good_end)
+            if len(block) != end - good_end or zlib.crc32(block) != crc:
+                break
+            good_end, good_rows = end, rows
+        if f.seek(0, os.SEEK_END) != good_end:
+            f.truncate(good_end)
+            sync(f)
+    return good_rows, False
+
+
+def stitch_log(base_path):
+    """
+    Recovers the parts of a log and joins them into one log at
+    base_path. The first part is renamed and the rows of the other
+    parts are appended to it, so only those are copied.
+
+    Args:
+        base_path (str): Path of the log the parts were recorded for.
+
+    Returns:
+        str: base_path, None if there are no parts, none of them kept
+          its header or a log already exists at base_path.
+    """
+    parts = log_parts(base_path)
+    if not parts:
+        return None
+    if os.path.exists(base_path):
+        print(f'{base_path} already exists, its parts are not stitched.')
+        return None
+    for path in parts:
+        recover_log(path)
+    # A part that lost even its header has nothing to add
+    kept = [path for path in parts if os.path.getsize(path) > 0]
+    if not kept:
+        remove_parts(parts)
+        return None
+    with open(kept[0], 'ab') as output:
+        for path in kept[1:]:
+            with open(path, 'rb') as part:
+                part.seek(header_length(path))
+                shutil.copyfileobj(part, output, COPY_BUFFER)
+        sync(output)
+    os.replace(kept[0], base_path)
+    remove_parts(parts)
+    return base_path
+
+
+def remove_parts(parts):
+    """Removes parts and their indexes that are still there."""
+    for path in parts:
+        for leftover in (path, path + INDEX_EXTENSION):
+            if os.path.exists(leftover):
+                os.remove(leftover)
+
+
+def stitch_folder(folder):
+    """Stitches every log in folder that was left in parts, such as
+    the logs of a drive that ended with a power loss, and returns
+    the stitched paths."""
+    bases = {base_path_of(path)
+             for path in glob.glob(os.path.join(folder, '*.part*'))}
+    bases.discard(None)
+    return [path for path in map(stitch_log, sorted(bases))
+            if path is not None]
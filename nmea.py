@@ -0,0 +1,568 @@
+"""Non-blocking NMEA reader for the NEO-6M GPS receiver.
+
+A reader thread takes whatever bytes the serial port has, assembles
+them into sentences and parses the GGA, RMC, VTG and GSA sentences as
+they complete. The sentences of one navigation epoch are merged into a
+Fix with the position, speed, altitude, satellites and dilution of
+precision. A fix is passed on as soon as the receiver goes quiet after
+the epoch or the next epoch starts, stamped with the monotonic time
+its first sentence arrived.
+
+Empty reads, bad checksums, line noise and serial errors are counted
+instead of ending the drive. configure_neo6m sets the update rate of
+the receiver to up to 10 Hz with the UBX protocol. RecordingPort saves
+the stream of a drive and ReplayPort stands in for the serial port,
+replaying it at its recorded pace or faster.
+"""
+import bisect
+import contextlib
+import itertools
+import queue
+import struct
+import threading
+import time
+from profiling import observe
+
+MAX_SENTENCE_LENGTH = 120       # NMEA allows 82, longer lines are noise
+READ_SIZE = 4096                # bytes read at most at once
+FIX_QUEUE_SIZE = 100            # fixes kept while nobody takes them
+GAP_TIMEOUT = 3.0               # seconds without data counted as a gap
+ERROR_RETRY_INTERVAL = 0.5      # seconds to wait after a serial error
+NMEA_MESSAGE_IDS = {'GGA': 0x00, 'GLL': 0x01, 'GSA': 0x02, 'GSV': 0x03,
+                    'RMC': 0x04, 'VTG': 0x05}
+NEO6M_SENTENCES = ['RMC', 'VTG', 'GGA', 'GSA']
+NEO6M_MAX_RATE = 10             # Hz, the datasheet guarantees 5 Hz
+BAUD_RATES = [9600, 19200, 38400, 57600, 115200]
+SENTENCE_BYTES = 80             # typical length of a sentence
+BAUD_HEADROOM = 1.5             # spare serial bandwidth
+UBX_CFG = 0x06
+UBX_CFG_PRT, UBX_CFG_MSG, UBX_CFG_RATE = 0x00, 0x01, 0x08
+
+
+def nmea_checksum(body):
+    """Returns the XOR of the characters between '$' and '*'."""
+    checksum = 0
+    for byte in body.encode('ascii'):
+        checksum ^= byte
+    return checksum
+
+
+def nmea_sentence(body):
+    """Adds the '$', checksum and line ending to a sentence body,
+    'GPVTG,,T,,M,0.1,N,0.2,K,A' -> '$GPVTG,...*hh\\r\\n'."""
+    return f'${body}*{nmea_checksum(body):02X}\r\n'
+
+
+def parse_time(value):
+    """Converts 'hhmmss.ss' to seconds since midnight."""
+    return int(value[:2]) * 3600 + int(value[2:4]) * 60 + float(value[4:])
+
+
+def parse_coordinate(value, hemisphere):
+    """Converts '(d)ddmm.mmmm' and its hemisphere to signed degrees."""
+    point = value.index('.') if '.' in value else len(value)
+    degrees = int(value[:point - 2]) + float(value[point - 2:]) / 60
+    return -degrees if hemisphere in ('S', 'W') else degrees
+
+
+def number(value, convert=float):
+    return convert(value) if value else None
+
+
+def parse_rmc(fields):
+    values = {'time': parse_time(fields[0]), 'valid': fields[1] == 'A'}
+    if fields[2] and fields[4]:
+        values['latitude'] = parse_coordinate(fields[2], fields[3])
+        values['longitude'] = parse_coordinate(fields[4], fields[5])
+    values['speed'] = number(fields[6])
+    values['course'] = number(fields[7])
+    values['date'] = fields[8] or None
+    return values
+
+
+def parse_gga(fields):
+    quality = number(fields[5], int)
+    values = {'time': parse_time(fields[0]), 'quality': quality,
+              'satellites': number(fields[6], int),
+              'hdop': number(fields[7]), 'altitude': number(fields[8])}
+    if fields[1] and fields[3]:
+        values['latitude'] = parse_coordinate(fields[1], fields[2])
+        values['longitude'] = parse_coordinate(fields[3], fields[4])
+    if quality == 0:
+        values['valid'] = False
+    return values
+
+
+def parse_vtg(fields):
+    return {'course': number(fields[0]), 'speed': number(fields[4])}
+
+
+def parse_gsa(fields):
+    return {'fix_type': number(fields[1], int), 'pdop': number(fields[14]),
+            'hdop': number(fields[15]), 'vdop': number(fields[16])}
+
+
+# Parser and smallest number of fields of every sentence
+SENTENCE_PARSERS = {'RMC': (parse_rmc, 9), 'GGA': (parse_gga, 9),
+                    'VTG': (parse_vtg, 5), 'GSA': (parse_gsa, 17)}
+
+
+class Fix:
+    """Merged sentences of one navigation epoch.
+
+    Values the receiver did not send are None. The speed over ground
+    is in knots, the altitude above mean sea level in meters and the
+    time in seconds since midnight UTC.
+    """
+
+    FIELDS = ('time', 'date', 'latitude', 'longitude', 'speed', 'course',
+              'altitude', 'quality', 'fix_type', 'satellites', 'hdop',
+              'pdop', 'vdop', 'valid')
+    __slots__ = FIELDS + ('received', 'sentences')
+
+    def __init__(self, received=None):
+        for name in self.FIELDS:
+            setattr(self, name, None)
+        self.received = received
+        self.sentences = []
+
+    def has_position(self):
+        """Checks if the fix has a position the receiver didn't mark
+        as invalid."""
+        return (self.latitude is not None and self.longitude is not None
+                and self.valid is not False)
+
+    def as_dict(self):
+        return {name: getattr(self, name) for name in self.FIELDS}
+
+    def __repr__(self):
+        return f'Fix({self.as_dict()})'
+
+
+class NmeaParser:
+    """Assembles sentences from raw chunks of bytes and merges the
+    sentences of every epoch into a Fix.
+
+    The epoch a sentence belongs to follows from the UTC time of RMC and
+    GGA sentences. VTG and GSA sentences, which carry no time, belong
+    to the epoch being assembled.
+    """
+
+    def __init__(self):
+        self.line = bytearray()
+        self.fix = None
+        self.sentences = 0
+        self.counts = {name: 0 for name in SENTENCE_PARSERS}
+        self.bad_checksums = 0
+        self.discarded = 0
+        self.fixes = 0
+
+    def feed(self, chunk, received=None):
+        """
+        Parses the sentences completed by a chunk of bytes.
+
+        Args:
+            chunk (bytes): Bytes read from the serial port.
+            received (float): time.monotonic() when the chunk was read.
+
+        Returns:
+            list: Fixes of the epochs that ended in the chunk.
+        """
+        if received is None:
+            received = time.monotonic()
+        fixes = []
+        start = 0
+        end = chunk.find(b'\n')
+        while end >= 0:
+            self.line += chunk[start:end]
+            fix = self.parse_line(bytes(self.line), received)
+            if fix is not None:
+                fixes.append(fix)
+            self.line.clear()
+            start = end + 1
+            end = chunk.find(b'\n', start)
+        self.line += chunk[start:]
+        if len(self.line) > MAX_SENTENCE_LENGTH:
+            # Noise without line endings
+            self.discarded += 1
+            self.line.clear()
+        return fixes
+
+    def parse_line(self, line, received):
+        """Parses one line, returns the fix of the previous epoch if
+        the line starts a new one."""
+        line = line.strip()
+        dollar = line.rfind(b'$')
+        star = line.rfind(b'*')
+        if dollar < 0 or star < dollar or len(line) > MAX_SENTENCE_LENGTH:
+            if line:
+                self.discarded += 1
+            return None
+        try:
+            body = line[dollar + 1:star].decode('ascii')
+            checksum = int(line[star + 1:star + 3], 16)
+        except ValueError:
+            self.discarded += 1
+            return None
+        if nmea_checksum(body) != checksum:
+            self.bad_checksums += 1
+            return None
+        self.sentences += 1
+        fields = body.split(',')
+        name = fields[0][-3:]
+        parser = SENTENCE_PARSERS.get(name)
+        if parser is None or len(fields) - 1 < parser[1]:
+            return None
+        try:
+            values = parser[0](fields[1:])
+        except (ValueError, IndexError):
+            self.discarded += 1
+            return None
+        self.counts[name] += 1
+
+        finished = None
+        epoch_time = values.get('time')
+        if (self.fix is not None and epoch_time is not None
+                and self.fix.time is not None
+                and self.fix.time != epoch_time):
+            finished = self.flush()
+        if self.fix is None:
+            self.fix = Fix(received)
+        for key, value in values.items():
+            # A value missing from one sentence doesn't hide another's
+            if value is not None or getattr(self.fix, key) is None:
+                setattr(self.fix, key, value)
+        self.fix.sentences.append(name)
+        return finished
+
+    def flush(self):
+        """Returns the fix being assembled, None if it has no time yet,
+        and starts a new one."""
+        fix = self.fix
+        if fix is None or fix.time is None:
+            return None
+        self.fix = None
+        self.fixes += 1
+        return fix
+
+
+class NmeaReader(threading.Thread):
+    """Reads and parses the NMEA output of a serial port on its own
+    thread.
+
+    The port is read with its timeout, an empty read means the receiver
+    has gone quiet after an epoch, so the fix is passed on without
+    waiting for the next one. A port timeout of a few tens of
+    milliseconds keeps that delay short.
+
+    Args:
+        port: serial.Serial, ReplayPort or another object with read(),
+          in_waiting and a read timeout.
+        on_fix (callable): Called on the reader thread with every fix,
+          fixes are queued for get_fix() otherwise.
+        gap_timeout (float): Seconds without data counted as a gap.
+        drop_when_full (bool): Drop fixes nobody takes, so a busy app
+          never holds up the serial port. A replay waits instead.
+
+    The reader ends on its own when a port with a finished() method,
+    such as ReplayPort, has nothing more to send.
+    """
+
+    def __init__(self, port, on_fix=None, gap_timeout=GAP_TIMEOUT,
+                 drop_when_full=True):
+        super().__init__(name='gps', daemon=True)
+        self.port = port
+        self.on_fix = on_fix
+        self.gap_timeout = gap_timeout
+        self.drop_when_full = drop_when_full
+        self.parser = NmeaParser()
+        self.fixes = queue.Queue(FIX_QUEUE_SIZE)
+        self.stop_event = threading.Event()
+        self.last_data = time.monotonic()
+        self.in_gap = False
+        self.gaps = 0
+        self.errors = 0
+        self.dropped = 0
+        self.bytes_read = 0
+        self.ended = False
+
+    def run(self):
+        while not self.stop_event.is_set():
+            try:
+                chunk = self.port.read(
+                    min(max(self.port.in_waiting, 1), READ_SIZE))
+            except OSError as e:
+                # serial.SerialException, such as a loose connector
+                if self.errors == 0:
+                    print(f'GPS read failed: {e}')
+                self.errors += 1
+                self.stop_event.wait(ERROR_RETRY_INTERVAL)
+                chunk = b''
+            now = time.monotonic()
+            if chunk:
+                self.bytes_read += len(chunk)
+                self.last_data = now
+                self.in_gap = False
+                for fix in self.parser.feed(chunk, now):
+                    self.publish(fix)
+            else:
+                self.publish(self.parser.flush())
+                finished = getattr(self.port, 'finished', None)
+                if finished is not None and finished():
+                    break
+                if not self.in_gap and now - self.last_data > \
+                        self.gap_timeout:
+                    self.in_gap = True
+                    self.gaps += 1
+        self.publish(self.parser.flush())
+        self.ended = True
+        # Wakes up get_fix() at once
+        with contextlib.suppress(queue.Full):
+            self.fixes.put_nowait(None)
+
+    def publish(self, fix):
+        if fix is None:
+            return
+        observe('gps_fix_latency', time.monotonic() - fix.received)
+        if self.on_fix is not None:
+            self.on_fix(fix)
+            return
+        if not self.drop_when_full:
+            while not self.stop_event.is_set():
+                try:
+                    self.fixes.put(fix, timeout=ERROR_RETRY_INTERVAL)
+                    return
+                except queue.Full:
+                    pass
+        try:
+            self.fixes.put_nowait(fix)
+        except queue.Full:
+            self.dropped += 1
+
+    def get_fix(self, timeout=None):
+        """Returns the next fix, None if none arrived within timeout
+        seconds or the reader has ended."""
+        try:
+            return self.fixes.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def silence(self):
+        """Returns the seconds since the port last sent data."""
+        return time.monotonic() - self.last_data
+
+    def stop(self):
+        self.stop_event.set()
+
+    def statistics(self):
+        """
+        Returns the reading statistics.
+
+        Returns:
+            dict: Bytes read, parsed sentences by type, fixes, bad
+              checksums, discarded lines, gaps, serial errors and fixes
+              dropped because nobody took them.
+        """
+        return {'bytes': self.bytes_read,
+                'sentences': dict(self.parser.counts),
+                'fixes': self.parser.fixes,
+                'bad_checksums': self.parser.bad_checksums,
+                'discarded': self.parser.discarded, 'gaps': self.gaps,
+                'errors': self.errors, 'dropped': self.dropped}
+
+
+def ubx_message(message_class, message_id, payload=b''):
+    """Frames a UBX message with its length and Fletcher checksum."""
+    content = struct.pack('<BBH', message_class, message_id,
+                          len(payload)) + payload
+    check_a = check_b = 0
+    for byte in content:
+        check_a = (check_a + byte) & 0xff
+        check_b = (check_b + check_a) & 0xff
+    return b'\xb5\x62' + content + bytes([check_a, check_b])
+
+
+def required_baud_rate(rate, sentences=NEO6M_SENTENCES):
+    """Returns the lowest standard baud rate that carries the sentences
+    at rate Hz, 10 bits are sent per byte."""
+    needed = SENTENCE_BYTES * len(sentences) * rate * 10 * BAUD_HEADROOM
+    for baud_rate in BAUD_RATES:
+        if baud_rate >= needed:
+            return baud_rate
+    return BAUD_RATES[-1]
+
+
+def configure_neo6m(port, rate, sentences=NEO6M_SENTENCES, baud_rate=None):
+    """
+    Sets the navigation update rate of a NEO-6M and the serial speed it
+    needs. The settings are not saved on the receiver, so they are sent
+    again at every start.
+
+    Args:
+        port (serial.Serial): Port of the receiver at its current speed,
+          switched to the new speed.
+        rate (float): Updates per second, 1 to 10.
+        sentences (list): NMEA sentences the receiver keeps sending,
+          the others are turned off to save bandwidth.
+        baud_rate (int): Serial speed, the lowest one that carries the
+          sentences at rate if not given.
+
+    Returns:
+        int: Serial speed the receiver was switched to.
+    """
+    if not 0 < rate <= NEO6M_MAX_RATE:
+        print(f'GPS rate must be between 1 and {NEO6M_MAX_RATE} Hz.')
+        return port.baudrate
+    if baud_rate is None:
+        baud_rate = required_baud_rate(rate, sentences)
+    for name, message_id in NMEA_MESSAGE_IDS.items():
+        port.write(ubx_message(UBX_CFG, UBX_CFG_MSG, bytes(
+            [0xf0, message_id, int(name in sentences)])))
+    if baud_rate != port.baudrate:
+        # UART1, 8 data bits, no parity, 1 stop bit, UBX and NMEA in,
+        # NMEA out
+        port.write(ubx_message(UBX_CFG, UBX_CFG_PRT, struct.pack(
+            '<BBHIIHHHH', 1, 0, 0, 0x08d0, baud_rate, 0x0003, 0x0002,
+            0, 0)))
+        port.flush()
+        # The receiver finishes sending at the old speed first
+        time.sleep(0.1)
+        port.baudrate = baud_rate
+    # Measurement period in ms, one measurement per solution, GPS time
+    port.write(ubx_message(UBX_CFG, UBX_CFG_RATE, struct.pack(
+        '<HHH', round(1000 / rate), 1, 1)))
+    port.flush()
+    return baud_rate
+
+
+def line_times(lines):
+    """Returns the recording time of every line in seconds from the
+    first epoch, from the UTC time of the RMC and GGA sentences. Lines
+    without a time belong to the epoch before them."""
+    times = []
+    first = previous = None
+    day = 0
+    for line in lines:
+        fields = line.split(b',', 2)
+        if (len(fields) > 2 and fields[0][-3:] in (b'RMC', b'GGA')
+                and fields[1]):
+            try:
+                current = parse_time(fields[1].decode('ascii'))
+            except ValueError:
+                current = None
+            if current is not None:
+                if previous is not None and current < previous - 43200:
+                    # Past midnight
+                    day += 86400
+                previous = current
+                if first is None:
+                    first = current + day
+                times.append(current + day - first)
+                continue
+        times.append(times[-1] if times else 0.0)
+    return times
+
+
+class ReplayPort:
+    """
+    Stands in for the serial port of the receiver, replaying a recorded
+    NMEA stream, such as one saved by RecordingPort.
+
+    The sentences of every epoch become available at once, when their
+    recorded UTC time comes up.
+
+    Args:
+        path (str): Recorded NMEA sentences.
+        speed (float): 1 replays in real time, 10 ten times faster,
+          None makes everything available at once.
+        timeout (float): Seconds read() waits for data, like the timeout
+          of serial.Serial.
+    """
+
+    def __init__(self, path, speed=None, timeout=0.05):
+        with open(path, 'rb') as f:
+            self.data = f.read()
+        lines = self.data.splitlines(keepends=True)
+        self.line_ends = list(itertools.accumulate(map(len, lines)))
+        self.line_times = line_times(lines)
+        self.speed = speed
+        self.timeout = timeout
+        self.position = 0
+        self.started = time.monotonic()
+        self.baudrate = None
+
+    def elapsed(self):
+        """Returns the recording time replayed so far in seconds."""
+        return (time.monotonic() - self.started) * self.speed
+
+    def available_end(self):
+        if self.speed is None:
+            return len(self.data)
+        lines = bisect.bisect_right(self.line_times, self.elapsed())
+        return self.line_ends[lines - 1] if lines else 0
+
+    @property
+    def in_waiting(self):
+        return max(self.available_end() - self.position, 0)
+
+    def finished(self):
+        return self.position >= len(self.data)
+
+    def read(self, size=1):
+        deadline = time.monotonic() + self.timeout
+        while self.in_waiting == 0:
+            remaining = deadline - time.monotonic()
+            if self.finished() or remaining <= 0:
+                if remaining > 0:
+                    time.sleep(remaining)
+                return b''
+            # Sleeps until the next epoch is due
+            next_line = bisect.bisect_right(self.line_times, self.elapsed())
+            due = ((self.line_times[next_line] - self.elapsed())
+                   / self.speed)
+            time.sleep(min(remaining, max(due, 0)))
+        end = min(self.position + size, self.available_end())
+        chunk = self.data[self.position:end]
+        self.position = end
+        return chunk
+
+    def write(self, data):
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class RecordingPort:
+    """
+    Saves everything read from a serial port to a file, so the drive
+    can be replayed with ReplayPort.
+
+    Args:
+        port (serial.Serial): Port of the receiver.
+        path (str): File the NMEA stream is written to.
+    """
+
+    def __init__(self, port, path):
+        self.port = port
+        self.file = open(path, 'wb')
+
+    @property
+    def in_waiting(self):
+        return self.port.in_waiting
+
+    def read(self, size=1):
+        chunk = self.port.read(size)
+        if chunk:
+            self.file.write(chunk)
+        return chunk
+
+    def __getattr__(self, name):
+        return getattr(self.port, name)
+
+    def close(self):
+        self.file.close()
+        self.port.close()
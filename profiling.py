@@ -0,0 +1,285 @@
+"""Stage timing and run manifests for the processing pipeline.
+
+Code marks its stages with ``with stage('merge'):`` and reports
+measurements with observe() and record(). Both do nothing unless a
+RunProfile is active, so instrumented code runs at full speed when
+profiling is off. An active profile collects for every stage its wall
+time, CPU time and how much it raised the memory of the process, and
+writes them with the observed metrics to a JSON run manifest. cProfile
+or tracemalloc can capture more detail at a higher cost.
+
+Stages nest, a stage opened inside another one is named 'outer/inner',
+and repeated stages add up their times.
+"""
+import contextlib
+import cProfile
+import json
+import os
+import platform
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+from datetime import datetime
+try:
+    import resource
+except ImportError:
+    resource = None
+
+PROFILE_CAPTURES = [None, 'cprofile', 'tracemalloc']
+TOP_ENTRIES = 20                # functions and allocation sites kept
+
+_active = None
+_null_stage = contextlib.nullcontext()
+
+
+def peak_rss():
+    """Returns the peak resident memory of the process in bytes,
+    None where the resource module is missing."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux counts kilobytes, macOS bytes
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def current_rss():
+    """Returns the resident memory of the process in bytes, None where
+    /proc is missing."""
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def increase(before, after):
+    """Returns after - before, None if either is unknown."""
+    if before is None or after is None:
+        return None
+    return after - before
+
+
+def stage(name):
+    """Returns a context manager timing a stage of the active profile."""
+    if _active is None:
+        return _null_stage
+    return _active.stage(name)
+
+
+def observe(name, value):
+    """Adds a measurement, such as a latency, to the active profile."""
+    if _active is not None:
+        _active.observe(name, value)
+
+
+def record(name, value):
+    """Sets a value, such as a sample rate, of the active profile."""
+    if _active is not None:
+        _active.values[name] = value
+
+
+def active():
+    """Returns the active RunProfile, None if profiling is off."""
+    return _active
+
+
+class RunProfile:
+    """
+    Collects the measurements of one run while it is active.
+
+    Args:
+        capture (str): None times the stages only, 'cprofile' also
+          profiles every function call and 'tracemalloc' traces the
+          peak Python memory of every stage and the allocation sites.
+        details (dict): Description of the run, such as its arguments,
+          copied into the manifest.
+    """
+
+    def __init__(self, capture=None, details=None):
+        if capture not in PROFILE_CAPTURES:
+            raise ValueError(f'Unknown profile capture {capture!r}.')
+        self.capture = capture
+        self.details = dict(details or {})
+        self.stages = {}
+        self.metrics = {}
+        self.values = {}
+        self.allocations = None
+        self.status = None
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.profiler = None
+        self.started = None
+        self.start_wall = self.start_cpu = None
+        self.wall = self.cpu = None
+        self.previous = None
+
+    def __enter__(self):
+        global _active
+        self.previous = _active
+        _active = self
+        self.started = datetime.now().isoformat(timespec='seconds')
+        if self.capture == 'tracemalloc' and not tracemalloc.is_tracing():
+            tracemalloc.start()
+        if self.capture == 'cprofile':
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+        self.start_wall = time.perf_counter()
+        self.start_cpu = time.process_time()
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        global _active
+        self.wall = time.perf_counter() - self.start_wall
+        self.cpu = time.process_time() - self.start_cpu
+        if self.profiler is not None:
+            self.profiler.disable()
+        if self.status is None:
+            self.status = 'ok' if exc_type is None else 'failed'
+        if self.capture == 'tracemalloc':
+            snapshot = tracemalloc.take_snapshot()
+            tracemalloc.stop()
+            self.allocations = [
+                {'site': str(entry.traceback), 'size': entry.size,
+                 'count': entry.count}
+                for entry in snapshot.statistics('lineno')[:TOP_ENTRIES]]
+        _active = self.previous
+        return False
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        """Times the code of a stage, nested in the open stage of the
+        calling thread."""
+        parents = getattr(self.local, 'stages', None)
+        if parents is None:
+            parents = self.local.stages = []
+        path = '/'.join([parent[0] for parent in parents] + [name])
+        tracing = self.capture == 'tracemalloc'
+        # Name and the highest traced peak of the stage before its open
+        # inner stage, and of its finished inner stages. Peaks are
+        # traced sizes, the increase is only taken when a stage ends.
+        frame = [name, 0]
+        if tracing:
+            traced_before, traced_peak = tracemalloc.get_traced_memory()
+            if parents:
+                # The reset below would lose the peak of the enclosing stage
+                parents[-1][1] = max(parents[-1][1], traced_peak)
+        parents.append(frame)
+        with self.lock:
+            # Stages are listed in the order they start
+            self.stages.setdefault(path, {'calls': 0, 'wall': 0.0,
+                                          'cpu': 0.0})
+        if tracing:
+            tracemalloc.reset_peak()
+        rss_before = current_rss()
+        peak_before = peak_rss()
+        start_wall = time.perf_counter()
+        start_cpu = time.process_time()
+        try:
+            yield
+        finally:
+            wall = time.perf_counter() - start_wall
+            cpu = time.process_time() - start_cpu
+            # Other threads share the process memory, so stages that
+            # overlap them are attributed some of theirs
+            rss = increase(rss_before, current_rss())
+            peak = increase(peak_before, peak_rss())
+            parents.pop()
+            if tracing:
+                traced_peak = max(tracemalloc.get_traced_memory()[1],
+                                  frame[1])
+                if parents:
+                    parents[-1][1] = max(parents[-1][1], traced_peak)
+                # Later code of the enclosing stage starts a new peak
+                tracemalloc.reset_peak()
+            with self.lock:
+                entry = self.stages[path]
+                entry['calls'] += 1
+                entry['wall'] += wall
+                entry['cpu'] += cpu
+                # The largest increase of all calls
+                for key, value in (('rss_increase', rss),
+                                   ('peak_rss_increase', peak)):
+                    if value is not None:
+                        entry[key] = max(entry.get(key, value), value)
+                if tracing:
+                    entry['peak_traced'] = max(entry.get('peak_traced', 0),
+                                               traced_peak - traced_before)
+
+    def observe(self, name, value):
+        """Adds a measurement to the count, total, minimum and maximum
+        of the metric name."""
+        with self.lock:
+            metric = self.metrics.get(name)
+            if metric is None:
+                self.metrics[name] = {'count': 1, 'total': value,
+                                      'min': value, 'max': value}
+                return
+            metric['count'] += 1
+            metric['total'] += value
+            metric['min'] = min(metric['min'], value)
+            metric['max'] = max(metric['max'], value)
+
+    def manifest(self):
+        """
+        Returns the collected measurements.
+
+        Returns:
+            dict: Run details, totals and the peak memory of the
+              process in bytes, stages with their calls, wall and CPU
+              time in seconds and the largest increase of the resident
+              memory and of its peak over a call in bytes, metrics with
+              their mean, the recorded values and the largest
+              allocation sites if tracemalloc was used.
+        """
+        with self.lock:
+            stages = [dict(entry, name=path)
+                      for path, entry in self.stages.items()]
+            metrics = {name: dict(metric, mean=metric['total']
+                                  / metric['count'])
+                       for name, metric in self.metrics.items()}
+            values = dict(self.values)
+        manifest = {'started': self.started, 'status': self.status,
+                    'capture': self.capture,
+                    'python': platform.python_version(),
+                    'platform': platform.platform(),
+                    'details': self.details, 'wall': self.wall,
+                    'cpu': self.cpu, 'peak_rss': peak_rss(),
+                    'stages': stages, 'metrics': metrics, 'values': values}
+        if self.allocations is not None:
+            manifest['allocations'] = self.allocations
+        return manifest
+
+    def write(self, path):
+        """
+        Writes the manifest as JSON, and the cProfile statistics next to
+        it with the extension .prof when they were captured.
+
+        Args:
+            path (str): Path of the JSON manifest.
+
+        Returns:
+            str: Path of the manifest.
+        """
+        manifest = self.manifest()
+        if self.profiler is not None:
+            profile_path = os.path.splitext(path)[0] + '.prof'
+            self.profiler.dump_stats(profile_path)
+            manifest['cprofile'] = profile_path
+            manifest['functions'] = top_functions(self.profiler)
+        with open(path, 'w') as f:
+            json.dump(manifest, f, indent=2, default=str)
+            f.write('\n')
+        return path
+
+
+def top_functions(profiler, count=TOP_ENTRIES):
+    """Returns the functions with the highest cumulative time."""
+    statistics = pstats.Stats(profiler).stats
+    rows = sorted(statistics.items(), key=lambda item: item[1][3],
+                  reverse=True)[:count]
+    return [{'function': f'{file}:{line}({name})', 'calls': calls,
+             'total': total, 'cumulative': cumulative}
+            for (file, line, name), (_, calls, total, cumulative, _)
+            in rows]
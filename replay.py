@@ -0,0 +1,202 @@
+"""Replays recorded drives through the live acquisition loop of app.py.
+
+The NMEA stream of a drive, saved with app.RECORD_NMEA, stands in for
+the GPS and an accelerometer log of the same drive for the MPU6050.
+Both are replayed in real time, faster or as fast as the app takes
+them, so the sampling, writing and live analysis of app.main can be
+load tested without a Raspberry Pi, a car or any sensor.
+
+    python replay.py gps_data_<timestamp>.nmea accel_data_<timestamp>.csv
+        --speed 10 --accel-rate 500
+
+The logs, run manifest and report are written to the output folder.
+"""
+import argparse
+import contextlib
+import glob
+import json
+import os
+import sys
+import time
+import numpy as np
+import app
+from func import read_data_file, time_keys
+from nmea import ReplayPort
+
+OUTPUT_FOLDER = "./replay"
+REPLAY_SPEED = 1.0              # 1 real time, None as fast as possible
+DATA_SUBFOLDER = "data"         # logs of the replay once it is reported
+RESULTS_SUBFOLDER = "results"   # run manifest and report
+
+
+class ReplayAccelerometer:
+    """
+    Stands in for the MPU6050, returning the samples of a recorded
+    accelerometer log.
+
+    A replay in time starts with the first read and returns the sample
+    that was recorded at the same time from there, so the app can sample
+    at any rate. As fast as possible the samples are returned one after
+    another, starting over at the end of the log.
+
+    Args:
+        path (str): CSV or binary accelerometer log.
+        speed (float): 1 replays in real time, 10 ten times faster,
+          None as fast as possible.
+    """
+
+    def __init__(self, path, speed=REPLAY_SPEED):
+        data = read_data_file(path)
+        if data is None:
+            raise ValueError(f'{path} has no accelerometer samples.')
+        self.samples = data[['x', 'y', 'z']].to_numpy(dtype=float)
+        times = time_keys(data['time'])
+        self.times = times - times[0]
+        self.speed = speed
+        self.started = None
+        self.next = 0
+        self.reads = 0
+
+    def __call__(self):
+        self.reads += 1
+        if self.speed is None:
+            sample = self.samples[self.next]
+            self.next = (self.next + 1) % len(self.samples)
+        else:
+            now = time.monotonic()
+            if self.started is None:
+                self.started = now
+            index = np.searchsorted(
+                self.times, (now - self.started) * self.speed, 'right') - 1
+            sample = self.samples[min(index, len(self.samples) - 1)]
+        return tuple(sample.tolist())
+
+
+def run_replay(nmea_path, accel_path, folder=OUTPUT_FOLDER,
+               speed=REPLAY_SPEED, accel_rate=None, live_analysis=None,
+               log_format=None, report=False, quiet=True):
+    """
+    Runs app.main on a recorded drive and measures how it kept up.
+
+    Args:
+        nmea_path (str): NMEA stream of the drive.
+        accel_path (str): Accelerometer log of the drive.
+        folder (str): Folder the app is run from. The logs are written
+          to it and moved to DATA_SUBFOLDER by the report, the run
+          manifest and the report go to RESULTS_SUBFOLDER.
+        speed (float): Replay speed, see ReplayPort.
+        accel_rate (float): Sample rate of the drive, app.ACCEL_RATE if
+          not given. The app samples speed times faster, so the logs
+          get as many samples per fix as a drive in real time.
+        live_analysis (bool): app.LIVE_ANALYSIS if not given.
+        log_format (str): app.LOG_FORMAT if not given.
+        report (bool): Process the drive into a report at the end.
+        quiet (bool): Hide the output of the app.
+
+    Returns:
+        dict: Wall and CPU time of the replay, the share of one CPU core
+          it used and the run manifest of the app, None if the app
+          didn't write one.
+    """
+    nmea_path = os.path.abspath(nmea_path)
+    accel_path = os.path.abspath(accel_path)
+    for subfolder in (DATA_SUBFOLDER, RESULTS_SUBFOLDER):
+        os.makedirs(os.path.join(folder, subfolder), exist_ok=True)
+    if accel_rate is None:
+        accel_rate = app.ACCEL_RATE
+    if speed is not None:
+        # The app samples on the wall clock, the replay runs faster
+        accel_rate *= speed
+    settings = {'LIVE_ANALYSIS': live_analysis, 'LOG_FORMAT': log_format}
+    settings = {name: value for name, value in settings.items()
+                if value is not None}
+    # The report moves the logs, so they can't stay with the results
+    settings.update(ACCEL_RATE=accel_rate, PROFILE='timing',
+                    DATA_FOLDER=DATA_SUBFOLDER,
+                    DATA_RESULTS=RESULTS_SUBFOLDER)
+    saved = {name: getattr(app, name) for name in settings}
+    previous_folder = os.getcwd()
+    output = open(os.devnull, 'w') if quiet else sys.stdout
+    try:
+        for name, value in settings.items():
+            setattr(app, name, value)
+        os.chdir(folder)
+        port = ReplayPort(nmea_path, speed, app.GPS_READ_TIMEOUT)
+        accelerometer = ReplayAccelerometer(accel_path, speed)
+        start_wall = time.perf_counter()
+        start_cpu = time.process_time()
+        with contextlib.redirect_stdout(output):
+            app.main(port, accelerometer, report)
+        wall = time.perf_counter() - start_wall
+        cpu = time.process_time() - start_cpu
+        manifests = sorted(
+            glob.glob(os.path.join(RESULTS_SUBFOLDER, 'run_*.json')),
+            key=os.path.getmtime)
+        manifest = None
+        if manifests:
+            with open(manifests[-1]) as f:
+                manifest = json.load(f)
+    finally:
+        os.chdir(previous_folder)
+        for name, value in saved.items():
+            setattr(app, name, value)
+        if quiet:
+            output.close()
+    return {'wall': wall, 'cpu': cpu, 'cpu_load': cpu / wall,
+            'manifest': manifest}
+
+
+def summary(result):
+    """Formats the throughput and headroom of a replay."""
+    lines = [f'Wall time: {result["wall"]:.2f} s, CPU time: '
+             f'{result["cpu"]:.2f} s, '
+             f'{result["cpu_load"]:.0%} of one core used']
+    manifest = result['manifest'] or {}
+    values = manifest.get('values', {})
+    accelerometer = values.get('accelerometer')
+    if accelerometer is not None:
+        lines.append(f'Accelerometer: {accelerometer["samples"]} samples '
+                     f'at {accelerometer["rate"]:.1f} Hz, '
+                     f'{accelerometer["dropped"]} dropped, '
+                     f'{accelerometer["missed"]} missed')
+    gps = values.get('gps')
+    if gps is not None:
+        rate = values.get('gps_rate')
+        lines.append(f'GPS: {gps["fixes"]} fixes'
+                     + (f' at {rate:.1f} Hz' if rate else '')
+                     + f', {gps["dropped"]} dropped')
+    for name, metric in manifest.get('metrics', {}).items():
+        lines.append(f'{name}: mean {metric["mean"]:.4g}, '
+                     f'max {metric["max"]:.4g}')
+    return '\n'.join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Replay a recorded drive through the live'
+                    ' acquisition loop.')
+    parser.add_argument('nmea', help='NMEA stream saved by app.py')
+    parser.add_argument('accel', help='accelerometer log of the drive')
+    parser.add_argument('--output-folder', default=OUTPUT_FOLDER)
+    parser.add_argument('--speed', type=float, default=REPLAY_SPEED,
+                        help='1 is real time, 0 as fast as possible')
+    parser.add_argument('--accel-rate', type=float, default=None)
+    parser.add_argument('--no-live', action='store_true',
+                        help='turn off the live road analysis')
+    parser.add_argument('--log-format', choices=['csv', 'binary'],
+                        default=None)
+    parser.add_argument('--report', action='store_true',
+                        help='process the drive into a report at the end')
+    parser.add_argument('--verbose', action='store_true',
+                        help='show the output of the app')
+    args = parser.parse_args(argv)
+    result = run_replay(args.nmea, args.accel, args.output_folder,
+                        args.speed or None, args.accel_rate,
+                        False if args.no_live else None, args.log_format,
+                        args.report, not args.verbose)
+    print(summary(result))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
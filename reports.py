@@ -0,0 +1,371 @@
+"""Road quality reports of one drive and exports of many drives.
+
+Every processed drive leaves two small CSV tables next to its report,
+segments_<timestamp>.csv with one row per 100 m segment and
+drive_<timestamp>.csv with the summary of the drive. ReportWriter
+streams these tables of any number of drives into one workbook with a
+Drives and a Segments sheet, with CSV and Parquet copies alongside.
+Workbooks are written in openpyxl's write-only mode, which writes every
+row out as it is added, and Parquet files get a row group per drive,
+so a month of fleet data is exported in one pass without holding the
+workbooks or tables in memory.
+
+    python reports.py ./results --from 2024_05 --to 2024_06 --name may
+
+Parquet files are written only where pyarrow is installed.
+"""
+import argparse
+import csv
+import glob
+import os
+import sys
+from datetime import datetime
+import openpyxl
+from openpyxl.utils import get_column_letter
+from func import calculate_road_rating, rating_color, step_distances
+
+SEGMENT_COLUMNS = ['segment', 'start_latitude', 'start_longitude',
+                   'end_latitude', 'end_longitude', 'distance_m', 'bumps',
+                   'z_std', 'color']
+SEGMENT_TYPES = [int, float, float, float, float, float, int, float, str]
+DRIVE_COLUMNS = ['timestamp', 'duration_s', 'distance_km', 'bumps',
+                 'big_bumps', 'medium_bumps', 'small_bumps', 'rating']
+DRIVE_TYPES = [str, float, float, int, int, int, int, str]
+EXPORT_TABLES = {'drives': (DRIVE_COLUMNS, DRIVE_TYPES),
+                 'segments': (['timestamp'] + SEGMENT_COLUMNS,
+                              [str] + SEGMENT_TYPES)}
+EXPORT_FORMATS = ['xlsx', 'csv']    # 'parquet' needs pyarrow
+COLUMN_WIDTH = 20                   # characters
+SEGMENTS_PREFIX = 'segments_'
+DRIVE_PREFIX = 'drive_'
+REPORT_PREFIX = 'report_'
+
+
+def segment_rows(segments, z_stds, bump_counts):
+    """
+    Yields the row of every segment of a drive.
+
+    Args:
+        segments (list): Coordinates of every segment.
+        z_stds (list): Standard deviation of z in every segment.
+        bump_counts (list): Number of bumps in every segment.
+
+    Yields:
+        list: Number, start and end coordinates, length in meters,
+          bumps, z deviation and colour of a segment, see
+          SEGMENT_COLUMNS.
+    """
+    for number, (segment, z_std, bump_count) in enumerate(
+            zip(segments, z_stds, bump_counts)):
+        yield segment_row(number, segment, z_std, bump_count)
+
+
+def segment_row(number, segment, z_std, bump_count):
+    """Returns the row of one segment, see segment_rows."""
+    (start_latitude, start_longitude), (end_latitude, end_longitude) = (
+        segment[0], segment[-1])
+    return [number, float(start_latitude), float(start_longitude),
+            float(end_latitude), float(end_longitude),
+            round(float(step_distances(segment).sum()), 2), int(bump_count),
+            float(z_std), rating_color(bump_count, z_std)]
+
+
+def drive_row(timestamp, duration, distance, bumps):
+    """
+    Returns the summary row of a drive, see DRIVE_COLUMNS.
+
+    Args:
+        timestamp (str): Timestamp of the drive.
+        duration (datetime.timedelta): Duration of the drive.
+        distance (str): Length of the drive in kilometers.
+        bumps (tuple): All, big, medium and small bumps.
+    """
+    return ([timestamp, duration.total_seconds(), float(distance)]
+            + [int(count) for count in bumps]
+            + [calculate_road_rating(duration, distance, bumps[0])])
+
+
+def table_path(folder, prefix, timestamp):
+    return os.path.join(folder, f'{prefix}{timestamp}.csv')
+
+
+def write_table(path, columns, rows):
+    """Writes a CSV table under a temporary name first, so an
+    interrupted run never leaves half of it, and returns its path."""
+    temporary_path = path + '.part'
+    with open(temporary_path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(columns)
+        writer.writerows(rows)
+    os.replace(temporary_path, path)
+    return path
+
+
+def read_table(path, types):
+    """Yields the rows of a CSV table converted to types, one at
+    a time."""
+    with open(path, newline='') as f:
+        reader = csv.reader(f)
+        next(reader, None)
+        for row in reader:
+            yield [convert(value) for convert, value in zip(types, row)]
+
+
+def write_segment_table(rows, folder, timestamp):
+    """Writes the segment rows of a drive to segments_<timestamp>.csv."""
+    return write_table(table_path(folder, SEGMENTS_PREFIX, timestamp),
+                       SEGMENT_COLUMNS, rows)
+
+
+def read_segment_table(folder, timestamp):
+    """Yields the segment rows of a drive, nothing if the drive has no
+    segment table."""
+    path = table_path(folder, SEGMENTS_PREFIX, timestamp)
+    if os.path.isfile(path):
+        yield from read_table(path, SEGMENT_TYPES)
+
+
+def write_drive_table(folder, timestamp, duration, distance, bumps):
+    """Writes the summary of a drive to drive_<timestamp>.csv."""
+    return write_table(table_path(folder, DRIVE_PREFIX, timestamp),
+                       DRIVE_COLUMNS,
+                       [drive_row(timestamp, duration, distance, bumps)])
+
+
+def find_drives(folder, start=None, end=None):
+    """
+    Finds the drives with a summary table in a folder.
+
+    Args:
+        folder (str): Folder of the processed drives.
+        start (str): First timestamp or timestamp prefix, such as
+          '2024_05', from the first drive if not given.
+        end (str): Timestamp the drives end before, to the last drive
+          if not given.
+
+    Returns:
+        list: Sorted timestamps of the drives.
+    """
+    pattern = os.path.join(folder, f'{DRIVE_PREFIX}*.csv')
+    timestamps = sorted(os.path.basename(path)[len(DRIVE_PREFIX):-4]
+                        for path in glob.glob(pattern))
+    return [timestamp for timestamp in timestamps
+            if (start is None or timestamp >= start)
+            and (end is None or timestamp < end)]
+
+
+class ReportWriter:
+    """
+    Writes the summaries and segments of many drives in one pass.
+
+    Drives are added one at a time and their rows written out at once:
+    the workbook in write-only mode, the CSV files row by row and the
+    Parquet files in one row group per drive. Everything is written
+    under temporary names and renamed by close(), so an interrupted
+    export never leaves files that look finished.
+
+    Args:
+        folder (str): Folder the files are written to, created if
+          missing.
+        name (str): Name of the export, the files are called
+          report_<name>.xlsx, report_<name>_drives.csv and so on.
+        formats (list): Any of 'xlsx', 'csv' and 'parquet'.
+    """
+
+    def __init__(self, folder, name, formats=EXPORT_FORMATS):
+        os.makedirs(folder, exist_ok=True)
+        self.drives = 0
+        self.segments = 0
+        self.paths = {}
+        self.sheets = {}
+        self.csv_files = {}
+        self.csv_writers = {}
+        self.parquet_writers = {}
+        self.workbook = self.pyarrow = None
+        base_path = os.path.join(folder, f'{REPORT_PREFIX}{name}')
+        if 'parquet' in formats:
+            try:
+                import pyarrow
+                import pyarrow.parquet
+                self.pyarrow = pyarrow
+            except ImportError:
+                print('Skipping the Parquet export, pyarrow is not'
+                      ' installed.')
+        if 'xlsx' in formats:
+            self.paths['xlsx'] = base_path + '.xlsx'
+            self.workbook = openpyxl.Workbook(write_only=True)
+        for table, (columns, _) in EXPORT_TABLES.items():
+            if self.workbook is not None:
+                sheet = self.workbook.create_sheet(table.capitalize())
+                for column in range(1, len(columns) + 1):
+                    sheet.column_dimensions[
+                        get_column_letter(column)].width = COLUMN_WIDTH
+                sheet.append(columns)
+                self.sheets[table] = sheet
+            if 'csv' in formats:
+                path = self.paths[f'{table}_csv'] = f'{base_path}_{table}.csv'
+                self.csv_files[table] = open(path + '.part', 'w', newline='')
+                self.csv_writers[table] = csv.writer(self.csv_files[table])
+                self.csv_writers[table].writerow(columns)
+            if self.pyarrow is not None:
+                self.paths[f'{table}_parquet'] = (
+                    f'{base_path}_{table}.parquet')
+
+    def add_drive(self, summary, segments=()):
+        """
+        Writes one drive.
+
+        Args:
+            summary (list): Summary row of the drive, see drive_row.
+            segments (iterable): Segment rows of the drive, see
+              segment_rows, read one at a time.
+        """
+        timestamp = summary[0]
+        segment_rows = []
+        for row in segments:
+            row = [timestamp] + list(row)
+            self.write_row('segments', row)
+            if self.pyarrow is not None:
+                segment_rows.append(row)
+            self.segments += 1
+        self.write_row('drives', list(summary))
+        if self.pyarrow is not None:
+            if segment_rows:
+                self.write_parquet('segments', segment_rows)
+            self.write_parquet('drives', [list(summary)])
+        self.drives += 1
+
+    def write_row(self, table, row):
+        if table in self.sheets:
+            self.sheets[table].append(row)
+        if table in self.csv_writers:
+            self.csv_writers[table].writerow(row)
+
+    def write_parquet(self, table, rows):
+        """Writes the rows of one drive as a row group."""
+        pa = self.pyarrow
+        columns, types = EXPORT_TABLES[table]
+        arrow_types = {str: pa.string(), int: pa.int64(),
+                       float: pa.float64()}
+        schema = pa.schema([(column, arrow_types[kind])
+                            for column, kind in zip(columns, types)])
+        batch = pa.Table.from_arrays(
+            [pa.array(list(values), type=field.type)
+             for values, field in zip(zip(*rows), schema)], schema=schema)
+        writer = self.parquet_writers.get(table)
+        if writer is None:
+            writer = pa.parquet.ParquetWriter(
+                self.paths[f'{table}_parquet'] + '.part', schema)
+            self.parquet_writers[table] = writer
+        writer.write_table(batch)
+
+    def close(self, keep=True):
+        """
+        Finishes the files and gives them their names.
+
+        Args:
+            keep (bool): Remove the unfinished files instead.
+
+        Returns:
+            dict: Path of every written file.
+        """
+        if self.workbook is not None:
+            # Saving also removes the temporary files of the sheets
+            self.workbook.save(self.paths['xlsx'] + '.part')
+            self.workbook = None
+        for f in self.csv_files.values():
+            f.close()
+        for writer in self.parquet_writers.values():
+            writer.close()
+        self.csv_files, self.csv_writers, self.parquet_writers = {}, {}, {}
+        for path in self.paths.values():
+            if not os.path.exists(path + '.part'):
+                continue
+            if keep:
+                os.replace(path + '.part', path)
+            else:
+                os.remove(path + '.part')
+        return self.files()
+
+    def files(self):
+        """Returns the path of every file the export has written."""
+        return {kind: path for kind, path in self.paths.items()
+                if os.path.isfile(path)}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close(keep=exc_type is None)
+
+
+def export_drives(folder_results, output_folder=None, name=None,
+                  formats=EXPORT_FORMATS, timestamps=None, start=None,
+                  end=None):
+    """
+    Exports the summaries and segments of processed drives into one
+    workbook, CSV and Parquet files, reading one drive at a time.
+
+    Args:
+        folder_results (str): Folder of the processed drives.
+        output_folder (str): Folder of the export, folder_results if not
+          given.
+        name (str): Name of the export, the current time if not given.
+        formats (list): Any of 'xlsx', 'csv' and 'parquet'.
+        timestamps (list): Drives to export, the drives found between
+          start and end if not given.
+        start (str): See find_drives.
+        end (str): See find_drives.
+
+    Returns:
+        dict: Path of every written file, None if there are no drives.
+    """
+    if timestamps is None:
+        timestamps = find_drives(folder_results, start, end)
+    timestamps = [timestamp for timestamp in sorted(timestamps)
+                  if os.path.isfile(table_path(folder_results,
+                                               DRIVE_PREFIX, timestamp))]
+    if not timestamps:
+        print('No processed drives to export.')
+        return None
+    name = name or datetime.now().strftime("%Y_%m_%d_%H_%M_%S")
+    with ReportWriter(output_folder or folder_results, name,
+                      formats) as writer:
+        for timestamp in timestamps:
+            summary = next(read_table(
+                table_path(folder_results, DRIVE_PREFIX, timestamp),
+                DRIVE_TYPES))
+            writer.add_drive(summary,
+                             read_segment_table(folder_results, timestamp))
+    print(f'Exported {writer.drives} drives and {writer.segments}'
+          f' segments.')
+    return writer.files()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Export the road quality of processed drives.')
+    parser.add_argument('results_folder',
+                        help='folder of the processed drives')
+    parser.add_argument('--output-folder', default=None)
+    parser.add_argument('--name', default=None,
+                        help='the files are called report_<name>.*')
+    parser.add_argument('--from', dest='start', default=None,
+                        help='first timestamp, such as 2024_05')
+    parser.add_argument('--to', dest='end', default=None,
+                        help='timestamp the drives end before')
+    parser.add_argument('--formats', nargs='+', default=EXPORT_FORMATS,
+                        choices=['xlsx', 'csv', 'parquet'])
+    args = parser.parse_args(argv)
+    paths = export_drives(args.results_folder, args.output_folder,
+                          args.name, args.formats, start=args.start,
+                          end=args.end)
+    if paths is None:
+        return 1
+    for path in paths.values():
+        print(path)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
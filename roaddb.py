@@ -0,0 +1,421 @@
+"""Road quality of many drives in one SQLite database.
+
+Every processed drive adds its 100 m segments and bump locations.
+Segments and bumps are found through R-tree indexes on their bounding
+boxes, and the segments of all drives are merged into grid cells of
+CELL_SIZE degrees, so the road quality of a whole area is a query
+instead of reprocessing every recorded drive.
+"""
+import sqlite3
+import sys
+import numpy as np
+from clusters import BUMP_CLUSTER_RADIUS, cluster_bumps
+from func import EARTH_RADIUS_METERS, haversine_distances, rating_color
+
+CELL_SIZE = 0.001               # degrees, about 110 m of latitude
+BUSY_TIMEOUT = 30               # seconds to wait for another writer
+MIN_CONFIDENCE = 0.5            # bump entities drawn on the fleet map
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS drives (
+    id INTEGER PRIMARY KEY,
+    timestamp TEXT UNIQUE NOT NULL,
+    duration REAL,
+    distance REAL,
+    bumps INTEGER
+);
+CREATE TABLE IF NOT EXISTS segments (
+    id INTEGER PRIMARY KEY,
+    drive_id INTEGER NOT NULL REFERENCES drives(id),
+    cell_row INTEGER NOT NULL,
+    cell_col INTEGER NOT NULL,
+    bump_count INTEGER NOT NULL,
+    z_std REAL NOT NULL,
+    color TEXT NOT NULL,
+    coords BLOB NOT NULL
+);
+CREATE INDEX IF NOT EXISTS segments_drive ON segments(drive_id);
+CREATE TABLE IF NOT EXISTS bumps (
+    id INTEGER PRIMARY KEY,
+    drive_id INTEGER NOT NULL REFERENCES drives(id),
+    latitude REAL NOT NULL,
+    longitude REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS bumps_drive ON bumps(drive_id);
+CREATE TABLE IF NOT EXISTS cells (
+    cell_row INTEGER NOT NULL,
+    cell_col INTEGER NOT NULL,
+    passes INTEGER NOT NULL,
+    bumps INTEGER NOT NULL,
+    z_std_sum REAL NOT NULL,
+    PRIMARY KEY (cell_row, cell_col)
+) WITHOUT ROWID;
+"""
+
+INDEX_TABLES = ['segments_index', 'bumps_index']
+
+
+def create_index(connection, name):
+    """Creates a spatial index with the R-tree module, or a plain table
+    with the same columns where SQLite is built without it."""
+    columns = 'id, min_lat, max_lat, min_lon, max_lon'
+    try:
+        connection.execute(f'CREATE VIRTUAL TABLE IF NOT EXISTS {name}'
+                           f' USING rtree({columns})')
+    except sqlite3.OperationalError:
+        connection.execute(f'CREATE TABLE IF NOT EXISTS {name} ('
+                           'id INTEGER PRIMARY KEY, min_lat REAL,'
+                           ' max_lat REAL, min_lon REAL, max_lon REAL)')
+        connection.execute(f'CREATE INDEX IF NOT EXISTS {name}_lat'
+                           f' ON {name}(min_lat, max_lat)')
+
+
+def cell_of(latitude, longitude):
+    """Returns the (row, column) of the grid cell containing a point."""
+    return (int(np.floor(latitude / CELL_SIZE)),
+            int(np.floor(longitude / CELL_SIZE)))
+
+
+def cell_corner(row, col):
+    """Returns the south-west corner of a grid cell."""
+    return round(row * CELL_SIZE, 9), round(col * CELL_SIZE, 9)
+
+
+def box_around(point, radius):
+    """Returns the south-west and north-east corners of a box that
+    contains every point within radius meters of point."""
+    d_lat = np.degrees(radius / EARTH_RADIUS_METERS)
+    d_lon = d_lat / max(np.cos(np.radians(point[0])), 1e-6)
+    return ((point[0] - d_lat, point[1] - d_lon),
+            (point[0] + d_lat, point[1] + d_lon))
+
+
+def bounding_box(coords):
+    """Returns (min_lat, max_lat, min_lon, max_lon) of a segment."""
+    lat_min, lon_min = coords.min(axis=0).tolist()
+    lat_max, lon_max = coords.max(axis=0).tolist()
+    return lat_min, lat_max, lon_min, lon_max
+
+
+def as_segment(coords):
+    """Converts stored coordinates back to a list of GPS coordinates."""
+    return [tuple(point) for point in
+            np.frombuffer(coords, dtype=np.float64).reshape(-1, 2).tolist()]
+
+
+class RoadDatabase:
+    """
+    Road quality database of all processed drives.
+
+    Args:
+        path (str): Path of the SQLite file, created if it doesn't exist.
+    """
+
+    def __init__(self, path):
+        self.connection = sqlite3.connect(path, timeout=BUSY_TIMEOUT)
+        # Batch workers can read while one of them writes
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        with self.connection:
+            self.connection.executescript(SCHEMA)
+            for name in INDEX_TABLES:
+                create_index(self.connection, name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self.connection.close()
+
+    def ingest_drive(self, timestamp, segments, z_stds, bump_counts,
+                     bump_coords, duration=None, distance=None, bumps=None):
+        """
+        Stores the results of one drive in a single transaction,
+        replacing the results of an earlier run with the same timestamp.
+
+        Args:
+            timestamp (str): Timestamp of the drive.
+            segments (list): List of segments, lists of GPS coordinates.
+            z_stds (list): Standard deviation of the z values of every
+              segment.
+            bump_counts (list): Number of bumps in every segment.
+            bump_coords (list): GPS coordinates of the detected bumps.
+            duration (datetime.timedelta): Duration of the drive.
+            distance (str): Distance of the drive in kilometers.
+            bumps (tuple): Bump statistics from bumps_statistics.
+
+        Returns:
+            int: Id of the drive in the database.
+        """
+        with self.connection as db:
+            self._remove_drive(timestamp)
+            drive_id = db.execute(
+                'INSERT INTO drives (timestamp, duration, distance, bumps)'
+                ' VALUES (?, ?, ?, ?)',
+                (timestamp,
+                 None if duration is None else duration.total_seconds(),
+                 None if distance is None else float(distance),
+                 None if bumps is None else bumps[0])).lastrowid
+            cells = {}
+            for segment, z_std, count in zip(segments, z_stds, bump_counts):
+                coords = np.asarray(segment, dtype=np.float64)
+                cell = cell_of(*coords[len(coords) // 2])
+                z_std = float(z_std)
+                segment_id = db.execute(
+                    'INSERT INTO segments (drive_id, cell_row, cell_col,'
+                    ' bump_count, z_std, color, coords)'
+                    ' VALUES (?, ?, ?, ?, ?, ?, ?)',
+                    (drive_id, *cell, int(count), z_std,
+                     rating_color(count, z_std), coords.tobytes())).lastrowid
+                db.execute('INSERT INTO segments_index VALUES (?, ?, ?, ?, ?)',
+                           (segment_id, *bounding_box(coords)))
+                passes, cell_bumps, z_std_sum = cells.get(cell, (0, 0, 0.0))
+                cells[cell] = (passes + 1, cell_bumps + int(count),
+                               z_std_sum + z_std)
+            self._update_cells(cells, 1)
+            db.executemany(
+                'INSERT INTO bumps (drive_id, latitude, longitude)'
+                ' VALUES (?, ?, ?)',
+                [(drive_id, float(latitude), float(longitude))
+                 for latitude, longitude in bump_coords])
+            db.execute('INSERT INTO bumps_index SELECT id, latitude,'
+                       ' latitude, longitude, longitude FROM bumps'
+                       ' WHERE drive_id = ?', (drive_id,))
+        return drive_id
+
+    def _update_cells(self, cells, sign):
+        self.connection.executemany(
+            'INSERT INTO cells VALUES (?, ?, ?, ?, ?)'
+            ' ON CONFLICT (cell_row, cell_col) DO UPDATE SET'
+            ' passes = passes + excluded.passes,'
+            ' bumps = bumps + excluded.bumps,'
+            ' z_std_sum = z_std_sum + excluded.z_std_sum',
+            [(row, col, sign * passes, sign * bumps, sign * z_std_sum)
+             for (row, col), (passes, bumps, z_std_sum) in cells.items()])
+        self.connection.execute('DELETE FROM cells WHERE passes <= 0')
+
+    def _remove_drive(self, timestamp):
+        db = self.connection
+        row = db.execute('SELECT id FROM drives WHERE timestamp = ?',
+                         (timestamp,)).fetchone()
+        if row is None:
+            return
+        drive_id = row[0]
+        cells = {(cell_row, cell_col): (passes, bumps, z_std_sum)
+                 for cell_row, cell_col, passes, bumps, z_std_sum
+                 in db.execute(
+                     'SELECT cell_row, cell_col, COUNT(*), SUM(bump_count),'
+                     ' SUM(z_std) FROM segments WHERE drive_id = ?'
+                     ' GROUP BY cell_row, cell_col', (drive_id,))}
+        self._update_cells(cells, -1)
+        for table, index in [('segments', 'segments_index'),
+                             ('bumps', 'bumps_index')]:
+            db.execute(f'DELETE FROM {index} WHERE id IN'
+                       f' (SELECT id FROM {table} WHERE drive_id = ?)',
+                       (drive_id,))
+            db.execute(f'DELETE FROM {table} WHERE drive_id = ?',
+                       (drive_id,))
+        db.execute('DELETE FROM drives WHERE id = ?', (drive_id,))
+
+    def segments_in_box(self, south_west, north_east):
+        """
+        Finds the segments of all drives that overlap a box.
+
+        Args:
+            south_west (tuple): Smallest (latitude, longitude) of the box.
+            north_east (tuple): Largest (latitude, longitude) of the box.
+
+        Returns:
+            list: List of (timestamp, segment, color, bump_count) tuples.
+        """
+        rows = self.connection.execute(
+            'SELECT drives.timestamp, segments.coords, segments.color,'
+            ' segments.bump_count FROM segments_index'
+            ' JOIN segments ON segments.id = segments_index.id'
+            ' JOIN drives ON drives.id = segments.drive_id'
+            ' WHERE max_lat >= ? AND min_lat <= ?'
+            ' AND max_lon >= ? AND min_lon <= ?',
+            (south_west[0], north_east[0], south_west[1], north_east[1]))
+        return [(timestamp, as_segment(coords), color, bump_count)
+                for timestamp, coords, color, bump_count in rows]
+
+    def segments_near(self, point, radius):
+        """
+        Finds the segments that pass within radius meters of a point.
+
+        Args:
+            point (tuple): GPS coordinates (latitude, longitude).
+            radius (float): Distance in meters.
+
+        Returns:
+            list: List of (timestamp, segment, color, bump_count) tuples,
+              nearest first.
+        """
+        found = []
+        for result in self.segments_in_box(*box_around(point, radius)):
+            distance = haversine_distances(point, result[1]).min()
+            if distance <= radius:
+                found.append((distance, result))
+        found.sort(key=lambda item: item[0])
+        return [result for _, result in found]
+
+    def bumps_in_box(self, south_west, north_east):
+        """Returns the (latitude, longitude) of the bumps of all drives
+        inside a box."""
+        return self.connection.execute(
+            'SELECT bumps.latitude, bumps.longitude FROM bumps_index'
+            ' JOIN bumps ON bumps.id = bumps_index.id'
+            ' WHERE min_lat >= ? AND max_lat <= ?'
+            ' AND min_lon >= ? AND max_lon <= ?',
+            (south_west[0], north_east[0], south_west[1],
+             north_east[1])).fetchall()
+
+    def bump_entities(self, south_west=None, north_east=None,
+                      radius=BUMP_CLUSTER_RADIUS):
+        """
+        Merges the bumps of all drives into bump entities, see
+        cluster_bumps.
+
+        The confidence of an entity is the share of the drives over it
+        that detected it. A drive is over the entity when one of its
+        segments has a bounding box that reaches the entity.
+
+        Args:
+            south_west (tuple): Smallest (latitude, longitude) of the box.
+            north_east (tuple): Largest (latitude, longitude) of the box,
+              the bumps of all drives are merged if not given.
+            radius (float): Cluster radius in meters.
+
+        Returns:
+            DataFrame: Latitude, longitude, hits, passes, extent, drives
+              over the entity and confidence of every entity.
+        """
+        query = 'SELECT latitude, longitude, drive_id FROM bumps'
+        params = ()
+        if south_west is not None:
+            query += (' WHERE id IN (SELECT id FROM bumps_index'
+                      ' WHERE min_lat >= ? AND max_lat <= ?'
+                      ' AND min_lon >= ? AND max_lon <= ?)')
+            params = (south_west[0], north_east[0], south_west[1],
+                      north_east[1])
+        rows = np.array(self.connection.execute(query, params).fetchall(),
+                        dtype=np.float64).reshape(-1, 3)
+        _, entities = cluster_bumps(rows[:, :2], rows[:, 2], radius)
+        coverage = []
+        for latitude, longitude, extent in zip(
+                entities['latitude'], entities['longitude'],
+                entities['extent']):
+            (min_lat, min_lon), (max_lat, max_lon) = box_around(
+                (latitude, longitude), radius + extent)
+            coverage.append(self.connection.execute(
+                'SELECT COUNT(DISTINCT segments.drive_id)'
+                ' FROM segments_index'
+                ' JOIN segments ON segments.id = segments_index.id'
+                ' WHERE max_lat >= ? AND min_lat <= ?'
+                ' AND max_lon >= ? AND min_lon <= ?',
+                (min_lat, max_lat, min_lon, max_lon)).fetchone()[0])
+        entities['drives'] = np.maximum(coverage, entities['passes'])
+        entities['confidence'] = entities['passes'] / entities['drives']
+        return entities
+
+    def cells_in_box(self, south_west=None, north_east=None):
+        """
+        Returns the road quality of the grid cells inside a box,
+        merged over all drives.
+
+        Args:
+            south_west (tuple): Smallest (latitude, longitude) of the box.
+            north_east (tuple): Largest (latitude, longitude) of the box,
+              all cells are returned if the box is not given.
+
+        Returns:
+            list: List of (south_west, north_east, passes, bumps per pass,
+              color) tuples, one per cell.
+        """
+        query = ('SELECT cell_row, cell_col, passes, bumps, z_std_sum'
+                 ' FROM cells')
+        params = ()
+        if south_west is not None:
+            query += (' WHERE cell_row BETWEEN ? AND ?'
+                      ' AND cell_col BETWEEN ? AND ?')
+            (min_row, min_col), (max_row, max_col) = (cell_of(*south_west),
+                                                      cell_of(*north_east))
+            params = (min_row, max_row, min_col, max_col)
+        cells = []
+        for row, col, passes, bumps, z_std_sum in self.connection.execute(
+                query, params):
+            mean_bumps = bumps / passes
+            cells.append((cell_corner(row, col), cell_corner(row + 1, col + 1),
+                          passes, mean_bumps,
+                          rating_color(mean_bumps, z_std_sum / passes)))
+        return cells
+
+    def colored_segments(self):
+        """
+        Returns the points and colour of the segments of all drives,
+        oldest drive first.
+
+        Returns:
+            list: List of (points, color) tuples, points is an array of
+              (latitude, longitude) rows.
+        """
+        return [(np.frombuffer(coords, dtype=np.float64).reshape(-1, 2),
+                 color) for coords, color in self.connection.execute(
+                     'SELECT segments.coords, segments.color FROM segments'
+                     ' JOIN drives ON drives.id = segments.drive_id'
+                     ' ORDER BY drives.timestamp, segments.id')]
+
+    def drives(self):
+        """Returns the timestamps of the stored drives."""
+        return [timestamp for timestamp, in self.connection.execute(
+            'SELECT timestamp FROM drives ORDER BY timestamp')]
+
+
+def plot_fleet_map(database, map_path, south_west=None, north_east=None):
+    """
+    Draws the merged road quality of all drives as colored cells,
+    with the bumps detected on most drives over them.
+
+    Args:
+        database (str): Path of the road database.
+        map_path (str): Path of the HTML map to create.
+        south_west (tuple): Smallest (latitude, longitude) to draw.
+        north_east (tuple): Largest (latitude, longitude) to draw,
+          every cell is drawn if the box is not given.
+
+    Returns:
+        str: Path of the map, None if there are no cells to draw.
+    """
+    import folium
+
+    with RoadDatabase(database) as db:
+        cells = db.cells_in_box(south_west, north_east)
+        entities = db.bump_entities(south_west, north_east)
+    if not cells:
+        print('No road cells to draw.')
+        return None
+    center = np.mean([cell[0] for cell in cells], axis=0) + CELL_SIZE / 2
+    my_map = folium.Map(location=tuple(center.tolist()), zoom_start=14)
+    for cell_south_west, cell_north_east, passes, bumps, color in cells:
+        folium.Rectangle(
+            bounds=[cell_south_west, cell_north_east], color=color,
+            fill=True, fill_opacity=0.5, weight=1,
+            tooltip=f'{passes} passes, {bumps:.1f} bumps per pass'
+        ).add_to(my_map)
+    entities = entities[entities['confidence'] >= MIN_CONFIDENCE]
+    for latitude, longitude, hits, confidence in zip(
+            entities['latitude'], entities['longitude'], entities['hits'],
+            entities['confidence']):
+        folium.CircleMarker(
+            location=(latitude, longitude), radius=4, color='black',
+            fill=True, tooltip=f'{hits} hits, {confidence:.0%} of drives'
+        ).add_to(my_map)
+    my_map.save(map_path)
+    return map_path
+
+
+if __name__ == '__main__':
+    # Usage: python roaddb.py road_quality.db fleet_map.html
+    plot_fleet_map(sys.argv[1], sys.argv[2])
@@ -0,0 +1,203 @@
+"""Content-hashed cache of the results of processing stages.
+
+Every stage result is stored under a key that hashes the key of the
+data it was computed from together with the settings the stage uses.
+The keys of later stages are built on the keys of earlier ones, so
+changing a colour threshold only recomputes the map, the image and the
+report, while the read, merged and classified data are loaded from the
+cache. The data files themselves are keyed by their content, not by
+their name or modification time.
+
+Results are Python objects saved with pickle, such as merged DataFrames
+and bump masks, or files such as the HTML map and the report image.
+When the cache grows past its size limit the least recently used
+entries are removed.
+
+CACHE_VERSION is part of every key and has to be raised when the code
+of a stage changes what it computes.
+"""
+import hashlib
+import os
+import pickle
+import shutil
+import tempfile
+import pandas as pd
+
+CACHE_VERSION = 2
+CACHE_MAX_BYTES = 1024 ** 3     # 1 GB
+HASH_BUFFER = 1024 * 1024       # bytes hashed at once
+OBJECT_EXTENSION = '.pkl'
+
+
+def file_digest(path):
+    """Returns the BLAKE2 hash of the content of a file."""
+    digest = hashlib.blake2b(digest_size=20)
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(HASH_BUFFER), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def frame_digest(data):
+    """Returns a hash of the columns, types and values of a DataFrame."""
+    digest = hashlib.blake2b(digest_size=20)
+    digest.update(repr([(str(name), str(dtype)) for name, dtype
+                        in data.dtypes.items()]).encode('utf-8'))
+    digest.update(pd.util.hash_pandas_object(data, index=False)
+                  .to_numpy().tobytes())
+    return digest.hexdigest()
+
+
+def copy_into(path, file):
+    with open(path, 'rb') as source:
+        shutil.copyfileobj(source, file)
+
+
+def stage_key(stage, *parts):
+    """Returns the key of a stage result computed from parts, which are
+    upstream keys and settings with a stable repr()."""
+    digest = hashlib.blake2b(digest_size=20)
+    digest.update(repr((CACHE_VERSION, stage) + parts).encode('utf-8'))
+    return digest.hexdigest()
+
+
+class StageCache:
+    """
+    Folder of cached stage results with a size limit.
+
+    The keys of the stages computed or loaded during a run are kept in
+    keys, so the stages that follow can build their keys on them.
+
+    Args:
+        folder (str): Folder of the cache, created if missing.
+        max_bytes (int): Size the cache is kept under.
+    """
+
+    def __init__(self, folder, max_bytes=CACHE_MAX_BYTES):
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self.keys = {}
+        self.hits = {}
+        self.misses = {}
+        os.makedirs(folder, exist_ok=True)
+
+    def path(self, stage, key, extension=OBJECT_EXTENSION):
+        return os.path.join(self.folder, f'{stage}-{key}{extension}')
+
+    def cached(self, stage, key, compute):
+        """
+        Returns the cached result of a stage, or computes and stores it.
+
+        Args:
+            stage (str): Name of the stage.
+            key (str): Key of the result, from stage_key.
+            compute (callable): Computes the result if it isn't cached.
+
+        Returns:
+            Result of the stage.
+        """
+        self.keys[stage] = key
+        path = self.path(stage, key)
+        try:
+            with open(path, 'rb') as f:
+                value = pickle.load(f)
+            self.hit(stage, path)
+            return value
+        except FileNotFoundError:
+            pass
+        except (OSError, pickle.UnpicklingError, EOFError) as e:
+            print(f'Ignoring the damaged cache entry {path}: {e}')
+        self.misses[stage] = self.misses.get(stage, 0) + 1
+        value = compute()
+        self.store(path, lambda f: pickle.dump(
+            value, f, protocol=pickle.HIGHEST_PROTOCOL))
+        return value
+
+    def cached_file(self, stage, key, path, produce):
+        """
+        Copies a cached file of a stage to path, or produces and stores
+        it.
+
+        Args:
+            stage (str): Name of the stage.
+            key (str): Key of the file, from stage_key.
+            path (str): Where the file is needed.
+            produce (callable): Writes the file to path if it isn't
+              cached, its result is returned.
+
+        Returns:
+            The result of produce, path if the file was cached.
+        """
+        self.keys[stage] = key
+        entry = self.path(stage, key, os.path.splitext(path)[1])
+        try:
+            shutil.copyfile(entry, path)
+            self.hit(stage, entry)
+            return path
+        except FileNotFoundError:
+            pass
+        self.misses[stage] = self.misses.get(stage, 0) + 1
+        result = produce()
+        if os.path.isfile(path):
+            self.store(entry, lambda f: copy_into(path, f))
+        return result
+
+    def hit(self, stage, path):
+        self.hits[stage] = self.hits.get(stage, 0) + 1
+        # The modification time orders the entries for eviction
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+
+    def store(self, path, write):
+        """Writes an entry under a temporary name first, so a reader in
+        another process never sees half of it."""
+        temporary_path = None
+        try:
+            handle, temporary_path = tempfile.mkstemp(
+                dir=self.folder, prefix='.tmp-')
+            with os.fdopen(handle, 'wb') as f:
+                write(f)
+            os.replace(temporary_path, path)
+        except (OSError, pickle.PicklingError) as e:
+            print(f'Could not cache {os.path.basename(path)}: {e}')
+            if temporary_path and os.path.exists(temporary_path):
+                os.remove(temporary_path)
+            return
+        self.evict(keep=path)
+
+    def entries(self):
+        """Returns (modification time, size, path) of every entry."""
+        entries = []
+        for entry in os.scandir(self.folder):
+            if entry.is_file() and not entry.name.startswith('.tmp-'):
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        return entries
+
+    def size(self):
+        return sum(size for _, size, _ in self.entries())
+
+    def evict(self, keep=None):
+        """Removes the least recently used entries until the cache is
+        under its size limit."""
+        entries = sorted(self.entries())
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            if path == keep:
+                continue
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+    def statistics(self):
+        """Returns the hits and misses of every stage."""
+        return {'hits': dict(self.hits), 'misses': dict(self.misses)}
@@ -0,0 +1,593 @@
+import itertools
+import os
+import tempfile
+import folium
+import numpy as np
+import pandas as pd
+from binlog import is_log_file, read_log
+from func import (BUMP_DETECTOR, BUMP_SIZE_LIMITS, MAP_STYLE,
+                  SEGMENT_DISTANCE_THRESHOLD, SUMMARY_COLUMN,
+                  TIMESTAMP_FORMAT, MergedLines, bump_sizes,
+                  create_map_image, draw_image_bumps, draw_image_segment,
+                  get_segment_color, merge_nearest, rating_color,
+                  road_duration, save_map, save_map_image, simplify_line,
+                  step_distances, time_keys, z_deviation)
+from profiling import stage
+from reports import segment_row, write_segment_table
+from roaddb import RoadDatabase
+
+CHUNK_SIZE = 100_000                    # rows read at once
+SELECTION_LIMIT = 1_000_000             # values sorted in memory at once
+SELECTION_BINS = 1024
+SPOOL_COLUMNS = ['latitude', 'longitude', 'z', SUMMARY_COLUMN]
+DSP_SPOOL_COLUMNS = SPOOL_COLUMNS + ['x', 'y', 'speed']
+SEGMENT_RECORD = np.dtype([('points', np.int64), ('z_std', np.float64),
+                           ('bump_count', np.int64), ('bumps', np.int64)])
+
+
+def iter_file_chunks(file_path, chunk_size=CHUNK_SIZE):
+    """Reads a CSV or binary data file as DataFrames of chunk_size rows."""
+    if not is_log_file(file_path):
+        yield from pd.read_csv(file_path, delimiter=',', chunksize=chunk_size)
+        return
+    columns, records = read_log(file_path)
+    for start in range(0, len(records), chunk_size):
+        yield pd.DataFrame(records[start:start + chunk_size],
+                           columns=columns)
+
+
+def iter_time_chunks(file_path, chunk_size=CHUNK_SIZE):
+    """
+    Reads a data file in chunks that never split rows with the same time.
+
+    Samples are expected in the order they were recorded. A 'key' column
+    with seconds since the midnight before the first sample is added,
+    so the keys keep increasing when a drive goes past midnight.
+
+    Args:
+        file_path (str): Path of the CSV or binary data file.
+        chunk_size (int): Number of rows read at once.
+
+    Yields:
+        DataFrame: Consecutive rows of the file.
+    """
+    carry = None
+    last_key = None
+    for chunk in iter_file_chunks(file_path, chunk_size):
+        if len(chunk) == 0:
+            continue
+        chunk['key'] = time_keys(chunk['time'], last_key)
+        last_key = chunk['key'].iloc[-1]
+        if carry is not None:
+            chunk = pd.concat([carry, chunk], ignore_index=True)
+        # Rows sharing the last time may continue in the next chunk
+        tail = chunk['key'] == chunk['key'].iloc[-1]
+        carry = chunk[tail]
+        if not tail.all():
+            yield chunk[~tail]
+    if carry is not None:
+        yield carry
+
+
+def iter_merged_chunks(file_path_accel, file_path_gps,
+                       chunk_size=CHUNK_SIZE, tolerance=None):
+    """
+    Merges the data files chunk by chunk, giving the same rows
+    in the same order as merge_dataframes on the whole files.
+
+    Args:
+        file_path_accel (str): Path of the first data file.
+        file_path_gps (str): Path of the second data file.
+        chunk_size (int): Number of rows read at once.
+        tolerance (float): Seconds between a sample and its nearest
+          GPS fix, rows with equal times are joined if None.
+
+    Yields:
+        DataFrame: Consecutive rows of the merged data.
+    """
+    if tolerance is not None:
+        yield from iter_nearest_chunks(file_path_accel, file_path_gps,
+                                       chunk_size, tolerance)
+        return
+    gps_chunks = iter_time_chunks(file_path_gps, chunk_size)
+    pending = None
+    for accel_chunk in iter_time_chunks(file_path_accel, chunk_size):
+        last_key = accel_chunk['key'].iloc[-1]
+        # Read ahead until every row matching this chunk is pending
+        while (pending is None or len(pending) == 0
+               or pending['key'].iloc[-1] <= last_key):
+            gps_chunk = next(gps_chunks, None)
+            if gps_chunk is None:
+                break
+            pending = (gps_chunk if pending is None else
+                       pd.concat([pending, gps_chunk], ignore_index=True))
+        if pending is None:
+            return
+        window = pending['key'] <= last_key
+        merged = pd.merge(accel_chunk.drop(columns='key'),
+                          pending[window].drop(columns='key'), on='time')
+        pending = pending[~window]
+        if len(merged) > 0:
+            yield merged
+
+
+def iter_nearest_chunks(file_path_accel, file_path_gps, chunk_size,
+                        tolerance):
+    """
+    Interpolates the GPS positions at the accelerometer times chunk by
+    chunk, like merge_dataframes with a tolerance on the whole files.
+
+    Args:
+        file_path_accel (str): Path of the first data file.
+        file_path_gps (str): Path of the second data file.
+        chunk_size (int): Number of rows read at once.
+        tolerance (float): Seconds between a sample and its nearest fix.
+
+    Yields:
+        DataFrame: Consecutive rows of the merged data.
+    """
+    accel_chunks = iter_time_chunks(file_path_accel, chunk_size)
+    gps_chunks = iter_time_chunks(file_path_gps, chunk_size)
+    first_accel = next(accel_chunks, None)
+    pending = next(gps_chunks, None)
+    if first_accel is None or pending is None:
+        return
+    if 'latitude' in first_accel:
+        # Callers pass the files in either order
+        first_accel, pending = pending, first_accel
+        accel_chunks, gps_chunks = gps_chunks, accel_chunks
+    for accel_chunk in itertools.chain([first_accel], accel_chunks):
+        last_key = accel_chunk['key'].iloc[-1]
+        # Read ahead past every fix this chunk can be matched with
+        while pending['key'].iloc[-1] <= last_key + tolerance:
+            gps_chunk = next(gps_chunks, None)
+            if gps_chunk is None:
+                break
+            pending = pd.concat([pending, gps_chunk], ignore_index=True)
+        merged = merge_nearest(accel_chunk.drop(columns='key'), pending,
+                               accel_chunk['key'].to_numpy(),
+                               pending['key'].to_numpy(), tolerance)
+        # Later samples only need the fix before the tolerance window
+        keys = pending['key'].to_numpy()
+        start = max(np.searchsorted(keys, last_key - tolerance) - 1, 0)
+        pending = pending.iloc[start:].reset_index(drop=True)
+        if len(merged) > 0:
+            yield merged
+
+
+def spool_merged(file_path_accel, file_path_gps, spool_path,
+                 chunk_size=CHUNK_SIZE, tolerance=None,
+                 columns=SPOOL_COLUMNS):
+    """
+    Writes the merged coordinates and z values to a binary file
+    that can be read back with numpy.memmap.
+
+    Args:
+        file_path_accel (str): Path of the first data file.
+        file_path_gps (str): Path of the second data file.
+        spool_path (str): Path of the binary file to be created.
+        chunk_size (int): Number of rows read at once.
+        tolerance (float): Seconds between a sample and its nearest
+          GPS fix, rows with equal times are joined if None.
+        columns (list): Columns written for every row, starting with
+          SPOOL_COLUMNS. Columns missing from the data are written as NaN.
+
+    Returns:
+        tuple: Number of rows, first and last time, smallest and largest
+          (latitude, longitude) of the drive, None if there is no data.
+    """
+    num_rows = 0
+    first_time = last_time = None
+    south_west = np.full(2, np.inf)
+    north_east = np.full(2, -np.inf)
+    try:
+        with open(spool_path, 'wb') as spool:
+            for chunk in iter_merged_chunks(file_path_accel, file_path_gps,
+                                            chunk_size, tolerance):
+                values = chunk.reindex(columns=columns).to_numpy(
+                    dtype=np.float64)
+                values.tofile(spool)
+                south_west = np.minimum(south_west, values[:, :2].min(axis=0))
+                north_east = np.maximum(north_east, values[:, :2].max(axis=0))
+                if first_time is None:
+                    first_time = chunk['time'].iloc[0]
+                last_time = chunk['time'].iloc[-1]
+                num_rows += len(chunk)
+    except pd.errors.EmptyDataError:
+        return None
+    if num_rows == 0:
+        return None
+    return (num_rows, first_time, last_time,
+            tuple(south_west.tolist()), tuple(north_east.tolist()))
+
+
+def order_statistic(chunks, rank):
+    """
+    Finds the value at the given rank of the sorted data without
+    holding all of it in memory, by narrowing down a histogram bin.
+
+    Args:
+        chunks (callable): Returns a new iterator over the data chunks.
+        rank (int): Zero based position in the sorted data.
+
+    Returns:
+        float: The value at the rank.
+    """
+    lo, hi = np.inf, -np.inf
+    count = 0
+    for chunk in chunks():
+        if len(chunk) > 0:
+            lo = min(lo, chunk.min())
+            hi = max(hi, chunk.max())
+            count += len(chunk)
+    hi_open = False
+    below = 0       # number of values smaller than lo
+
+    def in_range(chunk):
+        upper = chunk < hi if hi_open else chunk <= hi
+        return chunk[(chunk >= lo) & upper]
+
+    while True:
+        if lo == hi or (hi_open and np.nextafter(lo, np.inf) >= hi):
+            return float(lo)
+        if count <= SELECTION_LIMIT:
+            values = np.sort(np.concatenate([in_range(chunk)
+                                             for chunk in chunks()]))
+            return float(values[rank - below])
+        edges = np.linspace(lo, hi, SELECTION_BINS + 1)
+        counts = np.zeros(SELECTION_BINS, dtype=np.int64)
+        for chunk in chunks():
+            bins = np.searchsorted(edges, in_range(chunk), side='right') - 1
+            bins = np.minimum(bins, SELECTION_BINS - 1)
+            counts += np.bincount(bins, minlength=SELECTION_BINS)
+        cumulative = np.cumsum(counts)
+        selected = int(np.searchsorted(cumulative, rank - below,
+                                       side='right'))
+        new_lo, new_hi = edges[selected], edges[selected + 1]
+        new_hi_open = hi_open if selected == SELECTION_BINS - 1 else True
+        if (new_lo, new_hi, new_hi_open) == (lo, hi, hi_open):
+            # The range is too narrow to split, step over lo instead
+            equal = sum(int(np.count_nonzero(chunk == lo))
+                        for chunk in chunks())
+            if rank - below < equal:
+                return float(lo)
+            below += equal
+            count -= equal
+            lo = np.nextafter(lo, np.inf)
+            continue
+        if selected > 0:
+            below += int(cumulative[selected - 1])
+        count = int(counts[selected])
+        lo, hi, hi_open = new_lo, new_hi, new_hi_open
+
+
+def streaming_percentile(chunks, num_values, q):
+    """
+    Calculates the same percentile as numpy.percentile with linear
+    interpolation, reading the data chunk by chunk.
+
+    Args:
+        chunks (callable): Returns a new iterator over the data chunks.
+        num_values (int): Total number of values.
+        q (float): Percentile between 0 and 100.
+
+    Returns:
+        float: The percentile of the data.
+    """
+    quantile = np.true_divide(q, 100)
+    virtual_index = (num_values - 1) * quantile
+    if virtual_index < 0:
+        previous_index = next_index = 0
+    elif virtual_index >= num_values - 1:
+        previous_index = next_index = num_values - 1
+    else:
+        previous_index = int(np.floor(virtual_index))
+        next_index = previous_index + 1
+    gamma = virtual_index - np.floor(virtual_index)
+    previous = order_statistic(chunks, previous_index)
+    if next_index == previous_index:
+        return previous
+    following = order_statistic(chunks, next_index)
+    difference = following - previous
+    if gamma >= 0.5:
+        return float(following - difference * (1 - gamma))
+    return float(previous + difference * gamma)
+
+
+def analyze_stream(spool, threshold, on_segment, chunk_size=CHUNK_SIZE,
+                   classify=None):
+    """
+    Splits the merged data into segments and classifies bumps chunk by
+    chunk, giving the same results as the in-memory functions.
+
+    Args:
+        spool (numpy.ndarray): Rows of SPOOL_COLUMNS, usually a memmap
+          of the file written by spool_merged.
+        threshold (float): Bump threshold, the 70th percentile of |z|.
+        on_segment (callable): Called for every finished segment with the
+          list of coordinates, list of z values, NaN for summary rows,
+          number of bumps and coordinates of the bumps that weren't in
+          the previous segment.
+        chunk_size (int): Number of rows processed at once.
+        classify (callable): Returns the bump sizes of the next chunk of
+          rows, such as a dsp.BumpPipeline. Bumps are found with
+          threshold if not given.
+
+    Returns:
+        tuple: Road distance in meters and bump statistics in the format
+          of bumps_statistics.
+    """
+    size_counts = np.zeros(len(BUMP_SIZE_LIMITS) + 1, dtype=np.int64)
+    parts = []              # rows of the unfinished segment
+    segment_start = 0.0     # position where the unfinished segment starts
+    position = 0.0
+    previous_point = None
+    first_segment = True
+
+    def finish_segment():
+        rows = np.concatenate([part[0] for part in parts])
+        sizes = np.concatenate([part[1] for part in parts])
+        segment = list(zip(rows[:, 0].tolist(), rows[:, 1].tolist()))
+        bumps = sizes > 0
+        new_bumps = bumps if first_segment else bumps[1:]
+        new_rows = rows if first_segment else rows[1:]
+        bump_coords = list(zip(new_rows[new_bumps, 0].tolist(),
+                               new_rows[new_bumps, 1].tolist()))
+        z_data = np.where(rows[:, 3] == 1, np.nan, rows[:, 2])
+        on_segment(segment, z_data.tolist(), int(bumps.sum()), bump_coords)
+
+    for start in range(0, len(spool), chunk_size):
+        rows = np.asarray(spool[start:start + chunk_size])
+        if classify is None:
+            sizes = bump_sizes(rows[:, 2], threshold)
+        else:
+            sizes = classify(rows)
+        # Summary rows stayed below the trigger of a captured window
+        sizes = np.where(rows[:, 3] == 1, 0, sizes)
+        size_counts += np.bincount(sizes, minlength=len(size_counts))
+
+        coords = rows[:, :2]
+        if previous_point is not None:
+            coords = np.vstack((previous_point, coords))
+        steps = step_distances(coords)
+        if previous_point is None:
+            positions = np.cumsum(np.concatenate(([position], steps)))
+        else:
+            positions = np.cumsum(np.concatenate(([position], steps)))[1:]
+        position = positions[-1]
+        previous_point = rows[-1, :2]
+
+        local_start = 0
+        while True:
+            end = int(np.searchsorted(
+                positions, segment_start + SEGMENT_DISTANCE_THRESHOLD,
+                side='left'))
+            if end >= len(rows):
+                parts.append((rows[local_start:], sizes[local_start:]))
+                break
+            parts.append((rows[local_start:end + 1],
+                          sizes[local_start:end + 1]))
+            finish_segment()
+            first_segment = False
+            parts = []
+            local_start = end
+            segment_start = positions[end]
+    if parts:
+        finish_segment()
+
+    small_bumps, medium_bumps, big_bumps = (int(c) for c in size_counts[1:])
+    all_bumps = small_bumps + medium_bumps + big_bumps
+    return position, (all_bumps, big_bumps, medium_bumps, small_bumps)
+
+
+def dsp_classifier(num_rows, first_time, last_time):
+    """
+    Builds the dsp bump detector for the rows of a DSP_SPOOL_COLUMNS
+    spool, like func.dsp_bump_sizes on the whole drive.
+
+    Args:
+        num_rows (int): Number of rows of the drive.
+        first_time (str): Time of the first row.
+        last_time (str): Time of the last row.
+
+    Returns:
+        callable: Returns the bump sizes of the next chunk of rows, None
+          if the samples are too slow for the dsp detector.
+    """
+    # Imported here so SciPy is only loaded when it is used
+    from dsp import sample_rate, supported_pipeline
+    first_key, last_key = time_keys([first_time, last_time])
+    pipeline = supported_pipeline(sample_rate(num_rows,
+                                              last_key - first_key))
+    if pipeline is None:
+        return None
+
+    def classify(rows):
+        return pipeline({'x': rows[:, 4], 'y': rows[:, 5], 'z': rows[:, 2],
+                         'speed': rows[:, 6]})
+    return classify
+
+
+class SegmentSpool:
+    """
+    Keeps the segments of a drive and their bumps in files instead of
+    memory, and reads them back one at a time.
+
+    Args:
+        folder (str): Folder of the spool files.
+    """
+
+    def __init__(self, folder):
+        self.paths = [os.path.join(folder, f'{name}.bin')
+                      for name in ['records', 'points', 'bumps']]
+        self.files = [open(path, 'wb') for path in self.paths]
+
+    def add(self, segment, z_std, bump_count, bump_coords):
+        records, points, bumps = self.files
+        records.write(np.array([(len(segment), z_std, bump_count,
+                                 len(bump_coords))],
+                               dtype=SEGMENT_RECORD).tobytes())
+        points.write(np.asarray(segment, dtype=np.float64).tobytes())
+        bumps.write(np.asarray(bump_coords, dtype=np.float64).tobytes())
+
+    def close(self):
+        for file in self.files:
+            file.close()
+
+    def read(self, index):
+        if os.path.getsize(self.paths[index]) == 0:
+            return np.empty(0, dtype=SEGMENT_RECORD if index == 0
+                            else np.float64)
+        return np.memmap(self.paths[index], mode='r',
+                         dtype=SEGMENT_RECORD if index == 0 else np.float64)
+
+    def records(self):
+        return self.read(0)
+
+    def segments(self):
+        points = self.read(1).reshape(-1, 2)
+        ends = np.cumsum(self.records()['points'])
+        for start, end in zip(ends - self.records()['points'], ends):
+            yield list(map(tuple, points[start:end].tolist()))
+
+    def bump_coords(self):
+        for latitude, longitude in self.read(2).reshape(-1, 2).tolist():
+            yield latitude, longitude
+
+    def bump_chunks(self, chunk_size=CHUNK_SIZE):
+        bumps = self.read(2).reshape(-1, 2)
+        for start in range(0, len(bumps), chunk_size):
+            yield np.array(bumps[start:start + chunk_size])
+
+
+def process_stream(file_path_accel, file_path_gps, folder_results,
+                   image_path=None, timestamp=None, chunk_size=CHUNK_SIZE,
+                   merge_tolerance=None, database=None, map_style=MAP_STYLE,
+                   bump_detector=BUMP_DETECTOR):
+    """
+    Streaming counterpart of process_in_memory: builds the map and
+    the report statistics while holding only a few chunks in memory.
+    Segments are simplified and merged by color before they are kept
+    for the map. The full segments and the bumps are spooled to files
+    for the road database, the map image and the 'segments' map style.
+
+    Args:
+        file_path_accel (str): Path of file containig accelerometer data.
+        file_path_gps (str): Path of file containig GPS data.
+        folder_results (str): Path of folder where we store result.
+        image_path (str): Path of the map image to draw,
+          no image is drawn if not given.
+        timestamp (str): Timestamp used in the result file names.
+        chunk_size (int): Number of rows processed at once.
+        merge_tolerance (float): Seconds between a sample and its nearest
+          GPS fix, rows with equal times are joined if None.
+        database (str): Path of the road database the results are added
+          to, not stored if not given.
+        map_style (str): Style of the HTML map, see plot_map.
+        bump_detector (str): Bump detector, see classify_bumps.
+
+    Returns:
+        tuple: Map path, duration, distance and bump statistics,
+          None if there is no data to process.
+    """
+    columns = DSP_SPOOL_COLUMNS if bump_detector == 'dsp' else SPOOL_COLUMNS
+    with tempfile.TemporaryDirectory() as folder_temp:
+        spool_path = os.path.join(folder_temp, 'merged.bin')
+        with stage('spool'):
+            summary = spool_merged(file_path_accel, file_path_gps,
+                                   spool_path, chunk_size, merge_tolerance,
+                                   columns)
+        if summary is None:
+            return None
+        num_rows, first_time, last_time, south_west, north_east = summary
+        spool = np.memmap(spool_path, dtype=np.float64, mode='r',
+                          shape=(num_rows, len(columns)))
+
+        threshold = classify = None
+        if bump_detector == 'dsp':
+            classify = dsp_classifier(num_rows, first_time, last_time)
+            if classify is not None and np.isnan(spool[0, 4:6]).any():
+                print("The dsp bump detector needs all three "
+                      "accelerometer axes.")
+                classify = None
+        if classify is None:
+            # Summary rows of an event capture log are left out, like
+            # func.bump_threshold, unless there is nothing else
+            full_rate = num_rows - sum(
+                int(np.count_nonzero(spool[start:start + chunk_size, 3] == 1))
+                for start in range(0, num_rows, chunk_size))
+
+            def abs_z_chunks():
+                for start in range(0, num_rows, chunk_size):
+                    rows = spool[start:start + chunk_size]
+                    if full_rate > 0:
+                        rows = rows[rows[:, 3] != 1]
+                    yield np.abs(rows[:, 2])
+
+            with stage('threshold'):
+                threshold = streaming_percentile(
+                    abs_z_chunks, full_rate or num_rows, 70)
+        my_map = folium.Map(location=tuple(spool[0, :2].tolist()),
+                            zoom_start=15)
+        segment_spool = None
+        if (database is not None or image_path is not None
+                or map_style == 'segments'):
+            segment_spool = SegmentSpool(folder_temp)
+        # Only simplified lines and small per-segment rows stay in memory
+        segment_table = []
+        lines = MergedLines()
+
+        def on_segment(segment, z_data_segment, bump_count, bump_coords):
+            z_std = z_deviation(z_data_segment)
+            segment_table.append(segment_row(len(segment_table), segment,
+                                             z_std, bump_count))
+            lines.add(simplify_line(segment), get_segment_color(
+                segment, z_data_segment, [], bump_count))
+            if segment_spool is not None:
+                segment_spool.add(segment, z_std, bump_count, bump_coords)
+
+        with stage('segments'):
+            distance, bumps = analyze_stream(spool, threshold, on_segment,
+                                             chunk_size, classify)
+        spool = None            # release the memmap before cleanup
+        if segment_spool is not None:
+            segment_spool.close()
+
+        with stage('plot_map'):
+            if map_style == 'segments':
+                # Every segment with all of its points, like plot_map
+                records = segment_spool.records()
+                for segment, z_std, bump_count in zip(
+                        segment_spool.segments(), records['z_std'].tolist(),
+                        records['bump_count'].tolist()):
+                    folium.PolyLine(segment,
+                                    color=rating_color(bump_count, z_std),
+                                    weight=6).add_to(my_map)
+                records = None
+            else:
+                lines.add_to(my_map, map_style)
+            map_path = save_map(my_map, folder_results, timestamp)
+        if image_path is not None:
+            with stage('map_image'):
+                fig, ax = create_map_image(south_west, north_east)
+                for color, line in lines.lines:
+                    draw_image_segment(ax, line, color)
+                for bump_coords in segment_spool.bump_chunks(chunk_size):
+                    draw_image_bumps(ax, bump_coords)
+                save_map_image(fig, ax, image_path)
+        duration = road_duration({'time': [first_time, last_time]})
+        distance = format(distance / 1000, ".2f")
+        with stage('segment_table'):
+            write_segment_table(segment_table, folder_results,
+                                timestamp or TIMESTAMP_FORMAT)
+        if database is not None:
+            records = segment_spool.records()
+            with stage('database'), RoadDatabase(database) as db:
+                db.ingest_drive(timestamp or TIMESTAMP_FORMAT,
+                                segment_spool.segments(),
+                                records['z_std'].tolist(),
+                                records['bump_count'].tolist(),
+                                segment_spool.bump_coords(), duration,
+                                distance, bumps)
+            records = None      # release the memmaps before cleanup
+    return map_path, duration, distance, bumps
@@ -0,0 +1,566 @@
+"""Uploads the logs of finished drives to a collection server.
+
+Every drive in the data folder is packed into one compressed tar
+archive, zstd where the zstandard package is installed and gzip
+otherwise, and uploaded in chunks over a few keep-alive connections.
+The server tells how much of an archive it already has, so an upload
+that was cut off continues where it stopped, also after a restart.
+sync.json next to the archives keeps the state of every drive, and
+drives whose logs didn't change since their upload are skipped. When
+the connection drops the workers wait longer after every failed
+request, up to BACKOFF_LIMIT, and a drive that keeps failing waits
+for the next pass.
+
+The upload protocol is the core of tus (https://tus.io): HEAD returns
+the Upload-Offset the server has, PATCH appends a chunk at the given
+Upload-Offset. UploadServer is a receiver that implements it, for a
+collection machine on the local network and for testing.
+
+    python sync.py upload ./data http://192.168.1.10:8080 --watch 600
+    python sync.py receive ./uploads --port 8080
+"""
+import argparse
+import gzip
+import hashlib
+import http.client
+import json
+import os
+import queue
+import random
+import re
+import sys
+import tarfile
+import threading
+import time
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from binlog import LOG_EXTENSION
+
+COMPRESSION = 'zstd'            # 'zstd' or 'gzip'
+ZSTD_LEVEL = 10
+GZIP_LEVEL = 6
+ARCHIVE_EXTENSIONS = {'zstd': '.tar.zst', 'gzip': '.tar.gz'}
+CHUNK_SIZE = 1024 ** 2          # bytes per request
+UPLOAD_WORKERS = 2              # drives and connections at once
+UPLOAD_TIMEOUT = 30             # seconds, longest wait for the server
+UPLOAD_RETRIES = 8              # failed requests in a row per drive
+BACKOFF_START = 1.0             # seconds after the first failed request
+BACKOFF_LIMIT = 300.0           # seconds, longest wait between requests
+SYNC_INTERVAL = 600             # seconds between passes with --watch
+SYNC_FOLDER = 'sync'            # archives and manifest, in the data folder
+MANIFEST_NAME = 'sync.json'
+RECEIVER_PORT = 8080
+DRIVE_FILE = re.compile(r'^(accel|gps)_data_(\w+)'
+                        rf'(\.csv|{re.escape(LOG_EXTENSION)}|\.nmea)$')
+UPLOAD_NAME = re.compile(r'/([\w-]+(?:\.\w+)*)$')  # any base path
+
+
+def find_drives(folder):
+    """
+    Finds the logs of every drive with both an accelerometer and a GPS
+    log. Parts of logs that were not stitched are left out.
+
+    Returns:
+        dict: Sorted paths of the logs of every drive by timestamp.
+    """
+    drives = {}
+    for name in sorted(os.listdir(folder)):
+        match = DRIVE_FILE.match(name)
+        if match is not None:
+            drives.setdefault(match.group(2), []).append(
+                os.path.join(folder, name))
+    return {timestamp: paths for timestamp, paths in drives.items()
+            if {DRIVE_FILE.match(os.path.basename(path)).group(1)
+                for path in paths} == {'accel', 'gps'}}
+
+
+def file_versions(paths):
+    """Returns the size and modification time of every file by name."""
+    versions = {}
+    for path in paths:
+        stat = os.stat(path)
+        versions[os.path.basename(path)] = [stat.st_size, stat.st_mtime_ns]
+    return versions
+
+
+def available_compression(compression):
+    """Returns the compression to use, gzip if zstandard is missing."""
+    if compression == 'zstd':
+        try:
+            import zstandard  # noqa: F401
+        except ImportError:
+            print('zstandard is not installed, archives are gzip files.')
+            return 'gzip'
+    return compression
+
+
+def compress_drive(paths, folder, timestamp, compression):
+    """
+    Packs the logs of a drive into a compressed tar archive.
+
+    The archive name ends with the start of its SHA-256, so a drive
+    packed again after its logs changed is uploaded as a new file.
+
+    Args:
+        paths (list): Logs of the drive.
+        folder (str): Folder of the archives.
+        timestamp (str): Timestamp of the drive.
+        compression (str): 'zstd' or 'gzip'.
+
+    Returns:
+        tuple: Name and size of the archive.
+    """
+    part_path = os.path.join(folder, f'{timestamp}.part')
+    with open(part_path, 'wb') as f:
+        if compression == 'zstd':
+            import zstandard
+            stream = zstandard.ZstdCompressor(
+                level=ZSTD_LEVEL).stream_writer(f, closefd=False)
+        else:
+            # No time in the header, the same logs give the same archive
+            stream = gzip.GzipFile(fileobj=f, mode='wb',
+                                   compresslevel=GZIP_LEVEL, mtime=0)
+        with stream, tarfile.open(fileobj=stream, mode='w|') as archive:
+            for path in paths:
+                archive.add(path, arcname=os.path.basename(path))
+    digest = hashlib.sha256()
+    with open(part_path, 'rb') as f:
+        for block in iter(lambda: f.read(CHUNK_SIZE), b''):
+            digest.update(block)
+    name = (f'{timestamp}-{digest.hexdigest()[:16]}'
+            f'{ARCHIVE_EXTENSIONS[compression]}')
+    os.replace(part_path, os.path.join(folder, name))
+    return name, os.path.getsize(os.path.join(folder, name))
+
+
+def read_manifest(folder):
+    try:
+        with open(os.path.join(folder, MANIFEST_NAME)) as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return {'drives': {}}
+
+
+def write_manifest(folder, manifest):
+    path = os.path.join(folder, MANIFEST_NAME)
+    with open(path + '.part', 'w') as f:
+        json.dump(manifest, f, indent=1)
+    os.replace(path + '.part', path)
+
+
+class Backoff:
+    """
+    Exponential backoff with jitter, shared by the upload workers so
+    they all slow down when the connection drops.
+
+    Args:
+        start (float): Seconds to wait after the first failure.
+        limit (float): Longest wait in seconds.
+        sleep (callable): Waits the given seconds.
+    """
+
+    def __init__(self, start=BACKOFF_START, limit=BACKOFF_LIMIT,
+                 sleep=time.sleep):
+        self.start = start
+        self.limit = limit
+        self.sleep = sleep
+        self.failures = 0
+        self.waited = 0.0
+        self.lock = threading.Lock()
+
+    def wait(self, longest=None):
+        """Waits after a failure, at most longest seconds if given."""
+        with self.lock:
+            self.failures += 1
+            delay = min(self.limit, self.start * 2 ** (self.failures - 1))
+            # Workers that failed together don't retry together
+            delay *= random.uniform(0.5, 1)
+            if longest is not None:
+                delay = min(delay, longest)
+            self.waited += delay
+        self.sleep(delay)
+
+    def reset(self):
+        with self.lock:
+            self.failures = 0
+
+
+class ConnectionPool:
+    """
+    Keep-alive HTTP connections to one server. A connection is reused
+    after every complete response, so a worker opens a new one only
+    after an error or when the server closes it.
+
+    Args:
+        url (str): Base URL the archives are uploaded to.
+        timeout (float): Socket timeout in seconds.
+    """
+
+    def __init__(self, url, timeout=UPLOAD_TIMEOUT):
+        parts = urllib.parse.urlsplit(url)
+        self.connection_class = (http.client.HTTPSConnection
+                                 if parts.scheme == 'https'
+                                 else http.client.HTTPConnection)
+        self.host = parts.netloc
+        self.path = parts.path.rstrip('/')
+        self.timeout = timeout
+        self.idle = queue.SimpleQueue()
+        self.opened = 0
+
+    def request(self, method, name, body=None, headers=None):
+        """Sends a request, returns the response with its body read."""
+        try:
+            connection = self.idle.get_nowait()
+        except queue.Empty:
+            connection = self.connection_class(self.host,
+                                               timeout=self.timeout)
+            self.opened += 1
+        try:
+            connection.request(method, f'{self.path}/{name}', body,
+                               headers or {})
+            response = connection.getresponse()
+            response.read()
+        except BaseException:
+            connection.close()
+            raise
+        if response.will_close:
+            connection.close()
+        else:
+            self.idle.put(connection)
+        return response
+
+    def close(self):
+        while True:
+            try:
+                self.idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+
+class UploadAgent:
+    """
+    Compresses finished drives and uploads them with resumable chunks.
+
+    Args:
+        folder (str): Data folder with the logs of finished drives.
+        url (str): Base URL of the upload server.
+        workers (int): Drives uploaded at once.
+        chunk_size (int): Bytes per request.
+        compression (str): 'zstd' or 'gzip'.
+        retries (int): Failed requests in a row before a drive is left
+          for the next pass.
+        backoff (Backoff): Waits after failed requests.
+        remove (bool): Removes the logs of a drive once it is uploaded.
+        timeout (float): Socket timeout in seconds.
+        deadline (float): Seconds after the start of a pass when no
+          more requests are sent and the drives left are uploaded by
+          the next pass. No deadline if None.
+    """
+
+    def __init__(self, folder, url, workers=UPLOAD_WORKERS,
+                 chunk_size=CHUNK_SIZE, compression=COMPRESSION,
+                 retries=UPLOAD_RETRIES, backoff=None, remove=False,
+                 timeout=UPLOAD_TIMEOUT, deadline=None):
+        self.folder = folder
+        self.archive_folder = os.path.join(folder, SYNC_FOLDER)
+        self.workers = workers
+        self.chunk_size = chunk_size
+        self.compression = available_compression(compression)
+        self.retries = retries
+        self.backoff = Backoff() if backoff is None else backoff
+        self.remove = remove
+        self.deadline = deadline
+        self.stop_time = None
+        self.pool = ConnectionPool(url, timeout)
+        os.makedirs(self.archive_folder, exist_ok=True)
+        self.manifest = read_manifest(self.archive_folder)
+        self.lock = threading.Lock()
+        self.counts = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.pool.close()
+
+    def update(self, timestamp, **values):
+        with self.lock:
+            self.manifest['drives'].setdefault(timestamp, {}).update(values)
+            write_manifest(self.archive_folder, self.manifest)
+
+    def count(self, name, value=1):
+        with self.lock:
+            self.counts[name] = self.counts.get(name, 0) + value
+
+    def sync(self):
+        """
+        Uploads every drive that isn't uploaded yet or changed since.
+
+        Returns:
+            dict: Number of drives uploaded, skipped as up to date and
+              failed, bytes of archives and bytes sent, failed requests
+              and the connections opened.
+        """
+        self.counts = {'uploaded': 0, 'skipped': 0, 'failed': 0,
+                       'archive_bytes': 0, 'sent_bytes': 0, 'retries': 0}
+        self.stop_time = (None if self.deadline is None
+                          else time.monotonic() + self.deadline)
+        opened = self.pool.opened
+        jobs = []
+        for timestamp, paths in find_drives(self.folder).items():
+            entry = self.manifest['drives'].get(timestamp, {})
+            sources = file_versions(paths)
+            if (entry.get('state') == 'uploaded'
+                    and entry.get('sources') == sources):
+                self.counts['skipped'] += 1
+            else:
+                jobs.append((timestamp, paths, sources))
+        with ThreadPoolExecutor(self.workers) as executor:
+            for uploaded in executor.map(lambda job: self.sync_drive(*job),
+                                         jobs):
+                self.count('uploaded' if uploaded else 'failed')
+        self.counts['connections'] = self.pool.opened - opened
+        return dict(self.counts)
+
+    def sync_drive(self, timestamp, paths, sources):
+        entry = self.manifest['drives'].get(timestamp, {})
+        archive = entry.get('archive')
+        if (entry.get('sources') != sources or archive is None
+                or not os.path.isfile(os.path.join(self.archive_folder,
+                                                   archive))):
+            if archive is not None:
+                # Packed again below, the logs changed
+                self.remove_archive(archive)
+            archive, size = compress_drive(paths, self.archive_folder,
+                                           timestamp, self.compression)
+            self.update(timestamp, sources=sources, archive=archive,
+                        size=size, offset=0, state='compressed')
+        if not self.upload(timestamp):
+            return False
+        self.remove_archive(archive)
+        self.update(timestamp, state='uploaded',
+                    uploaded=time.strftime('%Y-%m-%d %H:%M:%S'))
+        if self.remove:
+            for path in paths:
+                os.remove(path)
+        return True
+
+    def remove_archive(self, name):
+        try:
+            os.remove(os.path.join(self.archive_folder, name))
+        except FileNotFoundError:
+            pass
+
+    def upload(self, timestamp):
+        """Uploads the archive of a drive from the offset the server
+        has, returns True once the server has all of it."""
+        entry = self.manifest['drives'][timestamp]
+        name, size = entry['archive'], entry['size']
+        self.count('archive_bytes', size)
+        failures = 0
+        offset = None
+        with open(os.path.join(self.archive_folder, name), 'rb') as f:
+            while offset is None or offset < size:
+                if self.time_left() == 0:
+                    print(f'Upload of {name} paused at {offset or 0}'
+                          f' of {size} bytes, the pass took too long')
+                    return False
+                try:
+                    if offset is None:
+                        offset = self.server_offset(name)
+                        continue
+                    f.seek(offset)
+                    chunk = f.read(self.chunk_size)
+                    response = self.pool.request(
+                        'PATCH', name, chunk,
+                        {'Upload-Offset': str(offset),
+                         'Upload-Length': str(size),
+                         'Content-Type': 'application/offset+octet-stream'})
+                    if response.status >= 500:
+                        raise ConnectionError(f'HTTP {response.status}')
+                except (OSError, http.client.HTTPException) as e:
+                    failures += 1
+                    self.count('retries')
+                    if failures > self.retries:
+                        print(f'Upload of {name} stopped at {offset or 0}'
+                              f' of {size} bytes: {e}')
+                        return False
+                    self.backoff.wait(self.time_left())
+                    # Only the server knows what arrived before the error
+                    offset = None
+                    continue
+                if response.status not in (204, 409):
+                    print(f'Upload of {name} failed: HTTP {response.status}'
+                          f' {response.reason}')
+                    return False
+                if response.status == 204:
+                    self.count('sent_bytes', len(chunk))
+                failures = 0
+                self.backoff.reset()
+                offset = int(response.getheader('Upload-Offset'))
+                self.update(timestamp, offset=offset, state='uploading')
+        return True
+
+    def time_left(self):
+        """Returns the seconds left until the deadline, None if there
+        is no deadline."""
+        if self.stop_time is None:
+            return None
+        return max(self.stop_time - time.monotonic(), 0.0)
+
+    def server_offset(self, name):
+        response = self.pool.request('HEAD', name)
+        if response.status == 404:
+            return 0
+        if response.status != 200:
+            raise ConnectionError(f'HTTP {response.status}')
+        return int(response.getheader('Upload-Offset'))
+
+
+def sync_drives(folder, url, **options):
+    """
+    Uploads the finished drives of a data folder once.
+
+    Args:
+        folder (str): Data folder with the logs of finished drives.
+        url (str): Base URL of the upload server.
+        **options: Options of UploadAgent.
+
+    Returns:
+        dict: Counts of UploadAgent.sync.
+    """
+    with UploadAgent(folder, url, **options) as agent:
+        counts = agent.sync()
+    print(f'Drives uploaded: {counts["uploaded"]}, up to date:'
+          f' {counts["skipped"]}, failed: {counts["failed"]}')
+    return counts
+
+
+class UploadHandler(BaseHTTPRequestHandler):
+    """Receives archives into UploadServer.folder, name.part until the
+    last chunk arrives."""
+
+    protocol_version = 'HTTP/1.1'
+
+    def paths(self):
+        match = UPLOAD_NAME.search(urllib.parse.urlsplit(self.path).path)
+        if match is None:
+            return None
+        path = os.path.join(self.server.folder, match.group(1))
+        return path, path + '.part'
+
+    def do_HEAD(self):
+        paths = self.paths()
+        if paths is None:
+            self.send_offset(404)
+            return
+        for path in paths:
+            if os.path.isfile(path):
+                self.send_offset(200, os.path.getsize(path))
+                return
+        self.send_offset(404)
+
+    def do_PATCH(self):
+        length = int(self.headers.get('Content-Length', 0))
+        chunk = self.rfile.read(length)
+        paths = self.paths()
+        if paths is None or len(chunk) < length:
+            self.close_connection = True
+            self.send_offset(400)
+            return
+        path, part_path = paths
+        with self.server.lock:
+            if os.path.isfile(path):
+                self.send_offset(409, os.path.getsize(path))
+                return
+            offset = (os.path.getsize(part_path)
+                      if os.path.isfile(part_path) else 0)
+            if int(self.headers.get('Upload-Offset', -1)) != offset:
+                self.send_offset(409, offset)
+                return
+            with open(part_path, 'ab') as f:
+                f.write(chunk)
+            offset += len(chunk)
+            if offset >= int(self.headers.get('Upload-Length', 0)):
+                os.replace(part_path, path)
+        self.send_offset(204, offset)
+
+    def send_offset(self, status, offset=None):
+        self.send_response(status)
+        if offset is not None:
+            self.send_header('Upload-Offset', str(offset))
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+
+class UploadServer(ThreadingHTTPServer):
+    """
+    HTTP server that receives uploaded archives.
+
+    Args:
+        folder (str): Folder the archives are written to.
+        address (tuple): Host and port, port 0 picks a free one.
+        handler (type): Request handler, UploadHandler or a subclass.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, folder, address=('127.0.0.1', RECEIVER_PORT),
+                 handler=UploadHandler):
+        super().__init__(address, handler)
+        os.makedirs(folder, exist_ok=True)
+        self.folder = folder
+        self.lock = threading.Lock()
+
+
+def receive_uploads(folder, host='0.0.0.0', port=RECEIVER_PORT):
+    """Receives uploads until interrupted."""
+    with UploadServer(folder, (host, port)) as server:
+        print(f'Receiving into {folder} on http://{host}:{port}/')
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Upload finished drives to a collection server.')
+    commands = parser.add_subparsers(dest='command', required=True)
+    upload = commands.add_parser('upload', help='upload finished drives')
+    upload.add_argument('folder', help='data folder of the drives')
+    upload.add_argument('url', help='base URL of the upload server')
+    upload.add_argument('--workers', type=int, default=UPLOAD_WORKERS)
+    upload.add_argument('--compression', choices=list(ARCHIVE_EXTENSIONS),
+                        default=COMPRESSION)
+    upload.add_argument('--remove', action='store_true',
+                        help='remove the logs of uploaded drives')
+    upload.add_argument('--watch', type=float, metavar='SECONDS',
+                        nargs='?', const=SYNC_INTERVAL,
+                        help='upload again every SECONDS')
+    receive = commands.add_parser('receive', help='receive uploads')
+    receive.add_argument('folder', help='folder of the received archives')
+    receive.add_argument('--host', default='0.0.0.0')
+    receive.add_argument('--port', type=int, default=RECEIVER_PORT)
+    args = parser.parse_args(argv)
+    if args.command == 'receive':
+        receive_uploads(args.folder, args.host, args.port)
+        return 0
+    while True:
+        counts = sync_drives(args.folder, args.url, workers=args.workers,
+                             compression=args.compression,
+                             remove=args.remove)
+        if args.watch is None:
+            return 1 if counts['failed'] else 0
+        try:
+            time.sleep(args.watch)
+        except KeyboardInterrupt:
+            return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
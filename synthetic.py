@@ -0,0 +1,228 @@
+"""Synthetic drives for tests and benchmarks.
+
+A drive follows a road with smooth turns at a slowly changing speed.
+The GPS fixes add position noise to the track and the accelerometer of
+a slightly tilted sensor records gravity, braking, road noise and the
+bumps injected at known places. The logs are written in the formats
+app.py records, so they can be processed like real drives.
+"""
+import os
+import numpy as np
+import pandas as pd
+from binlog import LOG_EXTENSION, RECORD_DTYPE, create_log_file
+from nmea import nmea_sentence
+
+ACCEL_RATE = 10                 # Hz
+GPS_RATE = 1                    # Hz
+START_TIME = 8 * 3600           # seconds since midnight
+START_POSITION = (44.8125, 20.4612)
+MEAN_SPEED = 14.0               # m/s
+GPS_NOISE = 2.0                 # meters
+ROAD_NOISE = 0.3                # m/s^2
+SENSOR_NOISE = 0.05             # m/s^2
+GRAVITY = 9.81                  # m/s^2
+SENSOR_TILT = (0.05, 0.1, 1.0)  # direction of gravity in sensor axes
+BUMPS_PER_KM = 5
+BUMP_PEAKS = [2.0, 4.0, 7.0]    # m/s^2: small, medium, big bump
+BUMP_FREQUENCY = 2.5            # Hz, body bounce after hitting a bump
+BUMP_DECAY = 0.3                # seconds
+BUMP_SECONDS = 1.2
+EARTH_RADIUS_METERS = 6371008.8
+KNOTS_TO_METERS_PER_SECOND = 1852 / 3600
+SECONDS_PER_DAY = 24 * 60 * 60
+
+
+def smooth_noise(times, rng, periods):
+    """Returns a smooth random signal of unit amplitude, the sum of
+    sines with the given periods in seconds and random phases."""
+    phases = rng.uniform(0, 2 * np.pi, len(periods))
+    return sum(np.sin(2 * np.pi * times / period + phase)
+               for period, phase in zip(periods, phases)) / len(periods)
+
+
+def bump_shape(seconds):
+    """Returns the vertical acceleration of a bump with a peak of 1,
+    seconds after the wheel hit it."""
+    omega = 2 * np.pi * BUMP_FREQUENCY
+    peak_time = np.arctan(omega * BUMP_DECAY) / omega
+    peak = np.exp(-peak_time / BUMP_DECAY) * np.sin(omega * peak_time)
+    inside = (seconds >= 0) & (seconds <= BUMP_SECONDS)
+    return np.where(inside, np.exp(-seconds / BUMP_DECAY)
+                    * np.sin(omega * seconds), 0.0) / peak
+
+
+def synthetic_drive(seconds, accel_rate=ACCEL_RATE, gps_rate=GPS_RATE,
+                    bumps_per_km=BUMPS_PER_KM, seed=0,
+                    start_time=START_TIME):
+    """
+    Generates the sensor data of a drive.
+
+    Args:
+        seconds (float): Length of the drive.
+        accel_rate (float): Accelerometer sample rate in Hz.
+        gps_rate (float): GPS fix rate in Hz.
+        bumps_per_km (float): Average number of injected bumps.
+        seed (int): Seed of the random generator, the same seed gives
+          the same drive.
+        start_time (float): Time of the first sample in seconds since
+          midnight. Later times wrap around at midnight like the logs.
+
+    Returns:
+        tuple: DataFrames of the accelerometer samples (x, y, z in m/s^2
+          and time), the GPS fixes (latitude, longitude, time and speed
+          in knots) and the injected bumps (latitude, longitude, time and
+          size 1 to 3 like bump_sizes). Times are seconds since midnight
+          rounded to milliseconds.
+    """
+    rng = np.random.default_rng(seed)
+    fix_times = np.arange(int(seconds * gps_rate) + 1) / gps_rate
+    sample_times = np.arange(int(seconds * accel_rate) + 1) / accel_rate
+
+    # The track is integrated on a fine grid shared by both sensors
+    step = min(1 / accel_rate, 1 / gps_rate, 0.1)
+    times = np.arange(int(seconds / step) + 2) * step
+    speed = MEAN_SPEED * (1 + 0.4 * smooth_noise(times, rng,
+                                                 [300, 77, 31]))
+    heading = np.cumsum(0.05 * smooth_noise(times, rng, [120, 45])) * step
+    distance = np.concatenate(([0.0], np.cumsum(speed[:-1] * step)))
+    east = np.concatenate(([0.0], np.cumsum(
+        speed[:-1] * np.sin(heading[:-1]) * step)))
+    north = np.concatenate(([0.0], np.cumsum(
+        speed[:-1] * np.cos(heading[:-1]) * step)))
+
+    def to_degrees(east, north):
+        latitude = START_POSITION[0] + np.degrees(north / EARTH_RADIUS_METERS)
+        longitude = START_POSITION[1] + np.degrees(
+            east / (EARTH_RADIUS_METERS * np.cos(np.radians(
+                START_POSITION[0]))))
+        return latitude, longitude
+
+    fix_east = np.interp(fix_times, times, east)
+    fix_north = np.interp(fix_times, times, north)
+    latitude, longitude = to_degrees(
+        fix_east + rng.normal(0, GPS_NOISE, len(fix_times)),
+        fix_north + rng.normal(0, GPS_NOISE, len(fix_times)))
+    gps_data = pd.DataFrame({
+        'latitude': latitude, 'longitude': longitude,
+        'time': fix_times,
+        'speed': np.interp(fix_times, times, speed)
+        / KNOTS_TO_METERS_PER_SECOND})
+
+    # Bumps are spread over the road, not over the time
+    num_bumps = rng.poisson(bumps_per_km * distance[-1] / 1000)
+    bump_distances = np.sort(rng.uniform(0, distance[-1], num_bumps))
+    bump_times = np.interp(bump_distances, distance, times)
+    bump_sizes = rng.integers(1, len(BUMP_PEAKS) + 1, num_bumps)
+    bump_latitude, bump_longitude = to_degrees(
+        np.interp(bump_times, times, east),
+        np.interp(bump_times, times, north))
+    bumps = pd.DataFrame({'latitude': bump_latitude,
+                          'longitude': bump_longitude,
+                          'time': bump_times, 'size': bump_sizes})
+
+    vertical = rng.normal(0, ROAD_NOISE, len(sample_times))
+    window = np.arange(int(np.ceil(BUMP_SECONDS * accel_rate)) + 1)
+    first = np.searchsorted(sample_times, bump_times)
+    indices = np.minimum(first[:, None] + window, len(sample_times) - 1)
+    np.add.at(vertical, indices,
+              np.array(BUMP_PEAKS)[bump_sizes - 1, None]
+              * bump_shape(sample_times[indices] - bump_times[:, None]))
+    forward = np.gradient(speed, step)
+
+    gravity_axis = np.array(SENSOR_TILT) / np.linalg.norm(SENSOR_TILT)
+    forward_axis = np.cross([0, 1, 0], gravity_axis)
+    forward_axis /= np.linalg.norm(forward_axis)
+    accel = (np.outer(GRAVITY + vertical, gravity_axis)
+             + np.outer(np.interp(sample_times, times, forward),
+                        forward_axis)
+             + rng.normal(0, SENSOR_NOISE, (len(sample_times), 3)))
+    accel_data = pd.DataFrame({'x': accel[:, 0], 'y': accel[:, 1],
+                               'z': accel[:, 2], 'time': sample_times})
+
+    for data in (accel_data, gps_data, bumps):
+        data['time'] = np.round(
+            (start_time + data['time']) % SECONDS_PER_DAY, 3)
+    return accel_data, gps_data, bumps
+
+
+def format_times(seconds):
+    """Formats seconds since midnight as 'HH:MM:SS.mmm' like the logs."""
+    milliseconds = (np.round(np.asarray(seconds) * 1000).astype(np.int64)
+                    % (SECONDS_PER_DAY * 1000))
+
+    def digits(values, width=2):
+        return np.char.zfill(values.astype(str), width)
+
+    hours_minutes = np.char.add(
+        np.char.add(digits(milliseconds // 3600000), ':'),
+        np.char.add(digits(milliseconds // 60000 % 60), ':'))
+    return np.char.add(hours_minutes, np.char.add(
+        np.char.add(digits(milliseconds // 1000 % 60), '.'),
+        digits(milliseconds % 1000, 3)))
+
+
+def write_drive(folder, accel_data, gps_data, timestamp='synthetic',
+                log_format='csv'):
+    """
+    Writes the data of synthetic_drive as the two logs of a drive.
+
+    Args:
+        folder (str): Folder the logs are written to.
+        accel_data (DataFrame): Accelerometer samples.
+        gps_data (DataFrame): GPS fixes.
+        timestamp (str): Timestamp in the file names.
+        log_format (str): 'csv' or 'binary', like app.LOG_FORMAT.
+
+    Returns:
+        tuple: Paths of the accelerometer and GPS logs.
+    """
+    paths = []
+    for name, data in (('accel', accel_data), ('gps', gps_data)):
+        if log_format == 'binary':
+            path = os.path.join(folder,
+                                f'{name}_data_{timestamp}{LOG_EXTENSION}')
+            file, _ = create_log_file(path, list(data.columns))
+            with file:
+                file.write(data.to_numpy(dtype=RECORD_DTYPE).tobytes())
+        else:
+            path = os.path.join(folder, f'{name}_data_{timestamp}.csv')
+            data.assign(time=format_times(data['time'])).to_csv(
+                path, index=False)
+        paths.append(path)
+    return tuple(paths)
+
+
+def nmea_coordinate(degrees, width):
+    """Formats degrees as NMEA '(d)ddmm.mmmm' and its hemisphere."""
+    minutes = round(abs(degrees) * 60, 4)
+    return f'{int(minutes // 60):0{width}d}{minutes % 60:07.4f}'
+
+
+def write_nmea(path, gps_data):
+    """
+    Writes GPS fixes as the NMEA stream of a NEO-6M, RMC, VTG, GGA and
+    GSA sentences for every fix, to be replayed with nmea.ReplayPort.
+
+    Args:
+        path (str): Path of the NMEA file.
+        gps_data (DataFrame): GPS fixes of synthetic_drive.
+
+    Returns:
+        str: path
+    """
+    with open(path, 'w', newline='') as f:
+        for latitude, longitude, seconds, speed in gps_data[
+                ['latitude', 'longitude', 'time', 'speed']].itertuples(
+                    index=False):
+            utc = format_times([seconds])[0].replace(':', '')[:9]
+            position = (f'{nmea_coordinate(latitude, 2)},'
+                        f'{"N" if latitude >= 0 else "S"},'
+                        f'{nmea_coordinate(longitude, 3)},'
+                        f'{"E" if longitude >= 0 else "W"}')
+            for body in (
+                    f'GPRMC,{utc},A,{position},{speed:.3f},,010126,,,A',
+                    f'GPVTG,,T,,M,{speed:.3f},N,{speed * 1.852:.3f},K,A',
+                    f'GPGGA,{utc},{position},1,08,0.94,117.3,M,38.5,M,,',
+                    'GPGSA,A,3,02,05,12,13,15,18,24,29,,,,,1.72,0.94,1.44'):
+                f.write(nmea_sentence(body))
+    return path
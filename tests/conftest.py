@@ -0,0 +1,6 @@
+import os
+import sys
+
+# The tests import the modules at the repository root, whichever
+# directory pytest is started from
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,27 @@
+import time
+from acquisition import AccelerometerPipeline
+
+
+class ListWriter:
+    def __init__(self):
+        self.rows = []
+
+    def writerows(self, rows):
+        self.rows.extend(rows)
+
+
+def test_accelerometer_pipeline():
+    writer = ListWriter()
+    pipeline = AccelerometerPipeline(lambda: (0.1, 0.2, -9.81), writer, 200)
+
+    pipeline.start()
+    time.sleep(0.5)
+    pipeline.stop()
+
+    statistics = pipeline.statistics()
+    # Generous bounds, the test machine may be busy
+    assert 60 <= statistics['samples'] <= 110
+    assert statistics['dropped'] == 0
+    assert len(writer.rows) == statistics['samples']
+    assert writer.rows[0][:3] == [0.1, 0.2, -9.81]
+    assert len(writer.rows[0][3]) == len('10:00:00.000')
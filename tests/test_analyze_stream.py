@@ -0,0 +1,97 @@
+import os
+import re
+import numpy as np
+from func import (classify_bumps, divide_into_segments, merge_dataframes,
+                  process_in_memory, read_data_file, road_distance,
+                  segment_bounds, segment_bump_counts, step_distances)
+from stream import (SPOOL_COLUMNS, SegmentSpool, analyze_stream,
+                    process_stream, spool_merged, streaming_percentile)
+
+
+def write_drive(folder, num_rows=1500):
+    # Two samples per second, so the merge multiplies rows
+    rng = np.random.default_rng(3)
+    track = np.array([44.8125, 20.4612]) + np.cumsum(
+        rng.normal(0, 0.0001, size=(num_rows, 2)), axis=0)
+    z_data = rng.normal(-9.81, 1.2, size=num_rows)
+    times = [f'10:{i // 120:02d}:{i // 2 % 60:02d}' for i in range(num_rows)]
+    accel_path = os.path.join(folder, 'accel_data_test.csv')
+    gps_path = os.path.join(folder, 'gps_data_test.csv')
+    with open(accel_path, 'w') as f:
+        f.write('x,y,z,time\n')
+        for z, time_ in zip(z_data.tolist(), times):
+            f.write(f'0.1,0.2,{z!r},{time_}\n')
+    with open(gps_path, 'w') as f:
+        f.write('latitude,longitude,time\n')
+        for (lat, lon), time_ in zip(track.tolist(), times):
+            f.write(f'{lat!r},{lon!r},{time_}\n')
+    return accel_path, gps_path
+
+
+def test_analyze_stream(tmpdir):
+    accel_path, gps_path = write_drive(str(tmpdir))
+    data = merge_dataframes(read_data_file(accel_path),
+                            read_data_file(gps_path))
+    bump_mask, bump_coords, bumps = classify_bumps(data)
+    coords = list(zip(data['latitude'], data['longitude']))
+    distances = step_distances(coords)
+    segments, z_data_segments = divide_into_segments(coords, data['z'],
+                                                     distances)
+    bump_counts = segment_bump_counts(bump_mask, segment_bounds(distances))
+
+    chunk_size = 64
+    spool_path = os.path.join(str(tmpdir), 'merged.bin')
+    num_rows = spool_merged(accel_path, gps_path, spool_path, chunk_size)[0]
+    spool = np.memmap(spool_path, dtype=np.float64, mode='r',
+                      shape=(num_rows, len(SPOOL_COLUMNS)))
+
+    def abs_z_chunks():
+        for start in range(0, num_rows, chunk_size):
+            yield np.abs(spool[start:start + chunk_size, 2])
+
+    threshold = streaming_percentile(abs_z_chunks, num_rows, 70)
+    results = []
+    distance, stream_bumps = analyze_stream(
+        spool, threshold, lambda *segment: results.append(segment),
+        chunk_size)
+
+    assert num_rows == len(data)
+    assert [result[0] for result in results] == segments
+    assert [result[1] for result in results] == z_data_segments
+    assert [result[2] for result in results] == bump_counts
+    assert sum((result[3] for result in results), []) == bump_coords
+    assert stream_bumps == bumps
+    assert format(distance / 1000, '.2f') == road_distance(coords, distances)
+
+
+def test_segment_spool(tmpdir):
+    segments = [[(44.81, 20.46), (44.82, 20.47)], [(44.82, 20.47)],
+                [(44.82, 20.47), (44.83, 20.48), (44.84, 20.49)]]
+    bump_coords = [[], [(44.82, 20.47)], [(44.83, 20.48), (44.84, 20.49)]]
+    spool = SegmentSpool(str(tmpdir))
+    for number, segment in enumerate(segments):
+        spool.add(segment, number / 10, len(bump_coords[number]),
+                  bump_coords[number])
+    spool.close()
+
+    assert list(spool.segments()) == segments
+    assert list(spool.records()['z_std']) == [0, 0.1, 0.2]
+    assert list(spool.records()['bump_count']) == [0, 1, 2]
+    assert list(spool.bump_coords()) == sum(bump_coords, [])
+
+
+def test_stream_segments_style(tmpdir):
+    accel_path, gps_path = write_drive(str(tmpdir))
+    colors = []
+    for name, process in [('memory', process_in_memory),
+                          ('stream', process_stream)]:
+        image_path = os.path.join(str(tmpdir), f'image_{name}.png')
+        map_path = process(accel_path, gps_path, str(tmpdir), image_path,
+                           name, merge_tolerance=None,
+                           map_style='segments')[0]
+        assert os.path.getsize(image_path) > 0
+        with open(map_path) as f:
+            colors.append(re.findall(r'"color": "(\w+)"', f.read()))
+    # One polyline per segment, not merged by color
+    assert len(colors[0]) > len(set(colors[0]))
+    assert colors[1] == colors[0]
@@ -0,0 +1,15 @@
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_app_startup():
+    # Importing the app loads only the acquisition code
+    code = ('import sys, app; print(" ".join(name for name in ["func",'
+            ' "live", "pandas", "folium", "openpyxl", "matplotlib",'
+            ' "selenium"] if name in sys.modules))')
+    result = subprocess.run([sys.executable, '-c', code], cwd=ROOT,
+                            capture_output=True, text=True, check=True)
+    assert result.stdout.strip() == ''
@@ -0,0 +1,43 @@
+import os
+import numpy as np
+from binlog import convert_csv_to_log, create_log_file, read_log
+from func import read_data_file, road_duration
+
+
+def test_binary_log(tmpdir):
+    log_path = os.path.join(str(tmpdir), 'accel_data.bin')
+    file, writer = create_log_file(log_path, ['x', 'y', 'z', 'time'])
+    writer.writerow([0.1, 0.2, -9.8, '10:00:00'])
+    writer.writerow([0.3, 0.4, -11.2, '10:00:01'])
+    file.close()
+    # A record cut short by power loss is ignored
+    with open(log_path, 'ab') as f:
+        f.write(b'\x00' * 12)
+
+    columns, records = read_log(log_path)
+
+    assert columns == ['x', 'y', 'z', 'time']
+    assert isinstance(records, np.memmap)
+    assert records.tolist() == [[0.1, 0.2, -9.8, 36000.0],
+                                [0.3, 0.4, -11.2, 36001.0]]
+
+
+def test_read_data_file_binary(tmpdir):
+    csv_path = os.path.join(str(tmpdir), 'gps_data.csv')
+    with open(csv_path, 'w') as f:
+        f.write('latitude,longitude,time\n')
+        f.write('44.81,20.46,10:00:00\n')
+        f.write('44.82,20.47,10:30:00\n')
+
+    log_path = convert_csv_to_log(csv_path)
+    data = read_data_file(log_path)
+
+    assert log_path == os.path.join(str(tmpdir), 'gps_data.bin')
+    assert list(data.columns) == ['latitude', 'longitude', 'time']
+    assert data['latitude'].tolist() == [44.81, 44.82]
+    assert road_duration(data) == road_duration(read_data_file(csv_path))
+
+    # A log without records is empty like a CSV file without rows
+    file, _ = create_log_file(log_path, ['latitude', 'longitude', 'time'])
+    file.close()
+    assert read_data_file(log_path) is None
@@ -0,0 +1,96 @@
+import numpy as np
+from dsp import default_pipeline, rate_supported
+from func import classify_bumps, merge_dataframes
+from live import LiveRoadQuality
+from stream import process_stream
+from synthetic import synthetic_drive as synthetic_road_drive
+from synthetic import write_drive
+
+
+def synthetic_drive(rate, seconds, bump_times, gravity_axis):
+    """Returns x, y and z samples of a drive in m/s^2 with a 1 g gravity
+    along gravity_axis, road noise and a short jolt at every bump."""
+    rng = np.random.default_rng(0)
+    t = np.arange(int(rate * seconds)) / rate
+    vertical = rng.normal(0, 0.3, len(t))
+    for bump_time in bump_times:
+        vertical += 12 * np.exp(-((t - bump_time) * 40) ** 2) * np.sin(
+            2 * np.pi * 12 * (t - bump_time))
+    axis = np.asarray(gravity_axis, dtype=float)
+    axis /= np.linalg.norm(axis)
+    accel = np.outer(9.81 + vertical, axis) + rng.normal(0, 0.1,
+                                                         (len(t), 3))
+    return {'x': accel[:, 0], 'y': accel[:, 1], 'z': accel[:, 2]}
+
+
+def test_bump_pipeline():
+    rate = 500
+    bump_times = [3.0, 7.5, 12.0]
+    for gravity_axis in [(0, 0, 1), (0.6, 0, 0.8), (0.3, -0.9, 0.3)]:
+        chunk = synthetic_drive(rate, 15, bump_times, gravity_axis)
+        sizes = default_pipeline(rate)(chunk)
+        bump_indices = np.flatnonzero(sizes)
+
+        # Every bump is found once the filters settled, nothing else
+        assert len(bump_indices) > 0
+        nearest = np.abs(bump_indices[:, None] / rate
+                         - np.array(bump_times)).min(axis=1)
+        assert np.all(nearest < 0.1)
+        assert {int(np.argmin(np.abs(bump_times - i / rate)))
+                for i in bump_indices} == {0, 1, 2}
+
+        # Chunks of any size give the same sizes as the whole drive
+        pipeline = default_pipeline(rate)
+        chunked = np.concatenate([
+            pipeline({axis: values[start:start + 777]
+                      for axis, values in chunk.items()})
+            for start in range(0, len(chunk['z']), 777)])
+        assert np.array_equal(chunked, sizes)
+
+
+def test_bump_pipeline_speed():
+    rate = 500
+    chunk = synthetic_drive(rate, 10, [5.0], (0, 0, 1))
+    slow = dict(chunk, speed=np.full(len(chunk['z']), 5.0))
+    fast = dict(chunk, speed=np.full(len(chunk['z']), 60.0))
+
+    # The same jolt is a bigger bump at a lower speed
+    assert (default_pipeline(rate)(slow).max()
+            > default_pipeline(rate)(fast).max())
+    unknown = dict(chunk, speed=np.full(len(chunk['z']), np.nan))
+    assert np.array_equal(default_pipeline(rate)(unknown),
+                          default_pipeline(rate)(chunk))
+
+
+def test_low_rate_falls_back(tmpdir, capsys):
+    # One sample per fix, like the app without ACCEL_RATE
+    assert not rate_supported(1.0) and rate_supported(10.0)
+    accel_data, gps_data, _ = synthetic_road_drive(600, accel_rate=1,
+                                                   gps_rate=1)
+    data = merge_dataframes(accel_data, gps_data)
+    percentile = classify_bumps(data, 'percentile')[2]
+    assert percentile[0] > 0
+    assert classify_bumps(data, 'dsp')[2] == percentile
+    assert 'too slow for the dsp bump detector' in capsys.readouterr().out
+
+    write_drive(str(tmpdir), accel_data, gps_data, 'slow')
+    for detector in ['percentile', 'dsp']:
+        result = process_stream(
+            str(tmpdir.join('accel_data_slow.csv')),
+            str(tmpdir.join('gps_data_slow.csv')), str(tmpdir),
+            timestamp=detector, chunk_size=100, bump_detector=detector)
+        assert result[3] == percentile
+    assert 'too slow for the dsp bump detector' in capsys.readouterr().out
+
+    results = []
+    for detector in ['percentile', 'dsp']:
+        live = LiveRoadQuality(bump_detector=detector)
+        for sample, fix in zip(accel_data.itertuples(),
+                               gps_data.itertuples()):
+            live.add_samples([sample.time], [sample.z], [sample.x],
+                             [sample.y])
+            live.add_fix(fix.latitude, fix.longitude, fix.time, fix.speed)
+        results.append(live.finish(str(tmpdir), timestamp=detector)[3])
+    assert results[0] == results[1]
+    assert live.pipeline is None and live.bump_detector == 'percentile'
+    assert 'too slow for the dsp bump detector' in capsys.readouterr().out
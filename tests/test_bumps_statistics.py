@@ -0,0 +1,11 @@
+from func import bumps_statistics
+
+
+def test_bumps_statistics():
+    # 70th percentile of the absolute values is 10, so the last three
+    # samples deviate by 1.2, 1.7 and 3 respectively
+    z_data = [-10, -10, -10, -10, -10, -10, -10, -11.2, -8.3, -13]
+
+    all_bumps, big_bumps, medium_bumps, small_bumps = bumps_statistics(z_data)
+
+    assert (all_bumps, big_bumps, medium_bumps, small_bumps) == (3, 1, 1, 1)
@@ -0,0 +1,19 @@
+import pandas as pd
+from func import bumps_statistics, classify_bumps, find_bump_coords
+
+
+def test_classify_bumps():
+    data = pd.DataFrame({
+        'latitude': [42.3601, 42.3602, 42.3603, 42.3604, 42.3605,
+                     42.3606, 42.3607, 42.3608, 42.3609, 42.3610],
+        'longitude': [-71.0589, -71.0588, -71.0587, -71.0586, -71.0585,
+                      -71.0584, -71.0583, -71.0582, -71.0581, -71.0580],
+        'z': [-10, -10, -10, -10, -10, -10, -10, -11.2, -8.3, -13]
+        })
+
+    bump_mask, bump_coords, bumps = classify_bumps(data)
+
+    assert list(bump_mask) == [False] * 7 + [True] * 3
+    assert bump_coords == find_bump_coords(data)
+    assert bumps == bumps_statistics(data['z'])
+    assert bumps == (3, 1, 1, 1)
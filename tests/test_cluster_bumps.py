@@ -0,0 +1,40 @@
+import numpy as np
+from clusters import cluster_bumps
+
+
+def test_cluster_bumps():
+    rng = np.random.default_rng(2)
+    # Two potholes 50 m apart, hit on three drives with 1 m GPS noise
+    potholes = np.array([[44.81000, 20.46000], [44.81045, 20.46000]])
+    coords, drives = [], []
+    for drive in range(3):
+        for pothole in potholes:
+            noise = rng.normal(0, 0.000009, size=(4, 2))
+            coords.extend((pothole + noise).tolist())
+            drives.extend([drive] * 4)
+    # A single detection far from both
+    coords.append([44.82, 20.47])
+    drives.append(0)
+
+    entity, entities = cluster_bumps(coords, drives, radius=5)
+
+    assert len(entities) == 3
+    assert len(set(entity[:4]) | set(entity[8:12])) == 1
+    assert entity[4] != entity[0]
+    assert sorted(entities['hits']) == [1, 12, 12]
+    assert sorted(entities['passes']) == [1, 3, 3]
+    first = entities.iloc[entity[0]]
+    assert abs(first['latitude'] - 44.81) < 0.00002
+    assert first['extent'] < 5
+
+    entity, entities = cluster_bumps([])
+    assert len(entity) == 0 and len(entities) == 0
+
+
+def test_cluster_bumps_chain():
+    # Detections 4 m apart along a rough stretch form one entity
+    coords = [(44.81 + i * 0.000036, 20.46) for i in range(10)]
+    entity, entities = cluster_bumps(coords, radius=5)
+    assert list(entity) == [0] * 10
+    assert entities['hits'][0] == 10
+    assert 15 < entities['extent'][0] < 20
@@ -0,0 +1,105 @@
+import time
+import numpy as np
+import pandas as pd
+from acquisition import AccelerometerPipeline, EventCapture
+from func import (bump_sizes, classify_bumps, get_segment_color,
+                  merge_dataframes, segment_bump_counts, segment_layout,
+                  segment_z, split_segments)
+from synthetic import synthetic_drive
+
+
+class ListWriter:
+    def __init__(self):
+        self.rows = []
+
+    def writerows(self, rows):
+        self.rows.extend(rows)
+
+
+def test_event_capture():
+    accel_data, _, bumps = synthetic_drive(600, accel_rate=100,
+                                           bumps_per_km=2, seed=1)
+    samples = accel_data[['time', 'x', 'y', 'z']].to_numpy()
+
+    # Replayed in the half second batches of the writer thread
+    capture = EventCapture()
+    written = np.concatenate(
+        [capture.select(samples[start:start + 50])
+         for start in range(0, len(samples), 50)] + [capture.finish()])
+
+    assert (np.diff(written[:, 0]) > 0).all()
+    kept = np.isin(samples[:, 0], written[:, 0])
+    assert np.array_equal(samples[kept], written[:, :4])
+    statistics = capture.statistics()
+    assert statistics['full_rate'] + statistics['summaries'] == len(written)
+    assert written[:, 4].sum() == statistics['summaries']
+    assert len(samples) / len(written) >= 10
+    assert len(bumps) // 2 <= statistics['events'] <= len(bumps) * 2
+
+    # Every injected bump is written at full rate
+    for bump_time in bumps['time']:
+        window = ((samples[:, 0] >= bump_time - 0.2)
+                  & (samples[:, 0] <= bump_time + 1))
+        assert kept[window].all()
+    assert kept[bump_sizes(samples[:, 3]) >= 2].all()
+    # One summary row per second between the windows
+    gaps = np.diff(written[:, 0])
+    assert gaps.max() < 2
+
+
+def test_pipeline_event_capture():
+    writer = ListWriter()
+    pipeline = AccelerometerPipeline(lambda: (0.1, 0.2, -9.81), writer, 200,
+                                     capture=EventCapture())
+
+    pipeline.start()
+    time.sleep(0.5)
+    pipeline.stop()
+
+    statistics = pipeline.statistics()
+    # A smooth road is only summarized
+    assert statistics['events'] == 0 and statistics['full_rate'] == 0
+    assert 1 <= len(writer.rows) <= 2
+    assert writer.rows[0][:3] == [0.1, 0.2, -9.81]
+    # Marked as a summary row after the time
+    assert writer.rows[0][4] == 1
+
+
+def segment_colors(accel_data, gps_data):
+    data = merge_dataframes(accel_data, gps_data, 1.0)
+    bump_mask, _, bumps = classify_bumps(data)
+    coords = list(zip(data['latitude'], data['longitude']))
+    bounds = segment_layout(coords)[1]
+    segments, z_data_segments = split_segments(coords, segment_z(data),
+                                               bounds)
+    colors = [get_segment_color(segment, z_data_segment, [], bump_count)
+              for segment, z_data_segment, bump_count in zip(
+                  segments, z_data_segments,
+                  segment_bump_counts(bump_mask, bounds))]
+    return colors, bumps
+
+
+def test_summary_rows_left_out():
+    accel_data, gps_data, _ = synthetic_drive(900, accel_rate=100,
+                                              bumps_per_km=0.5, seed=3)
+    samples = accel_data[['time', 'x', 'y', 'z']].to_numpy()
+    capture = EventCapture()
+    written = np.concatenate(
+        [capture.select(samples[start:start + 50])
+         for start in range(0, len(samples), 50)] + [capture.finish()])
+    captured = pd.DataFrame(written[:, 1:], columns=['x', 'y', 'z', 'summary'])
+    captured['time'] = written[:, 0]
+
+    colors, bumps = segment_colors(accel_data, gps_data)
+    captured_colors, captured_bumps = segment_colors(captured, gps_data)
+    # Medium and big bumps are captured whole, only the small ones
+    # that noise adds between the windows are missed
+    assert abs(sum(captured_bumps[1:3]) - sum(bumps[1:3])) <= 0.1 * sum(
+        bumps[1:3])
+    assert captured_bumps[3] < bumps[3]
+    # The peaks of the summary rows don't make smooth segments rough
+    assert 'green' not in captured_colors
+    assert captured_colors.count('blue') > len(captured_colors) // 2
+    unmarked_colors, _ = segment_colors(
+        captured.drop(columns='summary'), gps_data)
+    assert 'green' in unmarked_colors
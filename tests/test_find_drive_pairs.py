@@ -0,0 +1,39 @@
+import os
+from batch import find_drive_pairs, is_up_to_date
+
+
+def test_find_drive_pairs(tmpdir):
+    folder = str(tmpdir)
+    for name in ['accel_data_2023_06_07_10_15_48.csv',
+                 'gps_data_2023_06_07_10_15_48.csv',
+                 'accel_data_2023_06_07_10_12_56.csv',
+                 'gps_data_2023_06_07_10_12_56.csv',
+                 'accel_data_2023_06_07_10_14_11.csv']:
+        open(os.path.join(folder, name), 'w').close()
+
+    pairs = find_drive_pairs(folder)
+
+    # The drive without a GPS file is skipped
+    assert [pair[0] for pair in pairs] == ['2023_06_07_10_12_56',
+                                           '2023_06_07_10_15_48']
+    assert pairs[0][2] == os.path.join(folder,
+                                       'gps_data_2023_06_07_10_12_56.csv')
+
+
+def test_is_up_to_date(tmpdir):
+    folder = str(tmpdir)
+    accel_path = os.path.join(folder, 'accel_data_1.csv')
+    gps_path = os.path.join(folder, 'gps_data_1.csv')
+    report_path = os.path.join(folder, 'road_statistics_1.xlsx')
+    for path in [accel_path, gps_path]:
+        open(path, 'w').close()
+        os.utime(path, (1000, 1000))
+    assert not is_up_to_date('1', accel_path, gps_path, folder)
+
+    open(report_path, 'w').close()
+    os.utime(report_path, (2000, 2000))
+    assert is_up_to_date('1', accel_path, gps_path, folder)
+
+    # Newer data makes the report stale
+    os.utime(gps_path, (3000, 3000))
+    assert not is_up_to_date('1', accel_path, gps_path, folder)
@@ -1,6 +1,4 @@
 import random
-import sys
-sys.path.append('/home/syrmia/Desktop/GPS_tracking_improved')
 from func import get_segment_color
 
 
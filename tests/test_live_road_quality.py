@@ -0,0 +1,71 @@
+import numpy as np
+import pandas as pd
+from acquisition import format_time
+from func import merge_dataframes
+from live import LiveRoadQuality, RunningPercentile
+
+
+def test_live_road_quality(tmpdir):
+    # 5 Hz fixes and 50 Hz samples past midnight
+    rng = np.random.default_rng(5)
+    fix_times = 86_340 + np.arange(600) * 0.2
+    sample_times = 86_340 + np.arange(6000) * 0.02
+    gps_data = pd.DataFrame({
+        'latitude': 44.8125 + np.cumsum(rng.uniform(0, 2e-5, 600)),
+        'longitude': 20.4612 + np.cumsum(rng.uniform(0, 2e-5, 600)),
+        'time': [format_time(int(t * 1000) % 86_400_000)
+                 for t in fix_times]})
+    accel_data = pd.DataFrame({
+        'x': 0.1, 'y': 0.2, 'z': rng.normal(-9.81, 1.2, 6000),
+        'time': [format_time(int(t * 1000) % 86_400_000)
+                 for t in sample_times]})
+
+    closed = []
+    live = LiveRoadQuality(
+        lambda segment, color, bump_count: closed.append(color), 0.5)
+    for i in range(len(gps_data)):
+        live.add_samples(accel_data['time'][i * 10:i * 10 + 10],
+                         accel_data['z'][i * 10:i * 10 + 10])
+        fix = gps_data.iloc[i]
+        live.add_fix(fix['latitude'], fix['longitude'], fix['time'])
+
+    totals = live.totals()
+    assert totals['segments'] == len(closed) > 0
+    assert 119 < totals['duration'].total_seconds() < 120
+    assert abs(totals['threshold']
+               - np.percentile(np.abs(accel_data['z']), 70)) < 0.05
+
+    # Only the open segment is kept whole
+    assert len(np.concatenate(live.segment_parts)) < 2 * 6000 // len(closed)
+
+    map_path, duration, distance, bumps = live.finish(str(tmpdir))
+    data = merge_dataframes(accel_data, gps_data, 0.5)
+    assert live.num_rows == len(data)
+    # The trailing samples are positioned when the drive is finished
+    totals = live.totals()
+    assert duration == totals['duration']
+    assert float(distance) == round(totals['distance'] / 1000, 2)
+    # The last segment is closed as well
+    assert totals['segments'] == len(closed) == len(live.summaries)
+    # Counted from the histogram with the threshold of the whole drive
+    sizes = np.digitize(np.abs(np.abs(data['z']) - np.percentile(
+        np.abs(data['z']), 70)), [1, 1.5, 2])
+    assert abs(bumps[0] - np.count_nonzero(sizes)) <= len(data) // 200
+    assert sum(summary[2] for summary in live.summaries) >= totals['bumps']
+    assert len(list(live.bump_coords())) == totals['bumps']
+    assert sum(len(chunk) for chunk in live.bump_chunks(7)) == totals['bumps']
+
+    # Every segment is drawn on its own with the 'segments' style
+    map_path = live.finish(str(tmpdir), timestamp='segments',
+                           map_style='segments')[0]
+    with open(map_path) as f:
+        assert f.read().count('L.polyline(') == len(live.summaries)
+
+
+def test_running_percentile():
+    values = np.random.default_rng(1).uniform(0, 20, 10_000)
+    percentile = RunningPercentile(70)
+    for chunk in np.array_split(values, 7):
+        percentile.add(chunk)
+    assert abs(percentile.value() - np.percentile(values, 70)) < 0.01
+    assert RunningPercentile(70).value() is None
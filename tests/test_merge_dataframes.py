@@ -1,6 +1,4 @@
-import sys
 import pandas as pd
-sys.path.append('/home/syrmia/Desktop/GPS_tracking_improved')
 from func import merge_dataframes
 
 
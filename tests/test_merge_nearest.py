@@ -0,0 +1,27 @@
+import numpy as np
+import pandas as pd
+from func import merge_dataframes, time_keys
+
+
+def test_merge_nearest():
+    gps_data = pd.DataFrame({
+        'latitude': [45.0, 45.1, 45.3],
+        'longitude': [19.0, 19.2, 19.2],
+        'time': ['23:59:59.000', '00:00:00.000', '00:00:05.000']})
+    accel_data = pd.DataFrame({
+        'x': [0.0] * 5,
+        'y': [0.0] * 5,
+        'z': [1.0, 2.0, 3.0, 4.0, 5.0],
+        'time': ['23:59:58.800', '23:59:59.500', '00:00:00.250',
+                 '00:00:02.500', '00:00:05.100']})
+
+    assert np.allclose(time_keys(gps_data['time']), [86399, 86400, 86405])
+
+    data = merge_dataframes(accel_data, gps_data, tolerance=1.0)
+
+    # 00:00:02.500 is 2.5 s from both fixes
+    assert list(data['z']) == [1.0, 2.0, 3.0, 5.0]
+    assert list(data.columns) == ['latitude', 'longitude', 'x', 'y', 'z',
+                                  'time']
+    assert np.allclose(data['latitude'], [45.0, 45.05, 45.11, 45.3])
+    assert np.allclose(data['longitude'], [19.0, 19.1, 19.2, 19.2])
@@ -0,0 +1,20 @@
+import folium
+from func import MergedLines
+
+
+def test_merged_lines():
+    segments = [[(44.8 + i * 0.0001, 20.4) for i in range(start, start + 11)]
+                for start in range(0, 50, 10)]
+    lines = MergedLines(tolerance=1)
+    for segment, color in zip(segments, ['red', 'red', 'blue', 'blue',
+                                         'red']):
+        lines.add(segment, color)
+    my_map = folium.Map(location=segments[0][0])
+    lines.add_to(my_map, 'geojson')
+
+    # Straight lines are reduced to their ends
+    assert lines.lines == [('red', [segments[0][0], segments[1][-1]]),
+                           ('blue', [segments[2][0], segments[3][-1]]),
+                           ('red', [segments[4][0], segments[4][-1]])]
+    html = my_map.get_root().render()
+    assert html.count('"type": "Feature"') == 3
@@ -0,0 +1,122 @@
+import os
+import threading
+import pytest
+from nmea import (NmeaParser, NmeaReader, ReplayPort, nmea_sentence,
+                  required_baud_rate, ubx_message)
+
+
+def epoch(second, latitude=4448.1234, speed=12.5):
+    """Returns the sentences a NEO-6M sends for one epoch."""
+    utc = f'0800{second // 10:02d}.{second % 10}0'
+    return ''.join(nmea_sentence(body) for body in (
+        f'GPRMC,{utc},A,{latitude:.4f},N,02028.5678,E,{speed},84.2,'
+        f'181026,,,A',
+        f'GPVTG,84.2,T,,M,{speed},N,{speed * 1.852:.3f},K,A',
+        f'GPGGA,{utc},{latitude:.4f},N,02028.5678,E,1,08,0.94,117.3,M,'
+        f'38.5,M,,',
+        'GPGSA,A,3,02,05,12,13,15,18,24,29,,,,,1.72,0.94,1.44'))
+
+
+def test_nmea_parser():
+    parser = NmeaParser()
+    data = ('line noise\r\n' + epoch(0) + '$GPGSV,bad*00\r\n'
+            + epoch(1) + epoch(2)).encode('ascii')
+    # Sentences are split across the chunks
+    fixes = []
+    for start in range(0, len(data), 7):
+        fixes += parser.feed(data[start:start + 7])
+    assert [fix.time for fix in fixes] == [8 * 3600, 8 * 3600 + 0.1]
+    fixes.append(parser.flush())
+    assert parser.flush() is None
+
+    fix = fixes[0]
+    assert fix.has_position()
+    assert fix.latitude == pytest.approx(44 + 48.1234 / 60)
+    assert fix.longitude == pytest.approx(20 + 28.5678 / 60)
+    assert fix.speed == 12.5
+    assert fix.date == '181026'
+    assert (fix.satellites, fix.hdop, fix.altitude) == (8, 0.94, 117.3)
+    assert (fix.fix_type, fix.pdop, fix.vdop) == (3, 1.72, 1.44)
+    assert fix.sentences == ['RMC', 'VTG', 'GGA', 'GSA']
+    assert fixes[2].time == pytest.approx(8 * 3600 + 0.2)
+    assert parser.counts == {'RMC': 3, 'GGA': 3, 'VTG': 3, 'GSA': 3}
+    assert parser.bad_checksums == 1
+    assert parser.discarded == 1
+
+
+def test_no_fix():
+    parser = NmeaParser()
+    parser.feed(nmea_sentence('GPRMC,080000.00,V,,,,,,,181026,,,N')
+                .encode('ascii'))
+    parser.feed(nmea_sentence('GPGGA,080000.00,,,,,0,00,99.99,,,,,,')
+                .encode('ascii'))
+    fix = parser.flush()
+    assert fix.valid is False
+    assert not fix.has_position()
+    assert fix.satellites == 0
+
+
+def test_replay_port(tmpdir):
+    path = os.path.join(str(tmpdir), 'drive.nmea')
+    num_epochs = 5000
+    with open(path, 'w', newline='') as f:
+        for second in range(num_epochs):
+            f.write(epoch(second % 600, 4448 + second / 1e4))
+
+    port = ReplayPort(path, timeout=0.01)
+    fixes = []
+    reader = NmeaReader(port, fixes.append)
+    reader.start()
+    while not port.finished():
+        reader.join(0.01)
+    reader.stop()
+    reader.join()
+
+    assert [fix.latitude for fix in fixes] == pytest.approx(
+        [44 + (48 + second / 1e4) / 60 for second in range(num_epochs)])
+    statistics = reader.statistics()
+    assert statistics['fixes'] == num_epochs
+    assert statistics['sentences']['GSA'] == num_epochs
+    assert statistics['bad_checksums'] == statistics['dropped'] == 0
+
+
+@pytest.mark.skipif(not hasattr(os, 'openpty'), reason='needs a pty')
+def test_pty(tmpdir):
+    serial = pytest.importorskip('serial')
+    master, slave = os.openpty()
+    port = serial.Serial(os.ttyname(slave), 115200, timeout=0.02)
+    num_epochs = 1000
+    fixes = []
+    done = threading.Event()
+
+    def on_fix(fix):
+        fixes.append(fix)
+        if len(fixes) == num_epochs:
+            done.set()
+
+    reader = NmeaReader(port, on_fix)
+    reader.start()
+    # Epochs at well over 10 Hz, with a transient gap halfway through
+    for second in range(num_epochs):
+        os.write(master, epoch(second % 600).encode('ascii'))
+        if second == num_epochs // 2:
+            done.wait(0.2)
+    assert done.wait(10)
+    reader.stop()
+    reader.join()
+    port.close()
+    os.close(master)
+    os.close(slave)
+
+    assert len(fixes) == num_epochs
+    assert all(fix.has_position() for fix in fixes)
+    assert reader.statistics()['bad_checksums'] == 0
+
+
+def test_ubx_message():
+    # UBX-CFG-RATE for 10 Hz
+    assert ubx_message(0x06, 0x08, bytes([0x64, 0, 1, 0, 1, 0])) == bytes(
+        [0xb5, 0x62, 0x06, 0x08, 0x06, 0x00, 0x64, 0x00, 0x01, 0x00, 0x01,
+         0x00, 0x7a, 0x12])
+    assert required_baud_rate(1) == 9600
+    assert required_baud_rate(10) > 9600
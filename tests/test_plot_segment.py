@@ -1,6 +1,4 @@
 import folium
-import sys
-sys.path.append('/home/syrmia/Desktop/GPS_tracking_improved')
 from func import plot_segment
 
 
@@ -1,7 +1,5 @@
-import sys
 import pandas as pd
 import os
-sys.path.append('/home/syrmia/Desktop/GPS_tracking_improved')
 from func import read_data_file
 
 
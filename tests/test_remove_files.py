@@ -1,6 +1,4 @@
 import os
-import sys
-sys.path.append('/home/syrmia/Desktop/GPS_tracking_improved')
 from func import remove_files
 
 
@@ -0,0 +1,53 @@
+import os
+import numpy as np
+from matplotlib.image import imread, imsave
+from func import (MAP_IMAGE_SIZE, TILE_SIZE, WEB_MERCATOR_RADIUS,
+                  create_map_image, render_map_image)
+
+
+def test_render_map_image(tmpdir):
+    # Create test data
+    segments = [[(42.123, -71.456), (42.124, -71.457), (42.125, -71.458)],
+                [(42.125, -71.458), (42.126, -71.459)]]
+    z_data_segments = [[0.1, 0.2, 0.3], [0.3, 0.4]]
+    bump_coords = [(42.124, -71.457)]
+    image_path = os.path.join(str(tmpdir), 'map.png')
+
+    # Call the function
+    render_map_image(segments, z_data_segments, bump_coords, image_path)
+
+    # Assert that the PNG has the configured size
+    image = imread(image_path)
+    assert image.shape[:2] == (MAP_IMAGE_SIZE[1], MAP_IMAGE_SIZE[0])
+
+
+def test_render_map_image_with_tiles(tmpdir):
+    segments = [[(42.123, -71.456), (42.124, -71.457), (42.125, -71.458)]]
+    z_data_segments = [[0.1, 0.2, 0.3]]
+    tiles_folder = str(tmpdir.mkdir('tiles'))
+    # Magenta tiles cover the map at the zoom the image is drawn at
+    fig, ax = create_map_image(np.min(segments[0], axis=0),
+                               np.max(segments[0], axis=0), None)
+    x_limits, y_limits = ax.get_xlim(), ax.get_ylim()
+    world = 2 * np.pi * WEB_MERCATOR_RADIUS
+    zoom = int(np.round(np.log2(world * MAP_IMAGE_SIZE[0] / TILE_SIZE
+                                / (x_limits[1] - x_limits[0]))))
+    tile_span = world / 2 ** zoom
+    for tile_x in range(int((x_limits[0] + world / 2) // tile_span),
+                        int((x_limits[1] + world / 2) // tile_span) + 1):
+        folder = os.path.join(tiles_folder, str(zoom), str(tile_x))
+        os.makedirs(folder)
+        for tile_y in range(int((world / 2 - y_limits[1]) // tile_span),
+                            int((world / 2 - y_limits[0]) // tile_span) + 1):
+            imsave(os.path.join(folder, f'{tile_y}.png'),
+                   np.tile([1.0, 0.0, 1.0], (TILE_SIZE, TILE_SIZE, 1)))
+    image_path = os.path.join(str(tmpdir), 'map.png')
+
+    render_map_image(segments, z_data_segments, [], image_path,
+                     tiles_folder=tiles_folder)
+
+    image = imread(image_path)[:, :, :3]
+    magenta = np.all(np.abs(image - [1, 0, 1]) < 0.02, axis=2)
+    # The background is the cached tiles, except under the road
+    assert magenta[0, 0] and magenta[-1, -1]
+    assert magenta.mean() > 0.9
@@ -0,0 +1,94 @@
+import os
+import time
+import pytest
+from func import read_data_file
+from nmea import NmeaParser, ReplayPort, line_times
+from replay import ReplayAccelerometer, run_replay
+from synthetic import synthetic_drive, write_drive, write_nmea
+
+
+def test_replay_port_speed(tmpdir):
+    _, gps_data, _ = synthetic_drive(10, start_time=24 * 3600 - 5)
+    path = write_nmea(os.path.join(str(tmpdir), 'drive.nmea'), gps_data)
+    with open(path, 'rb') as f:
+        times = line_times(f.read().splitlines())
+    # Four sentences per fix, past midnight too
+    assert times[::4] == [float(second) for second in range(11)]
+
+    port = ReplayPort(path, speed=20, timeout=0.01)
+    parser = NmeaParser()
+    parser.feed(port.read(4096))
+    assert parser.flush().time == 24 * 3600 - 5
+    assert port.read(4096) == b''
+    time.sleep(0.06)
+    parser.feed(port.read(4096))
+    assert parser.flush().time == 24 * 3600 - 4
+    assert not port.finished()
+
+
+def test_replay_drive(tmpdir):
+    accel_data, gps_data, _ = synthetic_drive(60, accel_rate=100)
+    accel_path, _ = write_drive(str(tmpdir), accel_data, gps_data)
+    nmea_path = write_nmea(os.path.join(str(tmpdir), 'drive.nmea'),
+                           gps_data)
+
+    accelerometer = ReplayAccelerometer(accel_path, speed=None)
+    assert accelerometer() == pytest.approx(tuple(accel_data.iloc[0, :3]))
+
+    output = os.path.join(str(tmpdir), 'replay')
+    result = run_replay(nmea_path, accel_path, output, speed=None,
+                        accel_rate=100, live_analysis=True)
+
+    values = result['manifest']['values']
+    assert values['gps']['fixes'] == len(gps_data)
+    assert values['gps']['dropped'] == 0
+    assert values['accelerometer']['samples'] > 0
+    assert 0 < result['cpu_load']
+    gps_logs = [name for name in os.listdir(output)
+                if name.startswith('gps_data_')]
+    # The first fix only sets where the drive starts
+    gps_log = read_data_file(os.path.join(output, gps_logs[0]))
+    assert len(gps_log) == len(gps_data) - 1
+    assert list(gps_log['speed']) == pytest.approx(
+        list(gps_data['speed'][1:]), abs=1e-3)
+
+
+def test_replay_one_sample_per_fix(tmpdir):
+    accel_data, gps_data, _ = synthetic_drive(60, accel_rate=10)
+    accel_path, _ = write_drive(str(tmpdir), accel_data, gps_data)
+    nmea_path = write_nmea(os.path.join(str(tmpdir), 'drive.nmea'),
+                           gps_data)
+
+    output = os.path.join(str(tmpdir), 'replay')
+    result = run_replay(nmea_path, accel_path, output, speed=None,
+                        accel_rate=0, live_analysis=True)
+
+    # Not throttled to one fix per second
+    assert result['wall'] < 30
+    assert result['manifest']['values']['gps']['fixes'] == len(gps_data)
+    accel_logs = [name for name in os.listdir(output)
+                  if name.startswith('accel_data_')]
+    accel_log = read_data_file(os.path.join(output, accel_logs[0]))
+    assert len(accel_log) == len(gps_data) - 1
+
+
+def test_replay_report(tmpdir):
+    accel_data, gps_data, _ = synthetic_drive(60, accel_rate=10)
+    accel_path, _ = write_drive(str(tmpdir), accel_data, gps_data)
+    nmea_path = write_nmea(os.path.join(str(tmpdir), 'drive.nmea'),
+                           gps_data)
+
+    output = os.path.join(str(tmpdir), 'replay')
+    result = run_replay(nmea_path, accel_path, output, speed=None,
+                        accel_rate=0, live_analysis=True, report=True)
+
+    assert result['manifest'] is not None
+    # The report keeps both logs and names its files after the run
+    logs = sorted(os.listdir(os.path.join(output, 'data')))
+    assert [name.split('_')[0] for name in logs] == ['accel', 'gps']
+    timestamp = logs[0][len('accel_data_'):].split('.')[0]
+    results = os.listdir(os.path.join(output, 'results'))
+    assert f'run_{timestamp}.json' in results
+    assert [name for name in results
+            if name.startswith('road_statistics_')] == [
+        f'road_statistics_{timestamp}.xlsx']
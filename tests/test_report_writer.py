@@ -0,0 +1,84 @@
+import csv
+import os
+import openpyxl
+import pytest
+from func import process_data
+from reports import (DRIVE_COLUMNS, SEGMENT_COLUMNS, ReportWriter,
+                     export_drives, find_drives)
+from synthetic import synthetic_drive, write_drive
+
+
+def read_csv(path):
+    with open(path, newline='') as f:
+        return list(csv.reader(f))
+
+
+def test_report_writer(tmpdir):
+    folder = str(tmpdir)
+    accel_data, gps_data, _ = synthetic_drive(300)
+    accel_path, gps_path = write_drive(folder, accel_data, gps_data)
+    for timestamp in ['2024_04_30_08_00_00', '2024_05_02_08_00_00',
+                      '2024_05_03_08_00_00']:
+        report_path = process_data(accel_path, gps_path, folder, folder,
+                                   timestamp=timestamp, archive=False,
+                                   profile=None)
+        assert os.path.isfile(report_path)
+
+    workbook = openpyxl.load_workbook(report_path)
+    assert workbook.sheetnames == ['Summary', 'Segments']
+    summary = workbook['Summary']
+    assert summary['A8'].value == 'Road rating:'
+    assert summary['C5'].value is not None
+    assert len(summary._images) == 1
+    segments = [list(row) for row in workbook['Segments'].values]
+    assert segments[0] == SEGMENT_COLUMNS
+    table = read_csv(os.path.join(folder,
+                                  'segments_2024_05_03_08_00_00.csv'))
+    assert len(segments) == len(table) > 2
+    assert {row[8] for row in segments[1:]} <= {
+        'blue', 'green', 'yellow', 'orange', 'red'}
+
+    assert find_drives(folder, '2024_05', '2024_06') == [
+        '2024_05_02_08_00_00', '2024_05_03_08_00_00']
+    output = os.path.join(folder, 'exports')
+    paths = export_drives(folder, output, 'may', start='2024_05',
+                          end='2024_06')
+    assert sorted(paths) == ['drives_csv', 'segments_csv', 'xlsx']
+    drives = read_csv(paths['drives_csv'])
+    assert drives[0] == DRIVE_COLUMNS
+    assert [row[0] for row in drives[1:]] == [
+        '2024_05_02_08_00_00', '2024_05_03_08_00_00']
+    assert len(read_csv(paths['segments_csv'])) == 2 * (len(table) - 1) + 1
+
+    workbook = openpyxl.load_workbook(paths['xlsx'], read_only=True)
+    assert workbook.sheetnames == ['Drives', 'Segments']
+    assert len(list(workbook['Drives'].values)) == 3
+    assert not [name for name in os.listdir(output)
+                if name.endswith('.part')]
+
+
+def test_report_writer_interrupted(tmpdir):
+    folder = str(tmpdir)
+    with pytest.raises(KeyboardInterrupt):
+        with ReportWriter(folder, 'batch', ['xlsx', 'csv']) as writer:
+            writer.add_drive(['2024_05_02_08_00_00', 60.0, 1.0, 0, 0, 0, 0,
+                              'Excellent'])
+            raise KeyboardInterrupt
+    # Nothing is left that looks like a finished export
+    assert os.listdir(folder) == []
+
+
+def test_report_writer_parquet(tmpdir):
+    pq = pytest.importorskip('pyarrow.parquet')
+    with ReportWriter(str(tmpdir), 'batch', ['parquet']) as writer:
+        for day in [2, 3]:
+            writer.add_drive(
+                [f'2024_05_0{day}_08_00_00', 60.0, 1.0, 1, 0, 0, 1,
+                 'Good'],
+                [[0, 44.81, 20.46, 44.82, 20.46, 100.0, 1, 0.4, 'yellow']])
+    paths = writer.files()
+    drives = pq.ParquetFile(paths['drives_parquet'])
+    assert drives.metadata.num_row_groups == 2
+    segments = pq.read_table(paths['segments_parquet'])
+    assert segments.column_names == ['timestamp'] + SEGMENT_COLUMNS
+    assert segments.num_rows == 2
@@ -0,0 +1,16 @@
+from acquisition import RingBuffer
+
+
+def test_ring_buffer():
+    buffer = RingBuffer(3, 2)
+    assert buffer.push((1, 10))
+    assert buffer.push((2, 20))
+    assert buffer.drain().tolist() == [[1, 10], [2, 20]]
+
+    # Wraps around the end of the storage and drops rows when full
+    for i in range(3, 7):
+        buffer.push((i, i * 10))
+    assert len(buffer) == 3
+    assert buffer.dropped == 1
+    assert buffer.drain().tolist() == [[3, 30], [4, 40], [5, 50]]
+    assert len(buffer.drain()) == 0
@@ -0,0 +1,47 @@
+import os
+from datetime import timedelta
+from roaddb import RoadDatabase, plot_fleet_map
+
+
+def road(start, num_points=10):
+    return [(44.8100 + start + i * 0.0001, 20.4600) for i in range(num_points)]
+
+
+def test_road_database(tmpdir):
+    path = os.path.join(str(tmpdir), 'roads.db')
+    with RoadDatabase(path) as db:
+        db.ingest_drive('2024_01_01_10_00_00', [road(0), road(0.005)],
+                        [0.2, 0.2], [0, 6], [(44.8151, 20.46)] * 6,
+                        timedelta(minutes=5), '1.20', (6, 0, 0, 6))
+        db.ingest_drive('2024_01_02_10_00_00', [road(0)], [0.2], [3],
+                        [(44.8102, 20.46)] * 3)
+
+        near = db.segments_near((44.8105, 20.4601), 20)
+        assert [result[0] for result in near] == ['2024_01_01_10_00_00',
+                                                  '2024_01_02_10_00_00']
+        assert near[0][1] == road(0)
+        assert db.segments_near((44.8105, 20.4700), 20) == []
+        box = db.segments_in_box((44.814, 20.45), (44.816, 20.47))
+        assert [(color, count) for _, _, color, count in box] == [('red', 6)]
+        assert len(db.bumps_in_box((44.81, 20.45), (44.812, 20.47))) == 3
+
+        # Both drives over the first road are merged into one cell
+        cells = {cell[0]: cell[2:] for cell in db.cells_in_box()}
+        assert len(cells) == 2
+        assert sorted(cells.values()) == [(1, 6.0, 'red'),
+                                          (2, 1.5, 'yellow')]
+
+        entities = db.bump_entities().sort_values('latitude')
+        assert list(entities['hits']) == [3, 6]
+        assert list(entities['drives']) == [2, 1]
+        assert list(entities['confidence']) == [0.5, 1.0]
+
+        # Processing a drive again replaces its results
+        db.ingest_drive('2024_01_02_10_00_00', [road(0)], [0.2], [0], [])
+        passes = sorted(cell[2:] for cell in db.cells_in_box())
+        assert passes == [(1, 6.0, 'red'), (2, 0.0, 'blue')]
+        assert db.drives() == ['2024_01_01_10_00_00', '2024_01_02_10_00_00']
+
+    map_path = os.path.join(str(tmpdir), 'fleet.html')
+    assert plot_fleet_map(path, map_path) == map_path
+    assert os.path.isfile(map_path)
@@ -1,5 +1,3 @@
-import sys
-sys.path.append('/home/syrmia/Desktop/GPS_tracking_improved')
 from func import road_distance
 
 
@@ -1,6 +1,4 @@
-import sys
 from datetime import timedelta
-sys.path.append('/home/syrmia/Desktop/GPS_tracking_improved')
 from func import road_duration
 
 
@@ -0,0 +1,58 @@
+import os
+from batch import run_batch, run_jobs
+
+
+def write_drive(folder, timestamp, num_rows=30):
+    with open(os.path.join(folder, f'accel_data_{timestamp}.csv'), 'w') as f:
+        f.write('x,y,z,time\n')
+        for i in range(num_rows):
+            z = -13.5 if i % 7 == 0 else -9.8
+            f.write(f'0.1,0.2,{z},10:00:{i:02d}\n')
+    with open(os.path.join(folder, f'gps_data_{timestamp}.csv'), 'w') as f:
+        f.write('latitude,longitude,time\n')
+        for i in range(num_rows):
+            f.write(f'{44.81 + i * 0.0002},20.46,10:00:{i:02d}\n')
+
+
+def crash_on(timestamp, crashing):
+    if timestamp in crashing:
+        # Killed like a worker that runs out of memory
+        os._exit(1)
+    return timestamp, f'report_{timestamp}', 0.0
+
+
+def test_run_batch(tmpdir):
+    folder_data = str(tmpdir.mkdir('data'))
+    folder_results = str(tmpdir.mkdir('results'))
+    write_drive(folder_data, '2023_06_07_10_15_48')
+    write_drive(folder_data, '2023_06_07_10_12_56')
+
+    processed, skipped, failed = run_batch(folder_data, folder_results,
+                                           workers=2)
+
+    assert sorted(processed) == ['2023_06_07_10_12_56',
+                                 '2023_06_07_10_15_48']
+    assert skipped == [] and failed == []
+    for timestamp in processed:
+        assert os.path.isfile(os.path.join(
+            folder_results, f'road_statistics_{timestamp}.xlsx'))
+    # Data files are left in place when reprocessing
+    assert len(os.listdir(folder_data)) == 4
+
+    # A second run only skips the finished drives
+    processed, skipped, failed = run_batch(folder_data, folder_results,
+                                           workers=2)
+    assert processed == [] and len(skipped) == 2
+
+
+def test_run_jobs_with_dying_workers():
+    results = []
+    jobs = [(f'drive_{number}',) for number in range(10)]
+
+    run_jobs(jobs, 2, crash_on, (['drive_2', 'drive_7'],), results.append)
+
+    failed = sorted(timestamp for timestamp, report, _ in results
+                    if report is None)
+    assert failed == ['drive_2', 'drive_7']
+    assert sorted(timestamp for timestamp, _, _ in results) == sorted(
+        timestamp for timestamp, in jobs)
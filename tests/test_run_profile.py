@@ -0,0 +1,87 @@
+import json
+import os
+import profiling
+from func import process_data
+from profiling import RunProfile, observe, stage
+from synthetic import synthetic_drive, write_drive
+
+
+def test_run_profile(tmpdir):
+    # Nothing is recorded while profiling is off
+    assert stage('read') is stage('merge')
+    observe('latency', 1.0)
+
+    with RunProfile('tracemalloc', {'drive': 'test'}) as run:
+        assert profiling.active() is run
+        with stage('outer'):
+            with stage('inner'):
+                block = bytearray(10_000_000)
+                del block
+            with stage('inner'):
+                pass
+        with stage('before_inner'):
+            block = bytearray(20_000_000)
+            del block
+            with stage('inner'):
+                pass
+        for value in (0.1, 0.3):
+            observe('latency', value)
+    assert profiling.active() is None
+
+    manifest = run.manifest()
+    assert manifest['status'] == 'ok'
+    assert manifest['details'] == {'drive': 'test'}
+    stages = {entry['name']: entry for entry in manifest['stages']}
+    assert list(stages) == ['outer', 'outer/inner', 'before_inner',
+                            'before_inner/inner']
+    assert stages['outer/inner']['calls'] == 2
+    assert stages['outer']['wall'] >= stages['outer/inner']['wall']
+    # The peak of the inner stage counts for the outer one too
+    assert stages['outer/inner']['peak_traced'] >= 10_000_000
+    assert stages['outer']['peak_traced'] >= 10_000_000
+    # and the peak before an inner stage is kept
+    assert stages['before_inner']['peak_traced'] >= 20_000_000
+    assert stages['before_inner/inner']['peak_traced'] < 1_000_000
+    assert manifest['metrics']['latency']['count'] == 2
+    assert abs(manifest['metrics']['latency']['mean'] - 0.2) < 1e-9
+    assert manifest['allocations']
+
+
+def test_stage_memory():
+    with RunProfile() as run:
+        with stage('allocate'):
+            block = bytearray(50_000_000)
+            block[::4096] = b'x' * len(block[::4096])
+        with stage('idle'):
+            pass
+    stages = {entry['name']: entry for entry in run.manifest()['stages']}
+    if 'rss_increase' not in stages['idle']:
+        return      # no /proc on this platform
+    # What a stage adds, not the peak of the process so far
+    assert stages['allocate']['rss_increase'] >= 45_000_000
+    assert stages['idle']['rss_increase'] < 1_000_000
+    assert stages['idle']['peak_rss_increase'] < 1_000_000
+    del block
+
+
+def test_process_data_profile(tmpdir):
+    accel_data, gps_data, _ = synthetic_drive(120)
+    accel_path, gps_path = write_drive(str(tmpdir), accel_data, gps_data)
+
+    report_path = process_data(accel_path, gps_path, str(tmpdir),
+                               str(tmpdir), timestamp='profiled',
+                               archive=False, profile='cprofile')
+
+    assert report_path is not None
+    with open(os.path.join(str(tmpdir), 'run_profiled.json')) as f:
+        manifest = json.load(f)
+    assert manifest['status'] == 'ok'
+    names = [entry['name'] for entry in manifest['stages']]
+    for name in ('analyze', 'analyze/read', 'analyze/merge',
+                 'analyze/classify_bumps', 'analyze/segments',
+                 'analyze/plot_map', 'analyze/map_image', 'road_statistics'):
+        assert name in names
+    assert all(entry['wall'] >= 0 and entry['peak_rss_increase'] >= 0
+               for entry in manifest['stages'])
+    assert os.path.isfile(manifest['cprofile'])
+    assert manifest['functions']
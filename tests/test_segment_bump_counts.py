@@ -0,0 +1,49 @@
+import numpy as np
+import pandas as pd
+from func import (divide_into_segments, find_bump_coords, find_bump_mask,
+                  get_segment_color, segment_bounds, segment_bump_counts,
+                  step_distances)
+
+
+def test_segment_bump_counts():
+    bump_mask = np.array([True, False, True, True, False, False, True])
+    bounds = [(0, 3), (2, 5), (4, 7)]
+
+    assert segment_bump_counts(bump_mask, bounds) == [2, 2, 1]
+
+
+def test_segment_bump_counts_repeated_fixes():
+    # Five accelerometer rows per GPS fix, like merged data
+    coords = np.repeat([[44.81, 20.46], [44.82, 20.47], [44.83, 20.48]],
+                       5, axis=0)
+    bump_mask = np.zeros(len(coords), bool)
+    bump_mask[[6, 12]] = True
+    segment = list(map(tuple, coords.tolist()))
+    bump_coords = [segment[6], segment[12]]
+
+    # Only the detected rows count, not every row at their fixes
+    assert segment_bump_counts(bump_mask, [(0, len(coords))]) == [2]
+    assert sum(1 for item in segment if item in set(bump_coords)) == 10
+
+
+def test_segment_colors_match_coordinate_lookup():
+    # Random drive with roughly 10 m steps and a rough road surface
+    rng = np.random.default_rng(7)
+    track = np.array([44.8125, 20.4612]) + np.cumsum(
+        rng.normal(0, 0.0001, size=(2000, 2)), axis=0)
+    data = pd.DataFrame({'latitude': track[:, 0],
+                         'longitude': track[:, 1],
+                         'z': rng.normal(-9.81, 1.5, size=2000)})
+    coords = list(zip(data['latitude'], data['longitude']))
+    distances = step_distances(coords)
+    segments, z_data_segments = divide_into_segments(coords, data['z'],
+                                                     distances)
+    bump_mask = find_bump_mask(data)
+    bump_coords = find_bump_coords(data, bump_mask)
+    bump_counts = segment_bump_counts(bump_mask, segment_bounds(distances))
+
+    for segment, z_data_segment, count in zip(segments, z_data_segments,
+                                              bump_counts):
+        expected = get_segment_color(segment, z_data_segment, bump_coords)
+        assert get_segment_color(segment, z_data_segment, bump_coords,
+                                 count) == expected
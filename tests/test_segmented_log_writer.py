@@ -0,0 +1,94 @@
+import os
+import pytest
+from func import read_data_file
+from binlog import LOG_EXTENSION
+from logwriter import (INDEX_EXTENSION, SegmentedLogWriter, log_parts,
+                       part_path, read_index, recover_log, stitch_folder,
+                       stitch_log)
+
+
+HEADERS = ['x', 'y', 'z', 'time']
+
+
+def rows(start, stop):
+    return [[i * 0.5, -i * 0.25, 9.75, 8 * 3600 + i]
+            for i in range(start, stop)]
+
+
+@pytest.mark.parametrize('log_format, extension',
+                         [('csv', '.csv'), ('binary', LOG_EXTENSION)])
+def test_segmented_log_writer(tmpdir, log_format, extension):
+    base_path = os.path.join(str(tmpdir), f'accel_data_test{extension}')
+    writer = SegmentedLogWriter(base_path, HEADERS, log_format,
+                                flush_rows=10, flush_interval=3600,
+                                segment_rows=25)
+    writer.writerows(rows(0, 9))
+    # Nothing is written before flush_rows rows are waiting
+    assert writer.blocks == 0
+    writer.writerow(rows(9, 10)[0])
+    assert writer.blocks == 1
+    for row in rows(10, 65):
+        writer.writerow(row)
+    writer.close()
+
+    parts = log_parts(base_path)
+    assert parts == [part_path(base_path, n) for n in (1, 2, 3)]
+    assert [recover_log(path) for path in parts] == [
+        (30, True), (30, True), (5, True)]
+
+    assert stitch_log(base_path) == base_path
+    assert log_parts(base_path) == []
+    assert not os.path.exists(parts[0] + INDEX_EXTENSION)
+    data = read_data_file(base_path)
+    assert list(data.columns) == HEADERS
+    assert data.values.tolist() == rows(0, 65)
+
+
+@pytest.mark.parametrize('log_format, extension',
+                         [('csv', '.csv'), ('binary', LOG_EXTENSION)])
+def test_recover_after_power_loss(tmpdir, log_format, extension):
+    base_path = os.path.join(str(tmpdir), f'gps_data_test{extension}')
+    writer = SegmentedLogWriter(base_path, HEADERS, log_format,
+                                flush_rows=10, flush_interval=3600,
+                                segment_rows=20)
+    for row in rows(0, 45):
+        writer.writerow(row)
+    # Power is lost while the last block is written: no footer, part of
+    # the block reached the card and the rest is garbage
+    last = writer.parts[-1]
+    writer.file.write(writer._format(rows(45, 50))[:30] + b'\xff' * 7)
+    writer.file.flush()
+    writer.file.close()
+    writer.index.close()
+
+    assert recover_log(last) == (0, False)
+    assert recover_log(last) == (0, False)
+
+    assert stitch_folder(str(tmpdir)) == [base_path]
+    data = read_data_file(base_path)
+    assert data.values.tolist() == rows(0, 40)
+
+
+def test_recover_corrupted_block(tmpdir):
+    path = os.path.join(str(tmpdir), 'accel_data_test.part001.csv')
+    writer = SegmentedLogWriter(os.path.join(str(tmpdir),
+                                             'accel_data_test.csv'),
+                                HEADERS, flush_rows=10,
+                                flush_interval=3600, segment_rows=None)
+    for row in rows(0, 30):
+        writer.writerow(row)
+    writer.file.close()
+    writer.index.close()
+    # A byte in the middle of the second block of rows is lost
+    entries = read_index(path + INDEX_EXTENSION)
+    assert [entry[2] for entry in entries] == [0, 10, 20, 30]
+    offset = (entries[1][1] + entries[2][1]) // 2
+    with open(path, 'r+b') as f:
+        f.seek(offset)
+        byte = f.read(1)
+        f.seek(offset)
+        f.write(bytes([byte[0] ^ 0xff]))
+
+    rows_kept, clean = recover_log(path)
+    assert (rows_kept, clean) == (10, False)
+    assert read_data_file(path).values.tolist() == rows(0, 10)
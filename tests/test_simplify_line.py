@@ -0,0 +1,16 @@
+from func import simplify_line
+
+
+def test_simplify_line():
+    # A straight road with 0.5 m of noise and one 20 m detour
+    line = [(44.8 + i * 0.00001, 20.4 + (0.000005 if i % 2 else 0))
+            for i in range(100)]
+    line[50] = (line[50][0], 20.4 + 0.00025)
+
+    simplified = simplify_line(line, tolerance=2)
+
+    assert simplified[0] == line[0] and simplified[-1] == line[-1]
+    assert line[50] in simplified
+    assert len(simplified) <= 5
+    assert simplify_line(line, tolerance=0) == line
+    assert simplify_line(line[:2]) == line[:2]
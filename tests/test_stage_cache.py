@@ -0,0 +1,66 @@
+import json
+import os
+import time
+import func
+from func import process_data
+from stagecache import StageCache, stage_key
+from synthetic import synthetic_drive, write_drive
+
+
+def cache_statistics(folder, timestamp):
+    with open(os.path.join(folder, f'run_{timestamp}.json')) as f:
+        return json.load(f)['values']['stage_cache']
+
+
+def test_stage_cache(tmpdir, monkeypatch):
+    folder = str(tmpdir)
+    cache = os.path.join(folder, 'cache')
+    accel_data, gps_data, _ = synthetic_drive(300)
+    accel_path, gps_path = write_drive(folder, accel_data, gps_data)
+
+    def process(timestamp):
+        report_path = process_data(accel_path, gps_path, folder, folder,
+                                   timestamp=timestamp, archive=False,
+                                   profile='timing', cache=cache)
+        assert os.path.isfile(report_path)
+        assert os.path.isfile(os.path.join(folder, f'map_{timestamp}.html'))
+        return cache_statistics(folder, timestamp)
+
+    stages = ['merge', 'classify_bumps', 'segments', 'plot_map',
+              'map_image', 'road_statistics']
+    assert process('first') == {'hits': {},
+                                'misses': dict.fromkeys(stages, 1)}
+    assert process('again') == {'hits': dict.fromkeys(stages, 1),
+                                'misses': {}}
+
+    # Only the stages after the colour thresholds are computed again
+    monkeypatch.setattr(func, 'MIN_BUMPS_POOR', 4)
+    statistics = process('colors')
+    assert list(statistics['hits']) == stages[:3]
+    assert list(statistics['misses']) == stages[3:]
+
+    monkeypatch.setattr(func, 'SEGMENT_DISTANCE_THRESHOLD', 200)
+    statistics = process('segments')
+    assert list(statistics['hits']) == stages[:2]
+
+    # The same content under another name is found in the cache
+    renamed = os.path.join(folder, 'renamed.csv')
+    os.rename(accel_path, renamed)
+    accel_path = renamed
+    assert process('renamed')['hits']['merge'] == 1
+
+
+def test_stage_cache_eviction(tmpdir):
+    cache = StageCache(str(tmpdir), max_bytes=3500)
+    for n in range(3):
+        cache.cached('stage', stage_key('stage', n), lambda: bytes(1000))
+        time.sleep(0.01)
+    # Using the first entry makes the second one the oldest
+    cache.cached('stage', stage_key('stage', 0), lambda: None)
+    cache.cached('stage', stage_key('stage', 3), lambda: bytes(1000))
+
+    assert cache.size() <= 3500
+    assert cache.statistics() == {'hits': {'stage': 1},
+                                  'misses': {'stage': 4}}
+    assert os.path.exists(cache.path('stage', stage_key('stage', 0)))
+    assert not os.path.exists(cache.path('stage', stage_key('stage', 1)))
@@ -0,0 +1,22 @@
+import numpy as np
+from haversine import haversine, Unit
+from func import step_distances, segment_bounds
+
+
+def test_step_distances():
+    coords = [(42.123, -71.456), (42.345, -71.678), (42.567, -71.890)]
+
+    distances = step_distances(coords)
+
+    expected = [haversine(coords[0], coords[1], unit=Unit.METERS),
+                haversine(coords[1], coords[2], unit=Unit.METERS)]
+    assert np.allclose(distances, expected)
+
+
+def test_segment_bounds():
+    # Every step is 40 m long, so segments close on every third point
+    distances = np.full(6, 40.0)
+
+    bounds = segment_bounds(distances)
+
+    assert bounds == [(0, 4), (3, 7), (6, 7)]
@@ -0,0 +1,18 @@
+import numpy as np
+import stream
+from stream import streaming_percentile
+
+
+def test_streaming_percentile(monkeypatch):
+    # Force the histogram narrowing instead of sorting everything at once
+    monkeypatch.setattr(stream, 'SELECTION_LIMIT', 50)
+    rng = np.random.default_rng(0)
+    for values in [np.abs(rng.normal(9.81, 1, 5000)),
+                   np.round(np.abs(rng.normal(9.81, 1, 5000)), 1),
+                   np.full(5000, 9.81), np.array([1.5]), np.arange(11.0)]:
+        def chunks():
+            for start in range(0, len(values), 37):
+                yield values[start:start + 37]
+
+        assert (streaming_percentile(chunks, len(values), 70)
+                == np.percentile(values, 70))
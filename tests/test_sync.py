@@ -0,0 +1,133 @@
+import os
+import socket
+import tarfile
+import threading
+import time
+from sync import (Backoff, UploadHandler, UploadServer, find_drives,
+                  read_manifest, sync_drives)
+
+
+class FlakyHandler(UploadHandler):
+    """Drops every third request without an answer, and every request
+    after server.last_request."""
+
+    def drop(self):
+        with self.server.lock:
+            self.server.requests += 1
+            drop = (self.server.requests % 3 == 0
+                    or self.server.requests > self.server.last_request)
+        if drop:
+            self.rfile.read(int(self.headers.get('Content-Length', 0)))
+            self.close_connection = True
+        return drop
+
+    def do_PATCH(self):
+        if not self.drop():
+            super().do_PATCH()
+
+    def do_HEAD(self):
+        if not self.drop():
+            super().do_HEAD()
+
+
+def write_drives(folder, timestamps):
+    os.makedirs(folder, exist_ok=True)
+    for number, timestamp in enumerate(timestamps):
+        for name in ['accel', 'gps']:
+            with open(os.path.join(folder, f'{name}_data_{timestamp}.csv'),
+                      'wb') as f:
+                f.write(b'x,y,z,time\n' + os.urandom(50_000 * (number + 1)))
+    # Unfinished drive without its GPS log and a part of a log
+    for name in ['accel_data_2024_01_04_10_00_00.csv',
+                 'accel_data_2024_01_01_10_00_00.part1.csv']:
+        open(os.path.join(folder, name), 'w').close()
+
+
+def test_sync_drives(tmpdir):
+    data = os.path.join(str(tmpdir), 'data')
+    received = os.path.join(str(tmpdir), 'received')
+    timestamps = ['2024_01_01_10_00_00', '2024_01_02_10_00_00',
+                  '2024_01_03_10_00_00']
+    write_drives(data, timestamps)
+    assert sorted(find_drives(data)) == timestamps
+
+    server = UploadServer(received, ('127.0.0.1', 0), FlakyHandler)
+    server.requests = 0
+    server.last_request = float('inf')
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f'http://127.0.0.1:{server.server_port}/uploads'
+    waits = []
+    options = {'chunk_size': 16 * 1024, 'compression': 'gzip',
+               'retries': 3, 'backoff': Backoff(0.001, 0.01, waits.append)}
+    try:
+        counts = sync_drives(data, url, workers=1, **options)
+        assert counts['uploaded'] == 3 and counts['failed'] == 0
+        assert counts['retries'] == len(waits) > 0
+        # Chunks go over one keep-alive connection until one is dropped
+        assert counts['connections'] == counts['retries'] + 1
+        assert sync_drives(data, url, **options)['skipped'] == 3
+
+        # The connection drops for good while a new drive is uploaded
+        write_drives(data, [timestamps[-1].replace('03', '05')])
+        server.last_request = server.requests + 6
+        counts = sync_drives(data, url, **options)
+        assert counts['failed'] == 1 and counts['skipped'] == 3
+        assert max(waits) <= 0.01
+        manifest = read_manifest(os.path.join(data, 'sync'))['drives']
+        entry = manifest['2024_01_05_10_00_00']
+        assert entry['state'] == 'uploading'
+        assert 0 < entry['offset'] < entry['size']
+
+        # The next pass continues where the upload stopped
+        server.last_request = float('inf')
+        counts = sync_drives(data, url, **options)
+        assert counts['uploaded'] == 1 and counts['skipped'] == 3
+        assert (counts['sent_bytes']
+                <= counts['archive_bytes'] - entry['offset'])
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    archives = sorted(name for name in os.listdir(received)
+                      if name.endswith('.tar.gz'))
+    assert len(archives) == 4
+    assert os.listdir(os.path.join(data, 'sync')) == ['sync.json']
+    for timestamp, archive in zip(timestamps, archives):
+        assert archive.startswith(timestamp)
+        with tarfile.open(os.path.join(received, archive)) as tar:
+            for member in tar.getmembers():
+                with open(os.path.join(data, member.name), 'rb') as f:
+                    assert tar.extractfile(member).read() == f.read()
+            assert len(tar.getmembers()) == 2
+
+
+def test_sync_drives_at_shutdown(tmpdir):
+    data = os.path.join(str(tmpdir), 'data')
+    received = os.path.join(str(tmpdir), 'received')
+    write_drives(data, ['2024_01_01_10_00_00', '2024_01_02_10_00_00'])
+    with socket.socket() as closed:
+        closed.bind(('127.0.0.1', 0))
+        url = f'http://127.0.0.1:{closed.getsockname()[1]}'
+
+    # Without a server a single try fails at once
+    waits = []
+    start = time.monotonic()
+    counts = sync_drives(data, url, retries=0, timeout=1,
+                         backoff=Backoff(10, 10, waits.append))
+    assert counts['failed'] == 2 and waits == []
+    # Retries end at the deadline, however long the backoff
+    counts = sync_drives(data, url, retries=100, timeout=1, deadline=0.3,
+                         backoff=Backoff(10, 10))
+    assert counts['failed'] == 2
+    assert time.monotonic() - start < 5
+
+    server = UploadServer(received, ('127.0.0.1', 0))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f'http://127.0.0.1:{server.server_port}'
+    try:
+        counts = sync_drives(data, url, deadline=0)
+        assert counts['failed'] == 2 and counts['sent_bytes'] == 0
+        assert sync_drives(data, url, retries=0)['uploaded'] == 2
+    finally:
+        server.shutdown()
+        server.server_close()
@@ -0,0 +1,45 @@
+import numpy as np
+from func import (find_bump_coords, haversine_distances, process_in_memory,
+                  road_distance)
+from synthetic import synthetic_drive, write_drive
+
+
+def test_synthetic_drive(tmpdir):
+    accel_data, gps_data, bumps = synthetic_drive(300, accel_rate=50,
+                                                  gps_rate=5, seed=3)
+
+    assert len(accel_data) == 300 * 50 + 1
+    assert len(gps_data) == 300 * 5 + 1
+    assert list(accel_data.columns) == ['x', 'y', 'z', 'time']
+    assert list(gps_data.columns) == ['latitude', 'longitude', 'time',
+                                      'speed']
+    assert np.all(np.diff(accel_data['time']) > 0)
+    # Gravity is measured on all three axes of the tilted sensor
+    magnitude = np.linalg.norm(accel_data[['x', 'y', 'z']], axis=1)
+    assert abs(np.median(magnitude) - 9.81) < 0.1
+    assert (accel_data[['x', 'y', 'z']].median() > 0.4).all()
+    assert len(bumps) > 0 and set(bumps['size']) <= {1, 2, 3}
+
+    # Same seed, same drive
+    again, _, _ = synthetic_drive(300, accel_rate=50, gps_rate=5, seed=3)
+    assert again.equals(accel_data)
+
+    # Every injected bump is detected near where it was placed
+    data = accel_data.assign(latitude=np.interp(
+        accel_data['time'], gps_data['time'], gps_data['latitude']),
+        longitude=np.interp(accel_data['time'], gps_data['time'],
+                            gps_data['longitude']))
+    detected = np.array(find_bump_coords(data))
+    distances = haversine_distances(
+        bumps[['latitude', 'longitude']].to_numpy()[:, None], detected)
+    assert np.all(distances.min(axis=1) < 20)
+
+    # The logs process like a recorded drive
+    for log_format in ('csv', 'binary'):
+        accel_path, gps_path = write_drive(str(tmpdir), accel_data, gps_data,
+                                           log_format, log_format)
+        _, duration, distance, _ = process_in_memory(
+            accel_path, gps_path, str(tmpdir), timestamp=log_format)
+        assert duration.total_seconds() == 300
+        coords = list(zip(gps_data['latitude'], gps_data['longitude']))
+        assert abs(float(distance) - float(road_distance(coords))) < 0.2
@@ -0,0 +1,87 @@
+import os
+import threading
+import urllib.error
+import urllib.request
+import numpy as np
+import pytest
+from PIL import Image
+from roaddb import RoadDatabase
+from tiles import (COLORS, PALETTE, TileServer, build_tiles, road_pixels,
+                   world_pixels)
+
+
+def road(start, num_points=10):
+    return [(44.8100 + start + i * 0.0001, 20.4600) for i in range(num_points)]
+
+
+def ingest(path, timestamp, segments, bump_counts):
+    with RoadDatabase(path) as db:
+        db.ingest_drive(timestamp, segments, [0.2] * len(segments),
+                        bump_counts, [])
+
+
+def test_road_pixels():
+    # A horizontal line of 20 pixels, drawn 3 pixels wide
+    x, y = world_pixels(np.array([[44.81, 20.46]]), 17)
+    points = np.array([[44.81, 20.46], [44.81, 20.46 + 20 * 360 / 2 ** 25]])
+    pixel_x, pixel_y, drawn = road_pixels(points, np.array([0, 0]), 17)
+    assert list(np.unique(pixel_y)) == [int(y[0]) - 1, int(y[0]),
+                                        int(y[0]) + 1]
+    assert 20 * 3 <= len(pixel_x) <= 24 * 3
+    assert (drawn == 0).all()
+
+    # The later of two overlapping segments is on top
+    _, _, drawn = road_pixels(np.concatenate([points, points]),
+                              np.array([0, 0, 1, 1]), 17)
+    assert (drawn == 1).all()
+
+
+def test_build_and_serve_tiles(tmpdir):
+    database = os.path.join(str(tmpdir), 'roads.db')
+    folder = os.path.join(str(tmpdir), 'tiles')
+    ingest(database, '2024_01_01_10_00_00', [road(0), road(0.2)], [0, 6])
+
+    counts = build_tiles(database, folder, 12, 15)
+    assert counts['written'] >= 4 and counts['unchanged'] == 0
+    tile_paths = [os.path.join(root, name)
+                  for root, _, names in os.walk(folder)
+                  for name in names if name.endswith('.png')]
+    assert len(tile_paths) == counts['written']
+    colors = set()
+    for path in tile_paths:
+        pixels = np.asarray(Image.open(path)).reshape(-1, 4)
+        colors.update(map(tuple, pixels[pixels[:, 3] > 0].tolist()))
+    assert colors == {tuple(PALETTE[COLORS.index('blue')]),
+                      tuple(PALETTE[COLORS.index('red')])}
+
+    # Only the tiles under the new drive are drawn again
+    assert build_tiles(database, folder, 12, 15)['written'] == 0
+    ingest(database, '2024_01_02_10_00_00', [road(0.2)], [0])
+    counts = build_tiles(database, folder, 12, 15)
+    assert counts['written'] == counts['unchanged'] == len(tile_paths) // 2
+
+    server = TileServer(folder, ('127.0.0.1', 0))
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        url = f'http://127.0.0.1:{server.server_port}'
+        tile = os.path.relpath(tile_paths[0], folder)
+        with urllib.request.urlopen(f'{url}/{tile}') as response:
+            etag = response.headers['ETag']
+            with open(tile_paths[0], 'rb') as f:
+                assert response.read() == f.read()
+        request = urllib.request.Request(f'{url}/{tile}',
+                                         headers={'If-None-Match': etag})
+        with pytest.raises(urllib.error.HTTPError) as error:
+            urllib.request.urlopen(request)
+        assert error.value.code == 304
+        assert server.cache.hits == 1 and server.cache.misses == 1
+
+        with pytest.raises(urllib.error.HTTPError) as error:
+            urllib.request.urlopen(f'{url}/1/2/3.png')
+        assert error.value.code == 404
+        with urllib.request.urlopen(url) as response:
+            assert b'fitBounds' in response.read()
+    finally:
+        server.shutdown()
+        server.server_close()
@@ -0,0 +1,505 @@
+"""Road quality of all drives as a z/x/y tile pyramid and a tile server.
+
+build_tiles draws the coloured segments of every drive in the road
+database into PNG tiles for a range of zoom levels, with the latest
+drive over a road on top. The segments of a whole zoom level are
+projected, sampled at every pixel and binned into their tiles with
+array operations, so only the tiles a road passes through are drawn.
+A tile is written only when its pixels changed since the last build,
+tiles.json keeps a hash of every tile, and nothing is drawn when no
+drive changed at all.
+
+serve_tiles serves the pyramid over HTTP from an in-memory LRU cache,
+with ETags so a browser asks again only for tiles that changed, and an
+index page that shows the road quality over OpenStreetMap.
+
+    python tiles.py build road_quality.db ./tiles
+    python tiles.py serve ./tiles --port 8000
+"""
+import argparse
+import hashlib
+import json
+import os
+import re
+import sys
+import threading
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import numpy as np
+from matplotlib.colors import to_rgba
+from PIL import Image
+from func import MAP_LEGEND, TILE_SIZE, WEB_MERCATOR_RADIUS, to_web_mercator
+from roaddb import RoadDatabase
+
+TILE_MIN_ZOOM = 10
+TILE_MAX_ZOOM = 17
+TILE_LINE_WIDTH = 3                 # pixels
+TILE_OPACITY = 0.8
+TILE_BATCH_SAMPLES = 1_000_000      # pixels sampled at once
+TILE_CACHE_BYTES = 64 * 1024 ** 2   # 64 MB of tiles kept in memory
+TILE_SERVER_PORT = 8000
+MANIFEST_NAME = 'tiles.json'
+COLORS = [color for color, _ in MAP_LEGEND]
+PALETTE = np.array([[round(channel * 255) for channel
+                     in to_rgba(color, TILE_OPACITY)] for color in COLORS],
+                   dtype=np.uint8)
+TILE_PATH = re.compile(r'^/(\d+)/(\d+)/(\d+)\.png$')
+LEAFLET_URL = 'https://unpkg.com/leaflet@1.9.4/dist/leaflet'
+INDEX_PAGE = """<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>Road quality</title>
+<link rel="stylesheet" href="{leaflet}.css">
+<script src="{leaflet}.js"></script>
+<style>html, body, #map {{ height: 100%; margin: 0; }}</style>
+</head>
+<body>
+<div id="map"></div>
+<script>
+var map = L.map('map');
+L.tileLayer('https://tile.openstreetmap.org/{{z}}/{{x}}/{{y}}.png', {{
+    maxZoom: 19, attribution: '&copy; OpenStreetMap contributors'
+}}).addTo(map);
+L.tileLayer('/{{z}}/{{x}}/{{y}}.png', {{
+    minZoom: {min_zoom}, maxNativeZoom: {max_zoom}, maxZoom: 19
+}}).addTo(map);
+map.fitBounds({bounds});
+</script>
+</body>
+</html>
+"""
+
+
+def world_pixels(points, zoom):
+    """
+    Projects GPS coordinates to pixels of the whole world map at a zoom
+    level, the pixel of the tile pyramid they fall in.
+
+    Args:
+        points (numpy.ndarray): Rows of (latitude, longitude).
+        zoom (int): Zoom level.
+
+    Returns:
+        tuple: Arrays of x and y pixel positions.
+    """
+    x, y = to_web_mercator(points)
+    world = 2 * np.pi * WEB_MERCATOR_RADIUS
+    scale = TILE_SIZE * 2 ** zoom / world
+    return (x + world / 2) * scale, (world / 2 - y) * scale
+
+
+def line_samples(x, y, segment_ids, batch_samples=TILE_BATCH_SAMPLES):
+    """
+    Samples the lines between consecutive points of the same segment
+    about once per pixel.
+
+    Args:
+        x (numpy.ndarray): Pixel x of all points.
+        y (numpy.ndarray): Pixel y of all points.
+        segment_ids (numpy.ndarray): Segment of every point, the points
+          of a segment follow each other.
+        batch_samples (int): About how many samples are made at once.
+
+    Yields:
+        tuple: Arrays of x, y and segment of a batch of samples.
+    """
+    steps = np.flatnonzero(segment_ids[1:] == segment_ids[:-1])
+    lengths = np.hypot(x[steps + 1] - x[steps], y[steps + 1] - y[steps])
+    counts = np.ceil(lengths).astype(np.int64) + 1
+    ends = np.cumsum(counts)
+    bounds = np.searchsorted(
+        ends, np.arange(batch_samples, ends[-1] if len(ends) else 0,
+                        batch_samples), 'right')
+    for first, last in zip(np.concatenate(([0], bounds)),
+                           np.concatenate((bounds, [len(steps)]))):
+        if first == last:
+            continue
+        n = counts[first:last]
+        step = np.repeat(steps[first:last], n)
+        position = np.arange(n.sum()) - np.repeat(np.cumsum(n) - n, n)
+        t = position / np.repeat(np.maximum(n - 1, 1), n)
+        yield (x[step] + t * (x[step + 1] - x[step]),
+               y[step] + t * (y[step + 1] - y[step]), segment_ids[step])
+    # Segments of a single point are drawn as a dot
+    lone = np.ones(len(x), dtype=bool)
+    lone[steps] = lone[steps + 1] = False
+    if lone.any():
+        yield x[lone], y[lone], segment_ids[lone]
+
+
+def latest_pixels(keys, segment_ids, segment_bits):
+    """
+    Keeps the latest segment drawn over every pixel. Keys and segments
+    are packed into one integer, so a single sort orders the pixels and
+    puts the latest segment last.
+
+    Args:
+        keys (numpy.ndarray): Pixel keys, below 2 ** (63 - segment_bits).
+        segment_ids (numpy.ndarray): Segment drawn on every key.
+        segment_bits (int): Bits that hold every segment id.
+
+    Returns:
+        tuple: Sorted unique keys and the latest segment of each.
+    """
+    packed = np.sort((keys << segment_bits) | segment_ids)
+    keys = packed >> segment_bits
+    last = np.append(keys[1:] != keys[:-1], True)
+    return keys[last], packed[last] & ((1 << segment_bits) - 1)
+
+
+def road_pixels(points, segment_ids, zoom, line_width=TILE_LINE_WIDTH):
+    """
+    Finds the pixels the roads cover at a zoom level.
+
+    Args:
+        points (numpy.ndarray): Rows of (latitude, longitude) of all
+          segments.
+        segment_ids (numpy.ndarray): Segment of every point, later
+          segments are drawn over earlier ones.
+        zoom (int): Zoom level.
+        line_width (int): Width of the roads in pixels.
+
+    Returns:
+        tuple: Arrays of the x and y of every road pixel in the whole
+          world map and the segment drawn on it.
+    """
+    size = TILE_SIZE * 2 ** zoom
+    # Every sample colours a square of line_width pixels
+    brush_x, brush_y = np.meshgrid(np.arange(line_width) - line_width // 2,
+                                   np.arange(line_width) - line_width // 2)
+    x, y = world_pixels(points, zoom)
+    # Pixels are numbered inside the box of the roads to keep the keys
+    # small enough to pack with the segment ids
+    left = max(int(np.floor(x.min())) - line_width, 0)
+    top = max(int(np.floor(y.min())) - line_width, 0)
+    width = min(int(np.floor(x.max())) + line_width + 1, size) - left
+    height = min(int(np.floor(y.max())) + line_width + 1, size) - top
+    segment_bits = max(int(segment_ids.max()).bit_length(), 1)
+    if (width * height).bit_length() + segment_bits > 63:
+        raise ValueError(f'The roads cover too much to draw at zoom {zoom}.')
+    keys, segments = [], []
+    for sample_x, sample_y, sample_segments in line_samples(x, y,
+                                                            segment_ids):
+        sample_x = np.floor(sample_x).astype(np.int64)
+        sample_y = np.floor(sample_y).astype(np.int64)
+        # Neighbouring samples often fall on the same pixel
+        new = np.ones(len(sample_x), dtype=bool)
+        new[1:] = ((sample_x[1:] != sample_x[:-1])
+                   | (sample_y[1:] != sample_y[:-1])
+                   | (sample_segments[1:] != sample_segments[:-1]))
+        pixel_x = (sample_x[new, None] + brush_x.ravel()).ravel()
+        pixel_y = (sample_y[new, None] + brush_y.ravel()).ravel()
+        drawn = np.repeat(sample_segments[new], line_width ** 2)
+        inside = ((pixel_x >= 0) & (pixel_x < size)
+                  & (pixel_y >= 0) & (pixel_y < size))
+        batch = latest_pixels(
+            (pixel_y[inside] - top) * width + pixel_x[inside] - left,
+            drawn[inside], segment_bits)
+        keys.append(batch[0])
+        segments.append(batch[1])
+    keys, segments = latest_pixels(np.concatenate(keys),
+                                   np.concatenate(segments), segment_bits)
+    pixel_y, pixel_x = np.divmod(keys, width)
+    return pixel_x + left, pixel_y + top, segments
+
+
+def zoom_tiles(points, segment_ids, segment_colors, zoom):
+    """
+    Draws the roads of one zoom level and bins the pixels into their
+    tiles.
+
+    Args:
+        points (numpy.ndarray): Rows of (latitude, longitude) of all
+          segments.
+        segment_ids (numpy.ndarray): Segment of every point.
+        segment_colors (numpy.ndarray): Index in COLORS of every segment.
+        zoom (int): Zoom level.
+
+    Yields:
+        tuple: Tile x and y, and the index inside the tile and colour
+          of every road pixel of the tile.
+    """
+    pixel_x, pixel_y, drawn = road_pixels(points, segment_ids, zoom)
+    tile_x, local_x = np.divmod(pixel_x, TILE_SIZE)
+    tile_y, local_y = np.divmod(pixel_y, TILE_SIZE)
+    # Sorting by tile, then by pixel, groups the pixels of every tile
+    order = np.argsort(((tile_x << zoom) + tile_y) * TILE_SIZE ** 2
+                       + local_y * TILE_SIZE + local_x)
+    tile_x, tile_y = tile_x[order], tile_y[order]
+    local = (local_y * TILE_SIZE + local_x)[order]
+    colors = segment_colors[drawn[order]]
+    starts = np.flatnonzero(np.concatenate((
+        [True], (tile_x[1:] != tile_x[:-1]) | (tile_y[1:] != tile_y[:-1]))))
+    ends = np.append(starts[1:], len(order))
+    for start, end in zip(starts.tolist(), ends.tolist()):
+        yield (int(tile_x[start]), int(tile_y[start]), local[start:end],
+               colors[start:end])
+
+
+def tile_digest(local, colors):
+    """Returns a hash of the pixels of a tile and the drawing settings."""
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(repr((TILE_SIZE, PALETTE.tolist())).encode('utf-8'))
+    digest.update(local.astype(np.int64).tobytes())
+    digest.update(colors.astype(np.uint8).tobytes())
+    return digest.hexdigest()
+
+
+def source_digest(points, segment_ids, segment_colors, min_zoom,
+                  max_zoom):
+    """Returns a hash of all segments and the settings of a build."""
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(repr((min_zoom, max_zoom, TILE_LINE_WIDTH, TILE_SIZE,
+                        PALETTE.tolist())).encode('utf-8'))
+    for array in (points, segment_ids, segment_colors):
+        digest.update(np.ascontiguousarray(array).tobytes())
+    return digest.hexdigest()
+
+
+def write_tile(path, local, colors):
+    """Writes the PNG of a tile under a temporary name first."""
+    image = np.zeros((TILE_SIZE * TILE_SIZE, 4), dtype=np.uint8)
+    image[local] = PALETTE[colors]
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    Image.fromarray(image.reshape(TILE_SIZE, TILE_SIZE, 4), 'RGBA').save(
+        path + '.part', 'PNG')
+    os.replace(path + '.part', path)
+
+
+def read_manifest(folder):
+    try:
+        with open(os.path.join(folder, MANIFEST_NAME)) as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return {'tiles': {}}
+
+
+def write_manifest(folder, manifest):
+    path = os.path.join(folder, MANIFEST_NAME)
+    with open(path + '.part', 'w') as f:
+        json.dump(manifest, f)
+    os.replace(path + '.part', path)
+
+
+def build_tiles(database, folder, min_zoom=TILE_MIN_ZOOM,
+                max_zoom=TILE_MAX_ZOOM):
+    """
+    Draws the segments of all drives in a road database into a tile
+    pyramid stored as {z}/{x}/{y}.png. Tiles whose pixels didn't change
+    since the last build are kept as they are, tiles no road passes
+    through anymore are removed.
+
+    Args:
+        database (str): Path of the road database.
+        folder (str): Folder of the tile pyramid, created if missing.
+        min_zoom (int): Smallest zoom level drawn.
+        max_zoom (int): Largest zoom level drawn.
+
+    Returns:
+        dict: Number of tiles written, unchanged and removed.
+    """
+    with RoadDatabase(database) as db:
+        segments = db.colored_segments()
+    os.makedirs(folder, exist_ok=True)
+    previous = read_manifest(folder)
+    manifest = {'min_zoom': min_zoom, 'max_zoom': max_zoom, 'bounds': None,
+                'source': None, 'tiles': {}}
+    counts = {'written': 0, 'unchanged': 0, 'removed': 0}
+    if segments:
+        points = np.concatenate([coords for coords, _ in segments])
+        segment_ids = np.repeat(np.arange(len(segments)),
+                                [len(coords) for coords, _ in segments])
+        segment_colors = np.array([COLORS.index(color) for _, color
+                                   in segments], dtype=np.uint8)
+        manifest['bounds'] = [points.min(axis=0).tolist(),
+                              points.max(axis=0).tolist()]
+        manifest['source'] = source_digest(points, segment_ids,
+                                           segment_colors, min_zoom,
+                                           max_zoom)
+        # Nothing is drawn when no drive changed since the last build
+        if manifest['source'] == previous.get('source') and all(
+                os.path.isfile(os.path.join(folder, f'{name}.png'))
+                for name in previous['tiles']):
+            return {'written': 0, 'unchanged': len(previous['tiles']),
+                    'removed': 0}
+        for zoom in range(min_zoom, max_zoom + 1):
+            for tile_x, tile_y, local, colors in zoom_tiles(
+                    points, segment_ids, segment_colors, zoom):
+                name = f'{zoom}/{tile_x}/{tile_y}'
+                path = os.path.join(folder, f'{name}.png')
+                digest = tile_digest(local, colors)
+                manifest['tiles'][name] = digest
+                if (previous['tiles'].get(name) == digest
+                        and os.path.isfile(path)):
+                    counts['unchanged'] += 1
+                    continue
+                write_tile(path, local, colors)
+                counts['written'] += 1
+    for name in set(previous['tiles']) - set(manifest['tiles']):
+        try:
+            os.remove(os.path.join(folder, f'{name}.png'))
+            counts['removed'] += 1
+        except FileNotFoundError:
+            pass
+    write_manifest(folder, manifest)
+    return counts
+
+
+class TileCache:
+    """
+    In-memory LRU cache of tile files. A cached tile is read again when
+    its file changes, so a rebuild shows up without a restart.
+
+    Args:
+        max_bytes (int): Size of the tiles kept in memory.
+    """
+
+    def __init__(self, max_bytes=TILE_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get(self, path):
+        """Returns the content and ETag of a file, None if it doesn't
+        exist."""
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        version = (stat.st_mtime_ns, stat.st_size)
+        with self.lock:
+            entry = self.entries.get(path)
+            if entry is not None and entry[0] == version:
+                self.entries.move_to_end(path)
+                self.hits += 1
+                return entry[1], entry[2]
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+        except OSError:
+            return None
+        etag = f'"{hashlib.blake2b(data, digest_size=16).hexdigest()}"'
+        with self.lock:
+            self.misses += 1
+            old = self.entries.pop(path, None)
+            if old is not None:
+                self.size -= len(old[1])
+            if len(data) <= self.max_bytes:
+                self.entries[path] = (version, data, etag)
+                self.size += len(data)
+            while self.size > self.max_bytes:
+                _, (_, old_data, _) = self.entries.popitem(last=False)
+                self.size -= len(old_data)
+        return data, etag
+
+
+def index_page(folder):
+    """Returns the HTML page that shows the tiles of a folder."""
+    manifest = read_manifest(folder)
+    bounds = manifest.get('bounds') or [[-60, -180], [75, 180]]
+    return INDEX_PAGE.format(
+        leaflet=LEAFLET_URL, bounds=json.dumps(bounds),
+        min_zoom=manifest.get('min_zoom', TILE_MIN_ZOOM),
+        max_zoom=manifest.get('max_zoom', TILE_MAX_ZOOM))
+
+
+class TileHandler(BaseHTTPRequestHandler):
+    """Serves the index page and the tiles of TileServer.folder."""
+
+    def do_GET(self):
+        path = self.path.split('?', 1)[0]
+        if path in ('/', '/index.html'):
+            self.send_content(index_page(self.server.folder).encode(),
+                              'text/html; charset=utf-8')
+            return
+        match = TILE_PATH.match(path)
+        tile = None
+        if match is not None:
+            zoom, tile_x, tile_y = match.groups()
+            tile = self.server.cache.get(os.path.join(
+                self.server.folder, zoom, tile_x, f'{tile_y}.png'))
+        if tile is None:
+            self.send_error(404)
+            return
+        data, etag = tile
+        if etag in self.headers.get('If-None-Match', ''):
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.end_headers()
+            return
+        self.send_content(data, 'image/png', etag)
+
+    def send_content(self, data, content_type, etag=None):
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(data)))
+        # Browsers ask again every time and get 304 for unchanged tiles
+        self.send_header('Cache-Control', 'no-cache')
+        if etag is not None:
+            self.send_header('ETag', etag)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class TileServer(ThreadingHTTPServer):
+    """
+    HTTP server of a tile pyramid.
+
+    Args:
+        folder (str): Folder of the tile pyramid.
+        address (tuple): Host and port, port 0 picks a free one.
+        cache_bytes (int): Size of the in-memory tile cache.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, folder, address=('127.0.0.1', TILE_SERVER_PORT),
+                 cache_bytes=TILE_CACHE_BYTES):
+        super().__init__(address, TileHandler)
+        self.folder = folder
+        self.cache = TileCache(cache_bytes)
+
+
+def serve_tiles(folder, host='127.0.0.1', port=TILE_SERVER_PORT):
+    """Serves a tile pyramid until interrupted."""
+    with TileServer(folder, (host, port)) as server:
+        print(f'Serving {folder} on http://{host}:{server.server_port}/')
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Build and serve road quality map tiles.')
+    commands = parser.add_subparsers(dest='command', required=True)
+    build = commands.add_parser('build', help='draw the tile pyramid')
+    build.add_argument('database', help='road database of the drives')
+    build.add_argument('folder', help='folder of the tiles')
+    build.add_argument('--min-zoom', type=int, default=TILE_MIN_ZOOM)
+    build.add_argument('--max-zoom', type=int, default=TILE_MAX_ZOOM)
+    serve = commands.add_parser('serve', help='serve the tiles over HTTP')
+    serve.add_argument('folder', help='folder of the tiles')
+    serve.add_argument('--host', default='127.0.0.1')
+    serve.add_argument('--port', type=int, default=TILE_SERVER_PORT)
+    args = parser.parse_args(argv)
+    if args.command == 'build':
+        counts = build_tiles(args.database, args.folder, args.min_zoom,
+                             args.max_zoom)
+        print(f'Tiles written: {counts["written"]}, unchanged:'
+              f' {counts["unchanged"]}, removed: {counts["removed"]}')
+    else:
+        serve_tiles(args.folder, args.host, args.port)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())